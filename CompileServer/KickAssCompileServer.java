@@ -0,0 +1,80 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.security.Permission;
+
+/**
+ * Keeps KickAssembler loaded in a long-lived JVM, used by the "kickass_use_compile_server"
+ * setting. Reads one compile request per line from stdin, arguments separated by tabs,
+ * runs KickAssembler in-process and writes its output followed by "@@kickass-exit:<code>".
+ *
+ * Compile with: javac -cp KickAss.jar KickAssCompileServer.java
+ * Usage: java -cp KickAss.jar:<folder of this class> KickAssCompileServer [KickAssembler main class]
+ */
+public class KickAssCompileServer {
+    private static final String EXIT_MARKER = "@@kickass-exit:";
+
+    private static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            this.status = status;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        Class<?> kickAss = Class.forName(args.length > 0 ? args[0] : "cml.kickass.KickAssembler");
+        Method main = kickAss.getMethod("main", String[].class);
+        if (!trapExit()) {
+            // KickAssembler ends with System.exit, which cannot be trapped without a security
+            // manager (Java 18+ needs -Djava.security.manager=allow). The plugin then falls
+            // back to a plain java command.
+            System.err.println("KickAssCompileServer: cannot install security manager");
+            System.exit(2);
+        }
+
+        PrintStream out = System.out;
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] kickAssArgs = line.isEmpty() ? new String[0] : line.split("\t");
+            int status = 0;
+            try {
+                main.invoke(null, (Object) kickAssArgs);
+            } catch (InvocationTargetException ex) {
+                Throwable cause = ex.getCause();
+                if (cause instanceof ExitTrappedException) {
+                    status = ((ExitTrappedException) cause).status;
+                } else {
+                    cause.printStackTrace(out);
+                    status = 1;
+                }
+            }
+            out.flush();
+            System.err.flush();
+            out.println(EXIT_MARKER + status);
+            out.flush();
+        }
+    }
+
+    @SuppressWarnings("removal")
+    private static boolean trapExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitTrappedException(status);
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException ex) {
+            return false;
+        }
+    }
+}
@@ -2,6 +2,7 @@
 Sublime Text plugin for KickAssembler development for displaying information
 about certain addresses (VIC/SID registers for example)
 """
+import html
 import json
 import logging
 import os
@@ -9,16 +10,38 @@ import os
 import sublime
 import sublime_plugin
 
+from .kickass_address_index import C64_ADDRESS_INDEX, describe, help_key
+from .kickass_cycles import KickAssCycleCounter, formatCycles
+from .kickass_help_index import HelpIndex, source_manifest
+from .kickass_profiler import KickAssProfiler
+from .kickass_quick_assembler import OPCODES
+from .kickass_symbol_index import render_symbol_tooltip
+from .kickass_tooltip_render import (NumberTooltipRenderer, find_expression,
+                                     is_value_operand, load_css)
+from .kickass_vice_symbols import symbol_files_for_view
+
 
 TOOLTIP = """<style>%(css)s</style>
 <b><u>%(title)s</u></b><br>
 <b>%(name)s</b><br>
-%(desc)s"""
+%(desc)s%(extra)s"""
+
+CYCLES_TOOLTIP = """<br><b>Cycles: {0}</b>"""
+
+AREA_TOOLTIP = """<br><b>{0}</b>"""
+
+AREA_NOTE = """<b>{0}</b><br>"""
 
-NUMBER_TOOLTIP = """<style>{css}</style>
-<b>${value:02X}</b><br>
-<b>%{value:08b}</b><br>
-<b>{value}</b><br>"""
+LABEL_TOOLTIP = """<style>{css}</style>
+<b><u>{name}</u></b><br>
+<b>${value:04X}</b><br>
+<b>%{value:016b}</b><br>
+<b>{value}</b><br>{note}"""
+
+# Scopes of number literals, for words without their $ or % prefix
+NUMERIC_SCOPES = [('constant.numeric.hex', 'hex', 16),
+                  ('constant.numeric.bin', 'binary', 2),
+                  ('constant.numeric.decimal', 'decimal', 10)]
 
 
 def setup_logging(level):
@@ -39,9 +62,14 @@ class KickAssTooltip:
     """
     Name space/utility class for reading settings/definitions
     """
-    help_map = {}
+    help_index = None
     css_file = ''
+    css = ''
+    number_renderer = NumberTooltipRenderer()
     scopes = []
+    scope_selector = ''
+    hover_delay = 0
+    generation = 0
 
     def __init__(self):
         self.log_level = 'info'
@@ -66,94 +94,235 @@ class KickAssTooltip:
         plug_path = sublime.packages_path()
         default_css = os.path.join(plug_path, 'SublimeKickAssemblerC64/css/default.css')
 
-        KickAssTooltip.css_file = self.settings.get('css_file', default_css)
+        css_file = self.settings.get('css_file', default_css)
+        if css_file != KickAssTooltip.css_file:
+            # the css is inlined in the popups, read it once
+            KickAssTooltip.css_file = css_file
+            KickAssTooltip.css = load_css(css_file)
+            KickAssTooltip.number_renderer.set_css(KickAssTooltip.css)
 
         KickAssTooltip.scopes = self.settings.get('scopes', [])
+        KickAssTooltip.scope_selector = ', '.join(KickAssTooltip.scopes)
+        KickAssTooltip.hover_delay = self.settings.get('hover_delay', 0)
+
+        # invalidate popups rendered with the previous settings
+        KickAssTooltip.generation += 1
 
         self.help_directories = self.settings.get('help_directories', [])
         self._load_definition()
 
     def _load_definition(self):
         """
-        Read definition from json files and place them in class variable
-        help_map
+        Open the compiled help index in class variable help_index. The index
+        is only rebuilt from the json files, if any of them has changed.
         """
+        directories = []
         for dirname in self.help_directories:
             if not os.path.isabs(dirname):
                 dirname = os.path.join(sublime.packages_path(), dirname)
+            directories.append(dirname)
 
-            for fname in os.listdir(dirname):
-                logging.debug('Loading %s', fname)
-                try:
-                    with open(os.path.join(dirname, fname),
-                              encoding='utf8') as fileobject:
-                        try:
-                            data = json.load(fileobject)
-                        except ValueError as exc:
-                            logging.error('Error in JSON file: %s, %s',
-                                          fname, exc.message)
-                            continue
-                    KickAssTooltip.help_map.update(data)
-                except EnvironmentError:
-                    logging.error('Cannot access file: %s', fname)
+        if KickAssTooltip.help_index is None:
+            KickAssTooltip.help_index = HelpIndex(
+                os.path.join(sublime.cache_path(), 'KickassTooltips',
+                             'helpdb.idx'))
+        help_index = KickAssTooltip.help_index
 
-        logging.debug('Help map:\n%s', KickAssTooltip.help_map)
+        manifest = source_manifest(directories)
+        if help_index.is_current(manifest):
+            help_index.open()
+            return
+
+        def rebuild():
+            logging.debug('Rebuilding help index')
+            help_index.build(directories, manifest)
+            help_index.open()
+        sublime.set_timeout_async(rebuild, 0)
 
 
 class KickassTooltipsCommand(sublime_plugin.ViewEventListener):
     """
     Event listener class for specific view
     """
+    max_cached_popups = 512
+
+    def __init__(self, view):
+        super().__init__(view)
+        self._popup_cache = {}
+        self._cache_key = None
+        self._hover_id = 0
+        self._symbol_files = []
 
     def on_hover(self, point, hover_zone):
         """
         Mouse over text object. Check, if there is appropriate data to be
-        displayed about the object.
+        displayed about the object. The popup is shown after hover_delay, if
+        the mouse has not moved to another object in the meantime.
         """
 
         if hover_zone != sublime.HOVER_TEXT:
             return
 
-        selection = self.view.scope_name(self.view.sel()[0].begin())
+        if not self.view.match_selector(point, KickAssTooltip.scope_selector):
+            return
+
+        self._hover_id += 1
+        hover_id = self._hover_id
 
-        if KickAssTooltip.scopes[0] not in selection:
+        if KickAssTooltip.hover_delay:
+            sublime.set_timeout(lambda: self.show_hover(point, hover_id),
+                                KickAssTooltip.hover_delay)
+        else:
+            self.show_hover(point, hover_id)
+
+    def show_hover(self, point, hover_id):
+        """Show popup for point, unless a newer hover has happened"""
+        if hover_id != self._hover_id:
             return
 
-        text = self.view.substr(self.view.word(point))
+        html_message = self.get_popup(self.view.word(point))
+        if html_message is not None:
+            self.show_tooltip(html_message, point)
+
+    def get_popup(self, region):
+        """
+        Return rendered popup for the word region, cached until the view or
+        the settings or the .vs symbol files of the build change
+        """
+        self._symbol_files = symbol_files_for_view(self.view)
+        cache_key = (self.view.change_count(), KickAssTooltip.generation,
+                     tuple(f.stamp for f in self._symbol_files))
+        if cache_key != self._cache_key or \
+                len(self._popup_cache) > self.max_cached_popups:
+            self._popup_cache = {}
+            self._cache_key = cache_key
+
+        region_key = (region.begin(), region.end())
+        if region_key not in self._popup_cache:
+            with KickAssProfiler.phase('tooltip render'):
+                self._popup_cache[region_key] = self.render_popup(region)
+        return self._popup_cache[region_key]
+
+    def render_popup(self, region):
+        """Return popup html for the word region, None if nothing to show"""
+        text = self.view.substr(region)
 
         logging.debug('Text under mouse pointer: %s', text)
 
-        if text.lower() in KickAssTooltip.help_map:
-            help_message = KickAssTooltip.help_map[text.lower()]
+        number = self.number_at(region, text)
+        address = self.label_address(text) if number is None else None
+        info = self.address_info_at(
+            region, number[2] if number is not None else address)
+        if info is not None:
+            register_message = self.help_message(help_key(info.register))
+            if register_message is not None:
+                logging.debug('Register help message: %s', register_message)
+                if number is None:
+                    title = text
+                else:
+                    title = number[0] or '$%04X' % info.address
+                return self.render_help_tooltip(
+                    title, register_message,
+                    AREA_TOOLTIP.format(describe(info)))
+        note = AREA_NOTE.format(describe(info)) if info is not None else ''
+
+        help_message = self.help_message(text)
+        if help_message is not None:
             logging.debug('Help message: %s', help_message)
-            html_message = TOOLTIP % {'css': KickAssTooltip.css_file,
-                                      'title': text,
-                                      'name': help_message['name'],
-                                      'desc': help_message['descr']}
-            self.show_tooltip(html_message, point)
-            return
+            cycles = (self.cycles_at(region)
+                      if text.lower() in OPCODES else None)
+            return self.render_help_tooltip(
+                text, help_message,
+                CYCLES_TOOLTIP.format(formatCycles(*cycles)) if cycles else '')
 
-        val = None
-        if "constant.numeric.hex" in selection:
-            val = int(text, 16)
+        if number is not None:
+            title, kind, val = number
+            return self.render_numeric_tooltip(val, kind, title, note)
 
-        if "constant.numeric.bin" in selection:
-            val = int(text, 2)
+        if address is not None:
+            return self.render_label_tooltip(text, address, note)
 
-        if "constant.numeric.decimal" in selection:
-            val = int(text)
+        return render_symbol_tooltip(self.view.window(), text,
+                                     KickAssTooltip.css)
 
-        if val is not None:
-            self.show_numeric_tooltip(val, point)
+    def help_message(self, key):
+        """Entry of the help index, None if there is none"""
+        if KickAssTooltip.help_index is None:
+            return None
+        return KickAssTooltip.help_index.get(key)
+
+    def address_info_at(self, region, value):
+        """
+        Return AddressInfo of the C64 memory area of the value, None if there
+        is no value or it is an immediate operand or data, not an address
+        """
+        if value is None:
+            return None
+        line = self.view.line(region)
+        if is_value_operand(self.view.substr(line),
+                            region.begin() - line.begin()):
+            return None
+        return C64_ADDRESS_INDEX.find(value)
+
+    def cycles_at(self, region):
+        """
+        Return (minimum, maximum) cycles of the instruction on the line of
+        the mnemonic under the mouse pointer, None if it is not known
+        """
+        line = self.view.substr(self.view.line(region))
+        return KickAssCycleCounter.countStatic(line)
+
+    def number_at(self, region, text):
+        """
+        Return (title, kind, value) of the number literal or constant
+        expression under the mouse pointer, None if there is none
+        """
+        line = self.view.line(region)
+        number = find_expression(self.view.substr(line),
+                                 region.begin() - line.begin(),
+                                 region.end() - line.begin(),
+                                 self.label_address)
+        if number is not None:
+            return number
+
+        selection = self.view.scope_name(region.begin())
+        for scope, kind, base in NUMERIC_SCOPES:
+            if scope in selection:
+                try:
+                    return None, kind, int(text, base)
+                except ValueError:
+                    return None
+        return None
+
+    def label_address(self, name):
+        """Address of the label in the .vs files of the build"""
+        for symbol_file in self._symbol_files:
+            address = symbol_file.get(name)
+            if address is not None:
+                return address
+        return None
+
+    def render_help_tooltip(self, title, help_message, extra=''):
+        return TOOLTIP % {'css': KickAssTooltip.css,
+                          'title': html.escape(title),
+                          'name': help_message['name'],
+                          'desc': help_message['descr'],
+                          'extra': extra}
+
+    def render_numeric_tooltip(self, val, kind='decimal', title=None,
+                               note=''):
+        return KickAssTooltip.number_renderer.render(kind, val, title, note)
+
+    def render_label_tooltip(self, name, address, note=''):
+        return LABEL_TOOLTIP.format(css=KickAssTooltip.css, name=name,
+                                    value=address, note=note)
 
     def show_numeric_tooltip(self, val, point):
-        html_message = NUMBER_TOOLTIP.format(css=KickAssTooltip.css_file,
-                                             value=val)
-        self.show_tooltip(html_message, point)
+        self.show_tooltip(self.render_numeric_tooltip(val), point)
 
     def show_tooltip(self, html_message, point):
         logging.debug('HTML tooltip:\n%s', html_message)
-        self.view.show_popup(''.join(html_message),
+        self.view.show_popup(html_message,
                             flags=sublime.HIDE_ON_MOUSE_MOVE_AWAY,
                             location=point,
                             max_width=600,
@@ -165,6 +334,12 @@ class KickassTooltipsCommand(sublime_plugin.ViewEventListener):
         logging.debug('on_navigate')
 
 
+def plugin_unloaded():
+    """Release the memory mapped help index"""
+    if KickAssTooltip.help_index is not None:
+        KickAssTooltip.help_index.close()
+
+
 def plugin_loaded():
     """Plugin entry point"""
     tooltip = KickAssTooltip()
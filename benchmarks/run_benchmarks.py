@@ -0,0 +1,474 @@
+"""
+Benchmarks of the build preparation and tooltip hot paths, run outside Sublime
+Text on a generated project with thousands of source files and a large help
+database:
+
+    python benchmarks/run_benchmarks.py [--files 2000] [--help-entries 20000]
+        [--iterations 200] [--update-baseline]
+
+Prints the percentiles of each benchmark, and compares the medians with the
+stored baseline (benchmarks/baseline.json). The run fails if a median is more
+than --tolerance slower than its baseline. Baselines depend on the machine,
+update them with --update-baseline before comparing changes.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCHMARK_DIR)
+PACKAGE_NAME = 'SublimeKickAssemblerC64'
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+PERCENTILES = (50, 90, 99)
+
+# Medians this close to the baseline are never regressions, timer noise of
+# the fastest benchmarks is a large part of their run time
+MIN_REGRESSION_MS = 0.05
+
+# Lines of the source linted by the lint benchmarks
+LINT_LINES = 10000
+
+
+def import_plugin():
+    """
+    Import the plugin modules as a package, with the stand-in sublime modules
+    when run outside Sublime Text
+    """
+    try:
+        import sublime  # noqa: F401
+        import sublime_plugin  # noqa: F401
+    except ImportError:
+        sys.path.insert(0, os.path.join(BENCHMARK_DIR, 'shims'))
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules.setdefault(PACKAGE_NAME, package)
+    return dict((name, importlib.import_module(PACKAGE_NAME + '.' + name))
+                for name in ('kickass_build', 'kickass_annotations',
+                             'kickass_symbol_index', 'kickass_quick_assembler',
+                             'kickass_lint', 'KickassTooltips'))
+
+
+def load_settings_file(path):
+    """Read a .sublime-settings file, which may have trailing commas"""
+    with open(path, encoding='utf8') as fileobject:
+        text = fileobject.read()
+    return json.loads(re.sub(r',(\s*[}\]])', r'\1', text))
+
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf8') as fileobject:
+        fileobject.write(text)
+
+
+def create_project(folder, file_count):
+    """
+    Write a project of file_count source files: main.asm and Startup.asm
+    import a part of them, every tenth file has build annotations, and the
+    .vs file of main.asm has labels of all files
+    """
+    part_names = ['src/part%04d.asm' % n for n in range(file_count)]
+    for n, name in enumerate(part_names):
+        header = ['// Part %d of the benchmark project' % n, '//']
+        if n % 10 == 0:
+            header.append('// @kickass-build "file-to-run": "part%04d.prg"' % n)
+        code = ['#import "../lib/macros.asm"', '',
+                'part%d_start:' % n, '    lda #$%02x' % (n % 256),
+                '    sta $d020', '.macro part%d_macro(value) {' % n,
+                '    lda #value', '}', '.const PART%d_SIZE = %d' % (n, n)]
+        code.extend('part%d_loop%d: dex\n    bne part%d_loop%d' % (n, i, n, i)
+                    for i in range(20))
+        write_file(os.path.join(folder, name), '\n'.join(header + code) + '\n')
+
+    write_file(os.path.join(folder, 'lib', 'macros.asm'),
+               '.macro clear_screen() {\n    lda #$20\n}\n')
+    imports = ['#import "%s"' % name for name in part_names[:100]]
+    write_file(os.path.join(folder, 'main.asm'),
+               '// @kickass-build "file-to-run": "main.prg"\n\n' +
+               '\n'.join(imports) + '\nmain_start: jmp main_start\n')
+    write_file(os.path.join(folder, 'Startup.asm'),
+               '/* Startup file\n * @kickass-build "startup-file": "Startup"\n */\n'
+               '#import "main.asm"\n')
+    write_file(os.path.join(folder, 'bin', 'main.vs'),
+               ''.join('al C:%04x .part%d_start\n' % ((0x0801 + n) & 0xffff, n)
+                       for n in range(file_count)))
+    return os.path.join(folder, 'main.asm')
+
+
+def create_help_files(folder, entry_count, file_count=10):
+    """Write entry_count help entries, spread over file_count JSON files"""
+    per_file = int(math.ceil(entry_count / float(file_count)))
+    keys = []
+    for n in range(file_count):
+        entries = {}
+        for i in range(n * per_file, min(entry_count, (n + 1) * per_file)):
+            key = 'help%05d' % i
+            keys.append(key)
+            entries[key] = {'descr': 'Description of entry %d<br>' % i * 4,
+                            'name': 'Entry %d' % i, 'url': ''}
+        write_file(os.path.join(folder, 'bench%02d.json' % n),
+                   json.dumps(entries, indent=4))
+    return keys
+
+
+class BenchmarkView:
+    """
+    The view API used by the tooltips, on one line per word. Points are
+    LINE_LENGTH * line + column.
+    """
+    LINE_LENGTH = 100
+
+    def __init__(self, window, file_name, settings, words):
+        self._window = window
+        self._file_name = file_name
+        self._settings = settings
+        self.words = words
+        self.changes = 0
+
+    def id(self):
+        return 1
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def settings(self):
+        return self._settings
+
+    def change_count(self):
+        return self.changes
+
+    def match_selector(self, point, selector):
+        return True
+
+    def word(self, point):
+        row = point // self.LINE_LENGTH
+        start = row * self.LINE_LENGTH + self.words[row][2]
+        return self._window.sublime.Region(start, start + len(self.words[row][0]))
+
+    def line(self, region):
+        start = region.begin() - region.begin() % self.LINE_LENGTH
+        return self._window.sublime.Region(start, start + len(self.words[start // self.LINE_LENGTH][3]))
+
+    def substr(self, region):
+        row, column = divmod(region.begin(), self.LINE_LENGTH)
+        return self.words[row][3][column:column + region.end() - region.begin()]
+
+    def scope_name(self, point):
+        return self.words[point // self.LINE_LENGTH][1]
+
+    def points(self, scope):
+        """Points of the words with the scope"""
+        return [row * self.LINE_LENGTH + column
+                for row, (_, word_scope, column, _) in enumerate(self.words)
+                if scope in word_scope]
+
+    def show_popup(self, content, flags=0, location=-1, max_width=320,
+                   on_navigate=None):
+        pass
+
+    def hide_popup(self):
+        pass
+
+
+class BenchmarkWindow:
+    """The window API used by the build command and the tooltips"""
+
+    def __init__(self, sublime, folder, source_file, settings, words):
+        self.sublime = sublime
+        self.folder = folder
+        self.source_file = source_file
+        self.view = BenchmarkView(self, source_file, settings, words)
+
+    def id(self):
+        return 1
+
+    def folders(self):
+        return [self.folder]
+
+    def project_data(self):
+        return {'folders': [{'path': self.folder}], 'settings': {}}
+
+    def active_view(self):
+        return self.view
+
+    def extract_variables(self):
+        path = self.source_file
+        base_name, extension = os.path.splitext(os.path.basename(path))
+        return {'file': path, 'file_path': os.path.dirname(path),
+                'file_name': os.path.basename(path),
+                'file_base_name': base_name,
+                'file_extension': extension.lstrip('.'),
+                'folder': self.folder, 'packages': PACKAGE_DIR,
+                'platform': 'Linux'}
+
+    def run_command(self, command, args=None):
+        pass
+
+
+def percentile(timings, percent):
+    """Nearest rank percentile of sorted timings"""
+    rank = int(math.ceil(percent / 100.0 * len(timings)))
+    return timings[max(0, min(len(timings), rank) - 1)]
+
+
+def measure(function, iterations, warmup=3):
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    timings.sort()
+    result = dict(('p%d' % p, percentile(timings, p)) for p in PERCENTILES)
+    result['max'] = timings[-1]
+    return result
+
+
+def create_benchmarks(modules, project, options):
+    """Return [(name, function, iterations)] of all benchmarks"""
+    sublime = sys.modules['sublime']
+    kickass_build = modules['kickass_build']
+    annotations = modules['kickass_annotations'].KickAssAnnotationCache
+    tooltips = modules['KickassTooltips']
+
+    help_folder = os.path.join(project.folder, 'helpdb')
+    tooltip_settings = sublime.load_settings('KickassTooltips.sublime-settings')
+    tooltip_settings.update({'help_directories': [help_folder],
+                             'scopes': ['source.assembly.kickassembler'],
+                             'hover_delay': 0, 'log_level': 'error',
+                             'css_file': 'css/default.css'})
+    tooltip = tooltips.KickAssTooltip()
+    tooltip.load()
+
+    symbol_index = modules['kickass_symbol_index'].get_index(project.folder)
+    symbol_index.update()
+
+    command = kickass_build.KickassBuildCommand(project)
+    settings = kickass_build.SublimeSettings(command)
+    factory = kickass_build.KickAssCommandFactory(settings)
+    variables = project.extract_variables()
+    sources = [os.path.join(project.folder, 'src', name)
+               for name in sorted(os.listdir(os.path.join(project.folder, 'src')))]
+
+    def source_dict():
+        return {'env': {}, 'path': '$PATH', 'shell': True}
+
+    def exec_dict_cached():
+        command.createExecDict(source_dict(), dict(variables), 'build-run', settings)
+
+    def exec_dict_new():
+        kickass_build.KickassBuildCommand(project).createExecDict(
+            source_dict(), dict(variables), 'build-run', settings)
+
+    def create_command():
+        factory.createCommand(variables, 'build-run')
+
+    counter = {'hover': 0}
+
+    def annotations_cached():
+        # Read once by the warmup, the other annotation benchmarks clear the cache
+        command.parseAnnotations(sources[0])
+
+    def annotations_cold():
+        annotations.clear()
+        command.parseAnnotations(sources[0])
+
+    def annotations_populate():
+        annotations.clear()
+        annotations.populate([project.folder])
+
+    def load_definition_current():
+        tooltip._load_definition()
+
+    def load_definition_rebuild():
+        os.remove(tooltips.KickAssTooltip.help_index.index_file)
+        tooltip._load_definition()
+
+    quick_assembler = modules['kickass_quick_assembler'].KickAssQuickAssembler()
+
+    def quick_assemble():
+        quick_assembler.assemble(project.source_file)
+
+    linter_class = modules['kickass_lint'].KickAssLinter
+    with open(sources[0]) as fileobject:
+        source_lines = fileobject.read().splitlines()
+    lint_lines = [line.replace(':', '%d:' % (index // len(source_lines)), 1)
+                  for index, line in enumerate(source_lines * (LINT_LINES // len(source_lines) + 1))][:LINT_LINES]
+    lint_text = '\n'.join(lint_lines)
+    linter = linter_class({0xd419: 'read-only', 0xd400: 'write-only'})
+    linter.update(lint_text)
+
+    def lint_keystroke():
+        # Typing on a line in the middle of the file
+        counter['lint'] = counter.get('lint', 0) + 1
+        middle = LINT_LINES // 2
+        typed = lint_lines[:middle] + [lint_lines[middle] + ' ' * (counter['lint'] % 2)] + lint_lines[middle + 1:]
+        linter.update('\n'.join(typed))
+
+    def lint_cold():
+        linter_class().update(lint_text + ' ' * (counter.get('lint', 0) % 7))
+        counter['lint'] = counter.get('lint', 0) + 1
+
+    listener = tooltips.KickassTooltipsCommand(project.view)
+    help_points = project.view.points('help')
+    number_points = project.view.points('numeric')
+    symbol_points = project.view.points('symbol')
+
+    def hover_cached():
+        listener.on_hover(help_points[0], sublime.HOVER_TEXT)
+
+    def hover_changed(points):
+        def hover():
+            counter['hover'] += 1
+            project.view.changes += 1
+            listener.on_hover(points[counter['hover'] % len(points)],
+                              sublime.HOVER_TEXT)
+        return hover
+
+    iterations = options.iterations
+    slow_iterations = max(5, iterations // 20)
+    return [
+        ('createExecDict (cached plan)', exec_dict_cached, iterations),
+        ('createExecDict (new plan)', exec_dict_new, iterations),
+        ('KickAssCommandFactory.createCommand', create_command, iterations),
+        ('parseAnnotations (cached)', annotations_cached, iterations),
+        ('parseAnnotations (cold)', annotations_cold, iterations),
+        ('KickAssAnnotationCache.populate', annotations_populate, slow_iterations),
+        ('_load_definition (index current)', load_definition_current, iterations),
+        ('_load_definition (rebuild)', load_definition_rebuild, slow_iterations),
+        ('on_hover (cached popup)', hover_cached, iterations),
+        ('on_hover (help entry)', hover_changed(help_points), iterations),
+        ('on_hover (number)', hover_changed(number_points), iterations),
+        ('on_hover (project symbol)', hover_changed(symbol_points), iterations),
+        ('KickAssQuickAssembler.assemble', quick_assemble, slow_iterations),
+        ('KickAssLinter.update (keystroke, %d lines)' % LINT_LINES, lint_keystroke, iterations),
+        ('KickAssLinter.update (new view, %d lines)' % LINT_LINES, lint_cold, slow_iterations),
+        ]
+
+
+def create_words(help_keys, file_count):
+    """
+    Words under the mouse pointer: help entries, numbers and project symbols,
+    as (word, scope, column, line)
+    """
+    words = []
+    for n in range(200):
+        for prefix, word, scope in [
+                ('    ', help_keys[(n * 97) % len(help_keys)], 'help'),
+                ('    sta $', '%04x' % (n * 211), 'constant.numeric.hex'),
+                ('    jmp ', 'part%d_loop%d' % ((n * 13) % file_count, n % 20), 'symbol')]:
+            words.append((word, scope, len(prefix), prefix + word))
+    return words
+
+
+def compare(results, baseline, tolerance):
+    """Return the names of the benchmarks slower than their baseline"""
+    regressions = []
+    for name, result in results:
+        base = baseline.get(name)
+        if not base:
+            continue
+        limit = base['p50'] * (1.0 + tolerance)
+        if result['p50'] > limit and result['p50'] - base['p50'] > MIN_REGRESSION_MS:
+            regressions.append(name)
+    return regressions
+
+
+def print_results(results, baseline):
+    print('%-40s %10s %10s %10s %10s %10s' % ('benchmark (ms)', 'p50', 'p90',
+                                              'p99', 'max', 'baseline'))
+    for name, result in results:
+        base = baseline.get(name)
+        print('%-40s %10.3f %10.3f %10.3f %10.3f %10s' % (
+            name, result['p50'], result['p90'], result['p99'], result['max'],
+            '%.3f' % base['p50'] if base else '-'))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000,
+                        help='source files in the generated project')
+    parser.add_argument('--help-entries', type=int, default=20000,
+                        help='entries in the generated help database')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='timed runs of each benchmark')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='baseline file to compare with or update')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed slowdown of the median, 0.5 is 50%%')
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_arguments(argv)
+    modules = import_plugin()
+    sublime = sys.modules['sublime']
+
+    folder = tempfile.mkdtemp(prefix='kickass-benchmark-')
+    cwd = os.getcwd()
+    try:
+        if hasattr(sublime, '_cache_path'):
+            sublime._cache_path = os.path.join(folder, 'cache')
+            sublime._packages_path = PACKAGE_DIR
+        project_folder = os.path.join(folder, 'project')
+        source_file = create_project(project_folder, options.files)
+
+        help_keys = create_help_files(os.path.join(project_folder, 'helpdb'),
+                                      options.help_entries)
+
+        settings = load_settings_file(os.path.join(PACKAGE_DIR, 'Preferences.sublime-settings'))
+        project = BenchmarkWindow(sublime, project_folder, source_file, settings,
+                                  create_words(help_keys, options.files))
+        # The build runs in the folder of the file, as in prepareBuild
+        os.chdir(project_folder)
+
+        benchmarks = create_benchmarks(modules, project, options)
+
+        results = []
+        for name, function, iterations in benchmarks:
+            if options.filter in name:
+                results.append((name, measure(function, iterations)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    try:
+        with open(options.baseline, encoding='utf8') as fileobject:
+            baseline = json.load(fileobject)
+    except (EnvironmentError, ValueError):
+        baseline = {}
+
+    print_results(results, baseline)
+
+    if options.update_baseline:
+        baseline.update(results)
+        with open(options.baseline, 'w', encoding='utf8') as fileobject:
+            json.dump(baseline, fileobject, indent=4, sort_keys=True)
+        print('Baseline written to %s' % options.baseline)
+        return 0
+
+    regressions = compare(results, baseline, options.tolerance)
+    for name in regressions:
+        print('REGRESSION: %s is slower than its baseline' % name)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Minimal stand-in for the sublime module, so that the benchmarks can import the
+plugin outside Sublime Text. Only what the benchmarked code paths use is here.
+Timeouts run their callback at once.
+"""
+import os
+import re
+import tempfile
+
+HOVER_TEXT = 1
+HIDE_ON_MOUSE_MOVE_AWAY = 2
+
+_packages_path = tempfile.gettempdir()
+_cache_path = tempfile.gettempdir()
+_settings = {}
+
+VARIABLE_PATTERN = re.compile(r'\\\$|\$(?:([A-Za-z0-9_]+)|\{([A-Za-z0-9_]+)(?::([^}]*))?\})')
+
+
+class Region:
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+
+class Settings(dict):
+    def set(self, key, value):
+        self[key] = value
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+def version():
+    return '4000'
+
+
+def platform():
+    return 'linux'
+
+
+def packages_path():
+    return _packages_path
+
+
+def cache_path():
+    return _cache_path
+
+
+def load_resource(name):
+    path = os.path.join(_packages_path, *name.split('/')[1:])
+    try:
+        with open(path, encoding='utf8') as fileobject:
+            return fileobject.read()
+    except EnvironmentError:
+        raise IOError('resource not found')
+
+
+def load_settings(name):
+    return _settings.setdefault(name, Settings())
+
+
+def set_timeout(callback, delay=0):
+    callback()
+
+
+def set_timeout_async(callback, delay=0):
+    callback()
+
+
+def status_message(message):
+    pass
+
+
+def error_message(message):
+    pass
+
+
+def windows():
+    return []
+
+
+def active_window():
+    return None
+
+
+def expand_variables(value, variables):
+    if isinstance(value, dict):
+        return dict((k, expand_variables(v, variables)) for k, v in value.items())
+    if isinstance(value, list):
+        return [expand_variables(v, variables) for v in value]
+    if not isinstance(value, str):
+        return value
+
+    def replace(match):
+        if match.group(0) == '\\$':
+            return '$'
+        found = variables.get(match.group(1) or match.group(2))
+        return str(found) if found is not None else (match.group(3) or '')
+    return VARIABLE_PATTERN.sub(replace, value)
@@ -0,0 +1,78 @@
+"""
+Index of the C64 memory map for the tooltips. The zero page, RAM, ROM and
+I/O areas are kept in a sorted interval table, so that the area of an
+address is found with a binary search. The registers of the I/O chips
+repeat over their whole area, mirrored addresses are mapped back to the
+register, so that $D040 finds the help of $D000.
+"""
+import bisect
+from collections import namedtuple
+
+# mirror is the size of the repeated register block, None if not mirrored
+AddressArea = namedtuple('AddressArea', ['start', 'end', 'name', 'mirror'])
+
+# register is the address with mirrors mapped back to the first copy
+AddressInfo = namedtuple('AddressInfo', ['address', 'area', 'register'])
+
+C64_AREAS = [
+    AddressArea(0x0000, 0x0001, 'Processor port', None),
+    AddressArea(0x0002, 0x00ff, 'Zero page', None),
+    AddressArea(0x0100, 0x01ff, 'Stack', None),
+    AddressArea(0x0200, 0x03ff, 'KERNAL and BASIC work area', None),
+    AddressArea(0x0400, 0x07ff, 'Default screen memory', None),
+    AddressArea(0x0800, 0x9fff, 'RAM', None),
+    AddressArea(0xa000, 0xbfff, 'BASIC ROM', None),
+    AddressArea(0xc000, 0xcfff, 'RAM', None),
+    AddressArea(0xd000, 0xd3ff, 'VIC-II', 0x40),
+    AddressArea(0xd400, 0xd7ff, 'SID', 0x20),
+    AddressArea(0xd800, 0xdbff, 'Color RAM', None),
+    AddressArea(0xdc00, 0xdcff, 'CIA 1', 0x10),
+    AddressArea(0xdd00, 0xddff, 'CIA 2', 0x10),
+    AddressArea(0xde00, 0xdeff, 'I/O 1', None),
+    AddressArea(0xdf00, 0xdfff, 'I/O 2', None),
+    AddressArea(0xe000, 0xfff9, 'KERNAL ROM', None),
+    AddressArea(0xfffa, 0xffff, 'NMI, RESET and IRQ vectors', None),
+    ]
+
+
+class AddressIndex:
+    """
+    Sorted table of non-overlapping address areas
+    """
+
+    def __init__(self, areas):
+        self.areas = sorted(areas)
+        self._starts = [area.start for area in self.areas]
+        for previous, area in zip(self.areas, self.areas[1:]):
+            if area.start <= previous.end:
+                raise ValueError('Overlapping areas: %s, %s' %
+                                 (previous.name, area.name))
+
+    def find(self, address):
+        """Return AddressInfo of the address, None if it is in no area"""
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index < 0 or address > self.areas[index].end:
+            return None
+        area = self.areas[index]
+        register = address
+        if area.mirror:
+            register = area.start + (address - area.start) % area.mirror
+        return AddressInfo(address, area, register)
+
+    def __len__(self):
+        return len(self.areas)
+
+
+def describe(info):
+    """Name of the area of the AddressInfo, with the register it mirrors"""
+    if info.register != info.address:
+        return '%s, mirror of $%04X' % (info.area.name, info.register)
+    return info.area.name
+
+
+def help_key(address):
+    """Key of the register at the address in the register help files"""
+    return '%04x' % address
+
+
+C64_ADDRESS_INDEX = AddressIndex(C64_AREAS)
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+
+import sublime
+import sublime_plugin
+
+from .kickass_build_cache import SOURCE_IMPORT_PATTERNS
+from .kickass_symbol_index import SOURCE_EXTENSIONS
+
+ANNOTATION_MARKER = "@kickass-build"
+
+def read_header(handle):
+    """
+    Returns the comment lines at the top of a file, // lines and /* */ blocks,
+    blank lines included. Reading stops at the first line of code.
+    """
+    lines = []
+    inBlock = False
+    for line in iter(handle.readline, ''):
+        line = line.strip()
+        if inBlock:
+            inBlock = "*/" not in line
+            lines.append(line.split("*/", 1)[0].lstrip("*").strip())
+        elif line.startswith("//"):
+            lines.append(line[2:].strip())
+        elif line.startswith("/*"):
+            inBlock = "*/" not in line[2:]
+            lines.append(line[2:].split("*/", 1)[0].lstrip("*").strip())
+        elif line:
+            break
+    return lines
+
+def parse_header(lines):
+    """Returns the build annotations of the header lines, later annotations override earlier ones"""
+    annotations = {}
+    for line in lines:
+        if ANNOTATION_MARKER not in line:
+            continue
+        try:
+            annotations.update(json.loads("{%s}" % line.split(ANNOTATION_MARKER, 1)[1]))
+        except ValueError as err:
+            raise ValueError("Could not parse build annotations: %s" % err)
+    return annotations
+
+class KickAssAnnotationCache():
+    """
+    Build annotations (// @kickass-build "name": value) of source files, read
+    from the comment block at the top of the file. Entries are kept until the
+    file's mtime or size changes, and are read for all source files of a
+    project when it opens. Entries also have the file's imports, to find the
+    build targets that include a file.
+    """
+    __entries = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def getStamp(cls, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    @classmethod
+    def get(cls, path):
+        """Returns the annotations of the file, raises ValueError if they can not be parsed"""
+        stamp = cls.getStamp(path)
+        with cls.__lock:
+            entry = cls.__entries.get(os.path.normpath(path))
+        if entry is None or stamp is None or entry['stamp'] != stamp:
+            entry = cls.read(path, stamp)
+            cls.store(path, entry)
+        if entry['error']:
+            raise ValueError(entry['error'])
+        return entry['annotations']
+
+    @classmethod
+    def createEntry(cls, stamp, headerLines, imports):
+        try:
+            annotations, error = parse_header(headerLines), None
+        except ValueError as err:
+            annotations, error = {}, str(err)
+        return {'stamp': stamp, 'annotations': annotations, 'error': error, 'imports': imports}
+
+    @classmethod
+    def store(cls, path, entry):
+        # Files that can not be stat'ed can not be checked for changes
+        if entry['stamp'] is None:
+            return
+        with cls.__lock:
+            cls.__entries[os.path.normpath(path)] = entry
+
+    @classmethod
+    def update(cls, path):
+        """Reads the file again if it changed"""
+        stamp = cls.getStamp(path)
+        with cls.__lock:
+            entry = cls.__entries.get(os.path.normpath(path))
+        if stamp is None or (entry and entry['stamp'] == stamp):
+            return
+        try:
+            cls.store(path, cls.read(path, stamp))
+        except OSError:
+            pass
+
+    @classmethod
+    def read(cls, path, stamp):
+        """Reads the whole file, for the annotations in its header and its imports"""
+        with open(path, 'r', encoding='utf-8', errors='replace') as handle:
+            headerLines = read_header(handle)
+            handle.seek(0)
+            text = handle.read()
+        imports = [m.group(1) for line in text.splitlines() if '"' in line
+                   for p in SOURCE_IMPORT_PATTERNS for m in p.finditer(line)]
+        return cls.createEntry(stamp, headerLines, imports)
+
+    @classmethod
+    def populate(cls, folders):
+        """Reads all source files in the folders"""
+        for folder in folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for fileName in files:
+                    if fileName.lower().endswith(SOURCE_EXTENSIONS):
+                        cls.update(os.path.join(root, fileName))
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__entries.clear()
+
+    @classmethod
+    def getTargets(cls):
+        """
+        Returns the build targets known from the cache: annotated files, and the
+        startup files and build-all files they name
+        """
+        with cls.__lock:
+            entries = dict(cls.__entries)
+        targets = set()
+        for path, entry in entries.items():
+            annotations = entry['annotations']
+            if not annotations:
+                continue
+            targets.add(path)
+            folder = os.path.dirname(path)
+            extension = os.path.splitext(path)[1]
+            startupFile = annotations.get("startup-file")
+            if startupFile:
+                targets.add(os.path.normpath(os.path.join(folder, startupFile + extension)))
+            for target in annotations.get("build-all-files") or []:
+                targets.add(os.path.normpath(os.path.join(folder, target if os.path.splitext(target)[1] else target + extension)))
+        return targets
+
+    @classmethod
+    def getIncludedFiles(cls, target, entries):
+        """Returns the files in the import graph of the target, as far as it is cached"""
+        rootDir = os.path.dirname(target)
+        files = set()
+        pending = [target]
+        while pending:
+            path = pending.pop()
+            if path in files:
+                continue
+            files.add(path)
+            entry = entries.get(path)
+            for fileName in entry['imports'] if entry else []:
+                candidates = [os.path.normpath(os.path.join(folder, fileName)) for folder in [os.path.dirname(path), rootDir]]
+                pending.append(next((c for c in candidates if c in entries), candidates[0]))
+        return files
+
+    @classmethod
+    def getTargetsIncluding(cls, path):
+        """Returns the build targets that include the file, from the cache only"""
+        path = os.path.normpath(path)
+        with cls.__lock:
+            entries = dict(cls.__entries)
+        return sorted(t for t in cls.getTargets() if path in cls.getIncludedFiles(t, entries))
+
+def populate_window_async(window):
+    folders = window.folders()
+    if folders:
+        sublime.set_timeout_async(lambda: KickAssAnnotationCache.populate(folders), 0)
+
+class KickAssAnnotationListener(sublime_plugin.EventListener):
+    """Reads the annotations of all source files when a project opens, and of each saved file"""
+
+    def on_load_project_async(self, window):
+        populate_window_async(window)
+
+    def on_post_save_async(self, view):
+        fileName = view.file_name()
+        if fileName and fileName.lower().endswith(SOURCE_EXTENSIONS):
+            KickAssAnnotationCache.update(fileName)
+
+def plugin_loaded():
+    for window in sublime.windows():
+        populate_window_async(window)
@@ -0,0 +1,428 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+
+from .kickass_variables import KickAssVariableExpander
+
+# Pepto's C64 palette, colors of images are mapped to the nearest of these
+C64_PALETTE = [(0x00, 0x00, 0x00), (0xff, 0xff, 0xff), (0x68, 0x37, 0x2b), (0x70, 0xa4, 0xb2),
+               (0x6f, 0x3d, 0x86), (0x58, 0x8d, 0x43), (0x35, 0x28, 0x79), (0xb8, 0xc7, 0x6f),
+               (0x6f, 0x4f, 0x25), (0x43, 0x39, 0x00), (0x9a, 0x67, 0x59), (0x44, 0x44, 0x44),
+               (0x6c, 0x6c, 0x6c), (0x9a, 0xd2, 0x84), (0x6c, 0x5e, 0xb5), (0x95, 0x95, 0x95)]
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Channels per pixel of the PNG color types
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+KOALA_LOAD_ADDRESS = 0x6000
+
+class KickAssAssetError(Exception):
+    pass
+
+class C64Image():
+    """
+    Image with the pixels mapped to C64 colors, None for transparent pixels
+    """
+    def __init__(self, width, height, pixels):
+        self.__width = width
+        self.__height = height
+        self.__pixels = pixels
+
+    @property
+    def Width(self):
+        return self.__width
+
+    @property
+    def Height(self):
+        return self.__height
+
+    def getPixel(self, x, y):
+        return self.__pixels[y * self.__width + x]
+
+    def getCell(self, x, y, width, height):
+        return [self.__pixels[row * self.__width + column] for row in range(y, y + height) for column in range(x, x + width)]
+
+    def getBackground(self, step):
+        """The background color of the step, or the most common color of the image"""
+        background = step.get('background')
+        if background is not None:
+            if not isinstance(background, int) or not 0 <= background < len(C64_PALETTE):
+                raise KickAssAssetError("background must be a color from 0 to 15")
+            return background
+        counts = collections.Counter(p for p in self.__pixels if p is not None)
+        return min(counts, key=lambda color: (-counts[color], color)) if counts else 0
+
+    def requireSize(self, name, widths, heights):
+        if self.__width not in widths or self.__height not in heights:
+            raise KickAssAssetError("image is %dx%d, %s must be %s" % (
+                self.__width, self.__height, name, " or ".join("%dx%d" % (w, h) for w in widths for h in heights)))
+
+    def requireMultiple(self, name, width, height):
+        if not self.__width or not self.__height or self.__width % width or self.__height % height:
+            raise KickAssAssetError("image is %dx%d, %s must be a multiple of %dx%d" % (self.__width, self.__height, name, width, height))
+
+def getNearestColor(rgb, colors=range(len(C64_PALETTE))):
+    return min(colors, key=lambda color: sum((a - b) ** 2 for a, b in zip(rgb, C64_PALETTE[color])))
+
+def readPng(data):
+    """
+    Decodes a non-interlaced PNG into a C64Image. Grayscale, RGB, palette
+    and alpha images are read, pixels with alpha below 128 are transparent.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise KickAssAssetError("not a PNG file")
+    position = len(PNG_SIGNATURE)
+    header, palette, transparency, compressed = None, None, None, []
+    while position + 8 <= len(data):
+        length, chunkType = struct.unpack('>I4s', data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if chunkType == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunkType == b'PLTE':
+            palette = [tuple(chunk[i:i + 3]) for i in range(0, len(chunk) - 2, 3)]
+        elif chunkType == b'tRNS':
+            transparency = chunk
+        elif chunkType == b'IDAT':
+            compressed.append(chunk)
+        elif chunkType == b'IEND':
+            break
+    if header is None:
+        raise KickAssAssetError("PNG file has no header")
+
+    width, height, depth, colorType, _, _, interlace = header
+    if interlace:
+        raise KickAssAssetError("interlaced PNG files are not supported")
+    if colorType not in PNG_CHANNELS or (depth != 8 and colorType not in (0, 3)) or depth > 8:
+        raise KickAssAssetError("PNG files with color type %d and bit depth %d are not supported" % (colorType, depth))
+    if colorType == 3 and palette is None:
+        raise KickAssAssetError("PNG file has no palette")
+    try:
+        raw = zlib.decompress(b''.join(compressed))
+    except zlib.error as ex:
+        raise KickAssAssetError("PNG data is corrupt: %s" % ex)
+
+    channels = PNG_CHANNELS[colorType]
+    stride = (width * channels * depth + 7) // 8
+    if len(raw) < (stride + 1) * height:
+        raise KickAssAssetError("PNG data is truncated")
+    bytesPerPixel = max(1, channels * depth // 8)
+    previous = bytearray(stride)
+    colors = {}
+    pixels = []
+    for y in range(height):
+        offset = y * (stride + 1)
+        row = unfilterRow(raw[offset], bytearray(raw[offset + 1:offset + 1 + stride]), previous, bytesPerPixel)
+        previous = row
+        if depth < 8:
+            perByte = 8 // depth
+            mask = (1 << depth) - 1
+            samples = [(row[x // perByte] >> (8 - depth * (x % perByte + 1))) & mask for x in range(width)]
+        else:
+            samples = row
+        for x in range(width):
+            if colorType == 3:
+                index = samples[x]
+                alpha = transparency[index] if transparency is not None and index < len(transparency) else 255
+                rgb = palette[index] if index < len(palette) else (0, 0, 0)
+            elif colorType in (0, 4):
+                gray = samples[x * channels] * 255 // ((1 << depth) - 1)
+                alpha = samples[x * channels + 1] if colorType == 4 else 255
+                rgb = (gray, gray, gray)
+            else:
+                rgb = tuple(samples[x * channels:x * channels + 3])
+                alpha = samples[x * channels + 3] if colorType == 6 else 255
+            if alpha < 128:
+                pixels.append(None)
+                continue
+            if rgb not in colors:
+                colors[rgb] = getNearestColor(rgb)
+            pixels.append(colors[rgb])
+    return C64Image(width, height, pixels)
+
+def unfilterRow(filterType, row, previous, bytesPerPixel):
+    if filterType == 0:
+        return row
+    for i in range(len(row)):
+        left = row[i - bytesPerPixel] if i >= bytesPerPixel else 0
+        up = previous[i]
+        if filterType == 1:
+            row[i] = (row[i] + left) & 0xff
+        elif filterType == 2:
+            row[i] = (row[i] + up) & 0xff
+        elif filterType == 3:
+            row[i] = (row[i] + ((left + up) >> 1)) & 0xff
+        elif filterType == 4:
+            upLeft = previous[i - bytesPerPixel] if i >= bytesPerPixel else 0
+            estimate = left + up - upLeft
+            distances = (abs(estimate - left), abs(estimate - up), abs(estimate - upLeft))
+            row[i] = (row[i] + (left if distances[0] <= distances[1] and distances[0] <= distances[2] else
+                                up if distances[1] <= distances[2] else upLeft)) & 0xff
+        else:
+            raise KickAssAssetError("PNG data has unknown filter type %d" % filterType)
+    return row
+
+def getCellColors(pixels, background, count):
+    """
+    Returns the count most common colors of the cell besides the background,
+    and the pixels with the other colors mapped to the nearest of those
+    """
+    counts = collections.Counter(p for p in pixels if p is not None and p != background)
+    colors = sorted(counts, key=lambda color: (-counts[color], color))[:count]
+    allowed = [background] + colors
+    nearest = {}
+    mapped = []
+    for pixel in pixels:
+        if pixel is None:
+            pixel = background
+        elif pixel not in allowed:
+            if pixel not in nearest:
+                nearest[pixel] = getNearestColor(C64_PALETTE[pixel], allowed)
+            pixel = nearest[pixel]
+        mapped.append(pixel)
+    return colors, mapped
+
+def packBits(bits, bitsPerPixel):
+    """Packs pixel values to bytes, leftmost pixel in the highest bits"""
+    data = bytearray()
+    perByte = 8 // bitsPerPixel
+    for i in range(0, len(bits), perByte):
+        byte = 0
+        for value in bits[i:i + perByte]:
+            byte = (byte << bitsPerPixel) | value
+        data.append(byte)
+    return data
+
+def convertKoala(image, step):
+    """
+    Multicolor bitmap in Koala format: load address, bitmap, screen memory,
+    color memory and background color. 320 pixel wide images use every other pixel.
+    """
+    image.requireSize("koala pictures", (160, 320), (200,))
+    scale = image.Width // 160
+    background = image.getBackground(step)
+    bitmap, screen, colorRam = bytearray(), bytearray(), bytearray()
+    for y in range(0, 200, 8):
+        for x in range(0, 160, 4):
+            cell = image.getCell(x * scale, y, 4 * scale, 8)[::scale]
+            colors, pixels = getCellColors(cell, background, 3)
+            colors += [0] * (3 - len(colors))
+            bits = [0 if p == background else colors.index(p) + 1 for p in pixels]
+            bitmap.extend(packBits(bits, 2))
+            screen.append(colors[0] << 4 | colors[1])
+            colorRam.append(colors[2])
+    return bytes(struct.pack('<H', KOALA_LOAD_ADDRESS) + bitmap + screen + colorRam + bytearray([background]))
+
+def convertHires(image, step):
+    """
+    Hires bitmap: bitmap followed by screen memory, the foreground color of
+    each cell in the high nibble
+    """
+    image.requireSize("hires pictures", (320,), (200,))
+    bitmap, screen = bytearray(), bytearray()
+    for y in range(0, 200, 8):
+        for x in range(0, 320, 8):
+            cell = image.getCell(x, y, 8, 8)
+            counts = collections.Counter(p for p in cell if p is not None)
+            background = min(counts, key=lambda color: (-counts[color], color)) if counts else 0
+            colors, pixels = getCellColors(cell, background, 1)
+            foreground = colors[0] if colors else background
+            bitmap.extend(packBits([1 if p == foreground and p != background else 0 for p in pixels], 1))
+            screen.append(foreground << 4 | background)
+    return bytes(bitmap + screen)
+
+def convertCharset(image, step):
+    """Characters of 8x8 pixels, left to right and top to bottom"""
+    image.requireMultiple("charsets", 8, 8)
+    return convertCells(image, step, 8, 8, 0)
+
+def convertSprites(image, step):
+    """Hires sprites of 24x21 pixels, left to right and top to bottom, padded to 64 bytes"""
+    image.requireMultiple("sprites", 24, 21)
+    return convertCells(image, step, 24, 21, 1)
+
+def convertCells(image, step, width, height, padding):
+    background = image.getBackground(step)
+    data = bytearray()
+    for y in range(0, image.Height, height):
+        for x in range(0, image.Width, width):
+            data.extend(packBits([0 if p is None or p == background else 1 for p in image.getCell(x, y, width, height)], 1))
+            data.extend(bytearray(padding))
+    return bytes(data)
+
+CONVERTERS = {
+    'koala': convertKoala,
+    'hires': convertHires,
+    'charset': convertCharset,
+    'sprites': convertSprites,
+    }
+
+class KickAssAssetPipeline():
+    """
+    Converts binary assets declared in the kickass_assets setting, such as
+    PNG files to koala pictures or sprites, or SID files through a relocation
+    command. Results are kept in a content-addressed cache in the output folder,
+    keyed by a hash of the source file and the conversion, so a step only runs
+    when its source or its settings change. Outputs are only written when they
+    differ, which keeps the build cache up to date.
+
+    Conversions run in parallel on a pool of workers. Command steps each run
+    in their own process.
+    """
+    VERSION = 1
+    CACHE_FOLDER = 'AssetCache'
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, workingDir, outputFolder, steps, maxProcesses=None):
+        self.__workingDir = workingDir
+        self.__cacheFolder = os.path.join(workingDir, outputFolder, self.CACHE_FOLDER)
+        self.__steps = steps
+        self.__maxProcesses = maxProcesses or multiprocessing.cpu_count()
+        self.__manifest = self.loadManifest()
+
+    @property
+    def CacheFolder(self):
+        return self.__cacheFolder
+
+    def loadManifest(self):
+        try:
+            with open(os.path.join(self.__cacheFolder, self.MANIFEST_FILE), 'r', encoding='utf-8') as handle:
+                manifest = json.load(handle)
+            return manifest if manifest.get('version') == self.VERSION else {}
+        except (OSError, ValueError):
+            return {}
+
+    def saveManifest(self, files, outputs):
+        manifest = {'version': self.VERSION, 'files': files, 'outputs': outputs}
+        with open(os.path.join(self.__cacheFolder, self.MANIFEST_FILE), 'w', encoding='utf-8') as handle:
+            json.dump(manifest, handle)
+        self.__manifest = manifest
+
+    def getPath(self, path):
+        return os.path.normpath(os.path.join(self.__workingDir, path))
+
+    def getStamp(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def hashSource(self, path):
+        """Hash of the source file, reused while its mtime and size are unchanged"""
+        stamp = self.getStamp(path)
+        if stamp is None:
+            raise KickAssAssetError("source file not found")
+        entry = self.__manifest.get('files', {}).get(path)
+        if entry and entry['stamp'] == stamp:
+            return entry
+        with open(path, 'rb') as handle:
+            return {'stamp': stamp, 'hash': hashlib.sha1(handle.read()).hexdigest()}
+
+    def validateStep(self, step):
+        if not isinstance(step, dict) or not step.get('source') or not step.get('output'):
+            raise KickAssAssetError("asset steps need a source and an output")
+        if 'command' in step:
+            return
+        if step.get('convert') not in CONVERTERS:
+            raise KickAssAssetError("unknown conversion %r, use one of %s or a command" % (step.get('convert'), ", ".join(sorted(CONVERTERS))))
+
+    def createKey(self, step, sourceHash):
+        """Key of the converted content, the output path is not part of it"""
+        conversion = dict((k, v) for k, v in step.items() if k not in ('source', 'output'))
+        return hashlib.sha1(json.dumps([self.VERSION, conversion, sourceHash], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def convert(self, step, key):
+        """Runs the step and stores its result in the cache under the key"""
+        sourcePath = self.getPath(step['source'])
+        cachePath = os.path.join(self.__cacheFolder, key)
+        temporaryPath = cachePath + '.tmp'
+        if 'command' in step:
+            command = KickAssVariableExpander({'source': sourcePath, 'output': temporaryPath}, []).expand(step['command'])
+            process = subprocess.Popen(command, shell=True, cwd=self.__workingDir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0].decode('utf-8', 'replace').strip()
+            if process.returncode != 0 or not os.path.isfile(temporaryPath):
+                raise KickAssAssetError("command failed with exit code %d%s" % (process.returncode, ": %s" % output if output else ""))
+        else:
+            with open(sourcePath, 'rb') as handle:
+                image = readPng(handle.read())
+            with open(temporaryPath, 'wb') as handle:
+                handle.write(CONVERTERS[step['convert']](image, step))
+        os.replace(temporaryPath, cachePath)
+
+    def run(self):
+        """
+        Converts the steps whose results are not cached, and writes the outputs
+        that changed. Returns (converted, written) counts.
+        """
+        os.makedirs(self.__cacheFolder, exist_ok=True)
+        files, keys, errors = {}, [], []
+        for step in self.__steps:
+            try:
+                self.validateStep(step)
+                sourcePath = self.getPath(step['source'])
+                if sourcePath not in files:
+                    files[sourcePath] = self.hashSource(sourcePath)
+                keys.append(self.createKey(step, files[sourcePath]['hash']))
+            except (KickAssAssetError, OSError) as ex:
+                errors.append(self.formatError(step, ex))
+                keys.append(None)
+        if errors:
+            raise KickAssAssetError("\n".join(errors))
+
+        pending = collections.OrderedDict()
+        for step, key in zip(self.__steps, keys):
+            if key not in pending and not os.path.isfile(os.path.join(self.__cacheFolder, key)):
+                pending[key] = step
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.__maxProcesses)) as executor:
+            futures = [(step, executor.submit(self.convert, step, key)) for key, step in pending.items()]
+        for step, future in futures:
+            try:
+                future.result()
+            except (KickAssAssetError, OSError) as ex:
+                errors.append(self.formatError(step, ex))
+        if errors:
+            raise KickAssAssetError("\n".join(errors))
+
+        outputs = {}
+        written = 0
+        for step, key in zip(self.__steps, keys):
+            outputPath = self.getPath(step['output'])
+            if self.writeOutput(outputPath, key):
+                written += 1
+            outputs[outputPath] = {'key': key, 'stamp': self.getStamp(outputPath)}
+        self.removeUnused(set(keys))
+        self.saveManifest(files, outputs)
+        return len(pending), written
+
+    def writeOutput(self, outputPath, key):
+        """Copies the cached result to the output, unless it is there already"""
+        entry = self.__manifest.get('outputs', {}).get(outputPath)
+        if entry and entry['key'] == key and entry['stamp'] == self.getStamp(outputPath):
+            return False
+        outputFolder = os.path.dirname(outputPath)
+        if outputFolder:
+            os.makedirs(outputFolder, exist_ok=True)
+        shutil.copyfile(os.path.join(self.__cacheFolder, key), outputPath)
+        return True
+
+    def removeUnused(self, keys):
+        """Deletes cached results no step uses anymore, so the cache does not grow with every edit"""
+        for fileName in os.listdir(self.__cacheFolder):
+            if fileName != self.MANIFEST_FILE and fileName not in keys:
+                try:
+                    os.unlink(os.path.join(self.__cacheFolder, fileName))
+                except OSError:
+                    pass
+
+    def formatError(self, step, ex):
+        source = step.get('source') if isinstance(step, dict) else None
+        return "%s: %s" % (source or step, ex)
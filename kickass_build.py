@@ -5,6 +5,22 @@ import glob
 import shutil
 import json
 import contextlib
+import shlex
+import subprocess
+import multiprocessing
+import concurrent.futures
+import copy
+import threading
+import traceback
+from .kickass_assets import KickAssAssetPipeline, KickAssAssetError
+from .kickass_compile_server import KickAssCompileServer, KickAssCompileServerError
+from .kickass_build_cache import KickAssBuildCache
+from .kickass_build_plan import KickAssBuildPlanCache
+from .kickass_annotations import KickAssAnnotationCache
+from .kickass_output_cleanup import KickAssOutputCleaner
+from .kickass_profiler import KickAssProfiler, KickAssTimer
+from .kickass_settings import KickAssSettings
+from .kickass_variables import KickAssVariableExpander, KickAssVariableError
 
 # This file is based on work from:
 # https://github.com/STealthy-and-haSTy/SublimeScraps/blob/master/build_enhancements/custom_build_variables.py
@@ -42,8 +58,27 @@ vars_to_expand_list = [
                         "kickass_debug_command_x64",
                         "kickass_run_command_c64debugger",
                         "kickass_debug_command_c64debugger",
+                        "start_filename",
                         ]
 
+# Settings the exec dict is created from, besides the variables
+plan_setting_keys = custom_var_list + [
+                    "default_make_path",
+                    "kickass_build_all_files",
+                    "kickass_env",
+                    "kickass_path",
+                    "kickass_use_build_cache",
+                    "kickass_use_compile_server"]
+
+# Arguments of the build system passed on to exec, watch mode builds with those of the last build
+build_system_keys = ["encoding", "env", "file_regex", "line_regex", "path", "shell", "syntax", "working_dir"]
+build_system_resource = "Build Systems/KickAssembler(C64).sublime-build"
+
+# Build scripts looked for when creating the command, with the setting of their default folder
+plan_scripts = [("prebuild", "default_prebuild_path"),
+                ("postbuild", "default_postbuild_path"),
+                ("make", "default_make_path")]
+
 @contextlib.contextmanager
 def setTemporaryWorkingDirectory(path):
     _cwd = os.getcwd()
@@ -61,45 +96,136 @@ class KickassBuildCommand(sublime_plugin.WindowCommand):
     def createExecDict(self, sourceDict, variables, buildMode, settings):
         global custom_var_list, vars_to_expand_list
 
-        try:
-            # Save path variable from expansion
-            tmpPath = sourceDict.pop('path', None)
+        # Building the same target again with nothing changed reuses the exec dict
+        planKey = (buildMode, variables.get("file"))
+        commandFactory = KickAssCommandFactory(settings)
+        planFingerprint = self.getPlanFingerprint(sourceDict, variables, buildMode, settings, commandFactory)
+        plan = self.__planCache.get(planKey, planFingerprint)
+        if plan is not None:
+            return plan
+
+        # Save path variable from expansion
+        tmpPath = sourceDict.pop('path', None)
+
+        # Variables to expand; start with defaults, then add ours.
+        variables.update(self.getFilenameVariables(buildMode, settings, variables))
 
-            # Variables to expand; start with defaults, then add ours.
-            variables.update(self.getFilenameVariables(buildMode, settings, variables))
+        # Create the command
+        kickAssCommand = commandFactory.createCommand(variables, buildMode)
+        sourceDict['shell_cmd'] = kickAssCommand.CommandText
 
-            # Create the command
-            kickAssCommand = KickAssCommandFactory(settings).createCommand(variables, buildMode)
-            sourceDict['shell_cmd'] = kickAssCommand.CommandText
+        # Add pre and post variables
+        extendedDict = kickAssCommand.updateEnvVars(sourceDict)
 
-            # Add pre and post variables
-            extendedDict = kickAssCommand.updateEnvVars(sourceDict)
+        # Compile requests are run by the plugin before exec, expand them with everything else
+        if kickAssCommand.CompileRequest:
+            extendedDict['kickass_compile_request'] = kickAssCommand.CompileRequest
 
-            for custom_var in custom_var_list:
-                variables[custom_var] = settings.getSetting(custom_var)
+        for custom_var in custom_var_list:
+            variables[custom_var] = settings.getSetting(custom_var)
 
-            # Expand variables (mutiple times to support variables in Variables)
-            for x in range(2):
-                variables_to_expand = {k: v for k, v in variables.items() if k in vars_to_expand_list}
-                variables = self.mergeDictionaries(variables, sublime.expand_variables (variables_to_expand, variables))
+        if buildMode == 'build-all':
+            kickAssCommand.CompileRequest['targets'] = self.createBuildAllTargets(self.getBuildAllTargets(settings, variables), variables, settings)
 
-            # Create arguments to return by expanding variables in the
-            # arguments given.
-            args = sublime.expand_variables (extendedDict, variables)
+        # Create arguments to return by expanding variables in the
+        # arguments given.
+        with KickAssProfiler.phase("command expansion"):
+            args = KickAssVariableExpander(variables, vars_to_expand_list).expand(extendedDict)
 
-            # Reset path to unexpanded and add path addition from settings
-            args['path'] = self.getPathDelimiter().join(filter(None, [settings.getSetting("kickass_path"), tmpPath]))
+        # Reset path to unexpanded and add path addition from settings
+        args['path'] = self.getPathDelimiter().join(filter(None, [settings.getSetting("kickass_path"), tmpPath]))
 
-            envSetting = settings.getSetting("kickass_env")
-            if envSetting:
-                args['env'].update(envSetting)
-        except Exception as ex:
-            sourceDict['shell_cmd'] = "echo %s" % ex
-            return sourceDict
+        envSetting = settings.getSetting("kickass_env")
+        if envSetting:
+            args.setdefault('env', {}).update(envSetting)
 
+        self.__planCache.store(planKey, planFingerprint, args)
         return args
 
+    def getPlanFingerprint(self, sourceDict, variables, buildMode, settings, commandFactory):
+        """
+        Returns everything the exec dict is created from as a string: the build system
+        arguments, the variables, the settings, the build annotations and the build
+        scripts found. Returns None if the exec dict should not be reused.
+        """
+        try:
+            with KickAssProfiler.phase("script discovery"):
+                scriptStamps = [self.getFileStamp(path) for scriptFilename, setting in plan_scripts
+                                for path in commandFactory.getRunScriptPaths(scriptFilename, setting)]
+            return json.dumps([sourceDict, variables, buildMode, os.getcwd(),
+                               [settings.getSetting(key) for key in plan_setting_keys],
+                               self.getPlanAnnotations(variables, buildMode, settings),
+                               scriptStamps], sort_keys=True)
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+    def getPlanAnnotations(self, variables, buildMode, settings):
+        currentFileAnnotations = self.parseAnnotations(variables["file"])
+        if 'startup' not in buildMode:
+            return [currentFileAnnotations]
+        startupFile = currentFileAnnotations.get("startup-file") or settings.getSetting("kickass_startup_file_path")
+        return [currentFileAnnotations, self.parseAnnotations("%s/%s.%s" % (variables["file_path"], startupFile, variables["file_extension"]))]
+
+    def getFileStamp(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def getBuildAllTargets(self, settings, variables):
+        currentFileBuildAnnotations = self.parseAnnotations(variables["file"])
+        targets = currentFileBuildAnnotations.get("build-all-files") or settings.getSetting("kickass_build_all_files")
+        if not targets:
+            raise ValueError("No build targets found, add a kickass_build_all_files setting or a build-all-files annotation")
+        return targets
+
+    def createBuildAllTargets(self, targets, variables, settings):
+        """
+        Creates the compile command for each target, with the target's own
+        output folder inside the output folder
+        """
+        compileCommand = KickAssCommandFactory(settings).createCompileCommandText()
+        targetRequests = []
+        for target in targets:
+            baseName, extension = os.path.splitext(target)
+            extension = extension.lstrip('.') or variables["file_extension"]
+            targetVariables = self.mergeDictionaries(variables, {
+                "build_file_base_name": baseName,
+                "file_extension": extension,
+                "kickass_output_path": "%s/%s" % (variables["kickass_output_path"], os.path.basename(baseName)),
+                })
+            with KickAssProfiler.phase("command expansion"):
+                targetCommand = KickAssVariableExpander(targetVariables, vars_to_expand_list).expand(compileCommand)
+            targetRequests.append({
+                "source_file": "%s.%s" % (baseName, extension),
+                "command": targetCommand,
+                })
+        return targetRequests
+
+    def getFileVariables(self, path):
+        fileName = os.path.basename(path)
+        baseName, extension = os.path.splitext(fileName)
+        return {
+            "file": path,
+            "file_path": os.path.dirname(path),
+            "file_name": fileName,
+            "file_base_name": baseName,
+            "file_extension": extension.lstrip('.'),
+            }
+
+    def getProgramPath(self, variables, buildMode, settings):
+        variables = self.mergeDictionaries(variables, self.getFilenameVariables(buildMode, settings, variables))
+        for custom_var in custom_var_list:
+            variables[custom_var] = settings.getSetting(custom_var)
+        return KickAssVariableExpander(variables, vars_to_expand_list).expand("${file_path}/${kickass_output_path}/${kickass_compiled_filename}")
+
     def getFilenameVariables(self, buildMode, settings, variables):
+        if buildMode == 'build-all':
+            return {
+                "build_file_base_name": "BuildAll",
+                "start_filename": ""
+                }
         useStartup = 'startup' in buildMode
         currentFilePath = variables["file"]
         currentFileBuildAnnotations = self.parseAnnotations(currentFilePath)
@@ -114,39 +240,144 @@ class KickassBuildCommand(sublime_plugin.WindowCommand):
             }
 
     def parseAnnotations (self, filename):
-        with open(filename, 'r') as handle:
-            firstline = handle.readline().strip()
-        try:
-            return (json.loads("{%s}" % firstline[2:].strip().split("@kickass-build", 1)[1]) 
-                    if firstline.startswith("//") and "@kickass-build" in firstline 
-                    else {})
-        except ValueError as err:
-            raise ValueError("Could not parse build annotations: %s" % err)
+        # Annotations are read from the comment block at the top of the file, and cached until the file changes
+        with KickAssProfiler.phase("annotation parse"):
+            return KickAssAnnotationCache.get(filename)
 
     def getPathDelimiter(self):
         return ";" if platform.system()=='Windows' else ":" 
 
     def emptyFolder(self, path):
         for root, dirs, files in os.walk(path):
+            # Converted assets are kept, they are only converted again when their sources change
+            if root == path:
+                dirs[:] = [d for d in dirs if d != KickAssAssetPipeline.CACHE_FOLDER]
             for f in files:
                 os.unlink(os.path.join(root, f))
             for d in dirs:
                 shutil.rmtree(os.path.join(root, d))
 
+    def cleanOutputFolder(self, path, settings):
+        mode = settings.getSetting("kickass_output_cleanup") or "empty"
+        keepPatterns = settings.getSettingAsList("kickass_output_keep_files")
+        with KickAssProfiler.phase("folder cleanup"):
+            if mode == "empty" and not keepPatterns:
+                self.emptyFolder(path)
+            else:
+                KickAssOutputCleaner(path, keepPatterns).clean(mode)
+
+    def getAssetSteps(self, settings):
+        steps = settings.getSetting("kickass_assets")
+        return steps if isinstance(steps, list) else []
+
+    def convertAssets(self, steps, variables, settings):
+        maxProcesses = int(settings.getSetting("kickass_assets_max_processes") or multiprocessing.cpu_count())
+        pipeline = KickAssAssetPipeline(variables["file_path"], settings.getSetting("kickass_output_path"), steps, maxProcesses)
+        with KickAssProfiler.phase("asset conversion"):
+            converted, written = pipeline.run()
+        if converted or written:
+            print("Assets: %d converted, %d written, %d up to date" % (converted, written, len(steps) - written))
+
+    @classmethod
+    def rememberBuildSystemArgs(cls, windowId, kwargs):
+        with cls.__buildSystemLock:
+            cls.__buildSystemArgs[windowId] = dict((k, copy.deepcopy(v)) for k, v in kwargs.items() if k in build_system_keys)
+
+    @classmethod
+    def getBuildSystemArgs(cls, windowId):
+        """
+        Returns the build system arguments of the last build of the window, or of
+        the KickAssembler build system if the window has not built anything yet
+        """
+        with cls.__buildSystemLock:
+            args = cls.__buildSystemArgs.get(windowId)
+        if args is None:
+            args = cls.loadBuildSystemArgs()
+        return copy.deepcopy(args)
+
+    @classmethod
+    def loadBuildSystemArgs(cls):
+        buildSystem = sublime.decode_value(sublime.load_resource("Packages/%s/%s" % (__package__, build_system_resource)))
+        args = dict((k, v) for k, v in buildSystem.items() if k in build_system_keys)
+        args.update((k, v) for k, v in buildSystem.get(sublime.platform(), {}).items() if k in build_system_keys)
+        return args
+
     def mergeDictionaries(self, x, y):
         z = x.copy()   # start with x's keys and values
         z.update(y)    # modifies z with y's keys and values & returns None
         return z
 
+    __buildSystemArgs = {}
+    __buildSystemLock = threading.Lock()
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.__buildId = 0
+        self.__buildLock = threading.Lock()
+        self.__planCache = KickAssBuildPlanCache()
+
+    def startBuild(self):
+        """Makes a new build the current one, earlier builds are cancelled when they check isCurrentBuild"""
+        with self.__buildLock:
+            self.__buildId += 1
+            return self.__buildId
+
+    def isCurrentBuild(self, buildId):
+        with self.__buildLock:
+            return buildId == self.__buildId
+
     def run(self, **kwargs):
         settings = SublimeSettings(self)
-        if not settings.isLoaded(): 
+        timer = KickAssTimer(kwargs.get('buildmode'))
+        with timer.phase("settings load"):
+            loaded = settings.isLoaded()
+        if not loaded: 
             errorMessage = "Settings could not be loaded, please restart Sublime Text."
             sublime.error_message(errorMessage) 
             print(errorMessage)
             return
 
         variables = self.window.extract_variables()
+        buildId = self.startBuild()
+        # Timings are reported when the exec command has finished
+        KickAssProfiler.startBuild(self.window.id(), timer)
+
+        # Stop the previous build, and the emulator started by it. Watch mode reloads the
+        # program into that emulator, its builds only supersede the build in progress
+        if not kwargs.get('watch_file'):
+            self.rememberBuildSystemArgs(self.window.id(), kwargs)
+            self.window.run_command('kickass_exec', {'kill': True})
+
+        # File system work is done on the worker thread, so that large output folders do not block the UI.
+        # Builds are prepared one at a time, builds superseded while they wait are skipped.
+        sublime.status_message("Preparing build...")
+        sublime.set_timeout_async(lambda: self.prepareBuild(buildId, kwargs, variables, settings), 0)
+
+    def prepareBuild(self, buildId, kwargs, variables, settings):
+        if not self.isCurrentBuild(buildId): return
+
+        with KickAssProfiler.activate(KickAssProfiler.getBuild(self.window.id())):
+            # Errors on the worker thread would only reach the console, and leave the build hanging
+            try:
+                self.prepareCurrentBuild(buildId, kwargs, variables, settings)
+            except Exception as ex:
+                traceback.print_exc()
+                self.failBuild(buildId, "Could not prepare the build:\n%s" % ex)
+
+    def failBuild(self, buildId, errorMessage):
+        """Finishes the build's timings and reports the error, unless a newer build has started"""
+        KickAssProfiler.finishBuild(self.window.id(), KickAssProfiler.getActive())
+        if not self.isCurrentBuild(buildId): return
+        sublime.status_message("Build failed")
+        sublime.error_message(errorMessage)
+
+    def prepareCurrentBuild(self, buildId, kwargs, variables, settings):
+        # Watch mode builds the watched file, which may not be the current file,
+        # and loads the program into the running emulator when the build succeeds
+        watchFile = kwargs.pop('watch_file', None)
+        if watchFile:
+            variables.update(self.getFileVariables(watchFile))
+
         with setTemporaryWorkingDirectory(variables["file_path"]):
             outputFolder = settings.getSetting("kickass_output_path")
 
@@ -158,44 +389,211 @@ class KickassBuildCommand(sublime_plugin.WindowCommand):
             except:
                 pass
 
-            if settings.getSettingAsBool("kickass_empty_bin_folder_before_build") and os.path.isdir(outputFolder):
-                self.emptyFolder(outputFolder)
+            buildMode = kwargs.pop('buildmode')
+            try:
+                if watchFile:
+                    programPath = self.getProgramPath(variables, buildMode, settings)
+                execDict = self.createExecDict(kwargs, variables, buildMode, settings)
+            except Exception as ex:
+                if not isinstance(ex, KickAssVariableError):
+                    traceback.print_exc()
+                self.failBuild(buildId, "Could not create the build command:\n%s" % ex)
+                return
+            if watchFile:
+                execDict['reload_program'] = programPath
+            if settings.getSettingAsBool("kickass_empty_bin_folder_before_build") and settings.getSetting("kickass_output_cleanup") == "stale":
+                execDict['record_output_folder'] = os.path.join(variables["file_path"], outputFolder)
+            compileRequest = execDict.pop('kickass_compile_request', None)
+            if not self.isCurrentBuild(buildId): return
 
-            self.window.run_command('exec', self.createExecDict(kwargs, variables, kwargs.pop('buildmode'), settings))
+            if settings.getSettingAsBool("kickass_empty_bin_folder_before_build") and os.path.isdir(outputFolder):
+                # With the build cache the folder is only emptied if the build is not up to date
+                if compileRequest and compileRequest.get('use_build_cache'):
+                    compileRequest['empty_output_folder'] = True
+                else:
+                    self.cleanOutputFolder(outputFolder, settings)
+
+            assetSteps = self.getAssetSteps(settings)
+            if assetSteps:
+                try:
+                    self.convertAssets(assetSteps, variables, settings)
+                except KickAssAssetError as ex:
+                    self.failBuild(buildId, "Could not convert the assets:\n%s" % ex)
+                    return
+                if not self.isCurrentBuild(buildId): return
+
+            if compileRequest:
+                self.runWithCompileRequest(buildId, execDict, compileRequest, settings)
+            else:
+                self.runExec(buildId, execDict)
+
+    def runExec(self, buildId, execDict):
+        def runIfCurrent():
+            if self.isCurrentBuild(buildId):
+                self.window.run_command('kickass_exec', execDict)
+        sublime.set_timeout(runIfCurrent, 0)
+
+    def runWithCompileRequest(self, buildId, execDict, compileRequest, settings):
+        sublime.status_message("Compiling %s..." % compileRequest['source_file'])
+        compileRequest['encoding'] = execDict.get('encoding', 'utf-8')
+        timer = KickAssProfiler.getActive()
+        def compileAndRun():
+            if not self.isCurrentBuild(buildId): return
+            with KickAssProfiler.activate(timer):
+                try:
+                    self.runCompileRequest(compileRequest, self.createProcessEnvironment(execDict), settings)
+                except Exception as ex:
+                    traceback.print_exc()
+                    self.failBuild(buildId, "Could not compile %s:\n%s" % (compileRequest['source_file'], ex))
+                    return
+            self.runExec(buildId, execDict)
+        sublime.set_timeout_async(compileAndRun, 0)
+
+    def runCompileRequest(self, compileRequest, env, settings):
+        """
+        Compiles through the compile server, falling back to the plain compile command,
+        and leaves the output and result where the exec command can replay it.
+        Skips the compile if the build cache says the output is up to date.
+        """
+        workingDir = compileRequest['working_dir']
+        outputs = compileRequest['outputs']
+        buildCache = None
+        if compileRequest.get('use_build_cache'):
+            libDirs = self.getLibDirs(self.splitArguments(compileRequest['arguments']))
+            buildCache = KickAssBuildCache(os.path.join(workingDir, compileRequest['cache_file']), workingDir, libDirs)
+
+        targets = compileRequest.get('targets')
+        upToDate = not targets and buildCache is not None and buildCache.isUpToDate(compileRequest['source_file'], compileRequest['command'], outputs)
+        if not targets and not upToDate and compileRequest.get('empty_output_folder'):
+            self.cleanOutputFolder(os.path.join(workingDir, compileRequest['output_folder']), settings)
+
+        with KickAssProfiler.phase("assembler runtime"):
+            if targets:
+                exitCode, output = self.compileTargets(compileRequest, env, settings)
+            elif upToDate:
+                exitCode, output = 0, "%s is up to date, skipping compile.\n" % compileRequest['source_file']
+            else:
+                if compileRequest.get('use_compile_server'):
+                    try:
+                        exitCode, output = self.compileWithServer(compileRequest, env, settings)
+                    except KickAssCompileServerError as ex:
+                        print("%s, falling back to compile command" % ex)
+                        exitCode, output = self.compileWithShell(compileRequest, env)
+                else:
+                    exitCode, output = self.compileWithShell(compileRequest, env)
+                if buildCache and exitCode == 0:
+                    buildCache.store(outputs)
+
+        logFile = os.path.join(workingDir, compileRequest['log_file'])
+        failedFile = os.path.join(workingDir, compileRequest['failed_file'])
+        os.makedirs(os.path.dirname(logFile), exist_ok=True)
+        with open(logFile, 'w', encoding=compileRequest.get('encoding', 'utf-8'), errors='replace') as handle:
+            handle.write(output)
+        if exitCode != 0:
+            open(failedFile, 'w').close()
+        elif os.path.exists(failedFile):
+            os.unlink(failedFile)
+        return exitCode
+
+    def compileTargets(self, compileRequest, env, settings):
+        """
+        Compiles all build-all targets in parallel, returns the merged output
+        """
+        targets = compileRequest['targets']
+        maxProcesses = int(settings.getSetting("kickass_build_all_max_processes") or multiprocessing.cpu_count())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, maxProcesses)) as executor:
+            results = list(executor.map(lambda target: self.compileWithShell(self.mergeDictionaries(compileRequest, target), env), targets))
+
+        output = []
+        failedTargets = []
+        for target, (exitCode, targetOutput) in zip(targets, results):
+            if exitCode != 0:
+                failedTargets.append(target['source_file'])
+            output.append("==== %s: %s ====\n%s\n" % (target['source_file'], "failed" if exitCode != 0 else "ok", targetOutput))
+        output.append("Built %d of %d targets.%s\n" % (len(targets) - len(failedTargets), len(targets),
+                                                        " Failed: %s" % ", ".join(failedTargets) if failedTargets else ""))
+        return (1 if failedTargets else 0), "".join(output)
+
+    def getLibDirs(self, arguments):
+        return [arguments[i + 1] for i, arg in enumerate(arguments[:-1]) if arg.lower() == "-libdir"]
+
+    def compileWithServer(self, compileRequest, env, settings):
+        serverPath = settings.getSettingAsPath("kickass_compile_server_path")
+        serverClassName = settings.getSetting("kickass_compile_server_class_name") or "KickAssCompileServer"
+        kickAssClassName = settings.getSetting("kickass_main_class_name") or "cml.kickass.KickAssembler"
+        classPath = [p for p in [settings.getSetting("kickass_jar_path"), serverPath] + env.get("CLASSPATH", "").split(os.pathsep) if p]
+        watchedFiles = [p for p in classPath if os.path.isfile(p)] + [os.path.join(serverPath, serverClassName + ".class")]
+        server = KickAssCompileServer.getServer(["java", "-cp", os.pathsep.join(classPath), serverClassName, kickAssClassName],
+                                                compileRequest['working_dir'], env, watchedFiles)
+        return server.compile(self.splitArguments(compileRequest['arguments']), compileRequest.get('encoding', 'utf-8'))
+
+    def compileWithShell(self, compileRequest, env):
+        process = subprocess.Popen(compileRequest['command'], shell=True, cwd=compileRequest['working_dir'], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        return process.returncode, output.decode(compileRequest.get('encoding', 'utf-8'), 'replace').replace("\r\n", "\n")
+
+    def createProcessEnvironment(self, execDict):
+        # Same environment the exec command would create
+        env = os.environ.copy()
+        for key, value in (execDict.get('env') or {}).items():
+            env[key] = os.path.expandvars(value)
+        if execDict.get('path'):
+            env['PATH'] = os.path.expandvars(execDict['path'])
+        return env
+
+    def splitArguments(self, arguments):
+        lexer = shlex.shlex(arguments, posix=True)
+        lexer.whitespace_split = True
+        if platform.system()=='Windows':
+            lexer.escape = ''
+        return list(lexer)
 
 class SublimeSettings():
     def __init__(self, parentCommand):
-        # Get the project specific settings
-        project_data = parentCommand.window.project_data()
-        self.__project_settings = (project_data or {}).get('settings', {})
+        # Settings are resolved through a snapshot cached per window and view, which is
+        # only created when the first setting is read
+        self.__window = parentCommand.window
+        self.__snapshot = None
 
-        # Get the view specific settings
-        self.__view_settings = parentCommand.window.active_view().settings()
+    @property
+    def Snapshot(self):
+        if self.__snapshot is None:
+            self.__snapshot = KickAssSettings.forView(self.__window.active_view(), self.__window)
+        return self.__snapshot
 
     def isLoaded(self):
-        return self.__getSetting("kickass_output_path") != None
+        return self.Snapshot.get("kickass_output_path") != None
 
     def getSetting(self, settingKey):
-        setting = self.__getSetting(settingKey)
+        setting = self.Snapshot.get(settingKey)
         return setting if setting else ""
 
-    def __getSetting(self, settingKey): 
-        return self.__view_settings.get(settingKey, self.__project_settings.get(settingKey, None))
+    def getSettingAsBool(self, settingKey):
+        return self.Snapshot.getBool(settingKey)
+
+    def getSettingAsPath(self, settingKey):
+        return self.Snapshot.getPath(settingKey)
 
-    def getSettingAsBool(self, settingKey): 
-        return self.getSetting(settingKey).lower() == "true"
+    def getSettingAsList(self, settingKey):
+        return self.Snapshot.getList(settingKey)
 
 class KickAssCommand():
-    def __init__(self, commandText, hasPreCommand, hasPostCommand, buildMode):
+    def __init__(self, commandText, hasPreCommand, hasPostCommand, buildMode, compileRequest=None):
         self.__commandText = commandText
         self.__hasPreCommand = hasPreCommand
         self.__hasPostCommand = hasPostCommand
         self.__buildMode = buildMode
+        self.__compileRequest = compileRequest
 
     @property
     def CommandText(self):
         return self.__commandText
 
+    @property
+    def CompileRequest(self):
+        return self.__compileRequest
+
     def updateEnvVars(self, sourceDict):
         if not self.__hasPreCommand and not self.__hasPostCommand: return sourceDict
         prePostEnvVars = {
@@ -205,7 +603,7 @@ class KickAssCommand():
             "kickass_prg_file": "${file_path}/${kickass_output_path}/${kickass_compiled_filename}",
             "kickass_bin_folder": "${file_path}/${kickass_output_path}",
             }
-        sourceDict.get('env').update(prePostEnvVars)
+        sourceDict.setdefault('env', {}).update(prePostEnvVars)
         return sourceDict
 
 class KickAssCommandFactory():
@@ -213,6 +611,8 @@ class KickAssCommandFactory():
         self.__settings = settings
  
     def createCommand(self, variables, buildMode): 
+        if buildMode=="build-all":
+            return self.createBuildAllCommand(variables, buildMode)
         return self.createMakeCommand(variables, buildMode) if buildMode=="make" else self.createKickassCommand(variables, buildMode)
 
     def createMakeCommand(self, variables, buildMode): 
@@ -220,10 +620,26 @@ class KickAssCommandFactory():
         makeCommand = makeCommand if makeCommand else "echo Make file not found. Place a file named make.%s in ${file_path}%s" % (self.getExt(), " or %s." % (self.__settings.getSetting("default_make_path")) if self.__settings.getSetting("default_make_path") else ".")
         return KickAssCommand(makeCommand, True, False, buildMode)
 
-    def createKickassCommand(self, variables, buildMode): 
+    def createBuildAllCommand(self, variables, buildMode):
+        # Targets are compiled by the plugin, they are added to the request by the build command
+        compileRequest = {
+            "working_dir": "${file_path}",
+            "source_file": "build targets",
+            "output_folder": "${kickass_output_path}",
+            "outputs": [],
+            "log_file": "${kickass_output_path}/${build_file_base_name}_CompileLog.txt",
+            "failed_file": "${kickass_output_path}/${build_file_base_name}_CompileFailed",
+            "targets": [],
+            }
+        return KickAssCommand(self.createCompileReplayStatement(), False, False, buildMode, compileRequest)
+
+    def createCompileCommandText(self):
         javaCommand = "java -cp \"${kickass_jar_path}\"" if self.__settings.getSetting("kickass_jar_path") else "java"
         kickAssClassName = "${kickass_main_class_name}" if self.__settings.getSetting("kickass_main_class_name") else "cml.kickass.KickAssembler"
-        compileCommand = "%s %s ${kickass_compile_args} " % (javaCommand, kickAssClassName)
+        return "%s %s ${kickass_compile_args} " % (javaCommand, kickAssClassName)
+
+    def createKickassCommand(self, variables, buildMode): 
+        compileCommand = self.createCompileCommandText()
         compileDebugCommandAdd = "${kickass_compile_debug_additional_args}"
 
         runCommand = "${kickass_run_command_x64}" 
@@ -237,11 +653,20 @@ class KickAssCommandFactory():
         useRun = 'run' in buildMode
         useDebug = 'debug' in buildMode
 
-        command =  " ".join([compileCommand, compileDebugCommandAdd, "&&", self.createMonCommandsStatement()]) if useDebug else compileCommand
-
         preBuildScript = self.getRunScriptStatement("prebuild", "default_prebuild_path")
         postBuildScript = self.getRunScriptStatement("postbuild", "default_postbuild_path")
 
+        # Prebuild scripts may generate sources, so they must run before the compile
+        compileRequest = None
+        useCompileServer = self.__settings.getSettingAsBool("kickass_use_compile_server")
+        useBuildCache = self.__settings.getSettingAsBool("kickass_use_build_cache")
+        if preBuildScript == None and (useCompileServer or useBuildCache):
+            compileRequest = self.createCompileRequest(" ".join([compileCommand, compileDebugCommandAdd]) if useDebug else compileCommand, useDebug, useCompileServer, useBuildCache)
+            compileCommand = self.createCompileReplayStatement()
+            compileDebugCommandAdd = ""
+
+        command =  " ".join([compileCommand, compileDebugCommandAdd, "&&", self.createMonCommandsStatement()]) if useDebug else compileCommand
+
         if preBuildScript:
             command = " ".join([preBuildScript, "&&", command])
         if postBuildScript:
@@ -251,20 +676,54 @@ class KickAssCommandFactory():
         elif useRun:
             command = " ".join([command, "&&", runCommand])
 
+        if compileRequest:
+            return KickAssCommand(command.strip(), preBuildScript != None, postBuildScript != None, buildMode, compileRequest)
         return KickAssCommand(command.strip(), preBuildScript != None, postBuildScript != None, buildMode)
 
+    def createCompileRequest(self, compileCommand, useDebug, useCompileServer, useBuildCache):
+        outputs = ["${kickass_output_path}/${kickass_compiled_filename}"]
+        if "-vicesymbols" in self.__settings.getSetting("kickass_compile_args"):
+            outputs.append("${kickass_output_path}/${build_file_base_name}.vs")
+        return {
+            "command": compileCommand.strip(),
+            "arguments": "${kickass_compile_args} ${kickass_compile_debug_additional_args}" if useDebug else "${kickass_compile_args}",
+            "working_dir": "${file_path}",
+            "source_file": "${build_file_base_name}.${file_extension}",
+            "output_folder": "${kickass_output_path}",
+            "outputs": outputs,
+            "log_file": "${kickass_output_path}/${build_file_base_name}_CompileLog.txt",
+            "failed_file": "${kickass_output_path}/${build_file_base_name}_CompileFailed",
+            "cache_file": "${kickass_output_path}/${build_file_base_name}_BuildCache.json",
+            "use_compile_server": useCompileServer,
+            "use_build_cache": useBuildCache,
+            }
+
+    def createCompileReplayStatement(self):
+        if platform.system()=='Windows':
+            return "type \"${kickass_output_path}\\\\${build_file_base_name}_CompileLog.txt\" && (if exist \"${kickass_output_path}\\\\${build_file_base_name}_CompileFailed\" exit /b 1)"
+        else:
+            return "cat \"${kickass_output_path}/${build_file_base_name}_CompileLog.txt\" && [ ! -f \"${kickass_output_path}/${build_file_base_name}_CompileFailed\" ]"
+
     def getExt(self): 
         return "bat" if platform.system()=='Windows' else "sh" 
 
+    def getRunScriptPaths(self, scriptFilename, defaultScriptPathSetting):
+        """Returns the paths of the script in the default script folder and in the working directory"""
+        return ("%s/%s.%s" % (self.__settings.getSetting(defaultScriptPathSetting), scriptFilename, self.getExt()),
+                "%s.%s" % (scriptFilename, self.getExt()))
+
     def getRunScriptStatement(self, scriptFilename, defaultScriptPathSetting):
-        defaultScriptCommand = "%s/%s.%s" % (self.__settings.getSetting(defaultScriptPathSetting), scriptFilename, self.getExt())
-        hasDefaultScriptCommand = glob.glob(defaultScriptCommand)
-        scriptCommand = "%s.%s" % (scriptFilename, self.getExt())
-        hasScriptCommand = glob.glob(scriptCommand)
+        defaultScriptCommand, scriptCommand = self.getRunScriptPaths(scriptFilename, defaultScriptPathSetting)
+        with KickAssProfiler.phase("script discovery"):
+            hasDefaultScriptCommand = glob.glob(defaultScriptCommand)
+            hasScriptCommand = glob.glob(scriptCommand)
         return "%s \"%s\"" % ("call" if platform.system()=='Windows' else ".", (scriptCommand if hasScriptCommand else defaultScriptCommand)) if hasScriptCommand or hasDefaultScriptCommand else None 
  
     def createMonCommandsStatement(self):
         if platform.system()=='Windows':
             return "copy /Y \"${kickass_output_path}\\\\${build_file_base_name}.vs\" + \"${kickass_output_path}\\\\${kickass_breakpoint_filename}\" \"${kickass_output_path}\\\\${build_file_base_name}_MonCommands.mon\""
         else:
-            return "[ -f \"${kickass_output_path}/${kickass_breakpoint_filename}\" ] && cat \"${kickass_output_path}/${build_file_base_name}.vs\" \"${kickass_output_path}/${kickass_breakpoint_filename}\" > \"${kickass_output_path}/${build_file_base_name}_MonCommands.mon\" || cat \"${kickass_output_path}/${build_file_base_name}.vs\" > \"${kickass_output_path}/${build_file_base_name}_MonCommands.mon\""
\ No newline at end of file
+            return "[ -f \"${kickass_output_path}/${kickass_breakpoint_filename}\" ] && cat \"${kickass_output_path}/${build_file_base_name}.vs\" \"${kickass_output_path}/${kickass_breakpoint_filename}\" > \"${kickass_output_path}/${build_file_base_name}_MonCommands.mon\" || cat \"${kickass_output_path}/${build_file_base_name}.vs\" > \"${kickass_output_path}/${build_file_base_name}_MonCommands.mon\""
+
+def plugin_unloaded():
+    KickAssCompileServer.stopAll()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+
+# Files are scanned for these to find the inputs of a build. Source imports are
+# scanned recursively, everything else is only hashed.
+SOURCE_IMPORT_PATTERNS = [
+    re.compile(r'^\s*#import(?:if\b[^"]*)?\s*"([^"]+)"'),
+    re.compile(r'^\s*\.import\s+source\s+"([^"]+)"'),
+    ]
+BINARY_IMPORT_PATTERNS = [
+    re.compile(r'^\s*\.import\s+(?:binary|c64|text)\s+"([^"]+)"'),
+    re.compile(r'Load(?:Binary|Picture|Sid)\s*\(\s*"([^"]+)"'),
+    ]
+
+class KickAssBuildCache():
+    """
+    Decides if a build can be skipped, by comparing a hash of all files in the
+    import graph of the build file, and of the compile command, with the one
+    stored after the last successful build. Per file hashes and imports are
+    reused as long as the file's mtime and size are unchanged.
+    """
+    VERSION = 1
+
+    def __init__(self, cacheFile, workingDir, libDirs=None):
+        self.__cacheFile = cacheFile
+        self.__workingDir = workingDir
+        self.__libDirs = libDirs or []
+        self.__cache = self.loadCache()
+        self.__files = {}
+        self.__key = None
+
+    def loadCache(self):
+        try:
+            with open(self.__cacheFile, 'r', encoding='utf-8') as handle:
+                cache = json.load(handle)
+            return cache if cache.get('version') == self.VERSION else {}
+        except (OSError, ValueError):
+            return {}
+
+    def getFileEntry(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.__cache.get('files', {}).get(path)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        return {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': hashlib.sha1(content).hexdigest(),
+            'imports': self.parseImports(content.decode('utf-8', 'replace')) if self.isSourceFile(path) else None,
+            }
+
+    def isSourceFile(self, path):
+        return os.path.splitext(path)[1].lower() not in ['.bin', '.prg', '.sid', '.png', '.gif', '.jpg', '.kla', '.koa', '.raw', '.64c']
+
+    def parseImports(self, text):
+        sources, binaries = [], []
+        for line in text.splitlines():
+            if '"' not in line or line.lstrip().startswith('//'):
+                continue
+            sources.extend(m.group(1) for p in SOURCE_IMPORT_PATTERNS for m in p.finditer(line))
+            binaries.extend(m.group(1) for p in BINARY_IMPORT_PATTERNS for m in p.finditer(line))
+        return {'sources': sources, 'binaries': binaries}
+
+    def resolveImport(self, filename, importingDir, rootDir):
+        if os.path.isabs(filename):
+            return os.path.normpath(filename)
+        for folder in [importingDir, rootDir] + [os.path.join(self.__workingDir, d) for d in self.__libDirs]:
+            path = os.path.normpath(os.path.join(folder, filename))
+            if os.path.isfile(path):
+                return path
+        return os.path.normpath(os.path.join(importingDir, filename))
+
+    def scanInputs(self, sourceFile):
+        rootPath = os.path.normpath(os.path.join(self.__workingDir, sourceFile))
+        rootDir = os.path.dirname(rootPath)
+        files = {}
+        pending = [(rootPath, True)]
+        while pending:
+            path, isSource = pending.pop()
+            if path in files:
+                continue
+            entry = self.getFileEntry(path)
+            files[path] = entry
+            if not entry or not isSource or not entry['imports']:
+                continue
+            importingDir = os.path.dirname(path)
+            pending.extend((self.resolveImport(f, importingDir, rootDir), True) for f in entry['imports']['sources'])
+            pending.extend((self.resolveImport(f, importingDir, rootDir), False) for f in entry['imports']['binaries'])
+        return files
+
+    def createKey(self, compileCommand, files):
+        key = hashlib.sha1(compileCommand.encode('utf-8'))
+        for path in sorted(files):
+            key.update(("%s=%s\n" % (path, files[path]['hash'] if files[path] else None)).encode('utf-8'))
+        return key.hexdigest()
+
+    def hashOutputs(self, outputs):
+        hashes = {}
+        for output in outputs:
+            entry = self.getFileEntry(os.path.join(self.__workingDir, output))
+            hashes[output] = entry['hash'] if entry else None
+        return hashes
+
+    def isUpToDate(self, sourceFile, compileCommand, outputs):
+        """
+        Scans the inputs of the build, returns True if they, the compile command
+        and the outputs are unchanged since the last stored build.
+        """
+        self.__files = self.scanInputs(sourceFile)
+        self.__key = self.createKey(compileCommand, self.__files)
+        if self.__cache.get('key') != self.__key:
+            return False
+        storedOutputs = self.__cache.get('outputs', {})
+        outputHashes = self.hashOutputs(outputs)
+        return all(outputHashes[o] != None and storedOutputs.get(o) == outputHashes[o] for o in outputs)
+
+    def store(self, outputs):
+        """Stores the state scanned by isUpToDate, call after a successful build"""
+        cache = {
+            'version': self.VERSION,
+            'key': self.__key,
+            'files': {path: entry for path, entry in self.__files.items() if entry},
+            'outputs': self.hashOutputs(outputs),
+            }
+        os.makedirs(os.path.dirname(self.__cacheFile), exist_ok=True)
+        with open(self.__cacheFile, 'w', encoding='utf-8') as handle:
+            json.dump(cache, handle)
+        self.__cache = cache
@@ -0,0 +1,112 @@
+import os
+import re
+from collections import namedtuple
+
+# Structured records parsed from KickAssembler's output
+BuildMessage = namedtuple('BuildMessage', ['kind', 'file', 'line', 'column', 'text'])
+MemoryBlock = namedtuple('MemoryBlock', ['segment', 'start', 'end', 'name'])
+OutputFile = namedtuple('OutputFile', ['kind', 'path'])
+
+# Same format as the file_regex of the build system: (file line:column) message
+MESSAGE_PATTERN = re.compile(r'^\s*\((.+\.\S+)\s(\d*):(\d*)\)\s(.*)')
+SECTION_PATTERN = re.compile(r'^\s*Got\s+\d+\s+(error|warning)s?\b', re.IGNORECASE)
+MEMORY_MAP_PATTERN = re.compile(r'^\s*Memory Map\s*$')
+SEGMENT_PATTERN = re.compile(r'^(\S.*)-segment:\s*$')
+MEMORY_BLOCK_PATTERN = re.compile(r'^\s+\$([0-9A-Fa-f]+)-\$([0-9A-Fa-f]+)\s+(.*?)\s*$')
+# Written at the end of the assembly, such as "Writing prg file: bin/Startup.prg"
+OUTPUT_FILE_PATTERN = re.compile(r'^\s*Writing\s+(.+?)\s+file:\s*(.*?)\s*$')
+
+class KickAssOutputParser():
+    """
+    Parses KickAssembler output incrementally, as it arrives from the build
+    process. Returns errors/warnings, the -showmem memory map and the files
+    written as records for every completed line.
+    """
+    def __init__(self, workingDir=None):
+        self.__workingDir = workingDir
+        self.__pending = ''
+        self.__kind = 'error'
+        self.__segment = None
+        self.__messages = []
+        self.__memoryMap = []
+
+    @property
+    def Messages(self):
+        return self.__messages
+
+    @property
+    def MemoryMap(self):
+        return self.__memoryMap
+
+    @property
+    def Errors(self):
+        return [m for m in self.__messages if m.kind == 'error']
+
+    @property
+    def Warnings(self):
+        return [m for m in self.__messages if m.kind == 'warning']
+
+    def feed(self, text):
+        """Parses all lines completed by text, returns the new records"""
+        lines = (self.__pending + text.replace('\r\n', '\n')).split('\n')
+        self.__pending = lines.pop()
+        records = []
+        for line in lines:
+            record = self.parseLine(line)
+            if record:
+                records.append(record)
+        return records
+
+    def flush(self):
+        """Parses the last line, if the output did not end with a newline"""
+        line, self.__pending = self.__pending, ''
+        record = self.parseLine(line) if line else None
+        return [record] if record else []
+
+    def parseLine(self, line):
+        section = SECTION_PATTERN.match(line)
+        if section:
+            self.__kind = section.group(1).lower()
+            self.__segment = None
+            return None
+
+        if MEMORY_MAP_PATTERN.match(line):
+            self.__segment = ''
+            return None
+
+        if self.__segment is not None and self.isMemoryMapLine(line):
+            return self.parseMemoryMapLine(line)
+
+        outputFile = OUTPUT_FILE_PATTERN.match(line)
+        if outputFile:
+            return OutputFile(outputFile.group(1), outputFile.group(2))
+
+        message = MESSAGE_PATTERN.match(line)
+        if not message:
+            return None
+        fileName, lineNumber, column, text = message.groups()
+        kind = 'warning' if text.lower().startswith('warning') else self.__kind
+        if self.__workingDir and not os.path.isabs(fileName):
+            fileName = os.path.normpath(os.path.join(self.__workingDir, fileName))
+        record = BuildMessage(kind, fileName, int(lineNumber or 1), int(column or 1), text)
+        self.__messages.append(record)
+        return record
+
+    def isMemoryMapLine(self, line):
+        if not line.strip() or line.strip().startswith('-') or SEGMENT_PATTERN.match(line) or MEMORY_BLOCK_PATTERN.match(line):
+            return True
+        # Anything else ends the memory map
+        self.__segment = None
+        return False
+
+    def parseMemoryMapLine(self, line):
+        segment = SEGMENT_PATTERN.match(line)
+        if segment:
+            self.__segment = segment.group(1)
+            return None
+        block = MEMORY_BLOCK_PATTERN.match(line)
+        if block:
+            record = MemoryBlock(self.__segment, int(block.group(1), 16), int(block.group(2), 16), block.group(3))
+            self.__memoryMap.append(record)
+            return record
+        return None
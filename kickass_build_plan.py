@@ -0,0 +1,37 @@
+import copy
+import threading
+
+class KickAssBuildPlanCache():
+    """
+    Exec dicts of earlier builds, so that building again with the same settings,
+    annotations and build scripts does not create and expand the command again.
+    There is one plan per build target, a plan is replaced when its fingerprint
+    changes. Plans are copied in and out, the build changes the dict it runs.
+    """
+    MAX_PLANS = 64
+
+    def __init__(self):
+        self.__plans = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key, fingerprint):
+        """Returns a copy of the plan, or None if there is no plan with the fingerprint"""
+        if fingerprint is None:
+            return None
+        with self.__lock:
+            plan = self.__plans.get(key)
+            if plan is None or plan[0] != fingerprint:
+                return None
+            return copy.deepcopy(plan[1])
+
+    def store(self, key, fingerprint, execDict):
+        if fingerprint is None:
+            return
+        with self.__lock:
+            if key not in self.__plans and len(self.__plans) >= self.MAX_PLANS:
+                self.__plans.clear()
+            self.__plans[key] = (fingerprint, copy.deepcopy(execDict))
+
+    def clear(self):
+        with self.__lock:
+            self.__plans.clear()
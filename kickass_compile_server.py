@@ -0,0 +1,114 @@
+import os
+import platform
+import subprocess
+import threading
+
+# Keeps a KickAssembler JVM alive between builds, so that each build does not
+# pay for JVM startup and JIT warm-up. The JVM runs a small shim class (see
+# CompileServer/KickAssCompileServer.java) which reads one compile request per
+# line from stdin (arguments separated by tabs), runs KickAssembler in-process
+# and answers with the assembler output followed by an exit marker line.
+
+class KickAssCompileServerError(Exception):
+    pass
+
+class KickAssCompileServer():
+    EXIT_MARKER = "@@kickass-exit:"
+    __servers = {}
+    __serversLock = threading.Lock()
+
+    @classmethod
+    def getServer(cls, command, workingDir, env, watchedFiles):
+        """
+        Returns a running server for the command and working directory, starting
+        a new one if there is none, if the previous one died or if any of the
+        watched files (KickAss.jar, the shim class) changed since it was started.
+        """
+        key = (tuple(command), workingDir)
+        with cls.__serversLock:
+            server = cls.__servers.get(key)
+            if server and not server.isUsable(watchedFiles):
+                server.stop()
+                server = None
+            if not server:
+                server = cls(command, workingDir, env, watchedFiles)
+                server.start()
+                cls.__servers[key] = server
+            return server
+
+    @classmethod
+    def stopAll(cls):
+        with cls.__serversLock:
+            for server in cls.__servers.values():
+                server.stop()
+            cls.__servers.clear()
+
+    def __init__(self, command, workingDir, env, watchedFiles):
+        self.__command = command
+        self.__workingDir = workingDir
+        self.__env = env
+        self.__watchedFiles = self.getFileStamps(watchedFiles)
+        self.__process = None
+        self.__requestLock = threading.Lock()
+
+    def getFileStamps(self, files):
+        stamps = {}
+        for f in files:
+            try:
+                stamps[f] = os.path.getmtime(f)
+            except OSError:
+                stamps[f] = None
+        return stamps
+
+    def isRunning(self):
+        return self.__process != None and self.__process.poll() == None
+
+    def isUsable(self, watchedFiles):
+        return self.isRunning() and self.getFileStamps(watchedFiles) == self.__watchedFiles
+
+    def start(self):
+        startupInfo = None
+        if platform.system()=='Windows':
+            startupInfo = subprocess.STARTUPINFO()
+            startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        try:
+            self.__process = subprocess.Popen(self.__command,
+                                              cwd=self.__workingDir,
+                                              env=self.__env,
+                                              stdin=subprocess.PIPE,
+                                              stdout=subprocess.PIPE,
+                                              stderr=subprocess.STDOUT,
+                                              startupinfo=startupInfo)
+        except OSError as ex:
+            raise KickAssCompileServerError("Could not start compile server: %s" % ex)
+
+    def stop(self):
+        if not self.isRunning(): return
+        try:
+            self.__process.stdin.close()
+            self.__process.wait(timeout=2)
+        except Exception:
+            self.__process.kill()
+
+    def compile(self, arguments, encoding='utf-8'):
+        """
+        Sends one compile request, returns a tuple with exit code and output.
+        Raises KickAssCompileServerError if the server dies during the request.
+        """
+        with self.__requestLock:
+            if not self.isRunning():
+                raise KickAssCompileServerError("Compile server is not running")
+            try:
+                self.__process.stdin.write(("\t".join(arguments) + "\n").encode(encoding))
+                self.__process.stdin.flush()
+                output = []
+                while True:
+                    line = self.__process.stdout.readline()
+                    if not line:
+                        raise KickAssCompileServerError("Compile server exited unexpectedly:\n%s" % "".join(output))
+                    line = line.decode(encoding, "replace")
+                    if line.startswith(self.EXIT_MARKER):
+                        return int(line[len(self.EXIT_MARKER):].strip() or 1), "".join(output)
+                    output.append(line.replace("\r\n", "\n"))
+            except (OSError, ValueError) as ex:
+                raise KickAssCompileServerError("Compile server request failed: %s" % ex)
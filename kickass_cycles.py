@@ -0,0 +1,355 @@
+import html
+import re
+import threading
+
+import sublime
+import sublime_plugin
+
+from .kickass_lint import KickAssLinter
+from .kickass_quick_assembler import (KickAssQuickAssembler, QuickSourceFile, MODES, OPCODES,
+                                      ZEROPAGE_MODES)
+
+# Cycles per addressing mode, in the order of MODES. "+" adds a cycle when an
+# indexed address crosses a page, "*" marks branches, which take one cycle
+# more when taken and two more when taken to another page.
+CYCLE_TABLE = """
+adc  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+and  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+asl  2  -  5  6  -  6  7  -  -  -  -  -
+bcc  -  -  -  -  -  -  -  -  -  -  -  2*
+bcs  -  -  -  -  -  -  -  -  -  -  -  2*
+beq  -  -  -  -  -  -  -  -  -  -  -  2*
+bit  -  -  3  -  -  4  -  -  -  -  -  -
+bmi  -  -  -  -  -  -  -  -  -  -  -  2*
+bne  -  -  -  -  -  -  -  -  -  -  -  2*
+bpl  -  -  -  -  -  -  -  -  -  -  -  2*
+brk  7  -  -  -  -  -  -  -  -  -  -  -
+bvc  -  -  -  -  -  -  -  -  -  -  -  2*
+bvs  -  -  -  -  -  -  -  -  -  -  -  2*
+clc  2  -  -  -  -  -  -  -  -  -  -  -
+cld  2  -  -  -  -  -  -  -  -  -  -  -
+cli  2  -  -  -  -  -  -  -  -  -  -  -
+clv  2  -  -  -  -  -  -  -  -  -  -  -
+cmp  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+cpx  -  2  3  -  -  4  -  -  -  -  -  -
+cpy  -  2  3  -  -  4  -  -  -  -  -  -
+dec  -  -  5  6  -  6  7  -  -  -  -  -
+dex  2  -  -  -  -  -  -  -  -  -  -  -
+dey  2  -  -  -  -  -  -  -  -  -  -  -
+eor  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+inc  -  -  5  6  -  6  7  -  -  -  -  -
+inx  2  -  -  -  -  -  -  -  -  -  -  -
+iny  2  -  -  -  -  -  -  -  -  -  -  -
+jmp  -  -  -  -  -  3  -  -  5  -  -  -
+jsr  -  -  -  -  -  6  -  -  -  -  -  -
+lda  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+ldx  -  2  3  -  4  4  -  4+ -  -  -  -
+ldy  -  2  3  4  -  4  4+ -  -  -  -  -
+lsr  2  -  5  6  -  6  7  -  -  -  -  -
+nop  2  -  -  -  -  -  -  -  -  -  -  -
+ora  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+pha  3  -  -  -  -  -  -  -  -  -  -  -
+php  3  -  -  -  -  -  -  -  -  -  -  -
+pla  4  -  -  -  -  -  -  -  -  -  -  -
+plp  4  -  -  -  -  -  -  -  -  -  -  -
+rol  2  -  5  6  -  6  7  -  -  -  -  -
+ror  2  -  5  6  -  6  7  -  -  -  -  -
+rti  6  -  -  -  -  -  -  -  -  -  -  -
+rts  6  -  -  -  -  -  -  -  -  -  -  -
+sbc  -  2  3  4  -  4  4+ 4+ -  6  5+ -
+sec  2  -  -  -  -  -  -  -  -  -  -  -
+sed  2  -  -  -  -  -  -  -  -  -  -  -
+sei  2  -  -  -  -  -  -  -  -  -  -  -
+sta  -  -  3  4  -  4  5  5  -  6  6  -
+stx  -  -  3  -  4  4  -  -  -  -  -  -
+sty  -  -  3  4  -  4  -  -  -  -  -  -
+tax  2  -  -  -  -  -  -  -  -  -  -  -
+tay  2  -  -  -  -  -  -  -  -  -  -  -
+tsx  2  -  -  -  -  -  -  -  -  -  -  -
+txa  2  -  -  -  -  -  -  -  -  -  -  -
+txs  2  -  -  -  -  -  -  -  -  -  -  -
+tya  2  -  -  -  -  -  -  -  -  -  -  -
+alr  -  2  -  -  -  -  -  -  -  -  -  -
+anc  -  2  -  -  -  -  -  -  -  -  -  -
+arr  -  2  -  -  -  -  -  -  -  -  -  -
+dcp  -  -  5  6  -  6  7  7  -  8  8  -
+isc  -  -  5  6  -  6  7  7  -  8  8  -
+las  -  -  -  -  -  -  -  4+ -  -  -  -
+lax  -  2  3  -  4  4  -  4+ -  6  5+ -
+rla  -  -  5  6  -  6  7  7  -  8  8  -
+rra  -  -  5  6  -  6  7  7  -  8  8  -
+sax  -  -  3  -  4  4  -  -  -  6  -  -
+sbx  -  2  -  -  -  -  -  -  -  -  -  -
+sha  -  -  -  -  -  -  -  5  -  -  6  -
+shx  -  -  -  -  -  -  -  5  -  -  -  -
+shy  -  -  -  -  -  -  5  -  -  -  -  -
+slo  -  -  5  6  -  6  7  7  -  8  8  -
+sre  -  -  5  6  -  6  7  7  -  8  8  -
+tas  -  -  -  -  -  -  -  5  -  -  -  -
+"""
+
+def parseCycleTable(table):
+    """Returns opcode to (cycles, penalty), the penalty is '', '+' or '*'"""
+    cycles = {}
+    for row in table.strip().splitlines():
+        columns = row.split()
+        for mode, column in zip(MODES, columns[1:]):
+            if column != '-':
+                cycles[OPCODES[columns[0]][mode]] = (int(column.rstrip('+*')), column.lstrip('0123456789'))
+    return cycles
+
+OPCODE_CYCLES = parseCycleTable(CYCLE_TABLE)
+OPCODE_MODES = dict((opcode, mode) for modes in OPCODES.values() for mode, opcode in modes.items())
+
+PHANTOM_TEMPLATE = """<body id="kickass-cycles">
+<style>
+    span {{ color: color(var(--foreground) alpha(0.5)); padding-left: 1rem; }}
+</style>
+<span>{cycles} &nbsp; &Sigma; {total}</span>
+</body>"""
+
+def getCycles(opcode, address=None, operand=None):
+    """
+    Returns (minimum, maximum) cycles of an instruction. With the address of
+    the instruction and its operand, the branch page crossing is known, and
+    indexed addresses at the start of a page never cross a page.
+    """
+    cycles, penalty = OPCODE_CYCLES[opcode]
+    if penalty == '+':
+        # (zp),y always adds y to a pointer that is not known here
+        if operand is not None and operand & 0xff == 0 and OPCODE_MODES[opcode] != 'izy':
+            return cycles, cycles
+        return cycles, cycles + 1
+    if penalty == '*':
+        if address is None or operand is None:
+            return cycles, cycles + 2
+        return cycles, cycles + (1 if (address + 2) & 0xff00 == operand & 0xff00 else 2)
+    return cycles, cycles
+
+def formatCycles(minimum, maximum):
+    return str(minimum) if minimum == maximum else "%d-%d" % (minimum, maximum)
+
+class KickAssCycleCounter():
+    """
+    Counts the cycles of the instructions on source lines. Instructions are
+    taken from a quick assembly of the file where it has them, for the exact
+    addressing mode and address. Other lines, such as those in macros, are
+    decoded on their own, operands that are not known are taken to be
+    absolute.
+    """
+    __staticCycles = {}
+    MAX_STATIC_LINES = 20000
+
+    def __init__(self, assembly=None, fileName=None):
+        self.__assembled = {}
+        if assembly is not None:
+            for line in assembly.Lines:
+                if line.mode is not None and line.file == fileName:
+                    self.__assembled[line.line] = line
+
+    def countLine(self, lineNumber, text):
+        """Returns (minimum, maximum) cycles of the instruction on the line, None if it has none"""
+        assembled = self.__assembled.get(lineNumber)
+        if assembled is not None:
+            return getCycles(assembled.data[0], assembled.address, assembled.operand)
+        return self.countStatic(text)
+
+    @classmethod
+    def countStatic(cls, text):
+        if text not in cls.__staticCycles:
+            if len(cls.__staticCycles) >= cls.MAX_STATIC_LINES:
+                cls.__staticCycles.clear()
+            cls.__staticCycles[text] = cls.decodeStatic(text)
+        return cls.__staticCycles[text]
+
+    @classmethod
+    def decodeStatic(cls, text):
+        code, _ = QuickSourceFile.stripComments(text, False)
+        if not code.strip():
+            return None
+        kind, name, operand = QuickSourceFile.parseLine(code)[2:5]
+        decoded = KickAssQuickAssembler.decodeInstruction(name, operand) if kind == 'instruction' else None
+        if decoded is None:
+            return None
+        mnemonic, mode, expression, forced = decoded
+        modes = OPCODES[mnemonic]
+        value = None
+        if expression is not None:
+            kind, value = KickAssQuickAssembler.compileExpression(expression)
+            value = value if kind == 'value' else None
+        if mode in ZEROPAGE_MODES:
+            zeropage = ZEROPAGE_MODES[mode]
+            if zeropage in modes and (forced == 'zp' or mode not in modes or (forced is None and value is not None and 0 <= value <= 0xff)):
+                mode = zeropage
+        if mode not in modes:
+            return None
+        return getCycles(modes[mode], None, value if mode != 'rel' else None)
+
+    def countLines(self, firstLine, lines):
+        """Returns (line number, cycles, total cycles) of the lines with instructions"""
+        return addTotals((lineNumber, self.countLine(lineNumber, text)) for lineNumber, text in enumerate(lines, firstLine))
+
+def addTotals(lineCycles):
+    """Returns (line number, cycles, total cycles) of the (line number, cycles) of lines with instructions"""
+    counts = []
+    total = (0, 0)
+    for lineNumber, cycles in lineCycles:
+        if cycles is not None:
+            total = (total[0] + cycles[0], total[1] + cycles[1])
+            counts.append((lineNumber, cycles, total))
+    return counts
+
+def findEnclosingBlock(lines, lineIndex):
+    """
+    Returns (first, last) line index of the innermost { } block around the
+    line, such as a whole .macro, None if the line is not in a block
+    """
+    openLines = []
+    inComment = False
+    for index, line in enumerate(lines):
+        code, inComment = QuickSourceFile.stripComments(line, inComment)
+        code = re.sub(r'"(?:[^"\\]|\\.)*"', '""', code)
+        for char in code:
+            if char == '{':
+                openLines.append(index)
+            elif char == '}' and openLines:
+                first = openLines.pop()
+                if first <= lineIndex <= index:
+                    return first, index
+    return None
+
+class KickassShowCyclesCommand(sublime_plugin.TextCommand):
+    """
+    Shows the cycles of each instruction, and the total from the start, as
+    phantoms on the selected lines, or on the block around the caret, such as
+    a whole .macro. The counts are updated as the lines change: only the
+    changed lines are counted again, on their own, and the whole file is
+    assembled again for exact counts when it is saved.
+    """
+    REGION_KEY = 'kickass_cycles'
+    __phantomSets = {}
+    __counts = {}
+    __lock = threading.Lock()
+
+    def run(self, edit, clear=False):
+        if clear:
+            self.clear(self.view)
+            return
+        regions = [self.view.line(s) for s in self.view.sel() if not s.empty()]
+        if not regions:
+            caret = self.view.sel()[0].begin() if len(self.view.sel()) else 0
+            lines = self.view.substr(sublime.Region(0, self.view.size())).split('\n')
+            block = findEnclosingBlock(lines, self.view.rowcol(caret)[0])
+            if block is None:
+                sublime.status_message("Select the lines to count, or place the caret in a .macro or { } block")
+                return
+            regions = [sublime.Region(self.view.text_point(block[0], 0), self.view.line(self.view.text_point(block[1], 0)).end())]
+        # The regions move with the text as it is edited
+        self.view.add_regions(self.REGION_KEY, regions, '', '', sublime.HIDDEN)
+        self.update(self.view)
+
+    @classmethod
+    def update(cls, view, changed=False):
+        """Counts the lines again, with changed only the lines changed since the last count"""
+        regions = view.get_regions(cls.REGION_KEY)
+        if not regions:
+            return
+        text = view.substr(sublime.Region(0, view.size()))
+        lineRanges = [(view.rowcol(region.begin())[0], view.rowcol(region.end())[0]) for region in regions]
+        phantoms = []
+        for counts in cls.countRegions(view.id(), view.file_name(), text, lineRanges, changed):
+            for lineNumber, cycles, total in counts:
+                point = view.line(view.text_point(lineNumber - 1, 0)).end()
+                content = PHANTOM_TEMPLATE.format(cycles=html.escape(formatCycles(*cycles)), total=html.escape(formatCycles(*total)))
+                phantoms.append(sublime.Phantom(sublime.Region(point), content, sublime.LAYOUT_INLINE))
+        cls.getPhantomSet(view).update(phantoms)
+
+    @classmethod
+    def countRegions(cls, viewId, fileName, text, lineRanges, changed=False):
+        """
+        Returns the (line number, cycles, total cycles) of each (first, last)
+        line index range. With changed, the counts of the last call are kept
+        for the lines that did not change.
+        """
+        lines = text.split('\n')
+        with cls.__lock:
+            previous = cls.__counts.get(viewId) if changed else None
+        countLine = cls.getLineCounter(fileName, text, lines, previous)
+        lineCounts = {}
+        regionCounts = []
+        for first, last in lineRanges:
+            for index in range(first, min(last, len(lines) - 1) + 1):
+                lineCounts[index] = countLine(index)
+            regionCounts.append(addTotals((index + 1, lineCounts[index]) for index in range(first, min(last, len(lines) - 1) + 1)))
+        with cls.__lock:
+            cls.__counts[viewId] = (text, lineCounts)
+        return regionCounts
+
+    @classmethod
+    def getLineCounter(cls, fileName, text, lines, previous):
+        """Returns a function counting the line at an index"""
+        if previous is not None:
+            oldText, oldCounts = previous
+            changedLines = KickAssLinter.getChangedLines(oldText, text)
+            if changedLines is None:
+                return lambda index: oldCounts[index] if index in oldCounts else KickAssCycleCounter.countStatic(lines[index])
+            first, oldLast, start, end = changedLines
+            changedText = text[start:end] + '\n' + oldText[start:len(oldText) - len(text) + end]
+            # A block comment opened or closed changes the lines after it
+            if '/*' not in changedText and '*/' not in changedText:
+                newLast = first + text.count('\n', start, end)
+                def countLine(index):
+                    oldIndex = index if index < first else index + oldLast - newLast if index > newLast else None
+                    return oldCounts[oldIndex] if oldIndex in oldCounts else KickAssCycleCounter.countStatic(lines[index])
+                return countLine
+        assembly = KickAssQuickAssembler().assemble(fileName, text) if fileName else None
+        counter = KickAssCycleCounter(assembly, fileName)
+        return lambda index: counter.countLine(index + 1, lines[index])
+
+    @classmethod
+    def getPhantomSet(cls, view):
+        with cls.__lock:
+            if view.id() not in cls.__phantomSets:
+                cls.__phantomSets[view.id()] = sublime.PhantomSet(view, cls.REGION_KEY)
+            return cls.__phantomSets[view.id()]
+
+    @classmethod
+    def clear(cls, view):
+        view.erase_regions(cls.REGION_KEY)
+        with cls.__lock:
+            cls.__counts.pop(view.id(), None)
+            phantomSet = cls.__phantomSets.pop(view.id(), None)
+        if phantomSet:
+            phantomSet.update([])
+
+    @classmethod
+    def isShown(cls, view):
+        with cls.__lock:
+            return view.id() in cls.__phantomSets
+
+class KickassCyclesListener(sublime_plugin.EventListener):
+    """
+    Counts the changed lines again once the typing has paused, and all
+    counted lines when the file is saved
+    """
+    UPDATE_DELAY_MS = 200
+    __generations = {}
+
+    def on_modified_async(self, view):
+        if not KickassShowCyclesCommand.isShown(view):
+            return
+        generation = self.__generations.get(view.id(), 0) + 1
+        self.__generations[view.id()] = generation
+        sublime.set_timeout_async(lambda: self.update(view, generation), self.UPDATE_DELAY_MS)
+
+    def update(self, view, generation):
+        if self.__generations.get(view.id()) == generation:
+            KickassShowCyclesCommand.update(view, changed=True)
+
+    def on_post_save_async(self, view):
+        if KickassShowCyclesCommand.isShown(view):
+            KickassShowCyclesCommand.update(view)
+
+    def on_close(self, view):
+        self.__generations.pop(view.id(), None)
+        KickassShowCyclesCommand.clear(view)
@@ -0,0 +1,198 @@
+import html
+import os
+import platform
+import signal
+import subprocess
+import time
+
+import sublime
+from Default.exec import ExecCommand
+
+from .kickass_build_output import KickAssOutputParser, BuildMessage, OutputFile
+from .kickass_memory_map import MemoryMap, MemoryMapHistory
+from .kickass_output_cleanup import KickAssOutputCleaner
+from .kickass_profiler import KickAssProfiler
+from .kickass_watch import KickAssWatch
+
+PHANTOM_TEMPLATE = """<body id="kickass-build-message">
+<style>
+    div.error {{ background-color: color(var(--redish) alpha(0.25)); padding: 0.2rem 0.5rem; border-radius: 0.2rem; }}
+    div.warning {{ background-color: color(var(--yellowish) alpha(0.25)); padding: 0.2rem 0.5rem; border-radius: 0.2rem; }}
+    a {{ text-decoration: none; }}
+</style>
+<div class="{kind}">{text} <a href="hide">&times;</a></div>
+</body>"""
+
+class KickassExecCommand(ExecCommand):
+    """
+    The exec command, extended with a parser for the KickAssembler output.
+    Errors and warnings are shown as phantoms and gutter marks in the open
+    files while the build is running, instead of only after it has finished.
+    """
+    GUTTER_ICONS = {'error': 'circle', 'warning': 'dot'}
+    REGION_SCOPES = {'error': 'region.redish', 'warning': 'region.yellowish'}
+    __phantomSets = {}
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.__parser = None
+        self.__viewMessages = {}
+        self.__reloadProgram = None
+        self.__recordOutputFolder = None
+        self.__timer = None
+        self.__startTime = None
+        self.__assemblerEndTime = None
+        self.__emulatorStartTime = None
+
+    def run(self, **kwargs):
+        if kwargs.get('kill'):
+            self.killProcessTree()
+        # Toggling the inline errors passes update_phantoms_only/hide_phantoms_only in ST3, update_annotations_only in ST4
+        if kwargs.get('kill') or kwargs.get('update_phantoms_only') or kwargs.get('hide_phantoms_only') or \
+                kwargs.get('update_annotations_only'):
+            if kwargs.get('hide_phantoms_only') or \
+                    (kwargs.get('update_annotations_only') and not self.isShowingErrorsInline()):
+                self.hideMessages()
+            super().run(**kwargs)
+            return
+
+        self.hideMessages()
+        # Set by watch mode, the program is loaded into the running emulator after a successful build
+        self.__reloadProgram = kwargs.pop('reload_program', None)
+        # Set with the stale output cleanup, the files the build wrote are recorded when it has finished
+        self.__recordOutputFolder = kwargs.pop('record_output_folder', None)
+        self.__parser = KickAssOutputParser(kwargs.get('working_dir'))
+        self.__viewMessages = {}
+        self.__timer = KickAssProfiler.getBuild(self.window.id())
+        self.__startTime = time.perf_counter()
+        self.__assemblerEndTime = None
+        self.__emulatorStartTime = None
+        super().run(**kwargs)
+        # Messages are shown as they arrive, the default exec phantoms would duplicate them
+        self.show_errors_inline = False
+
+    def isShowingErrorsInline(self):
+        return sublime.load_settings('Preferences.sublime-settings').get('show_errors_inline', True)
+
+    def killProcessTree(self):
+        """
+        Kills the running build including its child processes. The exec kill only
+        stops the shell, which leaves an emulator started by build-run running.
+        """
+        proc = getattr(getattr(self, 'proc', None), 'proc', None)
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            if platform.system() == 'Windows':
+                startupInfo = subprocess.STARTUPINFO()
+                startupInfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                subprocess.call(['taskkill', '/T', '/F', '/PID', str(proc.pid)], startupinfo=startupInfo)
+            else:
+                for pid in reversed(self.getChildPids(proc.pid)):
+                    os.kill(pid, signal.SIGTERM)
+        except (OSError, subprocess.SubprocessError):
+            pass
+
+    def getChildPids(self, pid):
+        """Returns all descendants of the process, parents before children"""
+        pids = []
+        pending = [pid]
+        while pending:
+            try:
+                output = subprocess.check_output(['pgrep', '-P', str(pending.pop())])
+            except (OSError, subprocess.CalledProcessError):
+                continue
+            children = [int(p) for p in output.split()]
+            pids.extend(children)
+            pending.extend(children)
+        return pids
+
+    @property
+    def Parser(self):
+        return self.__parser
+
+    def on_data(self, proc, data):
+        if self.Parser:
+            text = data.decode(self.encoding, 'replace') if isinstance(data, bytes) else data
+            parsed = self.Parser.feed(text)
+            self.trackOutput(parsed, text)
+            records = [r for r in parsed if isinstance(r, BuildMessage)]
+            if records:
+                sublime.set_timeout(lambda: self.showMessages(records), 0)
+        super().on_data(proc, data)
+
+    def trackOutput(self, records, text):
+        """
+        The assembler has finished when it writes its output files, output
+        after that is from the emulator started by the build
+        """
+        if any(isinstance(r, OutputFile) for r in records):
+            self.__assemblerEndTime = time.perf_counter()
+        elif self.__assemblerEndTime is not None and self.__emulatorStartTime is None and text.strip():
+            self.__emulatorStartTime = time.perf_counter()
+
+    def reportTimings(self):
+        timer = self.__timer
+        if timer is None or self.__startTime is None:
+            return
+        # Builds with a compile request have timed the assembler before exec
+        if not timer.has("assembler runtime"):
+            timer.add("assembler runtime", (self.__assemblerEndTime or time.perf_counter()) - self.__startTime)
+        if self.__assemblerEndTime is not None and self.__emulatorStartTime is not None:
+            timer.add("emulator launch", self.__emulatorStartTime - self.__assemblerEndTime)
+        KickAssProfiler.finishBuild(self.window.id(), timer)
+        self.__timer = None
+
+    def on_finished(self, proc):
+        if self.Parser:
+            records = [r for r in self.Parser.flush() if isinstance(r, BuildMessage)]
+            if records:
+                sublime.set_timeout(lambda: self.showMessages(records), 0)
+        super().on_finished(proc)
+        self.reportTimings()
+        if self.Parser and self.Parser.MemoryMap:
+            MemoryMapHistory.record(self.window.id(), MemoryMap(self.Parser.MemoryMap))
+        if self.Parser and self.Parser.Messages:
+            sublime.status_message("Build finished with %d errors, %d warnings" % (len(self.Parser.Errors), len(self.Parser.Warnings)))
+        if self.__recordOutputFolder and not getattr(proc, 'killed', False):
+            outputFolder = self.__recordOutputFolder
+            sublime.set_timeout_async(lambda: KickAssOutputCleaner(outputFolder).recordBuild(), 0)
+        if self.__reloadProgram and not getattr(proc, 'killed', False) and proc.exit_code() == 0:
+            windowId, programPath = self.window.id(), self.__reloadProgram
+            sublime.set_timeout_async(lambda: KickAssWatch.reload(windowId, programPath), 0)
+
+    def showMessages(self, records):
+        for record in records:
+            self.__viewMessages.setdefault(record.file, []).append(record)
+        for fileName in set(record.file for record in records):
+            view = self.window.find_open_file(fileName)
+            if view:
+                self.updateView(view, self.__viewMessages[fileName])
+
+    def updateView(self, view, messages):
+        phantoms = []
+        for kind in self.GUTTER_ICONS:
+            regions = []
+            for message in (m for m in messages if m.kind == kind):
+                point = view.text_point(message.line - 1, message.column - 1)
+                regions.append(sublime.Region(point, view.line(point).end()))
+                phantoms.append(sublime.Phantom(sublime.Region(view.line(point).end()),
+                                                PHANTOM_TEMPLATE.format(kind=kind, text=html.escape(message.text, quote=False)),
+                                                sublime.LAYOUT_BELOW,
+                                                lambda href: self.hideMessages()))
+            view.add_regions('kickass_build_%ss' % kind, regions, self.REGION_SCOPES[kind], self.GUTTER_ICONS[kind],
+                             sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE)
+        self.getPhantomSet(view).update(phantoms)
+
+    def getPhantomSet(self, view):
+        phantomSets = KickassExecCommand.__phantomSets
+        if view.id() not in phantomSets:
+            phantomSets[view.id()] = sublime.PhantomSet(view, 'kickass_build_messages')
+        return phantomSets[view.id()]
+
+    def hideMessages(self):
+        for view in self.window.views():
+            if view.id() in KickassExecCommand.__phantomSets:
+                KickassExecCommand.__phantomSets.pop(view.id()).update([])
+            for kind in self.GUTTER_ICONS:
+                view.erase_regions('kickass_build_%ss' % kind)
@@ -0,0 +1,189 @@
+"""
+Compiled help database for KickassTooltips. All JSON help files are merged
+into a single index file with a sorted, fixed size key table, so that lookups
+are a binary search in a memory mapped file and entries are only decoded when
+they are displayed.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+MAGIC = b'KATIDX'
+VERSION = 2
+HEADER = struct.Struct('<6sHI')     # magic, version, manifest length
+COUNT = struct.Struct('<I')         # number of keys
+RECORD = struct.Struct('<IHII')     # key offset, key length, value offset, value length
+
+
+def source_manifest(directories):
+    """
+    Return {path: [mtime, size]} of all help files in the directories, in
+    the order they are merged
+    """
+    manifest = OrderedDict()
+    for dirname in directories:
+        try:
+            fnames = sorted(os.listdir(dirname))
+        except EnvironmentError:
+            logging.error('Cannot access directory: %s', dirname)
+            continue
+        for fname in fnames:
+            path = os.path.join(dirname, fname)
+            try:
+                stat = os.stat(path)
+            except EnvironmentError:
+                continue
+            manifest[path] = [stat.st_mtime, stat.st_size]
+    return manifest
+
+
+class HelpIndex:
+    """
+    Read access to the compiled index, and building it from the JSON files
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._records_offset = 0
+        self._entries = {}
+
+    def read_manifest(self):
+        """Return the manifest the index was built from, None if unusable"""
+        try:
+            with open(self.index_file, 'rb') as fileobject:
+                magic, version, length = HEADER.unpack(
+                    fileobject.read(HEADER.size))
+                if magic != MAGIC or version != VERSION:
+                    return None
+                return OrderedDict(json.loads(
+                    fileobject.read(length).decode('utf8')))
+        except (EnvironmentError, ValueError, struct.error):
+            return None
+
+    def is_current(self, manifest):
+        """
+        Check, if the index was built from the given source files, merged in
+        the same order
+        """
+        return self.read_manifest() == manifest
+
+    def build(self, directories, manifest=None):
+        """
+        Merge all JSON help files in the directories and write the index.
+        Later files override keys of earlier ones, same as the old help_map.
+        """
+        manifest = manifest or source_manifest(directories)
+        help_map = {}
+        for path in manifest:
+            logging.debug('Loading %s', path)
+            try:
+                with open(path, encoding='utf8') as fileobject:
+                    help_map.update(json.load(fileobject))
+            except ValueError as exc:
+                logging.error('Error in JSON file: %s, %s', path, exc)
+            except EnvironmentError:
+                logging.error('Cannot access file: %s', path)
+
+        # Stored as a list, the order decides which file's entry wins
+        manifest_data = json.dumps(list(manifest.items())).encode('utf8')
+        lower_map = dict((key.lower(), value) for key, value in help_map.items())
+        keys = sorted(key.encode('utf8') for key in lower_map)
+        values = [json.dumps(lower_map[key.decode('utf8')]).encode('utf8')
+                  for key in keys]
+
+        data_offset = (HEADER.size + len(manifest_data) + COUNT.size +
+                       RECORD.size * len(keys))
+        records = []
+        blobs = []
+        offset = data_offset
+        for key, value in zip(keys, values):
+            records.append(RECORD.pack(offset, len(key),
+                                       offset + len(key), len(value)))
+            blobs.append(key)
+            blobs.append(value)
+            offset += len(key) + len(value)
+
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'wb') as fileobject:
+            fileobject.write(HEADER.pack(MAGIC, VERSION, len(manifest_data)))
+            fileobject.write(manifest_data)
+            fileobject.write(COUNT.pack(len(keys)))
+            fileobject.write(b''.join(records))
+            fileobject.write(b''.join(blobs))
+
+        with self._lock:
+            self._close()
+            os.replace(tmp_file, self.index_file)
+        logging.debug('Help index built with %d entries', len(keys))
+
+    def open(self):
+        """Memory map the index file, only the header is read here"""
+        with self._lock:
+            self._close()
+            try:
+                self._file = open(self.index_file, 'rb')
+                self._map = mmap.mmap(self._file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+                length = HEADER.unpack_from(self._map, 0)[2]
+                self._records_offset = HEADER.size + length + COUNT.size
+                self._count = COUNT.unpack_from(self._map,
+                                                HEADER.size + length)[0]
+            except (EnvironmentError, ValueError, struct.error):
+                logging.error('Cannot open help index: %s', self.index_file)
+                self._close()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = None
+        self._file = None
+        self._count = 0
+        self._entries = {}
+
+    def _key_at(self, index):
+        key_offset, key_length, _, _ = RECORD.unpack_from(
+            self._map, self._records_offset + index * RECORD.size)
+        return self._map[key_offset:key_offset + key_length]
+
+    def get(self, key, default=None):
+        """Binary search for key (case insensitive), decode entry on demand"""
+        key = key.lower()
+        if key in self._entries:
+            return self._entries[key]
+        wanted = key.encode('utf8')
+        with self._lock:
+            if self._map is None:
+                return default
+            low, high = 0, self._count
+            while low < high:
+                middle = (low + high) // 2
+                if self._key_at(middle) < wanted:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == self._count or self._key_at(low) != wanted:
+                return default
+            _, _, value_offset, value_length = RECORD.unpack_from(
+                self._map, self._records_offset + low * RECORD.size)
+            entry = json.loads(self._map[value_offset:value_offset +
+                                         value_length].decode('utf8'))
+        self._entries[key] = entry
+        return entry
+
+    def __contains__(self, key):
+        return self.get(key) is not None
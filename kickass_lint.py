@@ -0,0 +1,529 @@
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+import sublime
+import sublime_plugin
+
+from .kickass_address_index import C64_ADDRESS_INDEX, describe
+from .kickass_profiler import KickAssProfiler
+from .kickass_quick_assembler import (KickAssQuickAssembler, QuickSourceFile, LABEL_PATTERN, OPCODES,
+                                      STRING_PATTERN, ZEROPAGE_MODES)
+from .kickass_settings import KickAssSettings
+from .kickass_symbol_index import find_definitions
+from .kickass_tooltip_render import ExpressionParser, ExpressionError
+
+# Problems found on a line, line and column are 1 based
+LintMessage = namedtuple('LintMessage', ['kind', 'line', 'column', 'length', 'text'])
+
+# The lint result of one line, which only depends on its text and on whether a
+# block comment is open at its start. Problems are (column, length, text),
+# closes are the blocks closed at its start, opens the blocks opened after the
+# statement, negative for blocks closed after it, labels are (name, column),
+# constant is (name, value, compiled operand) and access is (column, length,
+# reads, writes, compiled address) of instructions using an absolute address.
+LintLine = namedtuple('LintLine', ['inComment', 'outComment', 'closes', 'opens', 'blockName', 'labels', 'constant',
+                                   'pseudocommand', 'call', 'problems', 'access'])
+
+EMPTY_LINE = LintLine(False, False, 0, 0, None, (), None, None, None, (), None)
+
+READ_MODIFY_WRITE = frozenset(['asl', 'lsr', 'rol', 'ror', 'inc', 'dec', 'slo', 'rla', 'sre', 'rra', 'dcp', 'isc'])
+READING_MNEMONICS = READ_MODIFY_WRITE | frozenset(['lda', 'ldx', 'ldy', 'lax', 'las', 'adc', 'sbc', 'and', 'ora',
+                                                   'eor', 'cmp', 'cpx', 'cpy', 'bit'])
+WRITING_MNEMONICS = READ_MODIFY_WRITE | frozenset(['sta', 'stx', 'sty', 'sax', 'sha', 'shx', 'shy', 'tas'])
+
+# Blocks with other content than statements, such as the values of an .enum
+DATA_BLOCKS = frozenset(['.enum', '.struct', '.disk', '.define'])
+
+REGISTER_FILES = ('vic-registers.json', 'sid-registers.json')
+READ_ONLY_PATTERN = re.compile(r'\bread[- ]only\b', re.IGNORECASE)
+WRITE_ONLY_PATTERN = re.compile(r'\bwrite[- ]only\b', re.IGNORECASE)
+
+def loadRegisterAccess(directories):
+    """Returns address to 'read-only' or 'write-only' of the registers the help files describe so"""
+    access = {}
+    for directory in directories:
+        for fileName in REGISTER_FILES:
+            try:
+                with open(os.path.join(directory, fileName), encoding='utf-8') as handle:
+                    registers = json.load(handle)
+            except (EnvironmentError, ValueError):
+                continue
+            for address, entry in registers.items():
+                description = entry.get('descr', '') if isinstance(entry, dict) else ''
+                try:
+                    if READ_ONLY_PATTERN.search(description):
+                        access[int(address, 16)] = 'read-only'
+                    elif WRITE_ONLY_PATTERN.search(description):
+                        access[int(address, 16)] = 'write-only'
+                except ValueError:
+                    continue
+    return access
+
+class KickAssLinter():
+    """
+    Lints the text of one view as it is edited. The lines are kept with their
+    lint results, and only the lines changed since the last update, found by
+    comparing the text with the previous one, are linted again. Unknown
+    mnemonics, illegal addressing modes, duplicate labels and accesses to
+    read-only or write-only registers are reported.
+    """
+    __lintedLines = {}
+    MAX_LINTED_LINES = 50000
+
+    def __init__(self, registerAccess=None):
+        self.__registerAccess = registerAccess or {}
+        self.__text = ''
+        self.__lines = [EMPTY_LINE]
+        self.__constants = {}
+        self.__addresses = {}
+        self.__pseudocommands = set()
+        # (line, column, name, line of the first definition, scope) of duplicate labels
+        self.__duplicates = []
+        self.__labelCounts = {}
+        self.__lineScopes = []
+        # (first, last) line of .enum and other data blocks, which are not checked
+        self.__dataBlocks = []
+        self.__lineMessages = []
+        self.__checked = False
+        self.__messages = []
+        self.__lintedCount = 0
+
+    @property
+    def Messages(self):
+        return self.__messages
+
+    @property
+    def LintedCount(self):
+        """Number of lines linted by the last update"""
+        return self.__lintedCount
+
+    def update(self, text, isPseudoCommand=None):
+        """
+        Lints the changed lines of the text and returns the messages of the
+        whole text. isPseudoCommand tells if a name is a pseudocommand defined
+        in another file.
+        """
+        changed = self.getChangedLines(self.__text, text)
+        self.__text = text
+        self.__lintedCount = 0
+        if changed is None:
+            return self.__messages
+        first, oldLast, start, end = changed
+        inComment = self.__lines[first - 1].outComment if first else False
+        lines = []
+        for line in text[start:end].split('\n'):
+            linted = self.lintLine(line, inComment)
+            lines.append(linted)
+            inComment = linted.outComment
+        # An opened or closed block comment changes the lines after it
+        index = oldLast + 1
+        while index < len(self.__lines) and self.__lines[index].inComment != inComment:
+            start = end + 1
+            end = text.find('\n', start)
+            end = end if end >= 0 else len(text)
+            linted = self.lintLine(text[start:end], inComment)
+            lines.append(linted)
+            inComment = linted.outComment
+            index += 1
+        oldLines = self.__lines[first:index]
+        self.__lines[first:index] = lines
+        self.__lintedCount = len(lines)
+        changeKind = self.getChangeKind(first, oldLines, lines)
+        if changeKind is None:
+            self.check(isPseudoCommand)
+        else:
+            self.checkChanged(first, oldLines, lines, changeKind == 'labels')
+        self.__messages = sorted([LintMessage('error', line, column, len(name),
+                                              "Duplicate label '%s', first defined on line %d" % (name, firstLine))
+                                  for line, column, name, firstLine, _ in self.__duplicates] + self.__lineMessages,
+                                 key=lambda m: (m.line, m.column))
+        return self.__messages
+
+    @classmethod
+    def getChangedLines(cls, old, new):
+        """
+        Returns (first line, last old line, start, end) of the lines that
+        differ, where start and end are the offsets of the changed lines in
+        the new text, None for the same texts. The common start and end of the
+        texts are found by a binary search over slices, without a loop over
+        the lines.
+        """
+        if old == new:
+            return None
+        shorter = min(len(old), len(new))
+        low, high = 0, shorter
+        while low < high:
+            middle = (low + high + 1) // 2
+            if old[:middle] == new[:middle]:
+                low = middle
+            else:
+                high = middle - 1
+        prefix = low
+        low, high = 0, shorter - prefix
+        while low < high:
+            middle = (low + high + 1) // 2
+            if old[len(old) - middle:] == new[len(new) - middle:]:
+                low = middle
+            else:
+                high = middle - 1
+        suffix = low
+        end = new.find('\n', len(new) - suffix)
+        return (old.count('\n', 0, prefix), old.count('\n', 0, len(old) - suffix),
+                new.rfind('\n', 0, prefix) + 1, end if end >= 0 else len(new))
+
+    @classmethod
+    def lintLine(cls, line, inComment):
+        key = (line, inComment)
+        linted = cls.__lintedLines.get(key)
+        if linted is None:
+            linted = cls.parseLintLine(line, inComment)
+            if len(cls.__lintedLines) >= cls.MAX_LINTED_LINES:
+                cls.__lintedLines.clear()
+            cls.__lintedLines[key] = linted
+        return linted
+
+    @classmethod
+    def parseLintLine(cls, line, inComment):
+        code, outComment = QuickSourceFile.stripComments(line, inComment)
+        if not code.strip():
+            return EMPTY_LINE._replace(inComment=inComment, outComment=outComment)
+        closes, _, kind, name, operand, _ = QuickSourceFile.parseLine(code)
+        withoutStrings = STRING_PATTERN.sub('""', code)
+        opens = withoutStrings.count('{') - withoutStrings.count('}') + closes
+        labels = []
+        position = len(code) - len(code.lstrip(' \t}'))
+        while True:
+            match = LABEL_PATTERN.match(code, position)
+            if not match:
+                break
+            if not match.group(1).startswith('!'):
+                labels.append((match.group(1), match.start(1) + 1))
+            position = match.end()
+        column = position + len(code[position:]) - len(code[position:].lstrip()) + 1
+        length = len(code.rstrip().rstrip('{').rstrip()) - column + 1
+
+        constant = pseudocommand = call = access = None
+        problems = []
+        if kind == 'constant':
+            labels.append((name, code.find(name, column - 1) + 1))
+            compiled = KickAssQuickAssembler.compileExpression(operand.strip())
+            constant = (name, compiled[1] if compiled[0] == 'value' else None, compiled)
+        elif kind == 'directive' and name == '.pseudocommand':
+            callName = re.match(r'^@?([A-Za-z_][A-Za-z0-9_]*)', operand)
+            pseudocommand = callName.group(1) if callName else None
+        elif kind == 'instruction':
+            decoded = KickAssQuickAssembler.decodeInstruction(name, operand)
+            if decoded is None:
+                call = (name, column)
+            else:
+                problem, access = cls.checkInstruction(decoded, column, length)
+                if problem:
+                    problems.append((column, length, problem))
+        blockName = re.match(r'\.[A-Za-z]+', code[column - 1:]) if opens > 0 else None
+        blockName = blockName.group(0).lower() if blockName else None
+        return LintLine(inComment, outComment, closes, opens, blockName, tuple(labels), constant, pseudocommand, call,
+                        tuple(problems), access)
+
+    @classmethod
+    def checkInstruction(cls, decoded, column, length):
+        """Returns (problem, access) of an instruction"""
+        mnemonic, mode, expression, forced = decoded
+        modes = OPCODES[mnemonic]
+        compiled = KickAssQuickAssembler.compileExpression(expression.strip()) if expression is not None else None
+        value = compiled[1] if compiled and compiled[0] == 'value' else None
+        if mode not in modes:
+            zeropage = ZEROPAGE_MODES.get(mode)
+            if zeropage not in modes or forced == 'abs' or (forced is None and value is not None and value > 0xff):
+                return "Illegal addressing mode for %s" % mnemonic, None
+        if mode == 'abs' and (mnemonic in READING_MNEMONICS or mnemonic in WRITING_MNEMONICS):
+            return None, (column, length, mnemonic in READING_MNEMONICS, mnemonic in WRITING_MNEMONICS, compiled)
+        return None, None
+
+    def getChangeKind(self, first, oldLines, newLines):
+        """
+        Returns how the changed lines are checked: 'lines' when they define the
+        same labels, blocks, constants and pseudocommands as before, so that
+        only they are checked again, 'labels' when they also define other
+        labels, but open or close no blocks, and None when all lines are
+        checked again
+        """
+        if not self.__checked or any(line.call for line in oldLines) or any(line.call for line in newLines):
+            return None
+        if any(start <= first + len(oldLines) and first <= end for start, end in self.__dataBlocks):
+            return None
+        if [self.getStructure(line) for line in oldLines] == [self.getStructure(line) for line in newLines]:
+            return 'lines'
+        if any(line.closes or line.opens for line in oldLines) or any(line.closes or line.opens for line in newLines):
+            return None
+        if self.getDefinitions(oldLines) == self.getDefinitions(newLines):
+            return 'labels'
+        return None
+
+    @classmethod
+    def getStructure(cls, line):
+        return line.closes, line.opens, line.blockName, line.labels, line.constant, line.pseudocommand
+
+    @classmethod
+    def getDefinitions(cls, lines):
+        return [(line.constant, line.pseudocommand) for line in lines if line.constant or line.pseudocommand]
+
+    def check(self, isPseudoCommand):
+        """Checks the linted lines against each other, for labels, calls and register accesses"""
+        errors = []
+        accesses = []
+        constants = {}
+        pseudocommands = set()
+        calls = []
+        defined = {}
+        labelCounts = {}
+        duplicates = []
+        dataBlocks = []
+        # Blocks are numbered in the order they are opened, lines in data blocks have no scope
+        lineScopes = []
+        scopes = [(0, None)]
+        blockCount = 1
+        dataDepth = 0
+
+        def closeBlocks(index, count):
+            depth = dataDepth
+            for _ in range(count):
+                if len(scopes) > 1 and scopes.pop()[1] in DATA_BLOCKS:
+                    depth -= 1
+                    if not depth:
+                        dataBlocks[-1] = (dataBlocks[-1][0], index)
+            return depth
+
+        for index, line in enumerate(self.__lines):
+            if line is EMPTY_LINE:
+                lineScopes.append(None)
+                continue
+            if line.closes:
+                dataDepth = closeBlocks(index, line.closes)
+            scope = scopes[-1][0] if not dataDepth else None
+            lineScopes.append(scope)
+            if scope is not None:
+                for name, column in line.labels:
+                    key = (scope, name)
+                    labelCounts[key] = labelCounts.get(key, 0) + 1
+                    if key in defined:
+                        duplicates.append((index + 1, column, name, defined[key], scope))
+                    else:
+                        defined[key] = index + 1
+                if line.problems:
+                    errors.extend(LintMessage('error', index + 1, column, length, text) for column, length, text in line.problems)
+                elif line.call:
+                    calls.append((index, line.call))
+                elif line.access:
+                    accesses.append((index, line.access))
+                elif line.constant:
+                    constants[line.constant[0]] = line.constant
+                elif line.pseudocommand:
+                    pseudocommands.add(line.pseudocommand)
+            for _ in range(line.opens):
+                scopes.append((blockCount, line.blockName))
+                blockCount += 1
+                if line.blockName in DATA_BLOCKS:
+                    if not dataDepth:
+                        dataBlocks.append((index, len(self.__lines)))
+                    dataDepth += 1
+            if line.opens < 0:
+                dataDepth = closeBlocks(index, -line.opens)
+
+        for index, (name, column) in calls:
+            if name not in pseudocommands and not (isPseudoCommand and isPseudoCommand(name)):
+                errors.append(LintMessage('error', index + 1, column, len(name), "Unknown mnemonic '%s'" % name))
+        if constants != self.__constants:
+            # Addresses with names are resolved again when a constant changes
+            self.__constants = constants
+            self.__addresses = {}
+        self.__pseudocommands = pseudocommands
+        self.__duplicates = duplicates
+        self.__labelCounts = labelCounts
+        self.__lineScopes = lineScopes
+        self.__dataBlocks = dataBlocks
+        self.__lineMessages = errors + self.checkRegisterAccess(accesses)
+        self.__checked = True
+
+    def checkChanged(self, first, oldLines, lines, labels):
+        """
+        Checks the changed lines, and moves the messages of the lines after
+        them. With labels, the labels of the changed lines are checked again.
+        """
+        delta = len(lines) - len(oldLines)
+        last = first + len(oldLines)
+        duplicates = self.__duplicates
+        keys = set()
+        if labels:
+            # Lines without blocks are all in the scope of the first line
+            scope = self.__lineScopes[first]
+            self.__lineScopes[first:last] = [scope] * len(lines)
+            for line in oldLines:
+                for name, _ in line.labels:
+                    keys.add((scope, name))
+                    self.__labelCounts[(scope, name)] -= 1
+            for line in lines:
+                for name, _ in line.labels:
+                    keys.add((scope, name))
+                    self.__labelCounts[(scope, name)] = self.__labelCounts.get((scope, name), 0) + 1
+            duplicates = [d for d in duplicates if (d[4], d[2]) not in keys]
+
+        def move(line):
+            return line + delta if line > last else line
+        self.__duplicates = [(move(line), column, name, move(firstLine), scope)
+                             for line, column, name, firstLine, scope in duplicates]
+        keys = set(key for key in keys if self.__labelCounts[key] > 1)
+        if keys:
+            self.__duplicates = sorted(self.__duplicates + self.findDuplicates(keys))
+        self.__dataBlocks = [(start + delta, end + delta) if start >= last else (start, end) for start, end in self.__dataBlocks]
+
+        messages = [m for m in self.__lineMessages if m.line <= first]
+        accesses = []
+        for index, line in enumerate(lines, first):
+            if line.problems:
+                messages.extend(LintMessage('error', index + 1, column, length, text) for column, length, text in line.problems)
+            elif line.access:
+                accesses.append((index, line.access))
+        messages.extend(self.checkRegisterAccess(accesses))
+        messages.extend(m._replace(line=m.line + delta) if delta else m for m in self.__lineMessages if m.line > last)
+        self.__lineMessages = messages
+
+    def findDuplicates(self, keys):
+        """Returns the duplicates of the (scope, label) keys"""
+        duplicates = []
+        defined = {}
+        for index, line in enumerate(self.__lines):
+            if line.labels:
+                for name, column in line.labels:
+                    key = (self.__lineScopes[index], name)
+                    if key not in keys:
+                        continue
+                    if key in defined:
+                        duplicates.append((index + 1, column, name, defined[key], key[0]))
+                    else:
+                        defined[key] = index + 1
+        return duplicates
+
+    def checkRegisterAccess(self, accesses):
+        warnings = []
+        if not self.__registerAccess:
+            return warnings
+        for index, (column, length, reads, writes, compiled) in accesses:
+            address = self.getAddress(compiled)
+            info = C64_ADDRESS_INDEX.find(address) if isinstance(address, int) else None
+            if info is None:
+                continue
+            access = self.__registerAccess.get(info.register)
+            register = "$%04X" % address if info.register == address else "$%04X (%s)" % (address, describe(info))
+            if access == 'read-only' and writes:
+                warnings.append(LintMessage('warning', index + 1, column, length, "Write to read-only register %s" % register))
+            elif access == 'write-only' and reads:
+                warnings.append(LintMessage('warning', index + 1, column, length, "Read of write-only register %s" % register))
+        return warnings
+
+    def getAddress(self, compiled):
+        kind, value = compiled
+        if kind == 'value':
+            return value
+        if kind not in ('name', 'tokens'):
+            return None
+        if compiled not in self.__addresses:
+            try:
+                tokens = (('name', value),) if kind == 'name' else value
+                self.__addresses[compiled] = ExpressionParser(tokens, self.resolve).parse()
+            except ExpressionError:
+                self.__addresses[compiled] = None
+        return self.__addresses[compiled]
+
+    def resolve(self, name, resolving=()):
+        constant = self.__constants.get(name)
+        if constant is None or name in resolving:
+            return None
+        if constant[1] is not None:
+            return constant[1]
+        kind, value = constant[2]
+        try:
+            if kind == 'name':
+                return self.resolve(value, resolving + (name,))
+            if kind == 'tokens':
+                return ExpressionParser(value, lambda n: self.resolve(n, resolving + (name,))).parse()
+        except ExpressionError:
+            pass
+        return None
+
+class KickassLintListener(sublime_plugin.EventListener):
+    """
+    Lints KickAssembler sources as they are edited, on the async thread once
+    the typing has paused, and marks the problems with underlines. Enabled
+    with kickass_lint.
+    """
+    ERROR_REGION_KEY = 'kickass_lint_errors'
+    WARNING_REGION_KEY = 'kickass_lint_warnings'
+    LINT_DELAY_MS = 150
+    __linters = {}
+    __generations = {}
+    __registerAccess = None
+    __lock = threading.Lock()
+
+    def on_modified_async(self, view):
+        if not self.isEnabled(view):
+            return
+        generation = self.__generations.get(view.id(), 0) + 1
+        self.__generations[view.id()] = generation
+        sublime.set_timeout_async(lambda: self.lintIfCurrent(view, generation), self.LINT_DELAY_MS)
+
+    def on_load_async(self, view):
+        if self.isEnabled(view):
+            self.lint(view)
+
+    def on_activated_async(self, view):
+        if self.isEnabled(view):
+            self.lint(view)
+
+    def on_close(self, view):
+        with self.__lock:
+            self.__linters.pop(view.id(), None)
+        self.__generations.pop(view.id(), None)
+
+    def isEnabled(self, view):
+        return view.match_selector(0, 'source.assembly.kickassembler') and KickAssSettings.forView(view).getBool("kickass_lint")
+
+    def lintIfCurrent(self, view, generation):
+        if self.__generations.get(view.id()) == generation:
+            self.lint(view)
+
+    def lint(self, view):
+        with self.__lock:
+            linter = self.__linters.get(view.id())
+            if linter is None:
+                linter = self.__linters[view.id()] = [KickAssLinter(self.getRegisterAccess()), None]
+        changeCount = view.change_count()
+        if linter[1] == changeCount:
+            return
+        linter[1] = changeCount
+        with KickAssProfiler.phase("lint"):
+            messages = linter[0].update(view.substr(sublime.Region(0, view.size())),
+                                        lambda name: self.isPseudoCommand(view, name))
+        self.showMessages(view, messages)
+
+    def isPseudoCommand(self, view, name):
+        window = view.window()
+        return window is not None and any(d[3] == 'pseudocommand' for d in find_definitions(window, name))
+
+    def showMessages(self, view, messages):
+        for key, kind, scope in [(self.ERROR_REGION_KEY, 'error', 'region.redish'),
+                                 (self.WARNING_REGION_KEY, 'warning', 'region.yellowish')]:
+            regions = [sublime.Region(view.text_point(m.line - 1, m.column - 1), view.text_point(m.line - 1, m.column - 1) + m.length)
+                       for m in messages if m.kind == kind]
+            view.add_regions(key, regions, scope, '',
+                             sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE)
+
+    @classmethod
+    def getRegisterAccess(cls):
+        if cls.__registerAccess is None:
+            directories = sublime.load_settings("KickassTooltips.sublime-settings").get('help_directories', [])
+            cls.__registerAccess = loadRegisterAccess(
+                [d if os.path.isabs(d) else os.path.join(sublime.packages_path(), d) for d in directories])
+        return cls.__registerAccess
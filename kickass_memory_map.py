@@ -0,0 +1,180 @@
+import threading
+from collections import OrderedDict
+
+import sublime
+import sublime_plugin
+
+from .kickass_vice_symbols import symbol_files_for_view
+
+class MemoryMap():
+    """
+    C64 memory usage from the blocks of a -showmem memory map, with overlaps
+    and free space. Results are computed once, so redrawing is instant.
+    """
+    MEMORY_SIZE = 0x10000
+    BYTES_PER_CELL = 64
+    CELLS_PER_ROW = 64
+
+    def __init__(self, blocks):
+        self.__blocks = sorted(blocks, key=lambda b: (b.start, b.end))
+        self.__overlaps = self.findOverlaps(self.__blocks)
+        self.__usedRanges = self.mergeRanges(self.__blocks)
+        self.__rendered = {}
+
+    @property
+    def Blocks(self):
+        return self.__blocks
+
+    @property
+    def Overlaps(self):
+        return self.__overlaps
+
+    @property
+    def UsedBytes(self):
+        return sum(end - start + 1 for start, end in self.__usedRanges)
+
+    @property
+    def FreeBytes(self):
+        return self.MEMORY_SIZE - self.UsedBytes
+
+    @property
+    def FreeRanges(self):
+        ranges = []
+        nextFree = 0
+        for start, end in self.__usedRanges:
+            if start > nextFree:
+                ranges.append((nextFree, start - 1))
+            nextFree = max(nextFree, end + 1)
+        if nextFree < self.MEMORY_SIZE:
+            ranges.append((nextFree, self.MEMORY_SIZE - 1))
+        return ranges
+
+    @property
+    def Segments(self):
+        """Segment name to list of blocks, in order of first appearance"""
+        segments = OrderedDict()
+        for block in self.__blocks:
+            segments.setdefault(block.segment, []).append(block)
+        return segments
+
+    def findOverlaps(self, blocks):
+        overlaps = []
+        active = []
+        for block in blocks:
+            active = [a for a in active if a.end >= block.start]
+            overlaps.extend((a, block) for a in active)
+            active.append(block)
+        return overlaps
+
+    def mergeRanges(self, blocks):
+        ranges = []
+        for block in blocks:
+            if ranges and block.start <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], block.end))
+            else:
+                ranges.append((block.start, block.end))
+        return ranges
+
+    def getSegmentSizes(self):
+        return OrderedDict((segment, sum(b.end - b.start + 1 for b in blocks)) for segment, blocks in self.Segments.items())
+
+    def compare(self, previous):
+        """Returns (segment, previous size, size) of segments that changed size, and the change of used bytes"""
+        sizes = self.getSegmentSizes()
+        previousSizes = previous.getSegmentSizes()
+        changes = [(s, previousSizes.get(s, 0), sizes.get(s, 0)) for s in list(sizes) + [p for p in previousSizes if p not in sizes]
+                   if previousSizes.get(s, 0) != sizes.get(s, 0)]
+        return changes, self.UsedBytes - previous.UsedBytes
+
+    def getCellChar(self, cellStart):
+        cellEnd = cellStart + self.BYTES_PER_CELL - 1
+        used = 0
+        for start, end in self.__usedRanges:
+            if end >= cellStart and start <= cellEnd:
+                used += min(end, cellEnd) - max(start, cellStart) + 1
+        if any(a.end >= cellStart and b.start <= cellEnd and min(a.end, b.end) >= max(a.start, b.start, cellStart)
+               for a, b in self.__overlaps):
+            return '!'
+        if used == 0:
+            return '.'
+        return '#' if used == self.BYTES_PER_CELL else '+'
+
+    def render(self, labels=None, previous=None):
+        """Returns the memory map as text. labels is a dict of address to label name."""
+        # The arguments are kept with the text, so their ids stay unique
+        key = (id(labels), id(previous))
+        if key not in self.__rendered:
+            self.__rendered = {key: (labels, previous, self.renderText(labels or {}, previous))}
+        return self.__rendered[key][2]
+
+    def renderText(self, labels, previous):
+        lines = ["Memory map: %d blocks, %d bytes used, %d bytes free" % (len(self.__blocks), self.UsedBytes, self.FreeBytes), ""]
+
+        rowSize = self.BYTES_PER_CELL * self.CELLS_PER_ROW
+        for rowStart in range(0, self.MEMORY_SIZE, rowSize):
+            cells = ''.join(self.getCellChar(c) for c in range(rowStart, rowStart + rowSize, self.BYTES_PER_CELL))
+            lines.append("$%04X %s" % (rowStart, cells))
+        lines.append("      '#' used  '+' partly used  '.' free  '!' overlap, %d bytes per character" % self.BYTES_PER_CELL)
+        lines.append("")
+
+        for segment, blocks in self.Segments.items():
+            lines.append("%s-segment: %d bytes" % (segment, sum(b.end - b.start + 1 for b in blocks)))
+            for block in blocks:
+                label = labels.get(block.start)
+                lines.append("  $%04X-$%04X %6d bytes  %s%s" % (block.start, block.end, block.end - block.start + 1, block.name, " (%s)" % label if label else ""))
+        lines.append("")
+
+        if self.__overlaps:
+            lines.append("Overlaps:")
+            for a, b in self.__overlaps:
+                lines.append("  %s ($%04X-$%04X) and %s ($%04X-$%04X)" % (a.name, a.start, a.end, b.name, b.start, b.end))
+            lines.append("")
+
+        lines.append("Free: %d bytes" % self.FreeBytes)
+        for start, end in sorted(self.FreeRanges, key=lambda r: r[0] - r[1]):
+            lines.append("  $%04X-$%04X %6d bytes" % (start, end, end - start + 1))
+
+        if previous is not None:
+            changes, usedChange = self.compare(previous)
+            lines.append("")
+            lines.append("Compared to previous build: %+d bytes used" % usedChange)
+            for segment, previousSize, size in changes:
+                lines.append("  %s-segment: %d -> %d bytes (%+d)" % (segment, previousSize, size, size - previousSize))
+        return "\n".join(lines) + "\n"
+
+class MemoryMapHistory():
+    """Memory maps of the latest and the previous build, per window"""
+    __maps = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def record(cls, windowId, memoryMap):
+        with cls.__lock:
+            latest, _ = cls.__maps.get(windowId, (None, None))
+            cls.__maps[windowId] = (memoryMap, latest)
+
+    @classmethod
+    def get(cls, windowId):
+        """Returns (latest, previous) memory maps of the window"""
+        with cls.__lock:
+            return cls.__maps.get(windowId, (None, None))
+
+class KickassShowMemoryMapCommand(sublime_plugin.WindowCommand):
+    """Shows the memory map of the latest build in an output panel"""
+
+    def run(self, compare=True):
+        memoryMap, previous = MemoryMapHistory.get(self.window.id())
+        if not memoryMap:
+            sublime.status_message("No memory map, build with -showmem first")
+            return
+        text = memoryMap.render(self.getLabels(), previous if compare else None)
+        panel = self.window.create_output_panel('kickass_memory_map')
+        panel.run_command('append', {'characters': text})
+        self.window.run_command('show_panel', {'panel': 'output.kickass_memory_map'})
+
+    def getLabels(self):
+        view = self.window.active_view()
+        symbolFiles = symbol_files_for_view(view) if view else []
+        if not symbolFiles:
+            return None
+        return symbolFiles[0].addresses()
@@ -0,0 +1,150 @@
+import fnmatch
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+
+from .kickass_assets import KickAssAssetPipeline
+
+class KickAssOutputCleaner():
+    """
+    Cleans the output folder before a build, without deleting every file in it.
+
+    'stale' mode keeps a manifest of the files the last build wrote, recorded
+    when it has finished: the files that are new or changed since the folder
+    was cleaned before it. Only files the last build did not write are deleted,
+    such as the outputs of renamed sources, the ones it wrote are overwritten by
+    the next build anyway. Without a manifest all files are deleted, same as
+    emptying the folder.
+
+    'rename' mode renames the folder, which is atomic, and deletes the old
+    folder on a background thread. If the folder can not be renamed, its files
+    are deleted in place.
+
+    Files matching the keep patterns (for example *_ViceLog.txt), and the
+    converted assets cache, are kept in both modes.
+    """
+    MANIFEST_FILE = '.kickass_manifest.json'
+    OLD_FOLDER_MARKER = '.kickass-old-'
+
+    def __init__(self, path, keepPatterns=None):
+        self.__path = path
+        self.__keepPatterns = keepPatterns or []
+
+    def clean(self, mode):
+        if mode == 'rename':
+            self.renameAndDelete()
+        else:
+            self.removeStale()
+
+    def isKept(self, relativePath):
+        fileName = os.path.basename(relativePath)
+        if relativePath.split(os.sep)[0] == KickAssAssetPipeline.CACHE_FOLDER:
+            return True
+        return relativePath == self.MANIFEST_FILE or any(fnmatch.fnmatch(fileName, p) for p in self.__keepPatterns)
+
+    def listFiles(self):
+        """Returns {relative path: [mtime, size]} of all files in the folder"""
+        files = {}
+        for root, dirs, fileNames in os.walk(self.__path):
+            for fileName in fileNames:
+                path = os.path.join(root, fileName)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[os.path.relpath(path, self.__path)] = [stat.st_mtime, stat.st_size]
+        return files
+
+    def loadManifest(self):
+        try:
+            with open(os.path.join(self.__path, self.MANIFEST_FILE), 'r', encoding='utf-8') as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def saveManifest(self, manifest):
+        with open(os.path.join(self.__path, self.MANIFEST_FILE), 'w', encoding='utf-8') as handle:
+            json.dump(manifest, handle)
+
+    def removeStale(self):
+        """Deletes the files the last build did not write, returns their relative paths"""
+        manifest = self.loadManifest() or {}
+        written = manifest.get('written') or {}
+        files = self.listFiles()
+        removed = []
+        for relativePath in files:
+            if self.isKept(relativePath) or relativePath in written:
+                continue
+            try:
+                os.unlink(os.path.join(self.__path, relativePath))
+                removed.append(relativePath)
+            except OSError:
+                pass
+        self.removeEmptyFolders()
+        files = dict((p, s) for p, s in files.items() if p not in removed and p != self.MANIFEST_FILE)
+        self.saveManifest({'cleaned': files, 'written': written})
+        return removed
+
+    def recordBuild(self):
+        """
+        Records the files written since the folder was cleaned, call when the
+        build has finished. Returns their relative paths.
+        """
+        manifest = self.loadManifest() or {}
+        cleaned = manifest.get('cleaned') or {}
+        files = self.listFiles()
+        written = dict((p, s) for p, s in files.items() if p != self.MANIFEST_FILE and cleaned.get(p) != s)
+        # A build that wrote nothing, such as one that failed early, keeps the outputs of the one before
+        if written:
+            self.saveManifest({'cleaned': cleaned, 'written': written})
+        return sorted(written)
+
+    def removeAll(self):
+        """Deletes all files that are not kept, same as emptying the folder, returns their relative paths"""
+        removed = []
+        for relativePath in self.listFiles():
+            if self.isKept(relativePath) and relativePath != self.MANIFEST_FILE:
+                continue
+            try:
+                os.unlink(os.path.join(self.__path, relativePath))
+                removed.append(relativePath)
+            except OSError:
+                pass
+        self.removeEmptyFolders()
+        return removed
+
+    def removeEmptyFolders(self):
+        for root, dirs, fileNames in os.walk(self.__path, topdown=False):
+            if root != self.__path and not os.listdir(root):
+                os.rmdir(root)
+
+    def renameAndDelete(self):
+        """
+        Moves the folder out of the way and deletes it in the background, returns
+        the thread deleting it, None if the files were deleted in place
+        """
+        path = os.path.normpath(self.__path)
+        oldPath = "%s%s%d" % (path, self.OLD_FOLDER_MARKER, int(time.time() * 1000))
+        try:
+            os.rename(path, oldPath)
+        except OSError:
+            # Open files on Windows, and some network shares, prevent renaming the folder
+            self.removeAll()
+            return None
+        os.makedirs(path)
+
+        for root, dirs, fileNames in os.walk(oldPath):
+            for fileName in fileNames:
+                relativePath = os.path.relpath(os.path.join(root, fileName), oldPath)
+                if self.isKept(relativePath) and relativePath != self.MANIFEST_FILE:
+                    os.renames(os.path.join(oldPath, relativePath), os.path.join(path, relativePath))
+
+        # Includes old folders left behind if a previous delete was interrupted
+        oldPaths = glob.glob(glob.escape(path + self.OLD_FOLDER_MARKER) + '*') if hasattr(glob, 'escape') else [oldPath]
+        thread = threading.Thread(target=lambda: [shutil.rmtree(p, ignore_errors=True) for p in oldPaths])
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,207 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import sublime
+import sublime_plugin
+
+from .kickass_settings import KickAssSettings
+
+# Phases in the order they happen, other phases are listed after these
+PHASES = ["settings load",
+          "annotation parse",
+          "script discovery",
+          "folder cleanup",
+          "asset conversion",
+          "command expansion",
+          "assembler runtime",
+          "emulator launch",
+          "tooltip render",
+          "quick check"]
+
+class KickAssTimer():
+    """Time spent per phase of one build, phases entered more than once are added up"""
+
+    def __init__(self, name):
+        self.__name = name
+        self.__phases = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    @property
+    def Name(self):
+        return self.__name
+
+    @property
+    def Phases(self):
+        """Seconds per phase"""
+        with self.__lock:
+            return collections.OrderedDict(self.__phases)
+
+    def has(self, phase):
+        with self.__lock:
+            return phase in self.__phases
+
+    def add(self, phase, seconds):
+        with self.__lock:
+            self.__phases[phase] = self.__phases.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+class KickAssProfiler():
+    """
+    Collects phase timings of builds and tooltips. A build's timer is kept per
+    window from the build command until the exec command has finished, and is
+    active on the threads working on the build, so phases are timed where they
+    happen without passing the timer along. Phases outside of a build are
+    recorded on their own.
+
+    The last HISTORY_SIZE timings of each phase are kept for the summary. With
+    kickass_profile enabled in the settings of the active view, timings are
+    also printed to the console, and written as JSON lines to
+    kickass_profile_trace_file if set.
+    """
+    HISTORY_SIZE = 20
+    __history = {}
+    __builds = {}
+    __lock = threading.Lock()
+    __active = threading.local()
+
+    @classmethod
+    def startBuild(cls, windowId, timer):
+        with cls.__lock:
+            cls.__builds[windowId] = timer
+        return timer
+
+    @classmethod
+    def getBuild(cls, windowId):
+        with cls.__lock:
+            return cls.__builds.get(windowId)
+
+    @classmethod
+    def finishBuild(cls, windowId, timer):
+        """Records the timings of the build, once"""
+        with cls.__lock:
+            if timer is None or cls.__builds.get(windowId) is not timer:
+                return
+            del cls.__builds[windowId]
+        cls.record(timer.Name, timer.Phases)
+
+    @classmethod
+    def getActive(cls):
+        return getattr(cls.__active, 'timer', None)
+
+    @classmethod
+    @contextlib.contextmanager
+    def activate(cls, timer):
+        """Phases timed on this thread are added to the timer"""
+        previous = cls.getActive()
+        cls.__active.timer = timer
+        try:
+            yield timer
+        finally:
+            cls.__active.timer = previous
+
+    @classmethod
+    @contextlib.contextmanager
+    def phase(cls, phase):
+        timer = cls.getActive()
+        if timer is not None:
+            with timer.phase(phase):
+                yield
+            return
+        timer = KickAssTimer(phase)
+        with timer.phase(phase):
+            yield
+        cls.record(phase, timer.Phases)
+
+    @classmethod
+    def record(cls, name, phases):
+        with cls.__lock:
+            for phase, seconds in phases.items():
+                if phase not in cls.__history:
+                    cls.__history[phase] = collections.deque(maxlen=cls.HISTORY_SIZE)
+                cls.__history[phase].append(seconds)
+
+        settings = cls.getSettings()
+        if not settings.getBool("kickass_profile"):
+            return
+        print("KickAss timings %s: %s" % (name, cls.formatPhases(phases)))
+        traceFile = settings.getPath("kickass_profile_trace_file")
+        if traceFile:
+            cls.writeTrace(traceFile, name, phases)
+
+    @classmethod
+    def getSettings(cls):
+        """Settings snapshot of the active view, with its project and view settings"""
+        window = sublime.active_window()
+        view = window.active_view() if window else None
+        if view is None:
+            return KickAssSettings(sublime.load_settings('Preferences.sublime-settings'), window.project_data() if window else None)
+        return KickAssSettings.forView(view, window)
+
+    @classmethod
+    def formatPhases(cls, phases):
+        parts = ["%s %.1f ms" % (phase, seconds * 1000.0) for phase, seconds in phases.items()]
+        if len(phases) > 1:
+            parts.append("total %.1f ms" % (sum(phases.values()) * 1000.0))
+        return ", ".join(parts)
+
+    @classmethod
+    def writeTrace(cls, traceFile, name, phases):
+        line = json.dumps({
+            "time": time.time(),
+            "name": name,
+            "phases_ms": dict((phase, round(seconds * 1000.0, 3)) for phase, seconds in phases.items()),
+            }, sort_keys=True)
+        try:
+            with cls.__lock:
+                with open(traceFile, 'a', encoding='utf-8') as handle:
+                    handle.write(line + "\n")
+        except OSError as ex:
+            print("Could not write the timing trace %s: %s" % (traceFile, ex))
+
+    @classmethod
+    def getSummary(cls):
+        """Returns (phase, samples, last, average, max) of each phase, times in seconds"""
+        with cls.__lock:
+            history = dict((phase, list(samples)) for phase, samples in cls.__history.items())
+        phases = [p for p in PHASES if p in history] + sorted(p for p in history if p not in PHASES)
+        return [(p, len(history[p]), history[p][-1], sum(history[p]) / len(history[p]), max(history[p])) for p in phases]
+
+    @classmethod
+    def renderSummary(cls):
+        summary = cls.getSummary()
+        if not summary:
+            return "No timings yet, run a build first\n"
+        lines = ["Timings of the last %d runs of each phase, in ms" % cls.HISTORY_SIZE, "",
+                 "%-20s %8s %10s %10s %10s" % ("phase", "samples", "last", "average", "max")]
+        for phase, samples, last, average, maximum in summary:
+            lines.append("%-20s %8d %10.1f %10.1f %10.1f" % (phase, samples, last * 1000.0, average * 1000.0, maximum * 1000.0))
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__history.clear()
+            cls.__builds.clear()
+
+class KickassShowTimingsCommand(sublime_plugin.WindowCommand):
+    """Shows the average time of each build and tooltip phase in an output panel"""
+
+    def run(self, clear=False):
+        if clear:
+            KickAssProfiler.clear()
+            sublime.status_message("Timings cleared")
+            return
+        panel = self.window.create_output_panel('kickass_timings')
+        panel.run_command('append', {'characters': KickAssProfiler.renderSummary()})
+        self.window.run_command('show_panel', {'panel': 'output.kickass_timings'})
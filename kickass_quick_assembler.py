@@ -0,0 +1,932 @@
+import os
+import re
+from collections import namedtuple, OrderedDict
+
+import sublime
+import sublime_plugin
+
+from .kickass_build_output import BuildMessage, MemoryBlock
+from .kickass_profiler import KickAssProfiler
+from .kickass_settings import KickAssSettings
+from .kickass_tooltip_render import ExpressionParser, ExpressionError, tokenize
+
+# Addressing modes: implied/accumulator, immediate, zeropage, zeropage,x,
+# zeropage,y, absolute, absolute,x, absolute,y, indirect, (indirect,x),
+# (indirect),y and relative
+MODES = ('imp', 'imm', 'zp', 'zpx', 'zpy', 'abs', 'abx', 'aby', 'ind', 'izx', 'izy', 'rel')
+MODE_SIZES = {'imp': 1, 'imm': 2, 'zp': 2, 'zpx': 2, 'zpy': 2, 'abs': 3, 'abx': 3, 'aby': 3,
+              'ind': 3, 'izx': 2, 'izy': 2, 'rel': 2, 'illegal': 2}
+# Operands of no mode of the 6502, such as (indirect),x and #immediate,x, no mnemonic has an opcode for it
+ILLEGAL_MODE = 'illegal'
+# Zeropage variant of each absolute mode, used when the operand fits in a byte
+ZEROPAGE_MODES = {'abs': 'zp', 'abx': 'zpx', 'aby': 'zpy'}
+
+# Opcode per addressing mode, in the order of MODES
+OPCODE_TABLE = """
+adc  -  69 65 75 -  6d 7d 79 -  61 71 -
+and  -  29 25 35 -  2d 3d 39 -  21 31 -
+asl  0a -  06 16 -  0e 1e -  -  -  -  -
+bcc  -  -  -  -  -  -  -  -  -  -  -  90
+bcs  -  -  -  -  -  -  -  -  -  -  -  b0
+beq  -  -  -  -  -  -  -  -  -  -  -  f0
+bit  -  -  24 -  -  2c -  -  -  -  -  -
+bmi  -  -  -  -  -  -  -  -  -  -  -  30
+bne  -  -  -  -  -  -  -  -  -  -  -  d0
+bpl  -  -  -  -  -  -  -  -  -  -  -  10
+brk  00 -  -  -  -  -  -  -  -  -  -  -
+bvc  -  -  -  -  -  -  -  -  -  -  -  50
+bvs  -  -  -  -  -  -  -  -  -  -  -  70
+clc  18 -  -  -  -  -  -  -  -  -  -  -
+cld  d8 -  -  -  -  -  -  -  -  -  -  -
+cli  58 -  -  -  -  -  -  -  -  -  -  -
+clv  b8 -  -  -  -  -  -  -  -  -  -  -
+cmp  -  c9 c5 d5 -  cd dd d9 -  c1 d1 -
+cpx  -  e0 e4 -  -  ec -  -  -  -  -  -
+cpy  -  c0 c4 -  -  cc -  -  -  -  -  -
+dec  -  -  c6 d6 -  ce de -  -  -  -  -
+dex  ca -  -  -  -  -  -  -  -  -  -  -
+dey  88 -  -  -  -  -  -  -  -  -  -  -
+eor  -  49 45 55 -  4d 5d 59 -  41 51 -
+inc  -  -  e6 f6 -  ee fe -  -  -  -  -
+inx  e8 -  -  -  -  -  -  -  -  -  -  -
+iny  c8 -  -  -  -  -  -  -  -  -  -  -
+jmp  -  -  -  -  -  4c -  -  6c -  -  -
+jsr  -  -  -  -  -  20 -  -  -  -  -  -
+lda  -  a9 a5 b5 -  ad bd b9 -  a1 b1 -
+ldx  -  a2 a6 -  b6 ae -  be -  -  -  -
+ldy  -  a0 a4 b4 -  ac bc -  -  -  -  -
+lsr  4a -  46 56 -  4e 5e -  -  -  -  -
+nop  ea -  -  -  -  -  -  -  -  -  -  -
+ora  -  09 05 15 -  0d 1d 19 -  01 11 -
+pha  48 -  -  -  -  -  -  -  -  -  -  -
+php  08 -  -  -  -  -  -  -  -  -  -  -
+pla  68 -  -  -  -  -  -  -  -  -  -  -
+plp  28 -  -  -  -  -  -  -  -  -  -  -
+rol  2a -  26 36 -  2e 3e -  -  -  -  -
+ror  6a -  66 76 -  6e 7e -  -  -  -  -
+rti  40 -  -  -  -  -  -  -  -  -  -  -
+rts  60 -  -  -  -  -  -  -  -  -  -  -
+sbc  -  e9 e5 f5 -  ed fd f9 -  e1 f1 -
+sec  38 -  -  -  -  -  -  -  -  -  -  -
+sed  f8 -  -  -  -  -  -  -  -  -  -  -
+sei  78 -  -  -  -  -  -  -  -  -  -  -
+sta  -  -  85 95 -  8d 9d 99 -  81 91 -
+stx  -  -  86 -  96 8e -  -  -  -  -  -
+sty  -  -  84 94 -  8c -  -  -  -  -  -
+tax  aa -  -  -  -  -  -  -  -  -  -  -
+tay  a8 -  -  -  -  -  -  -  -  -  -  -
+tsx  ba -  -  -  -  -  -  -  -  -  -  -
+txa  8a -  -  -  -  -  -  -  -  -  -  -
+txs  9a -  -  -  -  -  -  -  -  -  -  -
+tya  98 -  -  -  -  -  -  -  -  -  -  -
+"""
+
+# Undocumented opcodes, with the mnemonics KickAssembler uses
+ILLEGAL_OPCODE_TABLE = """
+alr  -  4b -  -  -  -  -  -  -  -  -  -
+anc  -  0b -  -  -  -  -  -  -  -  -  -
+arr  -  6b -  -  -  -  -  -  -  -  -  -
+dcp  -  -  c7 d7 -  cf df db -  c3 d3 -
+isc  -  -  e7 f7 -  ef ff fb -  e3 f3 -
+las  -  -  -  -  -  -  -  bb -  -  -  -
+lax  -  ab a7 -  b7 af -  bf -  a3 b3 -
+rla  -  -  27 37 -  2f 3f 3b -  23 33 -
+rra  -  -  67 77 -  6f 7f 7b -  63 73 -
+sax  -  -  87 -  97 8f -  -  -  83 -  -
+sbx  -  cb -  -  -  -  -  -  -  -  -  -
+sha  -  -  -  -  -  -  -  9f -  -  93 -
+shx  -  -  -  -  -  -  -  9e -  -  -  -
+shy  -  -  -  -  -  -  9c -  -  -  -  -
+slo  -  -  07 17 -  0f 1f 1b -  03 13 -
+sre  -  -  47 57 -  4f 5f 5b -  43 53 -
+tas  -  -  -  -  -  -  -  9b -  -  -  -
+"""
+
+def parseOpcodeTable(table):
+    """Returns mnemonic to {mode: opcode}"""
+    opcodes = {}
+    for row in table.strip().splitlines():
+        columns = row.split()
+        opcodes[columns[0]] = dict((mode, int(opcode, 16)) for mode, opcode in zip(MODES, columns[1:]) if opcode != '-')
+    return opcodes
+
+OPCODES = parseOpcodeTable(OPCODE_TABLE)
+ILLEGAL_OPCODES = parseOpcodeTable(ILLEGAL_OPCODE_TABLE)
+OPCODES.update(ILLEGAL_OPCODES)
+
+# Mnemonics of which the implied mode works on the accumulator, also written as asl a
+ACCUMULATOR_MNEMONICS = frozenset(['asl', 'lsr', 'rol', 'ror'])
+
+# Operand syntax of each addressing mode, tried in order. Absolute modes are
+# changed to zeropage modes when the operand fits in a byte.
+OPERAND_PATTERNS = [
+    (re.compile(r'^#(.*),\s*[xXyY]$'), ILLEGAL_MODE),
+    (re.compile(r'^#(.*)$'), 'imm'),
+    (re.compile(r'^\((.*),\s*[xX]\s*\)$'), 'izx'),
+    (re.compile(r'^\((.*)\)\s*,\s*[yY]$'), 'izy'),
+    (re.compile(r'^(\(.*\))$'), 'ind'),
+    (re.compile(r'^(.*?),\s*[xX]$'), 'abx'),
+    (re.compile(r'^(.*?),\s*[yY]$'), 'aby'),
+    (re.compile(r'^(.*)$'), 'abs'),
+    ]
+# Mnemonic extensions forcing the operand size, such as lda.abs $10
+MODE_EXTENSIONS = {'z': 'zp', 'zp': 'zp', 'a': 'abs', 'abs': 'abs'}
+
+# Predefined constants of KickAssembler
+PREDEFINED = dict((name, value) for value, names in enumerate([
+    ['BLACK'], ['WHITE'], ['RED'], ['CYAN'], ['PURPLE'], ['GREEN'], ['BLUE'], ['YELLOW'],
+    ['ORANGE'], ['BROWN'], ['LIGHT_RED'], ['DARK_GRAY', 'DARK_GREY'], ['GRAY', 'GREY'],
+    ['LIGHT_GREEN'], ['LIGHT_BLUE'], ['LIGHT_GRAY', 'LIGHT_GREY']]) for name in names)
+PREDEFINED_UNKNOWN = frozenset(['true', 'false', 'PI', 'E', 'AUTO', 'cmdLineVars'])
+
+# Code before the first origin is placed here, an origin above the zeropage
+# keeps operands that are labels absolute, as they are in the full build
+DEFAULT_ORIGIN = 0x1000
+DEFAULT_SEGMENT = 'Default'
+
+COMMENT_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|(//)|(/\*)')
+STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"')
+LABEL_PATTERN = re.compile(r'\s*(!?[A-Za-z_][A-Za-z0-9_]*|!)\s*:(?!:)')
+STATEMENT_PATTERN = re.compile(r'^(\.?[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z]+)?)\s*(.*)$')
+ORIGIN_PATTERN = re.compile(r'^(?:\*|\.pc)\s*=\s*(.*?)\s*(?:"([^"]*)")?\s*(virtual)?$')
+ASSIGNMENT_PATTERN = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*)$')
+SEGMENT_PATTERN = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)\s*(?:\[(.*)\])?')
+SEGMENT_START_PATTERN = re.compile(r'\bstart\s*=\s*([^,\]]+)')
+MULTILABEL_REFERENCE_PATTERN = re.compile(r'!([A-Za-z_][A-Za-z0-9_]*)?(\++|-+)')
+CALL_PATTERN = re.compile(r'^:?([A-Za-z_][A-Za-z0-9_.]*)\s*\(')
+IMPORT_PATTERN = re.compile(r'^(?:#import|\.import\s+source)\s+"([^"]+)"')
+LIBDIR_PATTERN = re.compile(r'-libdir\s+(?:"([^"]+)"|(\S+))', re.IGNORECASE)
+
+# Directives that emit no code
+NO_CODE_DIRECTIVES = frozenset(['.assert', '.asserterror', '.break', '.cpu', '.encoding', '.error', '.errorif',
+                                '.eval', '.filenamespace', '.importonce', '.print', '.printnow', '.watch',
+                                '.plugin', '.return', '.var', '.const', '.label', '.enum', '.struct',
+                                '.define', '.function', '.macro', '.pseudocommand', '.segmentdef',
+                                '.segmentout', '.file', '.disk', '.memblock', '.segment', '.align',
+                                '.namespace', '.zp'])
+DATA_SIZES = {'.byte': 1, '.by': 1, '.word': 2, '.wo': 2, '.dword': 4, '.dw': 4}
+# Blocks whose contents are not assembled: definitions emit no code where they
+# are, the contents of loops, conditions and other blocks are assembled a
+# number of times
+DEFINITION_BLOCKS = frozenset(['.macro', '.function', '.pseudocommand', '.define', '.struct', '.enum', '.disk',
+                               '.plugin'])
+SCOPE_BLOCKS = frozenset(['', '.namespace', '.zp'])
+
+# One statement of a source line, in the order of assembly. Labels are the
+# names the statement's address is assigned to.
+QuickStatement = namedtuple('QuickStatement', ['file', 'line', 'column', 'labels', 'kind', 'name', 'operand'])
+# Bytes assembled from one statement. Mode is None for data, operand is the
+# value of an instruction's operand, None if it has none or it is not known.
+AssembledLine = namedtuple('AssembledLine', ['file', 'line', 'address', 'mode', 'data', 'operand'])
+
+class UnknownValue(Exception):
+    """A symbol exists, but its value is not known to the quick assembler"""
+    pass
+
+class UndefinedSymbol(Exception):
+    pass
+
+class QuickAssembly():
+    """Result of a quick assembly"""
+
+    def __init__(self, messages, blocks, lines, symbols, complete):
+        self.__messages = messages
+        self.__blocks = blocks
+        self.__lines = lines
+        self.__symbols = symbols
+        self.__complete = complete
+
+    @property
+    def Messages(self):
+        return self.__messages
+
+    @property
+    def Errors(self):
+        return [m for m in self.__messages if m.kind == 'error']
+
+    @property
+    def Blocks(self):
+        """Memory blocks, as in the memory map of a -showmem build"""
+        return self.__blocks
+
+    @property
+    def Lines(self):
+        return self.__lines
+
+    @property
+    def Symbols(self):
+        """Label and constant name to value, None if the value is not known"""
+        return self.__symbols
+
+    @property
+    def Complete(self):
+        """False if parts of the source could not be assembled, such as macro calls and loops"""
+        return self.__complete
+
+    def getSegmentSizes(self):
+        sizes = OrderedDict()
+        for block in self.__blocks:
+            sizes[block.segment] = sizes.get(block.segment, 0) + block.end - block.start + 1
+        return sizes
+
+class QuickSourceFile():
+    """
+    The statements of one source file in the order of assembly, and the names
+    it defines. Imports are statements of kind import, which the assembler
+    replaces with the statements of the imported file. Files read from disk
+    are only parsed again when their mtime or size changes.
+    """
+    __files = {}
+    __parsedLines = {}
+    MAX_PARSED_LINES = 20000
+
+    @classmethod
+    def get(cls, path, text=None):
+        """Returns the parsed file, None if it can not be read"""
+        stamp = None
+        if text is None:
+            try:
+                stat = os.stat(path)
+                stamp = (stat.st_mtime, stat.st_size)
+                if cls.__files.get(path, (None,))[0] == stamp:
+                    return cls.__files[path][1]
+                with open(path, 'r', encoding='utf-8', errors='replace') as handle:
+                    text = handle.read()
+            except OSError:
+                return None
+        lines = []
+        inComment = False
+        for lineNumber, line in enumerate(text.splitlines(), 1):
+            code, inComment = cls.stripComments(line, inComment)
+            if code.strip():
+                lines.append((lineNumber, len(line) - len(line.lstrip()) + 1, cls.parseLine(code)))
+        sourceFile = cls(path, lines)
+        if stamp is not None:
+            cls.__files[path] = (stamp, sourceFile)
+        return sourceFile
+
+    def __init__(self, path, lines):
+        self.__path = path
+        self.__statements = []
+        self.__names = set()
+        self.__calls = set()
+        self.__importOnce = False
+        self.__complete = True
+        blocks = []
+        for lineNumber, column, parsed in lines:
+            closes, labels, kind, name, operand, opens = parsed
+            for _ in range(closes):
+                if blocks:
+                    self.closeBlock(blocks.pop(), blocks)
+            if kind == 'importonce':
+                self.__importOnce = True
+            elif kind == 'import':
+                self.__statements.append(QuickStatement(path, lineNumber, column, (), kind, None, operand))
+            else:
+                self.addStatement(lineNumber, column, labels, kind, name, operand, opens, blocks)
+
+    @property
+    def Statements(self):
+        return self.__statements
+
+    @property
+    def Names(self):
+        """Labels, constants, variables, macros and functions defined in the file"""
+        return self.__names
+
+    @property
+    def Calls(self):
+        """Macros, pseudocommands and functions defined in the file"""
+        return self.__calls
+
+    @property
+    def ImportOnce(self):
+        return self.__importOnce
+
+    @property
+    def Complete(self):
+        """False if the file has loops or conditions with code"""
+        return self.__complete
+
+    def addStatement(self, lineNumber, column, labels, kind, name, operand, opens, blocks):
+        skipped = next((b for b in reversed(blocks) if b[0] != 'scope'), None)
+        scopes = [b[1] for b in blocks if b[0] == 'scope' and b[1]]
+        names = []
+        for label in labels:
+            if label.startswith('!'):
+                names.append(label)
+                continue
+            self.__names.add(label)
+            names.append(label)
+            if scopes:
+                self.__names.add('.'.join(scopes + [label]))
+                names.append('.'.join(scopes + [label]))
+
+        if kind in ('constant', 'variable'):
+            self.__names.add(name)
+        if kind == 'directive' and name in ('.macro', '.pseudocommand', '.function', '.define', '.enum', '.struct'):
+            callName = re.match(r'^@?([A-Za-z_][A-Za-z0-9_]*)', operand)
+            if callName:
+                self.__calls.add(callName.group(1))
+                self.__names.add(callName.group(1))
+
+        if skipped is not None:
+            # Inside a definition, loop or condition, only the names are kept
+            if kind not in ('directive', 'constant', 'variable', None) or (kind == 'directive' and name not in NO_CODE_DIRECTIVES):
+                skipped[2] = True
+            if opens:
+                blocks.append([self.getBlockKind(kind, name), None, False, None])
+            return
+
+        statement = QuickStatement(self.__path, lineNumber, column, tuple(names), kind, name, operand)
+        if opens:
+            blockKind = self.getBlockKind(kind, name)
+            scopeName = labels[-1] if labels and not labels[-1].startswith('!') else None
+            if kind == 'directive' and name == '.namespace':
+                scopeName = operand.strip()
+            if blockKind != 'scope':
+                # Added when the block is closed, when it is known if it has code
+                blocks.append([blockKind, scopeName, False, statement])
+                return
+            blocks.append([blockKind, scopeName, False, None])
+            statement = statement._replace(kind=None)
+        self.__statements.append(statement)
+
+    def closeBlock(self, block, blocks):
+        kind, _, emits, statement = block
+        if kind == 'scope':
+            return
+        if statement is None:
+            # A block inside a definition, loop or condition
+            outer = next((b for b in reversed(blocks) if b[0] != 'scope'), None)
+            if outer is not None and emits:
+                outer[2] = True
+            return
+        # Loops and conditions leave the address unknown if they have code
+        if kind == 'repeat' and emits:
+            self.__complete = False
+            statement = statement._replace(kind='unsupported')
+        else:
+            statement = statement._replace(kind=None)
+        self.__statements.append(statement)
+
+    def getBlockKind(self, kind, name):
+        if kind == 'directive' and name in DEFINITION_BLOCKS:
+            return 'definition'
+        if kind is None or (kind == 'directive' and name in SCOPE_BLOCKS):
+            return 'scope'
+        return 'repeat'
+
+    @classmethod
+    def stripComments(cls, line, inComment):
+        """Returns the line without comments, and if a block comment continues on the next line"""
+        if not inComment and '/' not in line:
+            return line, False
+        code = []
+        position = 0
+        while position < len(line):
+            if inComment:
+                end = line.find('*/', position)
+                if end < 0:
+                    return ''.join(code), True
+                position = end + 2
+                inComment = False
+                continue
+            match = COMMENT_PATTERN.search(line, position)
+            if not match:
+                code.append(line[position:])
+                break
+            code.append(line[position:match.start()])
+            if match.group(1):
+                break
+            if match.group(2):
+                inComment = True
+            else:
+                code.append(match.group(0))
+            position = match.end()
+        return ''.join(code), inComment
+
+    @classmethod
+    def parseLine(cls, code):
+        """Returns (closed blocks, labels, kind, name, operand, opens a block) of a line without comments"""
+        if code in cls.__parsedLines:
+            return cls.__parsedLines[code]
+        parsed = cls.parseStatement(code)
+        if len(cls.__parsedLines) >= cls.MAX_PARSED_LINES:
+            cls.__parsedLines.clear()
+        cls.__parsedLines[code] = parsed
+        return parsed
+
+    @classmethod
+    def parseStatement(cls, code):
+        rest = code.strip()
+        closes = 0
+        while rest.startswith('}'):
+            closes += 1
+            rest = rest[1:].lstrip()
+
+        labels = []
+        while True:
+            match = LABEL_PATTERN.match(rest)
+            if not match:
+                break
+            labels.append(match.group(1))
+            rest = rest[match.end():].lstrip()
+
+        opens = False
+        withoutStrings = STRING_PATTERN.sub('""', rest)
+        if withoutStrings.endswith('{') and withoutStrings.count('{') > withoutStrings.count('}'):
+            opens = True
+            rest = rest[:rest.rindex('{')].rstrip()
+        elif '{' in withoutStrings:
+            # A whole block on one line, such as .for (var i=0; i<8; i++) { nop }
+            return closes, labels, 'unsupported', None, rest, False
+
+        if not rest:
+            return closes, labels, None, None, '', opens
+        kind, name, operand = cls.parseKind(rest)
+        return closes, labels, kind, name, operand, opens
+
+    @classmethod
+    def parseKind(cls, text):
+        """Returns (kind, name, operand) of a statement"""
+        importMatch = IMPORT_PATTERN.match(text)
+        if importMatch:
+            return 'import', None, importMatch.group(1)
+        if text.startswith('#importonce'):
+            return 'importonce', None, ''
+        if text.startswith('#'):
+            # Other preprocessor directives, the conditions are not evaluated
+            return None, None, ''
+
+        origin = ORIGIN_PATTERN.match(text)
+        if origin:
+            return 'origin', origin.group(2), (origin.group(1), bool(origin.group(3)))
+        call = CALL_PATTERN.match(text)
+        if call and call.group(1).lower() not in OPCODES:
+            return 'unsupported', None, text
+
+        statement = STATEMENT_PATTERN.match(text)
+        if not statement:
+            return 'unsupported', None, text
+        name, operand = statement.groups()
+        if name.startswith('.'):
+            name = name.lower()
+            if name in ('.const', '.label', '.var'):
+                assignment = ASSIGNMENT_PATTERN.match(operand)
+                if not assignment:
+                    return 'unsupported', None, text
+                return ('variable' if name == '.var' else 'constant'), assignment.group(1), assignment.group(2)
+            return 'directive', name, operand
+        if name == 'else':
+            return 'directive', 'else', operand
+        return 'instruction', name, operand
+
+class KickAssQuickAssembler():
+    """
+    A fast, in-process pre-assembler for a subset of KickAssembler: the 6502
+    instructions with the undocumented opcodes, labels and multi labels,
+    .byte/.word/.fill and the like, origins and segments, constants and
+    simple expressions. Reports undefined symbols, illegal addressing modes,
+    values out of range and branches out of range, and the size of each
+    segment, without starting the JVM. The full build stays the source of
+    truth: macro calls, loops and conditions are not assembled, and addresses
+    after them are unknown and not checked.
+    """
+    __decodedInstructions = {}
+    __compiledExpressions = {}
+    MAX_DECODED_INSTRUCTIONS = 20000
+
+    def __init__(self, libDirs=None):
+        self.__libDirs = libDirs or []
+
+    @classmethod
+    def getLibDirs(cls, arguments, workingDir):
+        """The -libdir folders in the arguments, relative to workingDir"""
+        return [os.path.join(workingDir, os.path.expanduser(m.group(1) or m.group(2))) for m in LIBDIR_PATTERN.finditer(arguments or "")]
+
+    def assemble(self, path, text=None):
+        """Assembles the file at path, text is its contents if it is not read from disk"""
+        self.__statements = []
+        self.__messages = []
+        self.__knownNames = set(PREDEFINED_UNKNOWN)
+        self.__calls = set()
+        self.__multiLabels = {}
+        self.__importedOnce = set()
+        self.__complete = True
+        self.__missingImports = False
+        self.readFile(os.path.normpath(path), text, [])
+
+        # Values of the first pass are kept for the forward references of the second
+        self.__symbols = dict(PREDEFINED)
+        self.__multiAddresses = {}
+        self.__modes = {}
+        self.runPass(final=False)
+        self.__lines = []
+        self.__blocks = []
+        self.runPass(final=True)
+        return QuickAssembly(self.__messages, self.__blocks, self.__lines, self.__symbols, self.__complete)
+
+    def error(self, statement, text):
+        self.__messages.append(BuildMessage('error', statement.file, statement.line, statement.column, text))
+
+    def readFile(self, path, text, importStack):
+        sourceFile = QuickSourceFile.get(path, text)
+        if sourceFile is None:
+            self.__missingImports = True
+            self.__complete = False
+            return
+        if sourceFile.ImportOnce:
+            self.__importedOnce.add(path)
+        self.__knownNames.update(sourceFile.Names)
+        self.__calls.update(sourceFile.Calls)
+        self.__complete = self.__complete and sourceFile.Complete
+        importStack = importStack + [path]
+        for statement in sourceFile.Statements:
+            if statement.kind == 'import':
+                self.importFile(path, statement.operand, importStack)
+            else:
+                self.appendStatement(statement)
+
+    def importFile(self, path, name, importStack):
+        for folder in [os.path.dirname(path)] + self.__libDirs:
+            candidate = os.path.normpath(os.path.join(folder, name))
+            if os.path.isfile(candidate):
+                # Imports of a file that imports itself, and of #importonce files, are skipped
+                if candidate not in importStack and candidate not in self.__importedOnce:
+                    self.readFile(candidate, None, importStack)
+                return
+        self.__missingImports = True
+        self.__complete = False
+
+    def appendStatement(self, statement):
+        for label in statement.labels:
+            if label.startswith('!'):
+                self.__multiLabels.setdefault(label[1:], []).append(len(self.__statements))
+        self.__statements.append(statement)
+
+    def runPass(self, final):
+        self.__final = final
+        self.__segments = {DEFAULT_SEGMENT: DEFAULT_ORIGIN}
+        self.__segment = DEFAULT_SEGMENT
+        self.__pc = DEFAULT_ORIGIN
+        self.__block = None
+        self.__blockName = None
+        self.__virtual = False
+        for index, statement in enumerate(self.__statements):
+            self.__index = index
+            for label in statement.labels:
+                if label.startswith('!'):
+                    self.__multiAddresses[index] = self.__pc
+                else:
+                    self.__symbols[label] = self.__pc
+            if statement.kind == 'instruction':
+                self.assembleInstruction(statement)
+            elif statement.kind == 'directive':
+                self.assembleDirective(statement)
+            elif statement.kind == 'origin':
+                self.setOrigin(statement)
+            elif statement.kind == 'constant':
+                self.__symbols[statement.name] = self.evaluate(statement, statement.operand)
+            elif statement.kind == 'variable':
+                self.__symbols[statement.name] = None
+            elif statement.kind == 'unsupported':
+                self.__pc = None
+                self.__complete = False
+        self.closeMemoryBlock()
+
+    def setOrigin(self, statement):
+        expression, virtual = statement.operand
+        self.closeMemoryBlock()
+        self.__pc = self.evaluate(statement, expression)
+        self.__blockName = statement.name
+        self.__virtual = virtual
+
+    def closeMemoryBlock(self):
+        if self.__final and self.__block and not self.__virtual:
+            self.__blocks.append(MemoryBlock(*self.__block))
+        self.__block = None
+        self.__blockName = None
+
+    def emit(self, statement, mode, data, operand=None):
+        """Adds the bytes of a statement at the current address"""
+        if self.__pc is None:
+            return
+        if self.__final:
+            if self.__pc + len(data) > 0x10000:
+                self.error(statement, "Code beyond $FFFF")
+            self.__lines.append(AssembledLine(statement.file, statement.line, self.__pc, mode, bytes(data), operand))
+            if data:
+                if self.__block is None or self.__block[2] + 1 != self.__pc:
+                    name = self.__blockName or "Unnamed"
+                    self.closeMemoryBlock()
+                    self.__blockName = name
+                    self.__block = [self.__segment, self.__pc, self.__pc, name]
+                self.__block[2] = self.__pc + len(data) - 1
+        self.__pc += len(data)
+
+    def resolve(self, name):
+        value = self.__symbols.get(name)
+        if value is not None:
+            return value
+        if name in self.__symbols or name in self.__knownNames or '.' in name or self.__missingImports:
+            raise UnknownValue(name)
+        raise UndefinedSymbol(name)
+
+    def replaceMultiLabel(self, match):
+        name, direction = match.group(1) or '', match.group(2)
+        indexes = self.__multiLabels.get(name, [])
+        if direction[0] == '+':
+            candidates = [i for i in indexes if i > self.__index]
+        else:
+            candidates = [i for i in reversed(indexes) if i <= self.__index]
+        if len(candidates) < len(direction):
+            raise UndefinedSymbol('!' + name + direction)
+        address = self.__multiAddresses.get(candidates[len(direction) - 1])
+        if address is None:
+            raise UnknownValue(name)
+        return '$%x' % address
+
+    @classmethod
+    def compileExpression(cls, text):
+        """
+        Returns (kind, value) of an expression: a literal value, a single name,
+        the tokens of other expressions, multilabel for expressions with multi
+        label references, and unknown for what the quick assembler can not
+        evaluate
+        """
+        compiled = cls.__compiledExpressions.get(text)
+        if compiled is None:
+            if '!' in text:
+                compiled = ('multilabel', text)
+            else:
+                try:
+                    tokens = tokenize(text)
+                    compiled = ('tokens', tokens)
+                    if len(tokens) == 1 and tokens[0][0] == 'name':
+                        compiled = ('name', tokens[0][1])
+                    elif all(kind != 'name' for kind, _ in tokens):
+                        compiled = ('value', ExpressionParser(tokens).parse())
+                    # Function calls, such as sin(x) or list.get(0), are left to the full build
+                    elif any(kind == 'name' and next == ('operator', '(') for (kind, _), next in zip(tokens, tokens[1:])):
+                        compiled = ('unknown', None)
+                except ExpressionError:
+                    compiled = ('unknown', None)
+            if len(cls.__compiledExpressions) >= cls.MAX_DECODED_INSTRUCTIONS:
+                cls.__compiledExpressions.clear()
+            cls.__compiledExpressions[text] = compiled
+        return compiled
+
+    def evaluate(self, statement, text):
+        """Returns the value of the expression, None if it is not known"""
+        kind, value = self.compileExpression(text)
+        try:
+            if kind == 'value':
+                return value
+            if kind == 'name':
+                return self.resolve(value)
+            if kind == 'multilabel':
+                return self.evaluate(statement, MULTILABEL_REFERENCE_PATTERN.sub(self.replaceMultiLabel, value))
+            if kind == 'tokens':
+                return ExpressionParser(value, self.resolve).parse()
+            return None
+        except UnknownValue:
+            return None
+        except UndefinedSymbol as ex:
+            if self.__final:
+                self.error(statement, "Unknown symbol '%s'" % ex.args[0])
+            return None
+        except ExpressionError:
+            return None
+
+    @classmethod
+    def decodeInstruction(cls, name, operand):
+        """Returns (mnemonic, mode, expression, forced mode) of an instruction, None for unknown mnemonics"""
+        key = (name, operand)
+        if key not in cls.__decodedInstructions:
+            mnemonic, _, extension = name.lower().partition('.')
+            decoded = None
+            if mnemonic in OPCODES:
+                mode, expression = cls.getMode(mnemonic, operand.strip())
+                decoded = (mnemonic, mode, expression, MODE_EXTENSIONS.get(extension))
+            if len(cls.__decodedInstructions) >= cls.MAX_DECODED_INSTRUCTIONS:
+                cls.__decodedInstructions.clear()
+            cls.__decodedInstructions[key] = decoded
+        return cls.__decodedInstructions[key]
+
+    @classmethod
+    def getMode(cls, mnemonic, operand):
+        """Returns (mode, expression) of the operand"""
+        modes = OPCODES[mnemonic]
+        if not operand:
+            return 'imp', None
+        if operand in ('a', 'A') and mnemonic in ACCUMULATOR_MNEMONICS:
+            # asl a, the accumulator written out
+            return 'imp', None
+        if 'rel' in modes:
+            return 'rel', operand
+        for pattern, mode in OPERAND_PATTERNS:
+            match = pattern.match(operand)
+            if not match:
+                continue
+            expression = match.group(1)
+            if mode == 'izy' and not cls.isParenthesized('(%s)' % expression):
+                # Such as ($10)+($20),y
+                continue
+            if mode == 'ind' and ('ind' not in modes or not cls.isParenthesized(expression)):
+                # Parentheses around an operand of other instructions than jmp are an expression
+                mode = 'abs'
+            elif mode == 'abx' and cls.isParenthesized(expression):
+                mode = ILLEGAL_MODE
+            return mode, expression
+
+    @classmethod
+    def isParenthesized(cls, expression):
+        """True when the parenthesis opening the expression closes at its end"""
+        expression = expression.strip()
+        if not expression.startswith('('):
+            return False
+        depth = 0
+        for index, char in enumerate(expression):
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    return index == len(expression) - 1
+        return False
+
+    def assembleInstruction(self, statement):
+        decoded = self.decodeInstruction(statement.name, statement.operand)
+        if decoded is None:
+            if statement.name in self.__calls or self.__missingImports:
+                # A pseudocommand
+                self.__pc = None
+                self.__complete = False
+            elif self.__final:
+                self.error(statement, "Unknown mnemonic '%s'" % statement.name)
+            return
+        mnemonic, mode, expression, forced = decoded
+        modes = OPCODES[mnemonic]
+        if not self.__final and mode not in ZEROPAGE_MODES:
+            # The first pass only needs the size
+            if self.__pc is not None:
+                self.__pc += MODE_SIZES[mode]
+            return
+        value = self.evaluate(statement, expression) if expression is not None else None
+
+        if mode in ZEROPAGE_MODES:
+            mode = self.selectSize(mode, value, modes, forced)
+        if mode not in modes:
+            if self.__final:
+                self.error(statement, "Illegal addressing mode for %s" % mnemonic)
+            self.emit(statement, None, [0] * MODE_SIZES.get(mode, 1))
+            return
+
+        data = [modes[mode]]
+        if mode == 'rel':
+            data.append(self.getBranchOffset(statement, value) & 0xff)
+        elif mode in ('abs', 'abx', 'aby', 'ind'):
+            self.checkRange(statement, value, 0, 0xffff)
+            data.extend([(value or 0) & 0xff, (value or 0) >> 8 & 0xff])
+        elif mode != 'imp':
+            self.checkRange(statement, value, -128 if mode == 'imm' else 0, 0xff)
+            data.append((value or 0) & 0xff)
+        self.emit(statement, mode, data, value)
+
+    def selectSize(self, mode, value, modes, forced):
+        """Chooses between an absolute mode and its zeropage variant, once in the first pass"""
+        if self.__final and self.__index in self.__modes:
+            return self.__modes[self.__index]
+        zeropage = ZEROPAGE_MODES[mode]
+        if forced == 'zp' or (forced is None and value is not None and 0 <= value <= 0xff) or mode not in modes:
+            mode = zeropage if zeropage in modes else mode
+        self.__modes[self.__index] = mode
+        return mode
+
+    def getBranchOffset(self, statement, target):
+        if target is None or self.__pc is None:
+            return 0
+        offset = target - (self.__pc + 2)
+        if self.__final and not -128 <= offset <= 127:
+            self.error(statement, "Branch out of range: %+d bytes" % offset)
+        return offset
+
+    def checkRange(self, statement, value, minimum, maximum):
+        if self.__final and value is not None and not minimum <= value <= maximum:
+            self.error(statement, "Value out of range: %d" % value)
+
+    def assembleDirective(self, statement):
+        name, operand = statement.name, statement.operand.strip()
+        if name in DATA_SIZES:
+            size = DATA_SIZES[name]
+            data = []
+            for expression in self.splitArguments(operand):
+                value = self.evaluate(statement, expression)
+                self.checkRange(statement, value, -(1 << (8 * size - 1)), (1 << (8 * size)) - 1)
+                data.extend(((value or 0) >> (8 * n)) & 0xff for n in range(size))
+            self.emit(statement, None, data)
+        elif name in ('.fill', '.fillword', '.lohifill'):
+            arguments = self.splitArguments(operand)
+            count = self.evaluate(statement, arguments[0]) if arguments else None
+            if count is None or count < 0:
+                self.__pc = None
+                self.__complete = False
+                return
+            # The value may depend on the index i, it is only known for constants
+            value = self.evaluate(statement, arguments[1]) if len(arguments) > 1 and not re.search(r'\bi\b', arguments[1]) else None
+            size = 1 if name == '.fill' else 2
+            self.emit(statement, None, [(value or 0) >> (8 * (n % size)) & 0xff for n in range(count * size)])
+        elif name in ('.text', '.te'):
+            text = STRING_PATTERN.match(operand)
+            if not text or text.end() != len(operand):
+                self.__pc = None
+                self.__complete = False
+                return
+            self.emit(statement, None, [ord(c) & 0xff for c in re.sub(r'\\(.)', r'\1', text.group(0)[1:-1])])
+        elif name == '.align':
+            alignment = self.evaluate(statement, operand)
+            if alignment and self.__pc is not None:
+                self.emit(statement, None, [0] * (-self.__pc % alignment))
+        elif name == '.segmentdef':
+            segment = SEGMENT_PATTERN.match(operand)
+            if segment and segment.group(1) not in self.__segments:
+                start = SEGMENT_START_PATTERN.search(segment.group(2) or '')
+                self.__segments[segment.group(1)] = self.evaluate(statement, start.group(1)) if start else None
+        elif name == '.segment':
+            segment = SEGMENT_PATTERN.match(operand)
+            if segment:
+                self.__segments[self.__segment] = self.__pc
+                self.closeMemoryBlock()
+                self.__segment = segment.group(1)
+                start = SEGMENT_START_PATTERN.search(segment.group(2) or '')
+                if start and self.__segment not in self.__segments:
+                    self.__segments[self.__segment] = self.evaluate(statement, start.group(1))
+                self.__pc = self.__segments.get(self.__segment)
+        elif name == '.memblock':
+            memblock = STRING_PATTERN.match(operand)
+            self.closeMemoryBlock()
+            self.__blockName = memblock.group(0)[1:-1] if memblock else None
+        elif name not in NO_CODE_DIRECTIVES:
+            self.__pc = None
+            self.__complete = False
+
+    def splitArguments(self, operand):
+        """Splits at commas outside of parentheses and strings"""
+        arguments = []
+        depth = 0
+        start = 0
+        inString = False
+        for position, char in enumerate(operand):
+            if char == '"':
+                inString = not inString
+            elif inString:
+                continue
+            elif char in '([':
+                depth += 1
+            elif char in ')]':
+                depth -= 1
+            elif char == ',' and depth == 0:
+                arguments.append(operand[start:position].strip())
+                start = position + 1
+        if operand[start:].strip():
+            arguments.append(operand[start:].strip())
+        return arguments
+
+class KickassQuickCheckListener(sublime_plugin.EventListener):
+    """
+    Assembles a source file with the quick assembler when it is saved, and
+    marks the errors in the open files. Enabled with kickass_quick_check.
+    """
+    REGION_KEY = 'kickass_quick_check'
+
+    def on_post_save_async(self, view):
+        fileName = view.file_name()
+        if not fileName or not view.match_selector(0, 'source.assembly.kickassembler'):
+            return
+        settings = KickAssSettings.forView(view)
+        if not settings.getBool("kickass_quick_check"):
+            return
+        arguments = " ".join([settings.get("kickass_compile_args", ""), settings.get("kickass_args", "")])
+        assembler = KickAssQuickAssembler(KickAssQuickAssembler.getLibDirs(arguments, os.path.dirname(fileName)))
+        with KickAssProfiler.phase("quick check"):
+            assembly = assembler.assemble(fileName, view.substr(sublime.Region(0, view.size())))
+        self.showErrors(view, assembly)
+        sublime.status_message(self.getStatus(assembly))
+
+    def showErrors(self, view, assembly):
+        views = dict((v.file_name(), v) for v in view.window().views() if v.file_name()) if view.window() else {}
+        views[view.file_name()] = view
+        for fileName, fileView in views.items():
+            errors = [m for m in assembly.Errors if m.file == os.path.normpath(fileName)]
+            regions = [fileView.line(fileView.text_point(m.line - 1, m.column - 1)) for m in errors]
+            fileView.add_regions(self.REGION_KEY, regions, 'region.redish', 'circle',
+                                 sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE)
+
+    def getStatus(self, assembly):
+        errors = assembly.Errors
+        if errors:
+            return "Quick check: %d error%s, %s line %d: %s" % (len(errors), "" if len(errors) == 1 else "s",
+                                                               os.path.basename(errors[0].file), errors[0].line, errors[0].text)
+        sizes = ", ".join("%s-segment %d bytes" % (segment, size) for segment, size in assembly.getSegmentSizes().items())
+        return "Quick check: no errors%s%s" % (", " + sizes if sizes else "", "" if assembly.Complete else " (partly checked)")
@@ -0,0 +1,105 @@
+import os
+import threading
+
+import sublime
+import sublime_plugin
+
+class KickAssSettings():
+    """
+    Resolved settings of a view, view settings over project settings. Snapshots
+    are cached per window and view, and dropped when the view settings, the
+    preferences or the project change, so that repeated lookups do not go
+    through the settings API. Shared by the build, tooltips and indexers.
+    """
+    __snapshots = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def forView(cls, view, window=None):
+        window = window or view.window()
+        key = (window.id() if window else None, view.id())
+        with cls.__lock:
+            snapshot = cls.__snapshots.get(key)
+            if snapshot is None:
+                snapshot = cls(view.settings(), window.project_data() if window else None)
+                cls.__snapshots[key] = snapshot
+                cls.watch(view.settings(), lambda: cls.invalidate(key))
+            return snapshot
+
+    @classmethod
+    def watch(cls, settings, callback):
+        try:
+            settings.clear_on_change('kickass_settings')
+            settings.add_on_change('kickass_settings', callback)
+        except AttributeError:
+            # Plain dicts in tests
+            pass
+
+    @classmethod
+    def watchPreferences(cls):
+        preferences = sublime.load_settings('Preferences.sublime-settings')
+        preferences.clear_on_change('kickass_settings')
+        preferences.add_on_change('kickass_settings', cls.invalidateAll)
+
+    @classmethod
+    def invalidate(cls, key):
+        with cls.__lock:
+            cls.__snapshots.pop(key, None)
+
+    @classmethod
+    def invalidateView(cls, viewId):
+        with cls.__lock:
+            for key in [k for k in cls.__snapshots if k[1] == viewId]:
+                del cls.__snapshots[key]
+
+    @classmethod
+    def invalidateAll(cls):
+        with cls.__lock:
+            cls.__snapshots.clear()
+
+    def __init__(self, viewSettings, projectData):
+        self.__viewSettings = viewSettings
+        self.__projectSettings = (projectData or {}).get('settings', {})
+        self.__values = {}
+
+    def get(self, settingKey, default=None):
+        if settingKey not in self.__values:
+            self.__values[settingKey] = self.__viewSettings.get(settingKey, self.__projectSettings.get(settingKey, None))
+        value = self.__values[settingKey]
+        return default if value is None else value
+
+    def getBool(self, settingKey):
+        """Accepts JSON booleans and the "true"/"false" strings used by the default settings"""
+        value = self.get(settingKey)
+        if isinstance(value, bool):
+            return value
+        return isinstance(value, str) and value.strip().lower() == "true"
+
+    def getPath(self, settingKey):
+        value = self.get(settingKey)
+        return os.path.expanduser(value) if value else ""
+
+    def getList(self, settingKey):
+        value = self.get(settingKey)
+        if not value:
+            return []
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+
+class KickAssSettingsListener(sublime_plugin.EventListener):
+    """Drops cached settings when a project file is saved or a view is closed"""
+
+    def on_post_save_async(self, view):
+        if (view.file_name() or "").endswith(".sublime-project"):
+            KickAssSettings.invalidateAll()
+
+    def on_load_project_async(self, window):
+        KickAssSettings.invalidateAll()
+
+    def on_post_save_project_async(self, window):
+        KickAssSettings.invalidateAll()
+
+    def on_close(self, view):
+        KickAssSettings.invalidateView(view.id())
+
+def plugin_loaded():
+    KickAssSettings.watchPreferences()
@@ -0,0 +1,393 @@
+"""
+Project wide index of KickAssembler symbols (labels, macros, functions,
+pseudocommands, namespaces, constants and variables), their references and
+#import edges.
+The index is stored per folder in the Sublime Text cache folder, and only
+files whose mtime/size and content hash changed are parsed again.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import sublime
+import sublime_plugin
+
+from .kickass_build_cache import SOURCE_IMPORT_PATTERNS
+
+SOURCE_EXTENSIONS = ('.asm', '.s', '.inc', '.a', '.lib')
+INDEX_VERSION = 2
+RESCAN_INTERVAL = 30
+
+SYMBOL_PATTERNS = [
+    ('label', re.compile(r'^\s*([A-Za-z_]\w*)\s*:(?!:)')),
+    ('label', re.compile(r'^\s*\.label\s+@?([A-Za-z_]\w*)\s*=')),
+    ('macro', re.compile(r'^\s*\.macro\s+@?([A-Za-z_]\w*)')),
+    ('function', re.compile(r'^\s*\.function\s+@?([A-Za-z_]\w*)')),
+    ('pseudocommand', re.compile(r'^\s*\.pseudocommand\s+@?([A-Za-z_]\w*)')),
+    ('namespace', re.compile(r'^\s*\.(?:file)?namespace\s+([A-Za-z_]\w*)')),
+    ('const', re.compile(r'^\s*\.const\s+@?([A-Za-z_]\w*)\s*=')),
+    ('var', re.compile(r'^\s*\.var\s+@?([A-Za-z_]\w*)\s*=')),
+    ]
+
+REFERENCE_PATTERN = re.compile(r'(?<![\w.$%])([A-Za-z_]\w*)')
+
+SYMBOL_TOOLTIP = """<style>%(css)s</style>
+<b><u>%(title)s</u></b><br>
+<b>%(kind)s</b><br>
+%(location)s"""
+
+
+def code_lines(text):
+    """
+    Yield (line number, line) of the source text with comments removed,
+    skipping empty lines
+    """
+    in_comment = False
+    for line_number, line in enumerate(text.splitlines()):
+        if in_comment:
+            end = line.find('*/')
+            if end < 0:
+                continue
+            line = ' ' * (end + 2) + line[end + 2:]
+            in_comment = False
+        start = line.find('/*')
+        if start >= 0 and line.find('*/', start) < 0:
+            line = line[:start]
+            in_comment = True
+        comment = line.find('//')
+        if comment >= 0 and '"' not in line[:comment]:
+            line = line[:comment]
+        if not line.strip():
+            continue
+        yield line_number, line
+
+
+def parse_symbols(text):
+    """
+    Return (symbols, imports) of the source text, where symbols is a list of
+    [name, kind, line, column] with zero based line and column
+    """
+    symbols = []
+    imports = []
+    for line_number, line in code_lines(text):
+        for kind, pattern in SYMBOL_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                symbols.append([match.group(1), kind, line_number,
+                                match.start(1)])
+        for pattern in SOURCE_IMPORT_PATTERNS:
+            imports.extend(match.group(1) for match in pattern.finditer(line))
+    return symbols, imports
+
+
+def parse_references(text):
+    """
+    Return dict of name -> list of [line, column] of all identifiers in the
+    source text, with zero based line and column
+    """
+    references = {}
+    for line_number, line in code_lines(text):
+        for match in REFERENCE_PATTERN.finditer(line):
+            references.setdefault(match.group(1), []).append(
+                [line_number, match.start(1)])
+    return references
+
+
+class SymbolIndex:
+    """
+    Symbol index of all KickAssembler source files in a folder
+    """
+
+    def __init__(self, folder, index_file):
+        self.folder = folder
+        self.index_file = index_file
+        self.files = {}
+        self.definitions = {}
+        self.references = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def load(self):
+        """Load the index stored by a previous session"""
+        try:
+            with open(self.index_file, encoding='utf8') as fileobject:
+                data = json.load(fileobject)
+        except (EnvironmentError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION and \
+                data.get('folder') == self.folder:
+            with self._lock:
+                self.files = data['files']
+                self._rebuild_definitions()
+
+    def save(self):
+        """Store the index, if it has changed since it was loaded/saved"""
+        if not self._dirty:
+            return
+        with self._lock:
+            data = {'version': INDEX_VERSION, 'folder': self.folder,
+                    'files': self.files}
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as fileobject:
+            json.dump(data, fileobject)
+        os.replace(tmp_file, self.index_file)
+
+    def source_files(self):
+        """Return all source files in the folder"""
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for fname in files:
+                if fname.lower().endswith(SOURCE_EXTENSIONS):
+                    yield os.path.join(root, fname)
+
+    def update(self, paths=None):
+        """
+        Update the index for the given files, or for the whole folder. Only
+        changed files are parsed. Return the number of parsed files.
+        """
+        full_update = paths is None
+        if full_update:
+            paths = list(self.source_files())
+
+        parsed = 0
+        changes = {}
+        for path in paths:
+            entry = self._scan_file(path, self.files.get(path))
+            if entry is not self.files.get(path):
+                changes[path] = entry
+                parsed += 1 if entry and entry.get('parsed') else 0
+
+        removed = []
+        if full_update:
+            existing = set(paths)
+            removed = [path for path in self.files if path not in existing]
+
+        if changes or removed:
+            with self._lock:
+                for path, entry in changes.items():
+                    if entry is None:
+                        self.files.pop(path, None)
+                    else:
+                        entry.pop('parsed', None)
+                        self.files[path] = entry
+                for path in removed:
+                    del self.files[path]
+                self._rebuild_definitions()
+                self._dirty = True
+        logging.debug('Symbol index %s: %d files, %d parsed', self.folder,
+                      len(self.files), parsed)
+        return parsed
+
+    def _scan_file(self, path, entry):
+        try:
+            stat = os.stat(path)
+        except EnvironmentError:
+            return None
+        if entry and entry['mtime'] == stat.st_mtime and \
+                entry['size'] == stat.st_size:
+            return entry
+        try:
+            with open(path, 'rb') as fileobject:
+                content = fileobject.read()
+        except EnvironmentError:
+            return None
+        content_hash = hashlib.sha1(content).hexdigest()
+        if entry and entry['hash'] == content_hash:
+            updated = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+            return updated
+        text = content.decode('utf8', 'replace')
+        symbols, imports = parse_symbols(text)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size,
+                'hash': content_hash, 'symbols': symbols,
+                'imports': imports, 'references': parse_references(text),
+                'parsed': True}
+
+    def _rebuild_definitions(self):
+        definitions = {}
+        references = {}
+        for path, entry in self.files.items():
+            for name, kind, line, column in entry['symbols']:
+                definitions.setdefault(name, []).append(
+                    (path, line, column, kind))
+            for name, locations in entry['references'].items():
+                references.setdefault(name, []).extend(
+                    (path, line, column) for line, column in locations)
+        self.definitions = definitions
+        self.references = references
+
+    def find_definitions(self, name):
+        """Return list of (path, line, column, kind) defining name"""
+        return list(self.definitions.get(name, []))
+
+    def importers_of(self, path):
+        """Return files that #import the given file"""
+        fname = os.path.basename(path)
+        return [importer for importer, entry in self.files.items()
+                if any(os.path.basename(i) == fname
+                       for i in entry['imports'])]
+
+    def find_references(self, name):
+        """
+        Return list of (path, line, column, line text) of all occurrences of
+        name in the indexed files. Only the files referencing name are read,
+        for the line texts.
+        """
+        references = []
+        lines = {}
+        for path, line, column in sorted(self.references.get(name, [])):
+            if path not in lines:
+                try:
+                    with open(path, encoding='utf8',
+                              errors='replace') as fileobject:
+                        lines[path] = fileobject.read().splitlines()
+                except EnvironmentError:
+                    lines[path] = []
+            text = lines[path][line].strip() if line < len(lines[path]) else ''
+            references.append((path, line, column, text))
+        return references
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(folder):
+    """Return the symbol index of folder, loading the stored index once"""
+    with _indexes_lock:
+        index = _indexes.get(folder)
+        if index is None:
+            index_file = os.path.join(
+                sublime.cache_path(), 'KickassSymbols',
+                hashlib.sha1(folder.encode('utf8')).hexdigest() + '.json')
+            index = SymbolIndex(folder, index_file)
+            index.load()
+            _indexes[folder] = index
+        return index
+
+
+def indexes_for_window(window):
+    return [get_index(folder) for folder in (window.folders() if window else [])]
+
+
+def find_definitions(window, name):
+    """Definitions of name in all folders of the window"""
+    return [definition for index in indexes_for_window(window)
+            for definition in index.find_definitions(name)]
+
+
+def is_in_folder(path, folder):
+    """True when path is in folder or one of its subfolders"""
+    return path.startswith(os.path.join(folder, ''))
+
+
+def update_window_async(window, paths=None):
+    """Update the indexes of the window's folders in the background"""
+    indexes = indexes_for_window(window)
+
+    def update():
+        for index in indexes:
+            index_paths = None if paths is None else [
+                p for p in paths if is_in_folder(p, index.folder)]
+            if index_paths == []:
+                continue
+            index.update(index_paths)
+            index.save()
+    sublime.set_timeout_async(update, 0)
+
+
+def render_symbol_tooltip(window, name, css):
+    """Return popup html for a user defined symbol, None if not defined"""
+    definitions = find_definitions(window, name)
+    if not definitions:
+        return None
+    path, line, _, kind = definitions[0]
+    location = '%s:%d' % (os.path.basename(path), line + 1)
+    if len(definitions) > 1:
+        location += ' (+%d more)' % (len(definitions) - 1)
+    return SYMBOL_TOOLTIP % {'css': css, 'title': name, 'kind': kind,
+                             'location': location}
+
+
+def open_location(window, path, line, column):
+    window.open_file('%s:%d:%d' % (path, line + 1, column + 1),
+                     sublime.ENCODED_POSITION)
+
+
+def show_locations(window, locations, describe):
+    """Go to the only location, or let the user pick one"""
+    if len(locations) == 1:
+        open_location(window, *locations[0][:3])
+        return
+    items = [describe(location) for location in locations]
+    window.show_quick_panel(
+        items, lambda i: i >= 0 and open_location(window, *locations[i][:3]))
+
+
+class KickassGotoDefinitionCommand(sublime_plugin.TextCommand):
+    """Go to the definition of the symbol under the caret"""
+
+    def run(self, edit):
+        name = self.view.substr(self.view.word(self.view.sel()[0].begin()))
+        window = self.view.window()
+        definitions = find_definitions(window, name)
+        if not definitions:
+            sublime.status_message('No definition found for %s' % name)
+            return
+        show_locations(window, definitions, lambda d: [
+            '%s (%s)' % (name, d[3]),
+            '%s:%d' % (os.path.basename(d[0]), d[1] + 1)])
+
+    def is_enabled(self):
+        return self.view.match_selector(0, 'source.assembly.kickassembler')
+
+
+class KickassFindReferencesCommand(sublime_plugin.TextCommand):
+    """List all references of the symbol under the caret"""
+
+    def run(self, edit):
+        name = self.view.substr(self.view.word(self.view.sel()[0].begin()))
+        window = self.view.window()
+
+        def find():
+            references = [reference for index in indexes_for_window(window)
+                          for reference in index.find_references(name)]
+            if not references:
+                sublime.status_message('No references found for %s' % name)
+                return
+            sublime.set_timeout(lambda: show_locations(
+                window, references, lambda r: [
+                    r[3], '%s:%d' % (os.path.basename(r[0]), r[1] + 1)]), 0)
+        sublime.set_timeout_async(find, 0)
+
+    def is_enabled(self):
+        return self.view.match_selector(0, 'source.assembly.kickassembler')
+
+
+class KickassSymbolIndexListener(sublime_plugin.EventListener):
+    """
+    Keep the symbol indexes of open folders up to date. The folders of a
+    window are scanned again when a view is activated, at most every
+    RESCAN_INTERVAL seconds, which also drops files deleted meanwhile.
+    """
+
+    def on_activated_async(self, view):
+        window = view.window()
+        if window is None or \
+                time.time() - _updated_windows.get(window.id(), 0) < RESCAN_INTERVAL:
+            return
+        _updated_windows[window.id()] = time.time()
+        update_window_async(window)
+
+    def on_post_save_async(self, view):
+        if view.file_name() and \
+                view.file_name().lower().endswith(SOURCE_EXTENSIONS):
+            update_window_async(view.window(), [view.file_name()])
+
+
+_updated_windows = {}
@@ -0,0 +1,310 @@
+"""
+Rendering of the number tooltips of KickassTooltips. Number literals ($d020,
+%0101, 53280), the low/high byte operators (<, >) and simple constant
+expressions are evaluated from the text under the mouse pointer, and rendered
+popups are kept in a bounded LRU cache keyed by the kind and value of the
+literal, with the CSS file inlined.
+"""
+import html
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import sublime
+
+NUMBER_TOOLTIP = """<style>{css}</style>
+{title}{bits}<b>{value}</b><br>{note}"""
+
+BITS = """<b>${0:0{1}X}</b><br>
+<b>%{0:0{2}b}</b><br>
+"""
+
+TITLE = """<b><u>{0}</u></b><br>
+"""
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\$[0-9A-Fa-f]+)|(%[01]+)|(\d+)|'
+                           r'([A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)|'
+                           r'(<<|>>|[-+*/&|^()<>]))')
+
+# Binary operators by precedence, higher binds stronger
+BINARY_OPERATORS = {'|': 1, '^': 2, '&': 3, '<<': 4, '>>': 4,
+                    '+': 5, '-': 5, '*': 6, '/': 6}
+
+# Characters of the text around the mouse pointer an expression is taken from
+EXPRESSION_CHARACTERS = frozenset('$%<>()+-*/&|^#_.0123456789 \t'
+                                  'abcdefghijklmnopqrstuvwxyz'
+                                  'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+MAX_EXPRESSION_LENGTH = 80
+
+LITERAL_KINDS = ('hex', 'binary', 'decimal')
+
+# Immediate operands and data of directives are values, not addresses
+VALUE_OPERAND_PATTERN = re.compile(
+    r'^\s*(?:!?[A-Za-z_]\w*\s*:\s*)*(?:[A-Za-z]{3}(?:\.[A-Za-z]+)?\s*#|'
+    r'\.(?:byte|by|word|wo|dword|dw|text|fill|fillword|lohifill)\b)',
+    re.IGNORECASE)
+
+# Tokens of recently hovered texts, None for texts that can not be tokenized
+MAX_TOKENIZED_TEXTS = 1024
+_tokenized = {}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def tokenize(text):
+    """Return the tokens of text as a tuple of (kind, text) tuples"""
+    tokens = _tokenized.get(text)
+    if tokens is None and text not in _tokenized:
+        tokens = []
+        position = 0
+        stripped = text.rstrip()
+        while position < len(stripped):
+            match = TOKEN_PATTERN.match(stripped, position)
+            if not match:
+                tokens = None
+                break
+            kind = match.lastindex
+            tokens.append((('hex', 'binary', 'decimal', 'name', 'operator')[kind - 1],
+                           match.group(kind)))
+            position = match.end()
+        tokens = tuple(tokens) if tokens is not None else None
+        if len(_tokenized) >= MAX_TOKENIZED_TEXTS:
+            _tokenized.clear()
+        _tokenized[text] = tokens
+    if tokens is None:
+        raise ExpressionError('Unexpected character in: %s' % text)
+    return tokens
+
+
+class ExpressionParser:
+    """
+    Precedence climbing parser for constant expressions, evaluated while they
+    are parsed. Names are looked up with resolve, which returns None for
+    unknown names.
+    """
+
+    def __init__(self, tokens, resolve=None):
+        self.tokens = tokens
+        self.position = 0
+        self.resolve = resolve
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError('Empty expression')
+        value = self.parse_binary(1)
+        if self.position != len(self.tokens):
+            raise ExpressionError('Unexpected token: %s' % self.peek()[1])
+        return value
+
+    def parse_binary(self, precedence):
+        value = self.parse_unary()
+        while True:
+            kind, operator = self.peek()
+            if kind != 'operator' or BINARY_OPERATORS.get(operator, 0) < precedence:
+                return value
+            self.next()
+            value = self.apply(operator, value,
+                               self.parse_binary(BINARY_OPERATORS[operator] + 1))
+
+    def parse_unary(self):
+        kind, text = self.next()
+        if kind == 'operator' and text in ('<', '>', '-'):
+            value = self.parse_unary()
+            if text == '<':
+                return value & 0xff
+            if text == '>':
+                return (value >> 8) & 0xff
+            return -value
+        if kind == 'operator' and text == '(':
+            value = self.parse_binary(1)
+            if self.next() != ('operator', ')'):
+                raise ExpressionError('Missing )')
+            return value
+        if kind == 'hex':
+            return int(text[1:], 16)
+        if kind == 'binary':
+            return int(text[1:], 2)
+        if kind == 'decimal':
+            return int(text)
+        if kind == 'name':
+            value = self.resolve(text) if self.resolve else None
+            if value is None:
+                raise ExpressionError('Unknown name: %s' % text)
+            return value
+        raise ExpressionError('Unexpected token: %s' % text)
+
+    @staticmethod
+    def apply(operator, left, right):
+        if operator == '+':
+            return left + right
+        if operator == '-':
+            return left - right
+        if operator == '*':
+            return left * right
+        if operator == '/':
+            if right == 0 or left % right:
+                raise ExpressionError('Division without an integer result')
+            return left // right
+        if operator == '&':
+            return left & right
+        if operator == '|':
+            return left | right
+        if operator == '^':
+            return left ^ right
+        if right < 0:
+            raise ExpressionError('Negative shift')
+        return left << right if operator == '<<' else left >> right
+
+
+def evaluate(text, resolve=None):
+    """
+    Return (kind, value) of a literal or constant expression, where kind is
+    hex, binary or decimal for a single literal, name for a single name and
+    expression otherwise. Raise ExpressionError if it can not be evaluated.
+    """
+    text = text.strip()
+    if text.startswith('#'):
+        text = text[1:]
+    tokens = tokenize(text)
+    value = ExpressionParser(tokens, resolve).parse()
+    operands = [kind for kind, token in tokens if kind != 'operator' or
+                token not in '()']
+    if len(operands) == 1 and operands[0] in LITERAL_KINDS + ('name',):
+        return operands[0], value
+    return 'expression', value
+
+
+def find_expression(line, start, end, resolve=None):
+    """
+    Return (title, kind, value) of the number or constant expression in the
+    line that contains the columns start to end, None if there is none. The
+    title is the expression, None for single literals. Single names are not
+    reported, they are labels.
+    """
+    comment = line.find('//')
+    if 0 <= comment < end:
+        return None
+    if comment >= 0:
+        line = line[:comment]
+
+    left = start
+    while left > 0 and line[left - 1] in EXPRESSION_CHARACTERS:
+        left -= 1
+    right = end
+    while right < len(line) and line[right] in EXPRESSION_CHARACTERS:
+        right += 1
+    if right - left > MAX_EXPRESSION_LENGTH:
+        return None
+
+    # Mnemonics and directives before the expression, and text after it, are
+    # dropped word by word until what is left can be evaluated
+    words = [m.span() for m in re.finditer(r'\S+', line[left:right])]
+    starts = [left + s for s, _ in words if left + s <= start]
+    ends = [left + e for _, e in reversed(words) if left + e >= end]
+    for first in starts:
+        for last in ends:
+            text = line[first:last]
+            try:
+                kind, value = evaluate(text, resolve)
+            except ExpressionError:
+                continue
+            if kind == 'name':
+                return None
+            return (text.strip().lstrip('#') if kind == 'expression' else None,
+                    kind, value)
+    return None
+
+
+def is_value_operand(line, column):
+    """
+    Check, if the text at the column of the line is an immediate operand or
+    the data of a directive, such as .byte, rather than an address
+    """
+    match = VALUE_OPERAND_PATTERN.match(line)
+    return match is not None and match.end() <= column + 1
+
+
+def format_bits(value):
+    """
+    Return the hex and binary rows of value. Negative values are shown as
+    their 8 bit or 16 bit two's complement, values below -$8000 have no rows.
+    """
+    if value >= -0x80:
+        return BITS.format(value & 0xff if value < 0 else value, 2, 8)
+    if value >= -0x8000:
+        return BITS.format(value & 0xffff, 4, 16)
+    return ''
+
+
+def load_css(css_file):
+    """
+    Return the contents of the css file, given relative to the Packages
+    folder or as an absolute path. Relative files are read as a resource,
+    so that they are also found in a packed package.
+    """
+    if not css_file:
+        return ''
+    if not os.path.isabs(css_file):
+        try:
+            return sublime.load_resource(
+                'Packages/' + css_file.replace(os.sep, '/'))
+        except (IOError, OSError):
+            css_file = os.path.join(sublime.packages_path(), css_file)
+    try:
+        with open(css_file, encoding='utf8') as fileobject:
+            return fileobject.read()
+    except EnvironmentError:
+        logging.error('Cannot read css file: %s', css_file)
+        return ''
+
+
+class NumberTooltipRenderer:
+    """
+    Rendered number popups, least recently used entries are dropped when the
+    cache is full. Changing the css drops all entries.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.css = ''
+        self._popups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_css(self, css):
+        with self._lock:
+            if css != self.css:
+                self.css = css
+                self._popups.clear()
+
+    def render(self, kind, value, title=None, note=''):
+        key = (kind, value, title, note)
+        with self._lock:
+            popup = self._popups.get(key)
+            if popup is not None:
+                self._popups.move_to_end(key)
+                return popup
+            popup = NUMBER_TOOLTIP.format(
+                css=self.css, value=value, bits=format_bits(value),
+                title=TITLE.format(html.escape(title)) if title else '',
+                note=note)
+            self._popups[key] = popup
+            if len(self._popups) > self.max_entries:
+                self._popups.popitem(last=False)
+        return popup
+
+    def __len__(self):
+        return len(self._popups)
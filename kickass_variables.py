@@ -0,0 +1,117 @@
+import re
+
+import sublime
+
+# Same syntax as sublime.expand_variables: $name, ${name}, ${name:default} and \$ for a literal $
+TOKEN_PATTERN = re.compile(r'\\\$|\$(?:([A-Za-z0-9_]+)|\{([A-Za-z0-9_]+)(?::((?:[^{}]|\{[^{}]*\})*))?\}|(\{[A-Za-z0-9_]+/))')
+
+class KickAssVariableError(Exception):
+    pass
+
+class KickAssVariableExpander():
+    """
+    Expands ${var} references in build templates. Each template is parsed once
+    into a list of tokens (memoized, templates only change with the settings),
+    and expandable variables are resolved in dependency order, so nesting has no
+    fixed depth and cycles are reported instead of left unexpanded.
+
+    Variables that are not expandable are inserted as they are.
+    """
+    MAX_COMPILED_TEMPLATES = 1024
+    __compiledTemplates = {}
+
+    @classmethod
+    def compileTemplate(cls, template):
+        """
+        Returns the template as a list of tokens: strings for text and
+        (name, default tokens) tuples for variables. Returns None for templates
+        using regex replacements (${name/regex/format/}), which are left to
+        sublime.expand_variables.
+        """
+        tokens = cls.__compiledTemplates.get(template)
+        if tokens is not None or template in cls.__compiledTemplates:
+            return tokens
+
+        tokens = []
+        position = 0
+        for match in TOKEN_PATTERN.finditer(template):
+            if match.group(4):
+                tokens = None
+                break
+            if match.start() > position:
+                tokens.append(template[position:match.start()])
+            if match.group(0) == '\\$':
+                tokens.append('$')
+            else:
+                default = match.group(3)
+                defaultTokens = (cls.compileTemplate(default) or [default]) if default else None
+                tokens.append((match.group(1) or match.group(2), defaultTokens))
+            position = match.end()
+        if tokens is not None and position < len(template):
+            tokens.append(template[position:])
+
+        if len(cls.__compiledTemplates) >= cls.MAX_COMPILED_TEMPLATES:
+            cls.__compiledTemplates.clear()
+        cls.__compiledTemplates[template] = tokens
+        return tokens
+
+    def __init__(self, variables, expandable):
+        self.__variables = variables
+        self.__expandable = set(expandable)
+        self.__resolved = {}
+        self.__resolving = []
+
+    def resolve(self, name):
+        """Returns the value of the variable, expandable variables are expanded recursively"""
+        if name in self.__resolved:
+            return self.__resolved[name]
+        value = self.__variables.get(name)
+        if name in self.__expandable and isinstance(value, str):
+            if name in self.__resolving:
+                cycle = self.__resolving[self.__resolving.index(name):] + [name]
+                raise KickAssVariableError("Variables reference each other: %s" % " -> ".join(cycle))
+            self.__resolving.append(name)
+            try:
+                value = self.expandTemplate(value)
+            finally:
+                self.__resolving.pop()
+        self.__resolved[name] = value
+        return value
+
+    def resolveAll(self):
+        """Returns a copy of the variables, with the expandable variables expanded"""
+        variables = dict(self.__variables)
+        for name in self.__expandable:
+            # Variables being resolved keep their template, their expansion is in progress
+            if name in variables and name not in self.__resolving:
+                variables[name] = self.resolve(name)
+        return variables
+
+    def expandTemplate(self, template):
+        tokens = self.compileTemplate(template)
+        if tokens is None:
+            return sublime.expand_variables(template, self.resolveAll())
+        return self.expandTokens(tokens)
+
+    def expandTokens(self, tokens):
+        parts = []
+        for token in tokens:
+            if isinstance(token, str):
+                parts.append(token)
+                continue
+            name, default = token
+            value = self.resolve(name)
+            if value is None:
+                value = self.expandTokens(default) if default else ""
+            parts.append(value if isinstance(value, str) else str(value))
+        return "".join(parts)
+
+    def expand(self, value):
+        """Expands all strings in value, which may be a string, a list or a dict"""
+        if isinstance(value, str):
+            return self.expandTemplate(value)
+        if isinstance(value, dict):
+            return dict((k, self.expand(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return [self.expand(v) for v in value]
+        return value
@@ -0,0 +1,283 @@
+import contextlib
+import os
+import re
+import socket
+import struct
+import threading
+import time
+
+PROMPT_PATTERN = re.compile(br'\(C:\$[0-9a-fA-F]{4}\) $')
+CONNECT_RETRY_DELAY = 0.05
+
+# Monitor commands read from the .vs file and the breakpoint file
+LABEL_COMMAND_PATTERN = re.compile(r'^\s*(?:al|add_label)\s+(?:[a-zA-Z0-9]+:)?\$?([0-9a-fA-F]{1,4})\s+\.(\S+)')
+BREAK_COMMAND_PATTERN = re.compile(r'^\s*(?:break|bk)\s+(?:(?:load|store|exec)\s+)?(?:[a-zA-Z0-9]+:)?(\$?[0-9a-fA-F]{1,4}|\.\S+)\b', re.IGNORECASE)
+
+class ViceMonitorError(Exception):
+    pass
+
+def parse_monitor_address(address, defaultPort):
+    """Returns (host, port) of a "host:port" address, the port is optional"""
+    host, separator, port = (address or "").strip().rpartition(':')
+    if not separator:
+        return (port or "127.0.0.1", defaultPort)
+    try:
+        return (host or "127.0.0.1", int(port))
+    except ValueError:
+        raise ViceMonitorError("Invalid monitor address: %s" % address)
+
+def connect(address, timeout):
+    """
+    Connects to a monitor. An emulator that was just started opens the port a
+    moment later, so refused connections are retried with a growing delay
+    until the timeout.
+    """
+    deadline = time.time() + timeout
+    delay = CONNECT_RETRY_DELAY
+    while True:
+        try:
+            return socket.create_connection(address, timeout)
+        except ConnectionRefusedError:
+            if time.time() + delay > deadline:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+def read_breakpoints(paths):
+    """
+    Returns the addresses of the breakpoints set in monitor command files, such
+    as the .vs file and the breakpoint file. Breakpoints on labels are resolved
+    with the labels defined in the files.
+    """
+    labels = {}
+    breaks = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as handle:
+                lines = handle.read().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            match = LABEL_COMMAND_PATTERN.match(line)
+            if match:
+                labels[match.group(2)] = int(match.group(1), 16)
+                continue
+            match = BREAK_COMMAND_PATTERN.match(line)
+            if match:
+                breaks.append(match.group(1))
+    addresses = []
+    for target in breaks:
+        address = labels.get(target[1:]) if target.startswith('.') else int(target.lstrip('$'), 16)
+        if address is not None and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+class ViceTextMonitor():
+    """
+    Client for the text remote monitor of a running VICE, started with
+    -remotemonitor. Used to load a new build into the running emulator,
+    instead of starting a new emulator for every build.
+    """
+    DEFAULT_PORT = 6510
+    # VICE does not answer commands that resume the emulation with a prompt
+    RESUMING_COMMANDS = ('autostart', 'x', 'g')
+    RESUME_TIMEOUT = 0.1
+
+    def __init__(self, address, timeout=2.0):
+        self.__address = parse_monitor_address(address, self.DEFAULT_PORT)
+        self.__timeout = timeout
+
+    @property
+    def Address(self):
+        return self.__address
+
+    def sendCommands(self, commands):
+        """Sends the commands and resumes the emulation, returns the response of each command"""
+        try:
+            with contextlib.closing(connect(self.__address, self.__timeout)) as connection:
+                responses = []
+                for command in commands:
+                    connection.settimeout(self.RESUME_TIMEOUT if command.split(' ', 1)[0] in self.RESUMING_COMMANDS else self.__timeout)
+                    connection.sendall((command + "\n").encode('utf-8'))
+                    responses.append(self.readResponse(connection))
+                connection.sendall(b"x\n")
+                return responses
+        except (OSError, socket.timeout) as ex:
+            raise ViceMonitorError("Could not connect to the VICE monitor at %s:%d (%s), start VICE with -remotemonitor" % (self.__address + (ex,)))
+
+    def readResponse(self, connection):
+        """Reads until the monitor prompt, commands that resume the emulation end with a short timeout instead"""
+        data = b""
+        while not PROMPT_PATTERN.search(data):
+            try:
+                chunk = connection.recv(4096)
+            except socket.timeout:
+                break
+            if not chunk:
+                raise ViceMonitorError("VICE closed the monitor connection")
+            data += chunk
+        return PROMPT_PATTERN.sub(b"", data).decode('utf-8', 'replace').strip()
+
+    def loadProgram(self, path, commandFiles=()):
+        """
+        Loads and starts the program, the same way as attaching it on the command line.
+        The command files replace the breakpoints of the previous program.
+        """
+        commandFiles = [f for f in commandFiles if os.path.isfile(f)]
+        commands = (['delete'] + ['playback "%s"' % f for f in commandFiles] if commandFiles else [])
+        return self.sendCommands(commands + ['autostart "%s"' % path])
+
+class ViceBinaryMonitor():
+    """
+    Client for the binary monitor of a running VICE, started with -binarymonitor.
+    One connection is kept per emulator and reused by all requests. Requests are
+    sent together and their responses matched by request id, so a batch of
+    memory reads or breakpoints costs one round trip.
+    """
+    DEFAULT_PORT = 6502
+    STX = 0x02
+    API_VERSION = 0x02
+    EVENT_REQUEST_ID = 0xffffffff
+
+    MEMORY_GET = 0x01
+    CHECKPOINT_SET = 0x12
+    CHECKPOINT_DELETE = 0x13
+    PING = 0x81
+    EXIT = 0xaa
+    AUTOSTART = 0xdd
+
+    CPU_OPERATION_EXEC = 0x04
+    MAIN_MEMSPACE = 0x00
+
+    __connections = {}
+    __poolLock = threading.Lock()
+
+    @classmethod
+    def get(cls, address):
+        """Returns the pooled monitor of the address, which connects again if the connection was lost"""
+        key = parse_monitor_address(address, cls.DEFAULT_PORT)
+        with cls.__poolLock:
+            monitor = cls.__connections.get(key)
+            if monitor is None:
+                monitor = cls(address)
+                cls.__connections[key] = monitor
+            return monitor
+
+    @classmethod
+    def closeAll(cls):
+        with cls.__poolLock:
+            for monitor in cls.__connections.values():
+                monitor.close()
+            cls.__connections.clear()
+
+    def __init__(self, address, timeout=2.0):
+        self.__address = parse_monitor_address(address, self.DEFAULT_PORT)
+        self.__timeout = timeout
+        self.__connection = None
+        self.__nextRequestId = 1
+        self.__checkpoints = []
+        self.__lock = threading.Lock()
+
+    @property
+    def Address(self):
+        return self.__address
+
+    def isConnected(self):
+        return self.__connection is not None
+
+    def connect(self):
+        if self.__connection is None:
+            try:
+                self.__connection = connect(self.__address, self.__timeout)
+                # Breakpoints set through an earlier connection may belong to an emulator that has been closed
+                self.__checkpoints = []
+            except (OSError, socket.timeout) as ex:
+                raise ViceMonitorError("Could not connect to the VICE binary monitor at %s:%d (%s), start VICE with -binarymonitor" % (self.__address + (ex,)))
+
+    def close(self):
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+    def sendRequests(self, requests):
+        """Sends (command, body) requests in one write, returns the response bodies in the same order"""
+        with self.__lock:
+            self.connect()
+            try:
+                requestIds = []
+                data = []
+                for command, body in requests:
+                    requestIds.append(self.__nextRequestId)
+                    data.append(struct.pack('<BBIIB', self.STX, self.API_VERSION, len(body), self.__nextRequestId, command) + body)
+                    self.__nextRequestId = (self.__nextRequestId + 1) % self.EVENT_REQUEST_ID
+                self.__connection.sendall(b"".join(data))
+
+                # All responses are read before reporting errors, so that the connection can be reused
+                responses = {}
+                errors = []
+                while len(responses) < len(requestIds):
+                    responseType, errorCode, requestId, body = self.readResponse()
+                    # Events, such as the emulator stopping, are not answers to a request
+                    if requestId not in requestIds:
+                        continue
+                    if errorCode != 0:
+                        errors.append("VICE monitor command $%02x failed with error $%02x" % (requests[requestIds.index(requestId)][0], errorCode))
+                    responses[requestId] = body
+            except (OSError, socket.timeout, struct.error) as ex:
+                self.close()
+                raise ViceMonitorError("Lost the connection to the VICE binary monitor: %s" % ex)
+        if errors:
+            raise ViceMonitorError(errors[0])
+        return [responses[i] for i in requestIds]
+
+    def readResponse(self):
+        header = self.receive(12)
+        stx, apiVersion, bodyLength, responseType, errorCode, requestId = struct.unpack('<BBIBBI', header)
+        if stx != self.STX:
+            raise OSError("unexpected data")
+        return responseType, errorCode, requestId, self.receive(bodyLength)
+
+    def receive(self, length):
+        data = b""
+        while len(data) < length:
+            chunk = self.__connection.recv(length - len(data))
+            if not chunk:
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def ping(self):
+        self.sendRequests([(self.PING, b"")])
+
+    def readMemory(self, ranges):
+        """Reads (start, end) address ranges, end included, returns the bytes of each range"""
+        requests = [(self.MEMORY_GET, struct.pack('<BHHBH', 0, start, end, self.MAIN_MEMSPACE, 0)) for start, end in ranges]
+        return [body[2:2 + struct.unpack('<H', body[:2])[0]] for body in self.sendRequests(requests)]
+
+    def createBreakpointRequests(self, addresses):
+        """Requests replacing the breakpoints set by the last call with breakpoints at the addresses"""
+        requests = [(self.CHECKPOINT_DELETE, struct.pack('<I', n)) for n in self.__checkpoints]
+        requests.extend((self.CHECKPOINT_SET, struct.pack('<HHBBBBB', a, a, 1, 1, self.CPU_OPERATION_EXEC, 0, self.MAIN_MEMSPACE)) for a in addresses)
+        return requests
+
+    def setBreakpoints(self, addresses):
+        requests = self.createBreakpointRequests(addresses)
+        responses = self.sendRequests(requests + [(self.EXIT, b"")])
+        self.storeCheckpoints(requests, responses)
+
+    def storeCheckpoints(self, requests, responses):
+        self.__checkpoints = [struct.unpack('<I', body[:4])[0] for (command, _), body in zip(requests, responses) if command == self.CHECKPOINT_SET]
+
+    def loadProgram(self, path, commandFiles=()):
+        """
+        Sets the breakpoints found in the command files, replacing those of the
+        previous program, then loads and starts the program
+        """
+        requests = self.createBreakpointRequests(read_breakpoints(commandFiles))
+        fileName = path.encode('utf-8')
+        autostart = (self.AUTOSTART, struct.pack('<BHB', 1, 0, len(fileName)) + fileName)
+        responses = self.sendRequests(requests + [autostart, (self.EXIT, b"")])
+        self.storeCheckpoints(requests, responses)
+
+def plugin_unloaded():
+    ViceBinaryMonitor.closeAll()
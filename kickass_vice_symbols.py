@@ -0,0 +1,124 @@
+"""
+Label addresses from the VICE symbol file (.vs) written by KickAssembler's
+-vicesymbols option. The file is memory mapped and indexed, and only read
+again when its mtime or size changes.
+"""
+import mmap
+import os
+import re
+import threading
+
+import sublime
+
+from .kickass_settings import KickAssSettings
+
+LABEL_PATTERN = re.compile(br'^al\s+C:([0-9A-Fa-f]+)\s+\.(\S+)', re.MULTILINE)
+
+
+class ViceSymbolFile:
+    """
+    Index of label name to address of one .vs file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.labels = {}
+        self.stamp = None
+        self._addresses = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Reload the labels, if the file has changed since the last refresh.
+        Return the (mtime, size) of the file, None if it does not exist.
+        """
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime, stat.st_size)
+        except EnvironmentError:
+            stamp = None
+        with self._lock:
+            if stamp != self.stamp:
+                self.labels = self._read_labels() if stamp else {}
+                self.stamp = stamp
+                self._addresses = None
+        return stamp
+
+    def _read_labels(self):
+        labels = {}
+        try:
+            with open(self.path, 'rb') as fileobject:
+                if os.fstat(fileobject.fileno()).st_size == 0:
+                    return labels
+                data = mmap.mmap(fileobject.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+                try:
+                    for match in LABEL_PATTERN.finditer(data):
+                        name = match.group(2).decode('utf8', 'replace')
+                        address = int(match.group(1), 16)
+                        labels[name] = address
+                        # namespaced labels (gfx.start) are also found by
+                        # their local name, unless that is defined itself
+                        labels.setdefault(name.rsplit('.', 1)[-1], address)
+                finally:
+                    data.close()
+        except (EnvironmentError, ValueError):
+            return {}
+        return labels
+
+    def get(self, name, default=None):
+        return self.labels.get(name, default)
+
+    def addresses(self):
+        """Return {address: label name}, the same dict until the file changes"""
+        if self._addresses is None:
+            addresses = {}
+            for name, address in sorted(self.labels.items()):
+                if '.' not in name or address not in addresses:
+                    addresses[address] = name
+            self._addresses = addresses
+        return self._addresses
+
+
+_symbol_files = {}
+
+
+def get_symbol_file(path):
+    """Return the shared ViceSymbolFile for path"""
+    symbol_file = _symbol_files.get(path)
+    if symbol_file is None:
+        symbol_file = _symbol_files[path] = ViceSymbolFile(path)
+    return symbol_file
+
+
+def symbol_paths_for_view(view):
+    """
+    Return the .vs files the build of the view's file would write, for the
+    file itself and for the startup file
+    """
+    file_name = view.file_name()
+    if not file_name:
+        return []
+    settings = KickAssSettings.forView(view)
+    output_path = settings.get('kickass_output_path') or 'bin'
+    if '$' in output_path and view.window():
+        output_path = sublime.expand_variables(
+            output_path, view.window().extract_variables())
+    output_folder = os.path.join(os.path.dirname(file_name), output_path)
+    base_names = [os.path.splitext(os.path.basename(file_name))[0],
+                  settings.get('kickass_startup_file_path') or 'Startup']
+    return [os.path.join(output_folder, name + '.vs') for name in base_names]
+
+
+def symbol_files_for_view(view):
+    """
+    Return the refreshed symbol files of the view, most recently built first
+    """
+    stamped = []
+    for path in symbol_paths_for_view(view):
+        symbol_file = get_symbol_file(path)
+        stamp = symbol_file.refresh()
+        if stamp:
+            stamped.append((stamp, symbol_file))
+    stamped.sort(key=lambda item: item[0][0], reverse=True)
+    return [symbol_file for _, symbol_file in stamped]
@@ -0,0 +1,145 @@
+import copy
+import os
+import threading
+
+import sublime
+import sublime_plugin
+
+from .kickass_build import KickassBuildCommand
+from .kickass_build_cache import KickAssBuildCache
+from .kickass_profiler import KickAssProfiler
+from .kickass_settings import KickAssSettings
+from .kickass_vice_monitor import ViceTextMonitor, ViceBinaryMonitor, ViceMonitorError
+
+class KickAssWatch():
+    """
+    Watch mode of a window. Saving any file in the import graph of the watched
+    source file builds it again, once the saves have settled, and the new program
+    is loaded into the running VICE through its remote monitor instead of
+    starting a new emulator.
+    """
+    DEFAULT_DEBOUNCE_MS = 300
+    __watches = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def get(cls, windowId):
+        with cls.__lock:
+            return cls.__watches.get(windowId)
+
+    @classmethod
+    def start(cls, window, sourceFile, settings):
+        outputPath = os.path.join(os.path.dirname(sourceFile), settings.get("kickass_output_path", ""))
+        baseName = os.path.splitext(os.path.basename(sourceFile))[0]
+        address = settings.get("kickass_watch_monitor_address", "127.0.0.1")
+        monitor = ViceBinaryMonitor.get(address) if settings.get("kickass_watch_monitor") == "binary" else ViceTextMonitor(address)
+        watch = cls(window, sourceFile, monitor,
+                    int(settings.get("kickass_watch_debounce_ms", cls.DEFAULT_DEBOUNCE_MS)),
+                    os.path.join(outputPath, "%s_BuildCache.json" % baseName),
+                    settings.get("kickass_breakpoint_filename"), KickassBuildCommand.getBuildSystemArgs(window.id()))
+        watch.updateImportGraph()
+        with cls.__lock:
+            cls.__watches[window.id()] = watch
+        return watch
+
+    @classmethod
+    def stop(cls, windowId):
+        with cls.__lock:
+            return cls.__watches.pop(windowId, None)
+
+    @classmethod
+    def reload(cls, windowId, programPath):
+        watch = cls.get(windowId)
+        if watch:
+            watch.reloadProgram(programPath)
+
+    def __init__(self, window, sourceFile, monitor, debounceMs, cacheFile, breakpointFile=None, buildSystemArgs=None):
+        self.__window = window
+        self.__sourceFile = os.path.normpath(sourceFile)
+        self.__monitor = monitor
+        self.__debounceMs = debounceMs
+        self.__cacheFile = cacheFile
+        self.__breakpointFile = breakpointFile
+        # Environment, path and the other build system arguments, which the build command gets from the build system
+        self.__buildSystemArgs = buildSystemArgs or {}
+        self.__files = frozenset([self.__sourceFile])
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def SourceFile(self):
+        return self.__sourceFile
+
+    @property
+    def Files(self):
+        return self.__files
+
+    def updateImportGraph(self):
+        """Finds the files imported by the source file, also after each build as imports may have changed"""
+        buildCache = KickAssBuildCache(self.__cacheFile, os.path.dirname(self.__sourceFile))
+        files = buildCache.scanInputs(os.path.basename(self.__sourceFile))
+        self.__files = frozenset([self.__sourceFile] + [os.path.normpath(p) for p in files])
+
+    def isWatched(self, path):
+        return bool(path) and os.path.normpath(path) in self.__files
+
+    def fileSaved(self, path):
+        """Schedules a build if the file is in the import graph, saves in quick succession start one build"""
+        if not self.isWatched(path):
+            return False
+        with self.__lock:
+            self.__generation += 1
+            generation = self.__generation
+        sublime.set_timeout_async(lambda: self.rebuild(generation), self.__debounceMs)
+        return True
+
+    def rebuild(self, generation):
+        with self.__lock:
+            if generation != self.__generation:
+                return
+        args = copy.deepcopy(self.__buildSystemArgs)
+        args.update({'buildmode': 'build', 'watch_file': self.__sourceFile})
+        self.__window.run_command('kickass_build', args)
+
+    def getCommandFiles(self, programPath):
+        """The .vs file and the breakpoint file next to the program, with the labels and breakpoints to set"""
+        outputPath = os.path.dirname(programPath)
+        commandFiles = [os.path.splitext(programPath)[0] + ".vs"]
+        if self.__breakpointFile:
+            commandFiles.append(os.path.join(outputPath, self.__breakpointFile))
+        return commandFiles
+
+    def reloadProgram(self, programPath):
+        self.updateImportGraph()
+        try:
+            with KickAssProfiler.phase("emulator launch"):
+                self.__monitor.loadProgram(programPath, self.getCommandFiles(programPath))
+            sublime.status_message("Loaded %s into VICE" % os.path.basename(programPath))
+        except ViceMonitorError as ex:
+            sublime.status_message(str(ex))
+
+class KickassToggleWatchCommand(sublime_plugin.WindowCommand):
+    """Starts or stops watch mode for the current file"""
+
+    def run(self):
+        if KickAssWatch.stop(self.window.id()):
+            sublime.status_message("Watch mode stopped")
+            return
+        view = self.window.active_view()
+        sourceFile = view.file_name() if view else None
+        if not sourceFile:
+            sublime.status_message("Save the file before starting watch mode")
+            return
+        watch = KickAssWatch.start(self.window, sourceFile, KickAssSettings.forView(view, self.window))
+        sublime.status_message("Watching %s and %d imported files" % (os.path.basename(sourceFile), len(watch.Files) - 1))
+
+    def is_checked(self):
+        return KickAssWatch.get(self.window.id()) is not None
+
+class KickassWatchListener(sublime_plugin.EventListener):
+
+    def on_post_save_async(self, view):
+        window = view.window()
+        watch = KickAssWatch.get(window.id()) if window else None
+        if watch:
+            watch.fileSaved(view.file_name())
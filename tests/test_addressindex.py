@@ -0,0 +1,59 @@
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassaddressindex
+except ImportError:
+    from testglobals import kickassaddressindex
+
+AddressArea = kickassaddressindex.AddressArea
+
+class TestAddressIndex(TestCase):
+
+    def setUp(self):
+        self.target = kickassaddressindex.C64_ADDRESS_INDEX
+
+    def test_c64_areas_cover_whole_address_space_without_gaps(self):
+        areas = self.target.areas
+        self.assertEqual(0x0000, areas[0].start)
+        self.assertEqual(0xffff, areas[-1].end)
+        for previous, area in zip(areas, areas[1:]):
+            self.assertEqual(previous.end + 1, area.start)
+
+    def test_find_register_address_is_its_own_register(self):
+        info = self.target.find(53280)
+        self.assertEqual('VIC-II', info.area.name)
+        self.assertEqual(0xd020, info.register)
+        self.assertEqual('d020', kickassaddressindex.help_key(info.register))
+
+    def test_find_mirrored_registers_map_back_to_first_copy(self):
+        self.assertEqual(0xd000, self.target.find(0xd040).register)
+        self.assertEqual(0xd02e, self.target.find(0xd3ee).register)
+        self.assertEqual(0xd419, self.target.find(0xd439).register)
+        self.assertEqual(0xdc0d, self.target.find(0xdcfd).register)
+        self.assertEqual(0xdd00, self.target.find(0xdd10).register)
+
+    def test_find_area_bounds_and_areas_without_mirrors(self):
+        self.assertEqual('Processor port', self.target.find(0x0001).area.name)
+        self.assertEqual('Zero page', self.target.find(0x0002).area.name)
+        self.assertEqual('Color RAM', self.target.find(0xdbff).area.name)
+        self.assertEqual(0xd840, self.target.find(0xd840).register)
+        self.assertEqual('NMI, RESET and IRQ vectors', self.target.find(0xfffe).area.name)
+
+    def test_find_address_outside_of_areas_is_none(self):
+        target = kickassaddressindex.AddressIndex([AddressArea(0x1000, 0x1fff, 'Music', None)])
+        self.assertIsNone(target.find(0x0fff))
+        self.assertIsNone(target.find(0x2000))
+        self.assertIsNone(self.target.find(0x10000))
+        self.assertIsNone(self.target.find(-1))
+
+    def test_overlapping_areas_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            kickassaddressindex.AddressIndex([AddressArea(0x1000, 0x1fff, 'Music', None),
+                                              AddressArea(0x1f00, 0x20ff, 'Data', None)])
+
+    def test_describe_names_area_and_mirrored_register(self):
+        self.assertEqual('VIC-II', kickassaddressindex.describe(self.target.find(0xd020)))
+        self.assertEqual('VIC-II, mirror of $D000', kickassaddressindex.describe(self.target.find(0xd040)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+try:
+    from tests.testglobals import kickasshelpindex
+except ImportError:
+    from testglobals import kickasshelpindex
+
+class TestHelpIndex(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.helpFolder = os.path.join(self.folder, 'helpdb')
+        os.makedirs(self.helpFolder)
+        self.writeHelpFile('a.json', {'d020': {'name': 'BORDER', 'descr': 'Border color'}, 'lda': {'name': 'LoaD Accumulator', 'descr': ''}})
+        self.writeHelpFile('b.json', {'D021': {'name': 'BACKGROUND', 'descr': 'Background color'}, 'lda': {'name': 'LDA override', 'descr': ''}})
+        self.target = kickasshelpindex.HelpIndex(os.path.join(self.folder, 'cache', 'helpdb.idx'))
+
+    def tearDown(self):
+        self.target.close()
+        shutil.rmtree(self.folder)
+
+    def writeHelpFile(self, filename, data):
+        with open(os.path.join(self.helpFolder, filename), 'w') as handle:
+            json.dump(data, handle)
+
+    def buildAndOpen(self):
+        self.target.build([self.helpFolder])
+        self.target.open()
+
+    def test_get_existing_key_returns_entry(self):
+        self.buildAndOpen()
+        self.assertEqual({'name': 'BORDER', 'descr': 'Border color'}, self.target.get('d020'))
+
+    def test_get_is_case_insensitive(self):
+        self.buildAndOpen()
+        self.assertEqual('BACKGROUND', self.target.get('d021')['name'])
+        self.assertEqual('BORDER', self.target.get('D020')['name'])
+
+    def test_get_missing_key_returns_default(self):
+        self.buildAndOpen()
+        self.assertEqual(None, self.target.get('d022'))
+        self.assertEqual(None, self.target.get('zzz'))
+        self.assertEqual(None, self.target.get('0'))
+
+    def test_get_key_in_several_files_returns_last_loaded(self):
+        self.buildAndOpen()
+        self.assertEqual('LDA override', self.target.get('lda')['name'])
+
+    def test_get_index_not_opened_returns_default(self):
+        self.assertEqual(None, self.target.get('d020'))
+
+    def test_is_current_after_build_returns_true(self):
+        self.buildAndOpen()
+        self.assertTrue(self.target.is_current(kickasshelpindex.source_manifest([self.helpFolder])))
+
+    def test_is_current_help_file_added_returns_false(self):
+        self.buildAndOpen()
+        self.writeHelpFile('c.json', {'d418': {'name': 'VOLUME', 'descr': ''}})
+        self.assertFalse(self.target.is_current(kickasshelpindex.source_manifest([self.helpFolder])))
+
+    def test_is_current_help_directories_reordered_returns_false(self):
+        otherFolder = os.path.join(self.folder, 'other')
+        os.makedirs(otherFolder)
+        with open(os.path.join(otherFolder, 'a.json'), 'w') as handle:
+            json.dump({'lda': {'name': 'LDA other', 'descr': ''}}, handle)
+        self.target.build([self.helpFolder, otherFolder])
+        self.assertTrue(self.target.is_current(kickasshelpindex.source_manifest([self.helpFolder, otherFolder])))
+        self.assertFalse(self.target.is_current(kickasshelpindex.source_manifest([otherFolder, self.helpFolder])))
+
+    def test_build_removed_key_is_not_found(self):
+        self.buildAndOpen()
+        os.unlink(os.path.join(self.helpFolder, 'b.json'))
+        self.buildAndOpen()
+        self.assertEqual(None, self.target.get('d021'))
+        self.assertEqual('LoaD Accumulator', self.target.get('lda')['name'])
+
+if __name__ == '__main__':
+    unittest.main()
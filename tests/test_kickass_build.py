@@ -1,5 +1,5 @@
 from unittest import TestCase
-from unittest.mock import Mock, patch, create_autospec, PropertyMock
+from unittest.mock import Mock, patch, create_autospec, PropertyMock, call
 try:
     from tests.testsettings import TestSettings
 except ImportError:
@@ -15,6 +15,7 @@ def createCommand_mock(command_text='test-command-text'):
 def fix_createCommand_mock(mock, command_text='test-command-text'):
     mock.updateEnvVars.side_effect = (lambda dict: dict)
     type(mock).CommandText = PropertyMock(return_value=command_text)
+    type(mock).CompileRequest = PropertyMock(return_value=None)
     return mock
 
 class TestKickassBuildCommand(TestCase):
@@ -24,6 +25,12 @@ class TestKickassBuildCommand(TestCase):
         self.platform_system = self.platform_system_patch.start()
         self.platform_system.return_value = 'Darwin'
 
+        # Run build preparation synchronously
+        self.set_timeout_async_patch = patch('sublime.set_timeout_async', side_effect=lambda callback, delay=0: callback())
+        self.set_timeout_async_patch.start()
+        self.set_timeout_patch = patch('sublime.set_timeout', side_effect=lambda callback, delay=0: callback())
+        self.set_timeout_patch.start()
+
         self.window_mock = Mock()
         self.window_mock.extract_variables.return_value = default_variables_dict.copy()
 
@@ -38,6 +45,8 @@ class TestKickassBuildCommand(TestCase):
 
     def tearDown(self):
         self.platform_system_patch.stop()
+        self.set_timeout_async_patch.stop()
+        self.set_timeout_patch.stop()
 
     def test_getPathDelimiter_platform_is_windows_returns_semicolon(self):
         self.platform_system.return_value = 'Windows'
@@ -271,13 +280,14 @@ class TestKickassBuildCommand(TestCase):
     @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
     def test_run_creates_makedirs_called_once(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock):
+        execDict_mock.return_value = {}
         settings_mock.return_value.isLoaded.return_value = True
         settings_mock.return_value.getSetting.return_value = 'outputdir'
         actual = self.target.run(buildmode = 'build', env = {})
         os_mock.assert_called_once_with('outputdir', exist_ok=True)
 
     @patch('os.path.isdir', return_value=True)
-    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.emptyFolder', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
     @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
     @patch('glob.glob', autospec=True, return_value=True)
@@ -285,14 +295,15 @@ class TestKickassBuildCommand(TestCase):
     @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
     def test_run_emptybinfolder_setting_is_true_emptyfolder_is_called_once(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock, emptyfolder_mock, isdir_mock):
+        execDict_mock.return_value = {}
         settings_mock.return_value.isLoaded.return_value = True
         settings_mock.return_value.getSetting.return_value = 'outputdir'
         settings_mock.return_value.getSettingAsBool.return_value = True
         actual = self.target.run(buildmode = 'build', env = {})
-        emptyfolder_mock.assert_called_once_with(self.target, 'outputdir')
+        emptyfolder_mock.assert_called_once_with(self.target, 'outputdir', settings_mock.return_value)
 
     @patch('os.path.isdir', return_value=True)
-    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.emptyFolder', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
     @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
     @patch('glob.glob', autospec=True, return_value=True)
@@ -300,6 +311,7 @@ class TestKickassBuildCommand(TestCase):
     @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
     def test_run_emptybinfolder_setting_is_false_emptyfolder_is_not_called(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock, emptyfolder_mock, isdir_mock):
+        execDict_mock.return_value = {}
         settings_mock.return_value.isLoaded.return_value = True
         settings_mock.return_value.getSetting.return_value = 'outputdir'
         settings_mock.return_value.getSettingAsBool.return_value = False
@@ -312,14 +324,207 @@ class TestKickassBuildCommand(TestCase):
     @patch('os.makedirs', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
-    def test_run_window_runcommand_is_called_once(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock):
+    def test_run_window_runcommand_kills_previous_build_and_runs_exec(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock):
         settings_mock.return_value.isLoaded.return_value = True
         settings_mock.return_value.getSettingAsBool.return_value = False
         settings_mock.return_value.getSetting.return_value = 'outputdir'
         exec_dict_val = {'key11':'val11'}
         execDict_mock.return_value = exec_dict_val
         actual = self.target.run(buildmode = 'build', env = {})
-        self.window_mock.run_command.assert_called_once_with('exec', exec_dict_val)
+        self.assertEqual([call('kickass_exec', {'kill': True}), call('kickass_exec', exec_dict_val)], self.window_mock.run_command.call_args_list)
+
+    @patch('sublime.error_message', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssAssetPipeline', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('glob.glob', autospec=True, return_value=True)
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_run_asset_conversion_fails_shows_error_and_does_not_run_exec(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock, pipeline_mock, error_message_mock):
+        steps = [{'source': 'logo.png', 'output': 'logo.kla', 'convert': 'koala'}]
+        settings_mock.return_value.isLoaded.return_value = True
+        settings_mock.return_value.getSettingAsBool.return_value = False
+        settings_mock.return_value.getSetting.side_effect = lambda key: {'kickass_assets': steps, 'kickass_assets_max_processes': 2}.get(key, 'outputdir')
+        execDict_mock.return_value = {}
+        pipeline_mock.return_value.run.side_effect = kickassbuild.KickAssAssetError('logo.png: not a PNG file')
+        self.target.run(buildmode = 'build', env = {})
+        pipeline_mock.assert_called_once_with('test-path', 'outputdir', steps, 2)
+        error_message_mock.assert_called_once_with('Could not convert the assets:\nlogo.png: not a PNG file')
+        self.assertEqual([call('kickass_exec', {'kill': True})], self.window_mock.run_command.call_args_list)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.prepareBuild', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    def test_run_watch_file_build_does_not_kill_previous_exec_and_emulator(self, settings_mock, prepareBuild_mock):
+        settings_mock.return_value.isLoaded.return_value = True
+        self.target.run(buildmode = 'build', watch_file = '/work/src/main.asm')
+        self.assertEqual(0, self.window_mock.run_command.call_count)
+        self.assertEqual(1, prepareBuild_mock.call_count)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.prepareBuild', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    def test_run_prepares_build_on_worker_thread(self, settings_mock, prepareBuild_mock):
+        settings_mock.return_value.isLoaded.return_value = True
+        with patch('sublime.set_timeout_async') as set_timeout_async_mock:
+            self.target.run(buildmode = 'build', env = {})
+            self.assertEqual(0, prepareBuild_mock.call_count)
+            set_timeout_async_mock.call_args[0][0]()
+        prepareBuild_mock.assert_called_once_with(self.target, 1, {'buildmode': 'build', 'env': {}}, default_variables_dict, settings_mock.return_value)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_prepareBuild_build_is_superseded_build_is_skipped(self, cd_mock, execDict_mock):
+        buildId = self.target.startBuild()
+        self.target.startBuild()
+        self.target.prepareBuild(buildId, {'buildmode': 'build'}, default_variables_dict.copy(), self.settings_mock)
+        self.assertEqual(0, execDict_mock.call_count)
+        self.assertEqual(0, self.window_mock.run_command.call_count)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True, return_value={'key11':'val11'})
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_prepareBuild_watch_file_builds_watched_file_and_reloads_program(self, cd_mock, makedirs_mock, file_mock, execDict_mock):
+        buildId = self.target.startBuild()
+        self.target.prepareBuild(buildId, {'buildmode': 'build', 'watch_file': '/work/src/main.asm'}, default_variables_dict.copy(), self.all_settings)
+        variables = execDict_mock.call_args[0][2]
+        self.assertEqual(('/work/src/main.asm', '/work/src', 'main', 'asm'),
+                         (variables['file'], variables['file_path'], variables['file_base_name'], variables['file_extension']))
+        self.assertNotIn('watch_file', execDict_mock.call_args[0][1])
+        cd_mock.assert_called_once_with('/work/src')
+        self.window_mock.run_command.assert_called_once_with('kickass_exec', {'key11':'val11', 'reload_program': '/work/src/bin/main.prg'})
+
+    @patch('glob.glob', autospec=True, side_effect=lambda x: {'/prebuild.sh':False, 'prebuild.sh':True, '/postbuild.sh':False, 'postbuild.sh':False}[x])
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_prepareBuild_watch_file_build_with_prebuild_script_and_kickass_env_keeps_build_system_env(self, cd_mock, makedirs_mock, file_mock, glob_mock):
+        settings = TestSettings(dict(default_settings_dict, kickass_env={'test-settings-env-var': 'env-var'}))
+        buildId = self.target.startBuild()
+        self.target.prepareBuild(buildId, {'buildmode': 'build', 'watch_file': '/work/src/main.asm', 'env': {'CLASSPATH': 'KickAss.jar'}},
+                                 default_variables_dict.copy(), settings)
+        execDict = self.window_mock.run_command.call_args[0][1]
+        self.assertTrue(execDict['shell_cmd'].startswith('. "prebuild.sh" && java cml.kickass.KickAssembler "main.asm"'))
+        self.assertEqual(('KickAss.jar', 'build', 'env-var'),
+                         (execDict['env']['CLASSPATH'], execDict['env']['kickass_buildmode'], execDict['env']['test-settings-env-var']))
+
+    @patch('glob.glob', autospec=True, side_effect=lambda x: {'/prebuild.sh':False, 'prebuild.sh':True, '/postbuild.sh':False, 'postbuild.sh':False}[x])
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    def test_createExecDict_without_build_system_env_and_with_prebuild_script_and_kickass_env_adds_env(self, file_mocks, glob_mock):
+        settings = TestSettings(dict(default_settings_dict, kickass_env={'test-settings-env-var': 'env-var'}))
+        actual = self.target.createExecDict({}, default_variables_dict.copy(), 'build', settings)
+        self.assertTrue(actual['shell_cmd'].startswith('. "prebuild.sh" && java'))
+        self.assertEqual(('build', 'env-var'), (actual['env']['kickass_buildmode'], actual['env']['test-settings-env-var']))
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.prepareBuild', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    def test_run_remembers_build_system_args_of_window_for_watch_mode(self, settings_mock, prepareBuild_mock):
+        settings_mock.return_value.isLoaded.return_value = True
+        self.window_mock.id.return_value = 'build-system-test-window'
+        self.target.run(buildmode = 'build-run', env = {'CLASSPATH': 'KickAss.jar'}, shell = True, file_regex = 'regex')
+        self.target.run(buildmode = 'build', watch_file = '/work/src/main.asm')
+        self.assertEqual({'env': {'CLASSPATH': 'KickAss.jar'}, 'shell': True, 'file_regex': 'regex'},
+                         kickassbuild.KickassBuildCommand.getBuildSystemArgs('build-system-test-window'))
+
+    @patch('sublime.platform', return_value='osx', create=True)
+    @patch('sublime.decode_value', create=True, return_value={'shell': True, 'target': 'kickass_build', 'buildmode': 'build',
+                                                             'osx': {'env': {'CLASSPATH': 'KickAss.jar'}, 'path': '$PATH'}, 'linux': {'env': {}}})
+    @patch('sublime.load_resource', create=True)
+    def test_getBuildSystemArgs_window_without_build_reads_platform_args_of_build_system(self, load_resource_mock, decode_value_mock, platform_mock):
+        self.assertEqual({'shell': True, 'env': {'CLASSPATH': 'KickAss.jar'}, 'path': '$PATH'},
+                         kickassbuild.KickassBuildCommand.getBuildSystemArgs('window-without-build'))
+        self.assertTrue(load_resource_mock.call_args[0][0].endswith('/Build Systems/KickAssembler(C64).sublime-build'))
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True)
+    @patch('os.path.isdir', return_value=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True, return_value={'key11':'val11'})
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_prepareBuild_stale_cleanup_records_written_files_when_exec_finishes(self, cd_mock, makedirs_mock, execDict_mock, isdir_mock, cleanOutputFolder_mock):
+        settings = TestSettings(default_settings_dict)
+        settings.addSetting('kickass_output_cleanup', 'stale')
+        buildId = self.target.startBuild()
+        self.target.prepareBuild(buildId, {'buildmode': 'build'}, default_variables_dict.copy(), settings)
+        self.window_mock.run_command.assert_called_once_with('kickass_exec', {'key11':'val11', 'record_output_folder': 'test-path/bin'})
+
+    @patch('os.path.isdir', return_value=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.emptyFolder', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True, return_value={'key11':'val11'})
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_run_times_settings_load_and_build_preparation_with_build_timer(self, cd_mock, settings_mock, makedirs_mock, execDict_mock, emptyFolder_mock, isdir_mock):
+        settings_mock.return_value.isLoaded.return_value = True
+        settings_mock.return_value.getSetting.side_effect = lambda key: 'empty' if key == 'kickass_output_cleanup' else 'outputdir'
+        settings_mock.return_value.getSettingAsBool.return_value = True
+        settings_mock.return_value.getSettingAsList.return_value = []
+        self.target.run(buildmode = 'build', env = {})
+        timer = kickassbuild.KickAssProfiler.getBuild(self.window_mock.id.return_value)
+        self.assertEqual('build', timer.Name)
+        self.assertEqual(['settings load', 'folder cleanup'], list(timer.Phases))
+        self.assertIsNone(kickassbuild.KickAssProfiler.getActive())
+
+    @patch('traceback.print_exc')
+    @patch('sublime.error_message', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.getFilenameVariables', autospec=True, return_value={})
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=TypeError('bad setting'))
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_prepareBuild_error_creating_build_command_is_reported_and_exec_is_not_run(self, cd_mock, makedirs_mock, createCommand_mock, getFilenameVariables_mock, error_message_mock, print_exc_mock):
+        buildId = self.target.startBuild()
+        self.target.prepareBuild(buildId, {'buildmode': 'build', 'env': {}}, default_variables_dict.copy(), self.all_settings)
+        error_message_mock.assert_called_once_with('Could not create the build command:\nbad setting')
+        self.assertEqual(0, self.window_mock.run_command.call_count)
+
+    @patch('sublime.error_message', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True, side_effect=OSError('Access is denied'))
+    @patch('os.path.isdir', return_value=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True, return_value={'key11':'val11'})
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_prepareBuild_error_on_worker_thread_is_reported_and_finishes_build_timings(self, cd_mock, makedirs_mock, execDict_mock, isdir_mock, cleanOutputFolder_mock, error_message_mock):
+        buildId = self.target.startBuild()
+        timer = kickassbuild.KickAssProfiler.startBuild(self.window_mock.id.return_value, kickassbuild.KickAssTimer('build'))
+        self.target.prepareBuild(buildId, {'buildmode': 'build'}, default_variables_dict.copy(), self.all_settings)
+        error_message_mock.assert_called_once_with('Could not prepare the build:\nAccess is denied')
+        self.assertIsNone(kickassbuild.KickAssProfiler.getBuild(self.window_mock.id.return_value))
+        self.assertEqual(0, self.window_mock.run_command.call_count)
+
+    @patch('sublime.error_message', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.runCompileRequest', autospec=True, side_effect=RuntimeError('server died'))
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createProcessEnvironment', autospec=True, return_value={})
+    def test_runWithCompileRequest_compile_error_is_reported_and_exec_is_not_run(self, createProcessEnvironment_mock, runCompileRequest_mock, error_message_mock):
+        buildId = self.target.startBuild()
+        self.target.runWithCompileRequest(buildId, {}, {'source_file': 'test-file.asm'}, self.settings_mock)
+        error_message_mock.assert_called_once_with('Could not compile test-file.asm:\nserver died')
+        self.assertEqual(0, self.window_mock.run_command.call_count)
+
+    def test_runExec_build_is_superseded_before_exec_exec_is_not_run(self):
+        buildId = self.target.startBuild()
+        with patch('sublime.set_timeout') as set_timeout_mock:
+            self.target.runExec(buildId, {'key11':'val11'})
+            self.target.startBuild()
+            set_timeout_mock.call_args[0][0]()
+        self.assertEqual(0, self.window_mock.run_command.call_count)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.runCompileRequest', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createProcessEnvironment', autospec=True, return_value={})
+    def test_runWithCompileRequest_build_is_superseded_compile_is_skipped(self, createProcessEnvironment_mock, runCompileRequest_mock):
+        buildId = self.target.startBuild()
+        with patch('sublime.set_timeout_async') as set_timeout_async_mock:
+            self.target.runWithCompileRequest(buildId, {}, {'source_file': 'test-file.asm'}, self.settings_mock)
+            self.target.startBuild()
+            set_timeout_async_mock.call_args[0][0]()
+        self.assertEqual(0, runCompileRequest_mock.call_count)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.runCompileRequest', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createProcessEnvironment', autospec=True, return_value={})
+    def test_runWithCompileRequest_build_superseded_before_scheduling_does_not_run_exec(self, createProcessEnvironment_mock, runCompileRequest_mock):
+        buildId = self.target.startBuild()
+        self.target.startBuild()
+        self.target.runWithCompileRequest(buildId, {}, {'source_file': 'test-file.asm'}, self.settings_mock)
+        self.assertEqual(0, runCompileRequest_mock.call_count)
+        self.assertEqual(0, self.window_mock.run_command.call_count)
 
     @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
     @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
@@ -328,6 +533,7 @@ class TestKickassBuildCommand(TestCase):
     @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
     def test_run_createexecdict_is_called_once(self, cd_mock, settings_mock, os_mock, glob_mock, file_mock, execDict_mock):
+        execDict_mock.return_value = {}
         settings_mock.return_value.isLoaded.return_value = True
         settings_mock.return_value.getSettingAsBool.return_value = False
         settings_mock.return_value.getSetting.return_value = 'outputdir'
@@ -336,6 +542,151 @@ class TestKickassBuildCommand(TestCase):
         actual = self.target.run(buildmode = 'build', env = {})
         execDict_mock.assert_called_once_with(self.target, {'env': {}}, variables, 'build', settings_mock.return_value)
 
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.runWithCompileRequest', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_run_execdict_has_compilerequest_runwithcompilerequest_is_called_once(self, cd_mock, settings_mock, os_mock, execDict_mock, runWithCompileRequest_mock):
+        settings_mock.return_value.isLoaded.return_value = True
+        settings_mock.return_value.getSettingAsBool.return_value = False
+        settings_mock.return_value.getSetting.return_value = 'outputdir'
+        execDict_mock.return_value = {'key11':'val11', 'kickass_compile_request': {'key12':'val12'}}
+        actual = self.target.run(buildmode = 'build', env = {})
+        runWithCompileRequest_mock.assert_called_once_with(self.target, 1, {'key11':'val11'}, {'key12':'val12'}, settings_mock.return_value)
+        self.window_mock.run_command.assert_called_once_with('kickass_exec', {'kill': True})
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.getFilenameVariables', autospec=True, return_value={})
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.getPathDelimiter', autospec=True, return_value=':')
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, return_value=createCommand_mock())
+    def test_createExecDict_kickasscommand_has_compilerequest_returns_expanded_compilerequest(self, createCommand_mock, getPathDelimiter_mock, getFilenameVariables_mock):
+        type(createCommand_mock.return_value).CompileRequest = PropertyMock(return_value={'working_dir': '${file_path}'})
+        variables = default_variables_dict.copy()
+        actual = self.target.createExecDict({}, variables, 'build', self.settings_mock)
+        type(createCommand_mock.return_value).CompileRequest = PropertyMock(return_value=None)
+        self.assertEqual({'working_dir': 'test-path'}, actual['kickass_compile_request'])
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.compileWithShell', autospec=True, return_value=(0, 'shell-output'))
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.compileWithServer', autospec=True)
+    @patch('builtins.open', new_callable=mock_open34)
+    @patch('os.makedirs', autospec=True)
+    def test_runCompileRequest_server_fails_falls_back_to_compilecommand(self, makedirs_mock, open_mock, compileWithServer_mock, compileWithShell_mock):
+        compileWithServer_mock.side_effect = kickassbuild.KickAssCompileServerError('test-error')
+        compileRequest = {'working_dir': 'test-path', 'log_file': 'bin/test_CompileLog.txt', 'failed_file': 'bin/test_CompileFailed', 'outputs': [], 'use_compile_server': True}
+        actual = self.target.runCompileRequest(compileRequest, {}, self.all_settings)
+        compileWithShell_mock.assert_called_once_with(self.target, compileRequest, {})
+        open_mock.return_value.write.assert_called_once_with('shell-output')
+        self.assertEqual(0, actual)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssBuildCache', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.compileWithShell', autospec=True, return_value=(0, 'shell-output'))
+    @patch('builtins.open', new_callable=mock_open34)
+    @patch('os.makedirs', autospec=True)
+    def test_runCompileRequest_buildcache_is_up_to_date_compile_is_skipped(self, makedirs_mock, open_mock, compileWithShell_mock, emptyFolder_mock, buildCache_mock):
+        buildCache_mock.return_value.isUpToDate.return_value = True
+        compileRequest = {'working_dir': 'test-path', 'log_file': 'bin/test_CompileLog.txt', 'failed_file': 'bin/test_CompileFailed', 'cache_file': 'bin/test_BuildCache.json',
+                          'source_file': 'test.asm', 'command': 'test-command', 'arguments': '"test.asm" -libdir lib', 'outputs': ['bin/test.prg'], 'use_build_cache': True, 'empty_output_folder': True}
+        actual = self.target.runCompileRequest(compileRequest, {}, self.all_settings)
+        buildCache_mock.assert_called_once_with('test-path/bin/test_BuildCache.json', 'test-path', ['lib'])
+        buildCache_mock.return_value.isUpToDate.assert_called_once_with('test.asm', 'test-command', ['bin/test.prg'])
+        self.assertEqual(0, compileWithShell_mock.call_count)
+        self.assertEqual(0, emptyFolder_mock.call_count)
+        open_mock.return_value.write.assert_called_once_with('test.asm is up to date, skipping compile.\n')
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssBuildCache', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.compileWithShell', autospec=True, return_value=(0, 'shell-output'))
+    @patch('builtins.open', new_callable=mock_open34)
+    @patch('os.makedirs', autospec=True)
+    def test_runCompileRequest_buildcache_is_not_up_to_date_compiles_empties_folder_and_stores_cache(self, makedirs_mock, open_mock, compileWithShell_mock, emptyFolder_mock, buildCache_mock):
+        buildCache_mock.return_value.isUpToDate.return_value = False
+        compileRequest = {'working_dir': 'test-path', 'log_file': 'bin/test_CompileLog.txt', 'failed_file': 'bin/test_CompileFailed', 'cache_file': 'bin/test_BuildCache.json', 'output_folder': 'bin',
+                          'source_file': 'test.asm', 'command': 'test-command', 'arguments': '"test.asm"', 'outputs': ['bin/test.prg'], 'use_build_cache': True, 'empty_output_folder': True}
+        actual = self.target.runCompileRequest(compileRequest, {}, self.all_settings)
+        emptyFolder_mock.assert_called_once_with(self.target, 'test-path/bin', self.all_settings)
+        compileWithShell_mock.assert_called_once_with(self.target, compileRequest, {})
+        buildCache_mock.return_value.store.assert_called_once_with(['bin/test.prg'])
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssOutputCleaner', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.emptyFolder', autospec=True)
+    def test_cleanOutputFolder_mode_is_empty_and_no_keep_files_emptyfolder_is_called(self, emptyFolder_mock, cleaner_mock):
+        self.target.cleanOutputFolder('bin', TestSettings({'kickass_output_cleanup': 'empty'}))
+        emptyFolder_mock.assert_called_once_with(self.target, 'bin')
+        self.assertEqual(0, cleaner_mock.call_count)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssOutputCleaner', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.emptyFolder', autospec=True)
+    def test_cleanOutputFolder_mode_is_stale_cleaner_is_called_with_keep_files(self, emptyFolder_mock, cleaner_mock):
+        self.target.cleanOutputFolder('bin', TestSettings({'kickass_output_cleanup': 'stale', 'kickass_output_keep_files': ['*_ViceLog.txt']}))
+        cleaner_mock.assert_called_once_with('bin', ['*_ViceLog.txt'])
+        cleaner_mock.return_value.clean.assert_called_once_with('stale')
+        self.assertEqual(0, emptyFolder_mock.call_count)
+
+    def test_getFilenameVariables_buildmode_is_buildall_returns_buildall_dictionary(self):
+        actual = self.target.getFilenameVariables('build-all', self.all_settings, default_variables_dict.copy())
+        self.assertEqual({'build_file_base_name': 'BuildAll', 'start_filename': ''}, actual)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.parseAnnotations', autospec=True, return_value={'build-all-files': ['part1.asm']})
+    def test_getBuildAllTargets_has_buildallfiles_annotation_returns_annotation_targets(self, parseannotations_mock):
+        settings = TestSettings({'kickass_build_all_files': ['part2.asm']})
+        actual = self.target.getBuildAllTargets(settings, default_variables_dict.copy())
+        self.assertEqual(['part1.asm'], actual)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.parseAnnotations', autospec=True, return_value={})
+    def test_getBuildAllTargets_has_buildallfiles_setting_returns_setting_targets(self, parseannotations_mock):
+        settings = TestSettings({'kickass_build_all_files': ['part2.asm']})
+        actual = self.target.getBuildAllTargets(settings, default_variables_dict.copy())
+        self.assertEqual(['part2.asm'], actual)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.parseAnnotations', autospec=True, return_value={})
+    def test_getBuildAllTargets_no_targets_raises_valueerror(self, parseannotations_mock):
+        with self.assertRaisesRegex(ValueError, 'No build targets found'):
+            self.target.getBuildAllTargets(TestSettings({}), default_variables_dict.copy())
+
+    def test_createBuildAllTargets_each_target_has_own_output_folder(self):
+        variables = default_variables_dict.copy()
+        for key, value in default_settings_dict.items():
+            variables[key] = value
+        actual = self.target.createBuildAllTargets(['intro.asm', 'parts/outro'], variables, self.all_settings)
+        self.assertEqual('intro.asm', actual[0]['source_file'])
+        self.assertEqual('java cml.kickass.KickAssembler "intro.asm" -log "bin/intro/intro_BuildLog.txt" -o "bin/intro/intro.prg" -vicesymbols -showmem -odir "bin/intro"  ', actual[0]['command'])
+        self.assertEqual('parts/outro.asm', actual[1]['source_file'])
+        self.assertEqual('java cml.kickass.KickAssembler "parts/outro.asm" -log "bin/outro/parts/outro_BuildLog.txt" -o "bin/outro/parts/outro.prg" -vicesymbols -showmem -odir "bin/outro"  ', actual[1]['command'])
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.compileWithShell', autospec=True)
+    def test_compileTargets_one_target_fails_returns_error_and_merged_output(self, compileWithShell_mock):
+        compileWithShell_mock.side_effect = lambda target, request, env: (1, 'error-output') if request['source_file'] == 'b.asm' else (0, 'ok-output')
+        compileRequest = {'working_dir': 'test-path', 'targets': [{'source_file': 'a.asm', 'command': 'a'}, {'source_file': 'b.asm', 'command': 'b'}]}
+        actual = self.target.compileTargets(compileRequest, {}, TestSettings({'kickass_build_all_max_processes': '2'}))
+        self.assertEqual((1, '==== a.asm: ok ====\nok-output\n==== b.asm: failed ====\nerror-output\nBuilt 1 of 2 targets. Failed: b.asm\n'), actual)
+
+    def test_splitArguments_platform_is_linux_returns_unquoted_arguments(self):
+        self.platform_system.return_value = 'Linux'
+        actual = self.target.splitArguments('"test file.asm" -o "bin/test file.prg" -vicesymbols')
+        self.assertEqual(['test file.asm', '-o', 'bin/test file.prg', '-vicesymbols'], actual)
+
+    def test_splitArguments_platform_is_windows_keeps_backslashes(self):
+        self.platform_system.return_value = 'Windows'
+        actual = self.target.splitArguments('"test.asm" -odir "bin\\out"')
+        self.assertEqual(['test.asm', '-odir', 'bin\\out'], actual)
+
+    @patch('os.path.isdir', return_value=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.runWithCompileRequest', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.cleanOutputFolder', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickassBuildCommand.createExecDict', autospec=True)
+    @patch('os.makedirs', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.setTemporaryWorkingDirectory', autospec=True)
+    def test_run_emptybinfolder_setting_is_true_and_compilerequest_uses_buildcache_emptyfolder_is_deferred(self, cd_mock, settings_mock, os_mock, execDict_mock, emptyfolder_mock, runWithCompileRequest_mock, isdir_mock):
+        settings_mock.return_value.isLoaded.return_value = True
+        settings_mock.return_value.getSetting.return_value = 'outputdir'
+        settings_mock.return_value.getSettingAsBool.return_value = True
+        execDict_mock.return_value = {'kickass_compile_request': {'use_build_cache': True}}
+        actual = self.target.run(buildmode = 'build', env = {})
+        self.assertEqual(0, emptyfolder_mock.call_count)
+        runWithCompileRequest_mock.assert_called_once_with(self.target, 1, {}, {'use_build_cache': True, 'empty_output_folder': True}, settings_mock.return_value)
+
     def test_mergedictionaries_no_collisions_dictionaries_merged(self):
         dict1 = {'a':'b'}
         dict2 = {'c':'d'}
@@ -361,7 +712,7 @@ class TestKickassBuildCommand(TestCase):
     def test_parseAnnotations_open_is_called_once(self, open_mock):
         filename = 'test-file.asm'
         actual = self.target.parseAnnotations(filename)
-        open_mock.assert_called_once_with(filename, 'r')
+        open_mock.assert_called_once_with(filename, 'r', encoding='utf-8', errors='replace')
 
     @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
     def test_parseAnnotations_readline_is_called_once(self, open_mock):
@@ -496,6 +847,55 @@ class TestKickassBuildCommand(TestCase):
         actual = self.target.createExecDict({}, variables, 'build-and-debug-startup', self.all_settings)
         self.assertEqual(expected, actual['shell_cmd'])
 
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=kickassbuild.KickAssCommandFactory.createCommand)
+    def test_createExecDict_called_again_with_nothing_changed_returns_equal_dict_without_creating_command(self, createCommand_mock, file_mocks):
+        first = self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        second = self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual(1, createCommand_mock.call_count)
+
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=kickassbuild.KickAssCommandFactory.createCommand)
+    def test_createExecDict_returned_dict_changed_does_not_change_next_dict(self, createCommand_mock, file_mocks):
+        first = self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        expected = first['shell_cmd']
+        first['shell_cmd'] = 'changed'
+        second = self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        self.assertEqual(expected, second['shell_cmd'])
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=kickassbuild.KickAssCommandFactory.createCommand)
+    def test_createExecDict_annotation_line_changed_creates_command_again(self, createCommand_mock):
+        with patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample'):
+            self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        with patch('builtins.open', new_callable=mock_open34, read_data='// @kickass-build "file-to-run": "other.prg"'):
+            self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        self.assertEqual(2, createCommand_mock.call_count)
+
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=kickassbuild.KickAssCommandFactory.createCommand)
+    def test_createExecDict_setting_changed_creates_command_again(self, createCommand_mock, file_mocks):
+        self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        settings = TestSettings(dict(default_settings_dict, kickass_args='-afo'))
+        self.target.createExecDict({}, default_variables_dict.copy(), 'build', settings)
+        self.assertEqual(2, createCommand_mock.call_count)
+
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=kickassbuild.KickAssCommandFactory.createCommand)
+    def test_createExecDict_build_script_added_creates_command_again(self, createCommand_mock, file_mocks):
+        self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        with patch.object(self.target, 'getFileStamp', side_effect=lambda path: [1, 1] if path == 'prebuild.sh' else None):
+            self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        self.assertEqual(2, createCommand_mock.call_count)
+
+    @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCommand', autospec=True, side_effect=kickassbuild.KickAssCommandFactory.createCommand)
+    def test_createExecDict_other_buildmode_creates_command_again(self, createCommand_mock, file_mocks):
+        self.target.createExecDict({}, default_variables_dict.copy(), 'build', self.all_settings)
+        self.target.createExecDict({}, default_variables_dict.copy(), 'build-and-run', self.all_settings)
+        self.assertEqual(2, createCommand_mock.call_count)
+
     @patch('builtins.open', new_callable=mock_open34, read_data='.filenamespace goatPowerExample')
     @patch('glob.glob', autospec=True, return_value=True)
     def test_createExecDict_buildmode_is_make_returns_dictionary_with_correct_makecommand(self, glob_mock, getFilenameVariables_mock):
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+try:
+    from tests.testglobals import kickassannotations
+except ImportError:
+    from testglobals import kickassannotations
+
+class TestKickAssAnnotationCache(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.target = kickassannotations.KickAssAnnotationCache
+        self.target.clear()
+
+    def tearDown(self):
+        self.target.clear()
+        shutil.rmtree(self.folder)
+
+    def path(self, relativePath):
+        return os.path.normpath(os.path.join(self.folder, relativePath))
+
+    def writeFile(self, relativePath, text, mtime=1000):
+        path = self.path(relativePath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_get_first_line_annotation_returns_annotations(self):
+        path = self.writeFile('main.asm', '// @kickass-build "file-to-run": "intro.prg"\nnop\n')
+        self.assertEqual({'file-to-run': 'intro.prg'}, self.target.get(path))
+
+    def test_get_annotations_in_header_block_returns_merged_annotations(self):
+        path = self.writeFile('main.asm', '// Intro by Group\n\n// @kickass-build "startup-file": "main"\n'
+                                          '/*\n * @kickass-build "file-to-run": "intro.prg"\n */\nnop\n// @kickass-build "ignored": 1\n')
+        self.assertEqual({'startup-file': 'main', 'file-to-run': 'intro.prg'}, self.target.get(path))
+
+    def test_get_annotation_after_code_is_ignored(self):
+        path = self.writeFile('main.asm', 'nop\n// @kickass-build "file-to-run": "intro.prg"\n')
+        self.assertEqual({}, self.target.get(path))
+
+    def test_get_unchanged_file_does_not_read_file_again(self):
+        path = self.writeFile('main.asm', '// @kickass-build "file-to-run": "intro.prg"\n')
+        self.target.get(path)
+        with patch('builtins.open') as open_mock:
+            self.assertEqual({'file-to-run': 'intro.prg'}, self.target.get(path))
+        self.assertEqual(0, open_mock.call_count)
+
+    def test_get_changed_file_returns_new_annotations(self):
+        path = self.writeFile('main.asm', '// @kickass-build "file-to-run": "intro.prg"\n')
+        self.target.get(path)
+        self.writeFile('main.asm', '// @kickass-build "file-to-run": "part2.prg"\n', mtime=2000)
+        self.assertEqual({'file-to-run': 'part2.prg'}, self.target.get(path))
+
+    def test_get_invalid_annotation_raises_valueerror_also_when_cached(self):
+        path = self.writeFile('main.asm', '// @kickass-build "file-to-run"= "intro.prg"\n')
+        for i in range(2):
+            with self.assertRaisesRegex(ValueError, 'Could not parse build annotations'):
+                self.target.get(path)
+
+    def test_get_and_populate_read_latin1_file_the_same_way(self):
+        path = self.path('main.asm')
+        with open(path, 'wb') as handle:
+            handle.write(b'// @kickass-build "file-to-run": "main.prg"\n// (c) J\xf6rg\n#import "common.asm"\n')
+        self.assertEqual({'file-to-run': 'main.prg'}, self.target.get(path))
+        self.target.clear()
+        self.target.populate([self.folder])
+        self.assertEqual({'file-to-run': 'main.prg'}, self.target.get(path))
+
+    def test_getTargetsIncluding_file_read_by_get_has_imports(self):
+        path = self.writeFile('main.asm', '// @kickass-build "file-to-run": "main.prg"\n#import "common.asm"\n')
+        self.writeFile('common.asm', 'nop\n')
+        self.target.get(path)
+        self.assertEqual([path], self.target.getTargetsIncluding(self.path('common.asm')))
+
+    def test_populate_reads_all_source_files_in_folders(self):
+        path = self.writeFile('src/part1.asm', '// @kickass-build "file-to-run": "part1.prg"\n')
+        self.writeFile('notes.txt', '// @kickass-build "file-to-run": "notes.prg"\n')
+        self.target.populate([self.folder])
+        with patch('builtins.open') as open_mock:
+            self.assertEqual({'file-to-run': 'part1.prg'}, self.target.get(path))
+        self.assertEqual(0, open_mock.call_count)
+
+    def test_getTargetsIncluding_returns_annotated_targets_importing_file(self):
+        self.writeFile('main.asm', '// @kickass-build "file-to-run": "main.prg"\n#import "lib/macros.asm"\n')
+        self.writeFile('part2.asm', '// @kickass-build "file-to-run": "part2.prg"\n#import "music.asm"\n')
+        self.writeFile('lib/macros.asm', '#import "../music.asm"\n')
+        self.writeFile('music.asm', 'nop\n')
+        self.target.populate([self.folder])
+        self.assertEqual([self.path('main.asm'), self.path('part2.asm')], self.target.getTargetsIncluding(self.path('music.asm')))
+        self.assertEqual([self.path('main.asm')], self.target.getTargetsIncluding(self.path('lib/macros.asm')))
+
+    def test_getTargetsIncluding_startup_and_build_all_files_are_targets(self):
+        self.writeFile('part1.asm', '// @kickass-build "startup-file": "main", "build-all-files": ["part2.asm"]\n')
+        self.writeFile('main.asm', '#import "common.asm"\n')
+        self.writeFile('part2.asm', '#import "common.asm"\n')
+        self.writeFile('common.asm', 'nop\n')
+        self.target.populate([self.folder])
+        self.assertEqual([self.path('main.asm'), self.path('part2.asm')], self.target.getTargetsIncluding(self.path('common.asm')))
+
+    def test_getTargetsIncluding_does_not_read_files(self):
+        self.writeFile('main.asm', '// @kickass-build "file-to-run": "main.prg"\n#import "common.asm"\n')
+        self.writeFile('common.asm', 'nop\n')
+        self.target.populate([self.folder])
+        with patch('os.stat') as stat_mock, patch('builtins.open') as open_mock:
+            self.target.getTargetsIncluding(self.path('common.asm'))
+        self.assertEqual(0, stat_mock.call_count + open_mock.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
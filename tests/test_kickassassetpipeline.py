@@ -0,0 +1,160 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassassets
+except ImportError:
+    from testglobals import kickassassets
+
+BLACK, WHITE, RED, CYAN = (0, 0, 0), (255, 255, 255), (0x68, 0x37, 0x2b), (0x70, 0xa4, 0xb2)
+
+def createPng(rows, colorType=2, depth=8, palette=None, interlace=0, width=None):
+    """PNG of rows of samples, each row a list of channel values, without filtering"""
+    def chunk(chunkType, data):
+        return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff)
+    width = width or len(rows[0]) // kickassassets.PNG_CHANNELS[colorType]
+    raw = b''.join(b'\x00' + bytes(row) for row in rows)
+    data = kickassassets.PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', width, len(rows), depth, colorType, 0, 0, interlace))
+    if palette:
+        data += chunk(b'PLTE', b''.join(bytes(c) for c in palette))
+    return data + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+def createImage(width, height, pixels=None, background=BLACK):
+    """RGB PNG filled with the background, pixels maps (x, y) to colors"""
+    pixels = pixels or {}
+    return createPng([[v for x in range(width) for v in pixels.get((x, y), background)] for y in range(height)])
+
+class TestKickAssAssetConverters(TestCase):
+
+    def test_readpng_maps_rgb_and_palette_pixels_to_nearest_c64_color(self):
+        image = kickassassets.readPng(createPng([[0, 0, 0, 250, 250, 250, 0x68, 0x38, 0x2b]]))
+        self.assertEqual([0, 1, 2], [image.getPixel(x, 0) for x in range(3)])
+        image = kickassassets.readPng(createPng([[0b00011011]], colorType=3, depth=2, palette=[BLACK, WHITE, RED, CYAN], width=4))
+        self.assertEqual((4, 1), (image.Width, image.Height))
+        self.assertEqual([0, 1, 2, 3], [image.getPixel(x, 0) for x in range(4)])
+
+    def test_readpng_pixels_with_low_alpha_are_transparent(self):
+        image = kickassassets.readPng(createPng([[255, 255, 255, 255, 255, 255, 255, 0]], colorType=6))
+        self.assertEqual([1, None], [image.getPixel(0, 0), image.getPixel(1, 0)])
+
+    def test_readpng_interlaced_or_other_files_raise_asset_error(self):
+        with self.assertRaises(kickassassets.KickAssAssetError):
+            kickassassets.readPng(createPng([[0, 0, 0]], interlace=1))
+        with self.assertRaises(kickassassets.KickAssAssetError):
+            kickassassets.readPng(b'GIF89a')
+
+    def test_unfilterrow_applies_sub_up_average_and_paeth_filters(self):
+        previous = bytearray([10, 20, 30])
+        self.assertEqual(bytearray([1, 3, 6]), kickassassets.unfilterRow(1, bytearray([1, 2, 3]), previous, 1))
+        self.assertEqual(bytearray([11, 22, 33]), kickassassets.unfilterRow(2, bytearray([1, 2, 3]), previous, 1))
+        self.assertEqual(bytearray([6, 15, 25]), kickassassets.unfilterRow(3, bytearray([1, 2, 3]), previous, 1))
+        self.assertEqual(bytearray([11, 22, 33]), kickassassets.unfilterRow(4, bytearray([1, 2, 3]), previous, 1))
+
+    def test_convertsprites_sets_bits_of_non_background_pixels_and_pads_to_64_bytes(self):
+        image = kickassassets.readPng(createImage(48, 21, {(0, 0): WHITE, (23, 20): WHITE, (24, 0): RED}))
+        data = kickassassets.convertSprites(image, {})
+        self.assertEqual(128, len(data))
+        self.assertEqual((0x80, 0x01, 0), (data[0], data[62], data[63]))
+        self.assertEqual(0x80, data[64])
+
+    def test_convertcharset_wrong_size_raises_asset_error(self):
+        image = kickassassets.readPng(createImage(12, 8))
+        with self.assertRaises(kickassassets.KickAssAssetError):
+            kickassassets.convertCharset(image, {})
+
+    def test_convertkoala_writes_load_address_bitmap_screen_colors_and_background(self):
+        pixels = {(0, 0): WHITE, (1, 0): RED, (2, 0): CYAN, (3, 0): CYAN}
+        data = kickassassets.convertKoala(kickassassets.readPng(createImage(160, 200, pixels)), {})
+        self.assertEqual(10003, len(data))
+        self.assertEqual(b'\x00\x60', data[:2])
+        # cyan is the most common color of the cell, then white and red
+        self.assertEqual(0b10110101, data[2])
+        self.assertEqual((3 << 4) | 1, data[2 + 8000])
+        self.assertEqual(2, data[2 + 9000])
+        self.assertEqual(0, data[-1])
+
+    def test_convertkoala_background_setting_must_be_c64_color(self):
+        image = kickassassets.readPng(createImage(160, 200))
+        self.assertEqual(6, kickassassets.convertKoala(image, {'background': 6})[-1])
+        with self.assertRaises(kickassassets.KickAssAssetError):
+            kickassassets.convertKoala(image, {'background': 16})
+
+    def test_converthires_writes_bitmap_and_cell_colors(self):
+        data = kickassassets.convertHires(kickassassets.readPng(createImage(320, 200, {(7, 0): WHITE})), {})
+        self.assertEqual(9000, len(data))
+        self.assertEqual(0x01, data[0])
+        self.assertEqual(0x10, data[8000])
+        self.assertEqual(0x00, data[8001])
+
+class TestKickAssAssetPipeline(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.writeSource('logo.png', createImage(24, 21, {(0, 0): WHITE}))
+
+    def writeSource(self, name, data):
+        with open(os.path.join(self.folder, name), 'wb') as handle:
+            handle.write(data)
+
+    def readOutput(self, name):
+        with open(os.path.join(self.folder, name), 'rb') as handle:
+            return handle.read()
+
+    def run_pipeline(self, steps):
+        return kickassassets.KickAssAssetPipeline(self.folder, 'bin', steps, 2).run()
+
+    def test_run_converts_once_and_then_uses_cached_outputs(self):
+        steps = [{'source': 'logo.png', 'output': 'gfx/logo.bin', 'convert': 'sprites'}]
+        self.assertEqual((1, 1), self.run_pipeline(steps))
+        self.assertEqual(0x80, self.readOutput('gfx/logo.bin')[0])
+        self.assertEqual((0, 0), self.run_pipeline(steps))
+
+    def test_run_changed_source_is_converted_again(self):
+        steps = [{'source': 'logo.png', 'output': 'logo.bin', 'convert': 'sprites'}]
+        self.run_pipeline(steps)
+        self.writeSource('logo.png', createImage(24, 21, {(1, 0): WHITE}))
+        self.assertEqual((1, 1), self.run_pipeline(steps))
+        self.assertEqual(0x40, self.readOutput('logo.bin')[0])
+
+    def test_run_deleted_output_is_written_from_cache_without_converting(self):
+        steps = [{'source': 'logo.png', 'output': 'logo.bin', 'convert': 'sprites'}]
+        self.run_pipeline(steps)
+        os.unlink(os.path.join(self.folder, 'logo.bin'))
+        self.assertEqual((0, 1), self.run_pipeline(steps))
+
+    def test_run_same_conversion_of_same_source_is_converted_once(self):
+        steps = [{'source': 'logo.png', 'output': 'a.bin', 'convert': 'sprites'},
+                 {'source': 'logo.png', 'output': 'b.bin', 'convert': 'sprites'},
+                 {'source': 'logo.png', 'output': 'c.bin', 'convert': 'sprites', 'background': 1}]
+        self.assertEqual((2, 3), self.run_pipeline(steps))
+
+    def test_run_removes_cached_results_no_step_uses(self):
+        self.run_pipeline([{'source': 'logo.png', 'output': 'logo.bin', 'convert': 'sprites'}])
+        self.run_pipeline([{'source': 'logo.png', 'output': 'logo.bin', 'convert': 'sprites', 'background': 1}])
+        cacheFolder = os.path.join(self.folder, 'bin', kickassassets.KickAssAssetPipeline.CACHE_FOLDER)
+        self.assertEqual(2, len(os.listdir(cacheFolder)))
+
+    def test_run_command_step_writes_output_placeholder(self):
+        command = '"%s" -c "import shutil, sys; shutil.copyfile(sys.argv[1], sys.argv[2])" "${source}" "${output}"' % sys.executable
+        self.writeSource('tune.sid', b'PSID')
+        self.assertEqual((1, 1), self.run_pipeline([{'source': 'tune.sid', 'output': 'tune.bin', 'command': command}]))
+        self.assertEqual(b'PSID', self.readOutput('tune.bin'))
+
+    def test_run_invalid_steps_raise_asset_error_with_all_problems(self):
+        steps = [{'source': 'missing.png', 'output': 'a.bin', 'convert': 'sprites'},
+                 {'source': 'logo.png', 'output': 'b.bin', 'convert': 'gif'},
+                 {'source': 'logo.png', 'output': 'c.bin', 'command': 'exit 3'}]
+        with self.assertRaises(kickassassets.KickAssAssetError) as context:
+            self.run_pipeline(steps)
+        self.assertEqual(['missing.png: source file not found',
+                          "logo.png: unknown conversion 'gif', use one of charset, hires, koala, sprites or a command"],
+                         str(context.exception).split('\n'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassbuildcache
+except ImportError:
+    from testglobals import kickassbuildcache
+
+class TestKickAssBuildCache(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.folder, 'bin', 'Startup_BuildCache.json')
+        self.writeFile('Startup.asm', '#import "lib/macros.asm"\n#importif DEBUG "debug.asm"\n.import binary "music.bin"\n')
+        self.writeFile('lib/macros.asm', '.import source "tables.asm"\n')
+        self.writeFile('lib/tables.asm', '.var x = LoadPicture("logo.png")\n')
+        self.writeFile('debug.asm', '// #import "not-imported.asm"\n')
+        self.writeFile('music.bin', 'music')
+        self.writeFile('lib/logo.png', 'logo')
+        self.writeFile('bin/Startup.prg', 'prg')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def writeFile(self, filename, content):
+        path = os.path.join(self.folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        return path
+
+    def createTarget(self):
+        return kickassbuildcache.KickAssBuildCache(self.cacheFile, self.folder)
+
+    def buildAndStore(self):
+        target = self.createTarget()
+        target.isUpToDate('Startup.asm', 'test-command', ['bin/Startup.prg'])
+        target.store(['bin/Startup.prg'])
+
+    def test_parseImports_returns_source_and_binary_imports(self):
+        actual = self.createTarget().parseImports('#import "a.asm"\n#importif !DEBUG "b.asm"\n.import c64 "c.prg"\n.var s = LoadSid("d.sid")\n// #import "e.asm"')
+        self.assertEqual({'sources': ['a.asm', 'b.asm'], 'binaries': ['c.prg', 'd.sid']}, actual)
+
+    def test_scanInputs_returns_all_files_in_import_graph(self):
+        actual = self.createTarget().scanInputs('Startup.asm')
+        expected = [os.path.join(self.folder, f) for f in ['Startup.asm', 'lib/macros.asm', 'lib/tables.asm', 'lib/logo.png', 'debug.asm', 'music.bin']]
+        self.assertEqual(sorted(expected), sorted(actual))
+
+    def test_isUpToDate_no_cache_returns_false(self):
+        actual = self.createTarget().isUpToDate('Startup.asm', 'test-command', ['bin/Startup.prg'])
+        self.assertEqual(False, actual)
+
+    def test_isUpToDate_nothing_changed_returns_true(self):
+        self.buildAndStore()
+        actual = self.createTarget().isUpToDate('Startup.asm', 'test-command', ['bin/Startup.prg'])
+        self.assertEqual(True, actual)
+
+    def test_isUpToDate_imported_file_changed_returns_false(self):
+        self.buildAndStore()
+        self.writeFile('lib/tables.asm', '.var x = LoadPicture("logo2.png")\n')
+        actual = self.createTarget().isUpToDate('Startup.asm', 'test-command', ['bin/Startup.prg'])
+        self.assertEqual(False, actual)
+
+    def test_isUpToDate_binary_file_changed_returns_false(self):
+        self.buildAndStore()
+        self.writeFile('music.bin', 'new music')
+        actual = self.createTarget().isUpToDate('Startup.asm', 'test-command', ['bin/Startup.prg'])
+        self.assertEqual(False, actual)
+
+    def test_isUpToDate_compile_command_changed_returns_false(self):
+        self.buildAndStore()
+        actual = self.createTarget().isUpToDate('Startup.asm', 'test-command -showmem', ['bin/Startup.prg'])
+        self.assertEqual(False, actual)
+
+    def test_isUpToDate_output_removed_returns_false(self):
+        self.buildAndStore()
+        os.unlink(os.path.join(self.folder, 'bin/Startup.prg'))
+        actual = self.createTarget().isUpToDate('Startup.asm', 'test-command', ['bin/Startup.prg'])
+        self.assertEqual(False, actual)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassbuildplan
+except ImportError:
+    from testglobals import kickassbuildplan
+
+class TestKickAssBuildPlanCache(TestCase):
+
+    def setUp(self):
+        self.target = kickassbuildplan.KickAssBuildPlanCache()
+
+    def test_get_stored_plan_with_same_fingerprint_returns_copy_of_plan(self):
+        plan = {'shell_cmd': 'java', 'env': {'a': 'b'}}
+        self.target.store('key', 'fingerprint', plan)
+        actual = self.target.get('key', 'fingerprint')
+        self.assertEqual(plan, actual)
+        self.assertIsNot(plan['env'], actual['env'])
+
+    def test_get_stored_plan_with_other_fingerprint_returns_none(self):
+        self.target.store('key', 'fingerprint', {'shell_cmd': 'java'})
+        self.assertIsNone(self.target.get('key', 'other-fingerprint'))
+
+    def test_store_same_key_with_new_fingerprint_replaces_plan(self):
+        self.target.store('key', 'fingerprint', {'shell_cmd': 'old'})
+        self.target.store('key', 'new-fingerprint', {'shell_cmd': 'new'})
+        self.assertIsNone(self.target.get('key', 'fingerprint'))
+        self.assertEqual({'shell_cmd': 'new'}, self.target.get('key', 'new-fingerprint'))
+
+    def test_store_plan_changed_after_store_does_not_change_stored_plan(self):
+        plan = {'env': {}}
+        self.target.store('key', 'fingerprint', plan)
+        plan['env']['a'] = 'b'
+        self.assertEqual({'env': {}}, self.target.get('key', 'fingerprint'))
+
+    def test_store_without_fingerprint_does_not_store_plan(self):
+        self.target.store('key', None, {'shell_cmd': 'java'})
+        self.assertIsNone(self.target.get('key', None))
+
+    def test_store_more_than_max_plans_drops_old_plans(self):
+        for i in range(self.target.MAX_PLANS + 1):
+            self.target.store(i, 'fingerprint', {})
+        self.assertIsNone(self.target.get(0, 'fingerprint'))
+        self.assertEqual({}, self.target.get(self.target.MAX_PLANS, 'fingerprint'))
+
+    def test_clear_drops_all_plans(self):
+        self.target.store('key', 'fingerprint', {})
+        self.target.clear()
+        self.assertIsNone(self.target.get('key', 'fingerprint'))
+
+if __name__ == '__main__':
+    unittest.main()
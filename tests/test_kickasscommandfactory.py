@@ -51,6 +51,25 @@ class TestKickAssCommandFactory(TestCase):
         createMakeCommand_mock.assert_called_once_with(self.target, {}, buildMode)
         self.assertEqual(0, createKickassCommand_mock.call_count)
 
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createKickassCommand', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createBuildAllCommand', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommand', autospec=True)
+    def test_createCommand_buildmode_is_buildall_createbuildallcommand_is_called_once(self, kickassCommand_mock, createBuildAllCommand_mock, createKickassCommand_mock):
+        buildMode = 'build-all'
+        actual = self.target.createCommand({}, buildMode)
+        createBuildAllCommand_mock.assert_called_once_with(self.target, {}, buildMode)
+        self.assertEqual(0, createKickassCommand_mock.call_count)
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCompileReplayStatement', return_value='mocked-replay', autospec=True)
+    def test_createBuildAllCommand_returns_replay_command_with_targets_compilerequest(self, createreplaystatement_mock):
+        actual = self.target.createBuildAllCommand({}, 'build-all')
+        self.assertEqual('mocked-replay', actual.CommandText)
+        self.assertEqual([], actual.CompileRequest['targets'])
+
+    def test_createCompileCommandText_no_jarpath_setting_exist_returns_correct_compilecommand(self):
+        actual = self.target.createCompileCommandText()
+        self.assertEqual('java cml.kickass.KickAssembler ${kickass_compile_args} ', actual)
+
     @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.getRunScriptStatement', autospec=True)
     @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommand', autospec=True)
     def test_createMakeCommand_makescript_does_not_exist_getrunscriptstatement_is_called_once(self, kickassCommand_mock, getRunScriptStatement_mock):
@@ -163,6 +182,52 @@ class TestKickAssCommandFactory(TestCase):
         actual = self.target.createKickassCommand({}, buildMode)
         kickassCommand_mock.assert_called_once_with('test-pre-statement && java cml.kickass.KickAssembler ${kickass_compile_args}  ${kickass_compile_debug_additional_args} && mocked-moncommand && test-post-statement && ${kickass_debug_command_x64}', True, True, buildMode)
 
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.getRunScriptStatement', return_value=None, autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCompileReplayStatement', return_value='mocked-replay', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommand', autospec=True)
+    def test_createKickassCommand_compileserver_setting_is_true_returns_replay_command_and_compilerequest(self, kickassCommand_mock, createreplaystatement_mock, getRunScriptStatement_mock):
+        buildMode = 'build-run'
+        settings = TestSettings(default_settings_dict)
+        settings.addSetting('kickass_use_compile_server', 'true')
+        target = kickassbuild.KickAssCommandFactory(settings)
+        actual = target.createKickassCommand({}, buildMode)
+        kickassCommand_mock.assert_called_once_with('mocked-replay && ${kickass_run_command_x64}', False, False, buildMode, target.createCompileRequest('java cml.kickass.KickAssembler ${kickass_compile_args} ', False, True, False))
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.getRunScriptStatement', return_value=None, autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createMonCommandsStatement', return_value='mocked-moncommand', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.createCompileReplayStatement', return_value='mocked-replay', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommand', autospec=True)
+    def test_createKickassCommand_compileserver_setting_is_true_and_buildmode_is_builddebug_compilerequest_has_debug_arguments(self, kickassCommand_mock, createreplaystatement_mock, createmonstatement_mock, getRunScriptStatement_mock):
+        buildMode = 'build-debug'
+        settings = TestSettings(default_settings_dict)
+        settings.addSetting('kickass_use_compile_server', 'true')
+        target = kickassbuild.KickAssCommandFactory(settings)
+        actual = target.createKickassCommand({}, buildMode)
+        compileRequest = kickassCommand_mock.call_args[0][4]
+        self.assertEqual('mocked-replay  && mocked-moncommand && ${kickass_debug_command_x64}', kickassCommand_mock.call_args[0][0])
+        self.assertEqual('java cml.kickass.KickAssembler ${kickass_compile_args}  ${kickass_compile_debug_additional_args}', compileRequest['command'])
+        self.assertEqual('${kickass_compile_args} ${kickass_compile_debug_additional_args}', compileRequest['arguments'])
+
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommandFactory.getRunScriptStatement', side_effect=['test-pre-statement', None], autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_build.KickAssCommand', autospec=True)
+    def test_createKickassCommand_compileserver_setting_is_true_and_has_prebuildscript_returns_compilecommand(self, kickassCommand_mock, getRunScriptStatement_mock):
+        buildMode = 'build'
+        settings = TestSettings(default_settings_dict)
+        settings.addSetting('kickass_use_compile_server', 'true')
+        target = kickassbuild.KickAssCommandFactory(settings)
+        actual = target.createKickassCommand({}, buildMode)
+        kickassCommand_mock.assert_called_once_with('test-pre-statement && java cml.kickass.KickAssembler ${kickass_compile_args}', True, False, buildMode)
+
+    def test_createCompileReplayStatement_platform_is_linux_returns_correct_replay_statement(self):
+        self.platform_system.return_value = 'Linux'
+        actual = self.target.createCompileReplayStatement()
+        self.assertEqual('cat \"${kickass_output_path}/${build_file_base_name}_CompileLog.txt\" && [ ! -f \"${kickass_output_path}/${build_file_base_name}_CompileFailed\" ]', actual)
+
+    def test_createCompileReplayStatement_platform_is_windows_returns_correct_replay_statement(self):
+        self.platform_system.return_value = 'Windows'
+        actual = self.target.createCompileReplayStatement()
+        self.assertEqual('type \"${kickass_output_path}\\\\${build_file_base_name}_CompileLog.txt\" && (if exist \"${kickass_output_path}\\\\${build_file_base_name}_CompileFailed\" exit /b 1)', actual)
+
     @patch('platform.system', return_value='Windows', autospec=True)
     def test_getExt_platform_is_windows_returns_bat(self, platform_mock):
         actual = self.target.getExt()
@@ -0,0 +1,62 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+try:
+    from tests.testglobals import kickasscompileserver
+except ImportError:
+    from testglobals import kickasscompileserver
+
+class TestKickAssCompileServer(TestCase):
+
+    def setUp(self):
+        self.popen_patch = patch('subprocess.Popen')
+        self.popen_mock = self.popen_patch.start()
+        self.process_mock = self.popen_mock.return_value
+        self.process_mock.poll.return_value = None
+        self.target = kickasscompileserver.KickAssCompileServer(['java', 'KickAssCompileServer'], 'test-path', {}, [])
+        self.target.start()
+
+    def tearDown(self):
+        self.popen_patch.stop()
+        kickasscompileserver.KickAssCompileServer.stopAll()
+
+    def test_compile_writes_tab_separated_arguments(self):
+        self.process_mock.stdout.readline.side_effect = [b'@@kickass-exit:0\n']
+        self.target.compile(['test file.asm', '-o', 'bin/test.prg'])
+        self.process_mock.stdin.write.assert_called_once_with(b'test file.asm\t-o\tbin/test.prg\n')
+
+    def test_compile_returns_exitcode_and_output(self):
+        self.process_mock.stdout.readline.side_effect = [b'line1\r\n', b'line2\n', b'@@kickass-exit:1\n']
+        actual = self.target.compile(['test.asm'])
+        self.assertEqual((1, 'line1\nline2\n'), actual)
+
+    def test_compile_server_exits_during_request_raises_compileservererror(self):
+        self.process_mock.stdout.readline.side_effect = [b'line1\n', b'']
+        with self.assertRaisesRegex(kickasscompileserver.KickAssCompileServerError, 'exited unexpectedly'):
+            self.target.compile(['test.asm'])
+
+    def test_compile_server_not_running_raises_compileservererror(self):
+        self.process_mock.poll.return_value = 1
+        with self.assertRaisesRegex(kickasscompileserver.KickAssCompileServerError, 'not running'):
+            self.target.compile(['test.asm'])
+
+    def test_getServer_same_command_returns_same_server(self):
+        server1 = kickasscompileserver.KickAssCompileServer.getServer(['java'], 'test-path', {}, [])
+        server2 = kickasscompileserver.KickAssCompileServer.getServer(['java'], 'test-path', {}, [])
+        self.assertIs(server1, server2)
+
+    def test_getServer_server_died_returns_new_server(self):
+        server1 = kickasscompileserver.KickAssCompileServer.getServer(['java'], 'test-path', {}, [])
+        self.process_mock.poll.return_value = 1
+        server2 = kickasscompileserver.KickAssCompileServer.getServer(['java'], 'test-path', {}, [])
+        self.assertIsNot(server1, server2)
+
+    @patch('os.path.getmtime', autospec=True)
+    def test_getServer_watched_file_changed_returns_new_server(self, getmtime_mock):
+        getmtime_mock.return_value = 1
+        server1 = kickasscompileserver.KickAssCompileServer.getServer(['java'], 'test-path', {}, ['KickAss.jar'])
+        getmtime_mock.return_value = 2
+        server2 = kickasscompileserver.KickAssCompileServer.getServer(['java'], 'test-path', {}, ['KickAss.jar'])
+        self.assertIsNot(server1, server2)
+
+if __name__ == '__main__':
+    unittest.main()
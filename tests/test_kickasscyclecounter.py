@@ -0,0 +1,108 @@
+import os
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+try:
+    from tests.testglobals import kickasscycles, kickassquickassembler
+except ImportError:
+    from testglobals import kickasscycles, kickassquickassembler
+
+class TestKickAssCycleCounter(TestCase):
+
+    def count(self, text):
+        fileName = os.path.abspath('main.asm')
+        assembly = kickassquickassembler.KickAssQuickAssembler().assemble(fileName, text)
+        counter = kickasscycles.KickAssCycleCounter(assembly, fileName)
+        return [(lineNumber, kickasscycles.formatCycles(*cycles), kickasscycles.formatCycles(*total))
+                for lineNumber, cycles, total in counter.countLines(1, text.split('\n'))]
+
+    def test_cycle_table_has_cycles_for_each_opcode(self):
+        opcodes = set(opcode for modes in kickassquickassembler.OPCODES.values() for opcode in modes.values())
+        self.assertEqual(set(), opcodes - set(kickasscycles.OPCODE_CYCLES))
+
+    def test_get_cycles_indexed_address_adds_page_cross_cycle_unless_at_page_start(self):
+        self.assertEqual((4, 5), kickasscycles.getCycles(0xbd, 0x1000, 0x1234))
+        self.assertEqual((4, 4), kickasscycles.getCycles(0xbd, 0x1000, 0x1200))
+        self.assertEqual((5, 6), kickasscycles.getCycles(0xb1, 0x1000, 0x00))
+        self.assertEqual((5, 5), kickasscycles.getCycles(0x9d, 0x1000, 0x1234))
+
+    def test_get_cycles_branch_taken_to_other_page_adds_two_cycles(self):
+        self.assertEqual((2, 3), kickasscycles.getCycles(0xd0, 0x1000, 0x1010))
+        self.assertEqual((2, 4), kickasscycles.getCycles(0xd0, 0x10fe, 0x10f0))
+        self.assertEqual((2, 4), kickasscycles.getCycles(0xd0))
+
+    def test_format_cycles_shows_range_only_when_not_exact(self):
+        self.assertEqual('4', kickasscycles.formatCycles(4, 4))
+        self.assertEqual('4-5', kickasscycles.formatCycles(4, 5))
+
+    def test_count_lines_assembled_lines_use_addressing_mode_and_addresses(self):
+        self.assertEqual([(2, '2', '2'), (3, '3', '5'), (4, '4', '9'), (5, '4-5', '13-14'), (7, '2', '15-16'), (8, '2-3', '17-19')],
+                         self.count('*=$1000\nlda #0\nsta $fb\nsta $d020\nlda table,x\n.byte 0\nloop: dex\n    bne loop\n'
+                                    '.label table = $2010\n'))
+
+    def test_count_lines_unknown_operand_is_counted_with_page_cross(self):
+        self.assertEqual([(2, '4-5', '4-5')], self.count('*=$1000\nlda missing,y\n'))
+
+    def test_count_lines_macro_body_is_decoded_without_addresses(self):
+        self.assertEqual([(3, '2', '2'), (4, '4', '6'), (5, '2-4', '8-10')],
+                         self.count('*=$1000\n.macro Wait(count) {\n    ldx #count\n    sta $d020\n    bne *-3\n}\n'))
+
+    def test_count_static_line_without_instruction_is_none(self):
+        for text in ['', '// lda #0', 'label:', '.byte 1, 2', 'Wait(3)']:
+            self.assertIsNone(kickasscycles.KickAssCycleCounter.countStatic(text))
+
+    def test_find_enclosing_block_returns_innermost_block(self):
+        lines = ['.macro Wait() {', '    ldx #8', '!:  {', '    dex', '    }', '}', 'nop']
+        self.assertEqual((0, 5), kickasscycles.findEnclosingBlock(lines, 1))
+        self.assertEqual((2, 4), kickasscycles.findEnclosingBlock(lines, 3))
+        self.assertIsNone(kickasscycles.findEnclosingBlock(lines, 6))
+
+    def test_find_enclosing_block_ignores_braces_in_comments_and_strings(self):
+        lines = ['// {', '.text "{"', '/* {', '*/ nop']
+        self.assertIsNone(kickasscycles.findEnclosingBlock(lines, 3))
+
+class TestKickassShowCyclesCommand(TestCase):
+
+    def setUp(self):
+        self.view_mock = MagicMock()
+        self.view_mock.id.return_value = 1
+        self.view_mock.file_name.return_value = None
+        self.addCleanup(kickasscycles.KickassShowCyclesCommand.clear, self.view_mock)
+
+    @patch('sublime.status_message')
+    def test_run_caret_outside_block_shows_status_message(self, status_message_mock):
+        self.view_mock.sel.return_value = [MagicMock(**{'empty.return_value': True, 'begin.return_value': 0})]
+        self.view_mock.substr.return_value = 'nop\n'
+        self.view_mock.rowcol.return_value = (0, 0)
+        kickasscycles.KickassShowCyclesCommand(self.view_mock).run(None)
+        self.assertEqual(0, self.view_mock.add_regions.call_count)
+        self.assertEqual(1, status_message_mock.call_count)
+
+    def test_run_clear_erases_regions(self):
+        kickasscycles.KickassShowCyclesCommand(self.view_mock).run(None, clear=True)
+        self.view_mock.erase_regions.assert_called_with('kickass_cycles')
+        self.assertFalse(kickasscycles.KickassShowCyclesCommand.isShown(self.view_mock))
+
+    def countRegions(self, text, changed):
+        counts = kickasscycles.KickassShowCyclesCommand.countRegions(1, os.path.abspath('main.asm'), text, [(0, 4)], changed)
+        return [(lineNumber, kickasscycles.formatCycles(*cycles)) for lineNumber, cycles, total in counts[0]]
+
+    def test_countregions_changed_counts_only_changed_lines_again(self):
+        with patch.object(kickassquickassembler.KickAssQuickAssembler, 'assemble', autospec=True,
+                          side_effect=kickassquickassembler.KickAssQuickAssembler.assemble) as assemble_mock:
+            self.assertEqual([(2, '2'), (3, '2-3'), (4, '2')], self.countRegions('*=$1000\nloop: dex\n    bne loop\n    nop\n', False))
+            self.assertEqual([(2, '2'), (3, '2-3'), (4, '5')], self.countRegions('*=$1000\nloop: dex\n    bne loop\n    inc $10\n', True))
+            # Lines after inserted lines keep their counts
+            self.assertEqual([(3, '2'), (4, '2-3'), (5, '5')], self.countRegions('*=$1000\n// loop\nloop: dex\n    bne loop\n    inc $10\n', True))
+            self.assertEqual(1, assemble_mock.call_count)
+
+    def test_countregions_changed_block_comment_assembles_whole_file_again(self):
+        with patch.object(kickassquickassembler.KickAssQuickAssembler, 'assemble', autospec=True,
+                          side_effect=kickassquickassembler.KickAssQuickAssembler.assemble) as assemble_mock:
+            self.countRegions('*=$1000\nloop: dex\n    bne loop\n    nop\n', False)
+            # The commented out label is no longer the known branch target
+            self.assertEqual([(3, '2-4')], self.countRegions('*=$1000\n/*loop: dex\n*/    bne loop\n    nop\n', True)[:1])
+            self.assertEqual(2, assemble_mock.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+try:
+    from tests.testglobals import kickassexec, kickassprofiler
+except ImportError:
+    from testglobals import kickassexec, kickassprofiler
+
+class TestKickassExecCommand(TestCase):
+
+    def setUp(self):
+        self.window_mock = MagicMock()
+        self.window_mock.views.return_value = []
+        self.target = kickassexec.KickassExecCommand(self.window_mock)
+
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_run_disables_default_inline_errors(self, run_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work')
+        run_mock.assert_called_once_with(self.target, shell_cmd='test-command', working_dir='/work')
+        self.assertFalse(self.target.show_errors_inline)
+        self.assertIsNotNone(self.target.Parser)
+
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_run_kill_does_not_reset_parser(self, run_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work')
+        parser = self.target.Parser
+        self.target.run(kill=True)
+        self.assertIs(parser, self.target.Parser)
+
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickassExecCommand.killProcessTree', autospec=True)
+    def test_run_kill_kills_process_tree(self, killProcessTree_mock, run_mock):
+        self.target.run(kill=True)
+        killProcessTree_mock.assert_called_once_with(self.target)
+        run_mock.assert_called_once_with(self.target, kill=True)
+
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickassExecCommand.isShowingErrorsInline', return_value=True)
+    def test_run_update_annotations_only_does_not_start_build(self, isShowingErrorsInline_mock, run_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work')
+        parser = self.target.Parser
+        with patch.object(self.target, 'hideMessages') as hideMessages_mock:
+            self.target.run(update_annotations_only=True)
+        hideMessages_mock.assert_not_called()
+        run_mock.assert_called_with(self.target, update_annotations_only=True)
+        self.assertIs(parser, self.target.Parser)
+
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickassExecCommand.isShowingErrorsInline', return_value=False)
+    def test_run_update_annotations_only_with_inline_errors_turned_off_hides_messages(self, isShowingErrorsInline_mock, run_mock):
+        with patch.object(self.target, 'hideMessages') as hideMessages_mock:
+            self.target.run(update_annotations_only=True)
+        hideMessages_mock.assert_called_once_with()
+        run_mock.assert_called_once_with(self.target, update_annotations_only=True)
+
+    @patch('platform.system', return_value='Linux')
+    @patch('os.kill')
+    @patch('subprocess.check_output')
+    def test_killprocesstree_kills_children_before_shell_is_killed(self, check_output_mock, kill_mock, system_mock):
+        self.target.proc = MagicMock()
+        self.target.proc.proc.pid = 10
+        self.target.proc.proc.poll.return_value = None
+        check_output_mock.side_effect = lambda args: {'10': b'11\n', '11': b'12\n'}.get(args[2], b'')
+        self.target.killProcessTree()
+        self.assertEqual([12, 11], [c[0][0] for c in kill_mock.call_args_list])
+
+    @patch('os.kill')
+    def test_killprocesstree_process_has_finished_nothing_is_killed(self, kill_mock):
+        self.target.proc = MagicMock()
+        self.target.proc.proc.poll.return_value = 0
+        self.target.killProcessTree()
+        self.assertEqual(0, kill_mock.call_count)
+
+    @patch('sublime.set_timeout', side_effect=lambda callback, delay=0: callback())
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickassExecCommand.showMessages', autospec=True)
+    @patch('Default.exec.ExecCommand.on_data', autospec=True)
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_on_data_shows_messages_before_process_finishes(self, run_mock, on_data_mock, showMessages_mock, timeout_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work', encoding='utf-8')
+        self.target.encoding = 'utf-8'
+        self.target.on_data(None, b"  (/work/test-file.asm 5:9) Error\n")
+        self.assertEqual(1, showMessages_mock.call_count)
+        self.assertEqual(5, showMessages_mock.call_args[0][1][0].line)
+        on_data_mock.assert_called_once_with(self.target, None, b"  (/work/test-file.asm 5:9) Error\n")
+
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickassExecCommand.updateView', autospec=True)
+    def test_showmessages_updates_only_open_views(self, updateView_mock):
+        view_mock = MagicMock()
+        self.window_mock.find_open_file.side_effect = lambda f: view_mock if f == '/work/a.asm' else None
+        message = kickassexec.BuildMessage('error', '/work/a.asm', 1, 1, 'Error')
+        self.target.showMessages([message, kickassexec.BuildMessage('error', '/work/b.asm', 1, 1, 'Error')])
+        updateView_mock.assert_called_once_with(self.target, view_mock, [message])
+
+    @patch('sublime.set_timeout_async', side_effect=lambda callback, delay=0: callback())
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssWatch.reload')
+    @patch('Default.exec.ExecCommand.on_finished', autospec=True)
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_on_finished_build_succeeded_loads_program_into_emulator(self, run_mock, on_finished_mock, reload_mock, timeout_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work', reload_program='/work/bin/test.prg')
+        run_mock.assert_called_once_with(self.target, shell_cmd='test-command', working_dir='/work')
+        proc = MagicMock(killed=False)
+        proc.exit_code.return_value = 0
+        self.target.on_finished(proc)
+        reload_mock.assert_called_once_with(self.window_mock.id.return_value, '/work/bin/test.prg')
+
+    @patch('sublime.set_timeout_async', side_effect=lambda callback, delay=0: callback())
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssWatch.reload')
+    @patch('Default.exec.ExecCommand.on_finished', autospec=True)
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_on_finished_build_failed_does_not_load_program(self, run_mock, on_finished_mock, reload_mock, timeout_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work', reload_program='/work/bin/test.prg')
+        proc = MagicMock(killed=False)
+        proc.exit_code.return_value = 1
+        self.target.on_finished(proc)
+        self.assertEqual(0, reload_mock.call_count)
+
+    @patch('sublime.set_timeout_async', side_effect=lambda callback, delay=0: callback())
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssOutputCleaner', autospec=True)
+    @patch('Default.exec.ExecCommand.on_finished', autospec=True)
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_on_finished_records_files_written_to_output_folder_unless_killed(self, run_mock, on_finished_mock, cleaner_mock, timeout_mock):
+        self.target.run(shell_cmd='test-command', working_dir='/work', record_output_folder='/work/bin')
+        run_mock.assert_called_once_with(self.target, shell_cmd='test-command', working_dir='/work')
+        self.target.on_finished(MagicMock(killed=True))
+        self.assertEqual(0, cleaner_mock.call_count)
+        self.target.on_finished(MagicMock(killed=False))
+        cleaner_mock.assert_called_once_with('/work/bin')
+        cleaner_mock.return_value.recordBuild.assert_called_once_with()
+
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssProfiler.finishBuild')
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssProfiler.getBuild')
+    @patch('Default.exec.ExecCommand.on_data', autospec=True)
+    @patch('Default.exec.ExecCommand.on_finished', autospec=True)
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_on_finished_reports_assembler_runtime_and_emulator_launch_of_build(self, run_mock, on_finished_mock, on_data_mock, getBuild_mock, finishBuild_mock):
+        timer = kickassprofiler.KickAssTimer('build-and-run')
+        getBuild_mock.return_value = timer
+        self.target.run(shell_cmd='test-command', working_dir='/work', encoding='utf-8')
+        self.target.encoding = 'utf-8'
+        self.target.on_data(None, b"Writing prg file: bin/test.prg\n")
+        self.target.on_data(None, b"*** VICE Version 3.5 ***\n")
+        self.target.on_finished(MagicMock(killed=False))
+        self.assertEqual(['assembler runtime', 'emulator launch'], list(timer.Phases))
+        finishBuild_mock.assert_called_once_with(self.window_mock.id.return_value, timer)
+
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssProfiler.finishBuild')
+    @patch('SublimeKickAssemblerC64.kickass_exec.KickAssProfiler.getBuild')
+    @patch('Default.exec.ExecCommand.on_finished', autospec=True)
+    @patch('Default.exec.ExecCommand.run', autospec=True)
+    def test_on_finished_assembler_timed_by_compile_request_is_not_timed_again(self, run_mock, on_finished_mock, getBuild_mock, finishBuild_mock):
+        timer = kickassprofiler.KickAssTimer('build')
+        timer.add('assembler runtime', 2.0)
+        getBuild_mock.return_value = timer
+        self.target.run(shell_cmd='test-command', working_dir='/work')
+        self.target.on_finished(MagicMock(killed=False))
+        self.assertEqual({'assembler runtime': 2.0}, dict(timer.Phases))
+
+if __name__ == '__main__':
+    unittest.main()
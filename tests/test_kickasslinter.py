@@ -0,0 +1,129 @@
+import os
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+try:
+    from tests.testglobals import kickasslint
+except ImportError:
+    from testglobals import kickasslint
+
+REGISTERS = {0xd013: 'read-only', 0xd400: 'write-only', 0xd419: 'read-only'}
+
+class TestKickAssLinter(TestCase):
+
+    def setUp(self):
+        self.target = kickasslint.KickAssLinter(REGISTERS)
+
+    def lint(self, text, isPseudoCommand=None):
+        return [(m.line, m.column, m.length, m.text) for m in self.target.update(text, isPseudoCommand)]
+
+    def test_load_register_access_finds_read_only_and_write_only_registers_of_help_files(self):
+        helpFolder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'helpdb')
+        access = kickasslint.loadRegisterAccess([helpFolder])
+        self.assertEqual('read-only', access[0xd419])
+        self.assertEqual('read-only', access[0xd013])
+        self.assertEqual('write-only', access[0xd400])
+        self.assertNotIn(0xd020, access)
+
+    def test_update_unknown_mnemonic_and_illegal_addressing_mode_are_errors(self):
+        self.assertEqual([(1, 5, 3, "Unknown mnemonic 'ldz'"), (2, 5, 9, 'Illegal addressing mode for stx'),
+                          (3, 5, 11, 'Illegal addressing mode for stx')],
+                         self.lint('    ldz #1\n    stx $10,x\n    stx $1234,y\n    stx $12,y\n    lda ($fb),y\n'))
+
+    def test_update_immediate_operand_with_index_is_illegal_addressing_mode(self):
+        self.assertEqual([(1, 5, 10, 'Illegal addressing mode for lda')], self.lint('    lda #$10,x\n    lda #$10\n'))
+
+    def test_update_shifts_and_rotates_with_accumulator_operand_are_not_errors(self):
+        self.assertEqual([], self.lint('    asl a\n    lsr A\n    rol a\n    ror a\n'))
+
+    def test_update_pseudocommands_are_not_unknown_mnemonics(self):
+        text = '.pseudocommand mov src : tar {\n    lda src\n    sta tar\n}\n    mov #1 : $d020\n    add16 a : b\n'
+        self.assertEqual([], self.lint(text, lambda name: name == 'add16'))
+
+    def test_update_duplicate_labels_in_same_scope_are_errors(self):
+        self.assertEqual([(4, 1, 5, "Duplicate label 'start', first defined on line 1")],
+                         self.lint('start: nop\n!: nop\n!: nop\nstart: rts\nirq: {\nstart: rti\n}\n'))
+
+    def test_update_duplicate_constants_are_errors(self):
+        self.assertEqual([(2, 8, 4, "Duplicate label 'SIZE', first defined on line 1")],
+                         self.lint('.const SIZE = 1\n.const SIZE = 2\n'))
+
+    def test_update_register_accesses_with_literals_and_constants_are_warnings(self):
+        self.assertEqual([(2, 5, 9, 'Write to read-only register $D419'), (3, 5, 7, 'Read of write-only register $D400'),
+                          (4, 5, 11, 'Write to read-only register $D419'), (5, 5, 9, 'Write to read-only register $D013')],
+                         self.lint('.const SID = $d400\n    sta $d419\n    lda SID\n    sta SID+$19\n    inc $d013\n'
+                                   '    lda $d419\n    sta $d400\n    sta $d419,x\n'))
+
+    def test_update_mirrored_register_accesses_are_warnings(self):
+        self.assertEqual([(1, 5, 9, 'Write to read-only register $D439 (SID, mirror of $D419)'),
+                          (2, 5, 9, 'Write to read-only register $D053 (VIC-II, mirror of $D013)')],
+                         self.lint('    sta $d439\n    sta $d053\n    lda $d459\n'))
+
+    def test_update_comments_and_enum_values_are_not_checked(self):
+        self.assertEqual([], self.lint('// ldz #1\n/* ldz\n   ldz */ nop\n.enum { RED,\n    GREEN }\n'))
+
+    def test_update_typing_on_a_line_lints_only_that_line(self):
+        text = '\n'.join('part%d: lda #%d' % (n, n) for n in range(100))
+        self.lint(text)
+        self.assertEqual([(51, 9, 3, "Unknown mnemonic 'ldz'")], self.lint(text.replace('part50: lda', 'part50: ldz')))
+        self.assertEqual(1, self.target.LintedCount)
+
+    def test_update_opening_block_comment_lints_following_lines_again(self):
+        self.lint('nop\nldz #1\nnop\nnop\n')
+        self.assertEqual([], self.lint('/*nop\nldz #1\nnop*/\nnop\n'))
+        self.assertEqual(3, self.target.LintedCount)
+
+    def test_update_inserted_and_removed_lines_move_messages(self):
+        self.lint('start: nop\n    ldz #1\nstart: nop\n')
+        self.assertEqual([(4, 5, 3, "Unknown mnemonic 'ldz'"), (5, 1, 5, "Duplicate label 'start', first defined on line 2")],
+                         self.lint('\nstart: nop\n\n    ldz #1\nstart: nop\n'))
+        self.assertEqual([(2, 1, 5, "Duplicate label 'start', first defined on line 1")], self.lint('start: nop\nstart: nop\n'))
+
+    def test_update_renamed_label_removes_duplicate(self):
+        text = 'start: nop\n    nop\nstart: nop\n'
+        self.lint(text)
+        self.assertEqual([], self.lint(text.replace('start: nop\n    nop', 'begin: nop\n    nop')))
+        self.assertEqual([(3, 1, 5, "Duplicate label 'start', first defined on line 1")], self.lint(text))
+
+    def test_update_same_text_is_not_linted_again(self):
+        self.lint('nop\n')
+        self.lint('nop\n')
+        self.assertEqual(0, self.target.LintedCount)
+
+class TestKickassLintListener(TestCase):
+
+    def setUp(self):
+        self.view_mock = MagicMock()
+        self.view_mock.id.return_value = 1
+        self.view_mock.window.return_value = None
+        self.view_mock.match_selector.return_value = True
+        self.view_mock.change_count.return_value = 1
+        self.view_mock.substr.return_value = '    ldz #1\n'
+        self.view_mock.text_point.side_effect = lambda row, column: row * 100 + column
+        self.settings = {'kickass_lint': 'true'}
+        patcher = patch.object(kickasslint.KickAssSettings, 'forView',
+                               return_value=kickasslint.KickAssSettings(self.settings, None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(kickasslint.KickassLintListener, 'getRegisterAccess', return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.target = kickasslint.KickassLintListener()
+        self.addCleanup(self.target.on_close, self.view_mock)
+
+    def test_on_activated_async_marks_errors_with_regions(self):
+        self.target.on_activated_async(self.view_mock)
+        self.assertEqual(('kickass_lint_errors', [kickasslint.sublime.Region(4, 7)]), self.view_mock.add_regions.call_args_list[0][0][:2])
+
+    def test_on_activated_async_same_change_count_is_not_linted_again(self):
+        self.target.on_activated_async(self.view_mock)
+        self.target.on_activated_async(self.view_mock)
+        self.assertEqual(1, self.view_mock.substr.call_count)
+
+    def test_on_modified_async_disabled_does_not_lint(self):
+        self.settings['kickass_lint'] = 'false'
+        self.target.on_modified_async(self.view_mock)
+        self.assertEqual(0, self.view_mock.add_regions.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
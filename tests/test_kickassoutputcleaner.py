@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+try:
+    from tests.testglobals import kickassoutputcleanup
+except ImportError:
+    from testglobals import kickassoutputcleanup
+
+class TestKickAssOutputCleaner(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.outputFolder = os.path.join(self.folder, 'bin')
+        os.makedirs(self.outputFolder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def writeFile(self, relativePath, text='data', mtime=1000):
+        path = os.path.join(self.outputFolder, relativePath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        os.utime(path, (mtime, mtime))
+
+    def listFiles(self):
+        return sorted(kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder).listFiles())
+
+    def test_removestale_without_manifest_removes_all_files_and_folders(self):
+        self.writeFile('test.prg')
+        self.writeFile(os.path.join('sub', 'test.d64'))
+        kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder).removeStale()
+        self.assertEqual(['.kickass_manifest.json'], self.listFiles())
+        self.assertFalse(os.path.isdir(os.path.join(self.outputFolder, 'sub')))
+
+    def test_removestale_keeps_files_matching_keep_patterns(self):
+        self.writeFile('test.prg')
+        self.writeFile('test_ViceLog.txt')
+        kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder, ['*_ViceLog.txt']).removeStale()
+        self.assertIn('test_ViceLog.txt', self.listFiles())
+        self.assertNotIn('test.prg', self.listFiles())
+
+    def test_removestale_keeps_asset_cache(self):
+        self.writeFile(os.path.join('AssetCache', 'manifest.json'))
+        kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder).removeStale()
+        self.assertIn(os.path.join('AssetCache', 'manifest.json'), self.listFiles())
+
+    def test_removestale_removes_only_files_last_build_did_not_write(self):
+        target = kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder)
+        self.writeFile('old.prg')
+        target.removeStale()
+        self.writeFile('test.prg')
+        self.assertEqual(['test.prg'], target.recordBuild())
+        self.writeFile('renamed.prg')
+        self.assertEqual(['renamed.prg'], target.removeStale())
+        self.assertEqual(['.kickass_manifest.json', 'test.prg'], self.listFiles())
+
+    def test_recordbuild_counts_changed_files_as_written(self):
+        target = kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder, ['*.d64'])
+        self.writeFile('disk.d64')
+        self.writeFile('notes.txt')
+        target.removeStale()
+        self.writeFile('disk.d64', 'changed', mtime=2000)
+        self.assertEqual(['disk.d64'], target.recordBuild())
+
+    def test_recordbuild_build_writing_nothing_keeps_outputs_of_build_before(self):
+        target = kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder)
+        target.removeStale()
+        self.writeFile('test.prg')
+        target.recordBuild()
+        target.removeStale()
+        self.assertEqual([], target.recordBuild())
+        self.assertEqual([], target.removeStale())
+        self.assertIn('test.prg', self.listFiles())
+
+    def test_renameanddelete_replaces_folder_and_keeps_files_matching_keep_patterns(self):
+        self.writeFile('test.prg')
+        self.writeFile(os.path.join('logs', 'test_ViceLog.txt'))
+        thread = kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder, ['*_ViceLog.txt']).renameAndDelete()
+        thread.join()
+        self.assertEqual([os.path.join('logs', 'test_ViceLog.txt')], self.listFiles())
+        self.assertEqual(['bin'], os.listdir(self.folder))
+
+    def test_renameanddelete_folder_can_not_be_renamed_deletes_files_in_place(self):
+        self.writeFile('test.prg')
+        self.writeFile('test_ViceLog.txt')
+        with patch('os.rename', side_effect=PermissionError('in use')):
+            self.assertIsNone(kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder, ['*_ViceLog.txt']).renameAndDelete())
+        self.assertEqual(['test_ViceLog.txt'], self.listFiles())
+
+    def test_renameanddelete_deletes_old_folders_left_behind(self):
+        os.makedirs(os.path.join(self.folder, 'bin.kickass-old-1'))
+        kickassoutputcleanup.KickAssOutputCleaner(self.outputFolder).renameAndDelete().join()
+        self.assertEqual(['bin'], os.listdir(self.folder))
+
+if __name__ == '__main__':
+    unittest.main()
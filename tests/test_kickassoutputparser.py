@@ -0,0 +1,79 @@
+import os
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassbuildoutput
+except ImportError:
+    from testglobals import kickassbuildoutput
+
+OUTPUT = """parsing
+flex pass 1
+Got 1 errors while executing:
+  (test-path/test-file.asm 5:9) Unknown symbol 'foo'
+
+Memory Map
+----------
+Default-segment:
+  $0801-$080c Basic
+  $0810-$0a3f Unnamed
+
+Code-segment:
+  $1000-$10ff Code
+Writing prg file: bin/test-file.prg
+  (lib.asm 3:1) Warning: Unused label
+"""
+
+class TestKickAssOutputParser(TestCase):
+
+    def setUp(self):
+        self.target = kickassbuildoutput.KickAssOutputParser('/work')
+
+    def test_feed_parses_error_message(self):
+        records = self.target.feed("  (/src/test-file.asm 5:9) Unknown symbol 'foo'\n")
+        self.assertEqual([kickassbuildoutput.BuildMessage('error', '/src/test-file.asm', 5, 9, "Unknown symbol 'foo'")], records)
+
+    def test_feed_relative_filename_is_resolved_against_working_dir(self):
+        records = self.target.feed("  (test-file.asm 5:9) Error\n")
+        self.assertEqual(os.path.normpath('/work/test-file.asm'), records[0].file)
+
+    def test_feed_message_without_line_and_column_defaults_to_one(self):
+        records = self.target.feed("  (/src/test-file.asm :) Error\n")
+        self.assertEqual((1, 1), (records[0].line, records[0].column))
+
+    def test_feed_message_starting_with_warning_is_warning(self):
+        records = self.target.feed("  (/src/lib.asm 3:1) Warning: Unused label\n")
+        self.assertEqual('warning', records[0].kind)
+
+    def test_feed_message_in_warnings_section_is_warning(self):
+        records = self.target.feed("Got 2 warnings:\n  (/src/lib.asm 3:1) Unused label\n")
+        self.assertEqual('warning', records[0].kind)
+
+    def test_feed_incomplete_line_is_parsed_when_completed(self):
+        self.assertEqual([], self.target.feed("  (/src/test-file.asm 5:9) Unkn"))
+        records = self.target.feed("own symbol 'foo'\r\n")
+        self.assertEqual("Unknown symbol 'foo'", records[0].text)
+
+    def test_flush_parses_last_line_without_newline(self):
+        self.target.feed("  (/src/test-file.asm 5:9) Error")
+        self.assertEqual(1, len(self.target.flush()))
+        self.assertEqual([], self.target.flush())
+
+    def test_feed_parses_memory_map_blocks_with_segments(self):
+        self.target.feed(OUTPUT)
+        self.assertEqual([kickassbuildoutput.MemoryBlock('Default', 0x0801, 0x080c, 'Basic'),
+                          kickassbuildoutput.MemoryBlock('Default', 0x0810, 0x0a3f, 'Unnamed'),
+                          kickassbuildoutput.MemoryBlock('Code', 0x1000, 0x10ff, 'Code')], self.target.MemoryMap)
+
+    def test_feed_message_after_memory_map_is_parsed(self):
+        self.target.feed(OUTPUT)
+        self.assertEqual(1, len(self.target.Errors))
+        self.assertEqual(1, len(self.target.Warnings))
+        self.assertEqual(os.path.normpath('/work/lib.asm'), self.target.Warnings[0].file)
+
+    def test_feed_parses_written_output_files(self):
+        records = self.target.feed("Writing prg file: bin/test-file.prg\nWriting Vice symbol file: bin/test-file.vs\n")
+        self.assertEqual([kickassbuildoutput.OutputFile('prg', 'bin/test-file.prg'),
+                          kickassbuildoutput.OutputFile('Vice symbol', 'bin/test-file.vs')], records)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+try:
+    from tests.testglobals import kickassprofiler
+except ImportError:
+    from testglobals import kickassprofiler
+
+KickAssProfiler = kickassprofiler.KickAssProfiler
+KickAssTimer = kickassprofiler.KickAssTimer
+
+class TestKickAssProfiler(TestCase):
+
+    def setUp(self):
+        KickAssProfiler.clear()
+        self.folder = tempfile.mkdtemp()
+        self.settings = {}
+        self.window_mock = MagicMock()
+        self.window_mock.project_data.return_value = None
+        self.window_mock.active_view.return_value.settings.return_value = self.settings
+        patcher = patch('sublime.active_window', create=True, return_value=self.window_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        kickassprofiler.KickAssSettings.invalidateAll()
+
+    def tearDown(self):
+        KickAssProfiler.clear()
+        shutil.rmtree(self.folder)
+
+    def test_timer_phase_entered_twice_adds_up_time(self):
+        target = KickAssTimer('build')
+        with patch('time.perf_counter', side_effect=[1.0, 1.5, 2.0, 2.25]):
+            with target.phase('annotation parse'):
+                pass
+            with target.phase('annotation parse'):
+                pass
+        self.assertEqual({'annotation parse': 0.75}, dict(target.Phases))
+
+    def test_phase_with_active_timer_adds_to_timer_and_records_nothing(self):
+        timer = KickAssTimer('build')
+        with KickAssProfiler.activate(timer):
+            with KickAssProfiler.phase('folder cleanup'):
+                pass
+        self.assertTrue(timer.has('folder cleanup'))
+        self.assertEqual([], KickAssProfiler.getSummary())
+
+    def test_phase_without_active_timer_is_recorded_on_its_own(self):
+        with KickAssProfiler.phase('tooltip render'):
+            pass
+        self.assertEqual(['tooltip render'], [s[0] for s in KickAssProfiler.getSummary()])
+
+    def test_activate_timer_is_only_active_on_its_thread(self):
+        timer = KickAssTimer('build')
+        active = []
+        with KickAssProfiler.activate(timer):
+            thread = threading.Thread(target=lambda: active.append(KickAssProfiler.getActive()))
+            thread.start()
+            thread.join()
+            self.assertIs(timer, KickAssProfiler.getActive())
+        self.assertEqual([None], active)
+        self.assertIsNone(KickAssProfiler.getActive())
+
+    def test_finishbuild_records_timings_of_current_build_once(self):
+        timer = KickAssTimer('build')
+        timer.add('settings load', 0.002)
+        KickAssProfiler.startBuild(1, timer)
+        KickAssProfiler.finishBuild(1, timer)
+        KickAssProfiler.finishBuild(1, timer)
+        self.assertEqual([('settings load', 1, 0.002, 0.002, 0.002)], KickAssProfiler.getSummary())
+        self.assertIsNone(KickAssProfiler.getBuild(1))
+
+    def test_finishbuild_superseded_build_is_not_recorded(self):
+        first = KickAssTimer('build')
+        first.add('settings load', 0.001)
+        KickAssProfiler.startBuild(1, first)
+        KickAssProfiler.startBuild(1, KickAssTimer('build'))
+        KickAssProfiler.finishBuild(1, first)
+        self.assertEqual([], KickAssProfiler.getSummary())
+
+    def test_getsummary_averages_last_history_size_samples_in_phase_order(self):
+        for n in range(KickAssProfiler.HISTORY_SIZE + 5):
+            KickAssProfiler.record('build', {'assembler runtime': float(n), 'custom phase': 1.0, 'settings load': 1.0})
+        summary = KickAssProfiler.getSummary()
+        self.assertEqual(['settings load', 'assembler runtime', 'custom phase'], [s[0] for s in summary])
+        self.assertEqual((KickAssProfiler.HISTORY_SIZE, 24.0, 14.5, 24.0), summary[1][1:])
+
+    @patch('builtins.print')
+    def test_record_profile_disabled_prints_nothing(self, print_mock):
+        KickAssProfiler.record('build', {'settings load': 0.001})
+        self.assertEqual(0, print_mock.call_count)
+
+    @patch('builtins.print')
+    def test_record_profile_enabled_prints_phases_and_total(self, print_mock):
+        self.settings['kickass_profile'] = 'true'
+        KickAssProfiler.record('build', {'settings load': 0.001, 'assembler runtime': 0.5})
+        print_mock.assert_called_once_with("KickAss timings build: settings load 1.0 ms, assembler runtime 500.0 ms, total 501.0 ms")
+
+    @patch('builtins.print')
+    def test_record_profile_enabled_in_project_settings_prints_phases(self, print_mock):
+        self.window_mock.project_data.return_value = {'settings': {'kickass_profile': True}}
+        KickAssProfiler.record('build', {'settings load': 0.001})
+        self.assertEqual(1, print_mock.call_count)
+
+    @patch('builtins.print')
+    def test_record_reads_settings_through_cached_snapshot(self, print_mock):
+        self.settings['kickass_profile'] = True
+        KickAssProfiler.record('build', {'settings load': 0.001})
+        KickAssProfiler.record('tooltip render', {'tooltip render': 0.0005})
+        self.assertEqual(1, self.window_mock.project_data.call_count)
+
+    @patch('builtins.print')
+    def test_record_trace_file_set_appends_json_line_per_record(self, print_mock):
+        traceFile = os.path.join(self.folder, 'trace.jsonl')
+        self.settings.update({'kickass_profile': True, 'kickass_profile_trace_file': traceFile})
+        KickAssProfiler.record('build', {'settings load': 0.001})
+        KickAssProfiler.record('tooltip render', {'tooltip render': 0.0005})
+        with open(traceFile) as handle:
+            lines = [json.loads(line) for line in handle]
+        self.assertEqual([('build', {'settings load': 1.0}), ('tooltip render', {'tooltip render': 0.5})],
+                         [(line['name'], line['phases_ms']) for line in lines])
+
+    def test_showtimings_command_shows_summary_in_output_panel(self):
+        KickAssProfiler.record('build', {'settings load': 0.001})
+        window_mock = MagicMock()
+        kickassprofiler.KickassShowTimingsCommand(window_mock).run()
+        text = window_mock.create_output_panel.return_value.run_command.call_args[0][1]['characters']
+        self.assertIn('settings load', text)
+        window_mock.run_command.assert_called_once_with('show_panel', {'panel': 'output.kickass_timings'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+try:
+    from tests.testglobals import kickassquickassembler
+except ImportError:
+    from testglobals import kickassquickassembler
+
+class TestKickAssQuickAssembler(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.target = kickassquickassembler.KickAssQuickAssembler()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, relativePath):
+        return os.path.join(self.folder, relativePath)
+
+    def writeFile(self, relativePath, text):
+        os.makedirs(os.path.dirname(self.path(relativePath)), exist_ok=True)
+        with open(self.path(relativePath), 'w') as handle:
+            handle.write(text)
+
+    def assemble(self, text):
+        return self.target.assemble(self.path('main.asm'), text)
+
+    def getBytes(self, assembly):
+        return b''.join(line.data for line in assembly.Lines)
+
+    def test_opcode_tables_cover_mnemonics_of_help_files(self):
+        helpFolder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'helpdb')
+        for fileName in ['opcodes.json', 'illegal-opcodes.json']:
+            with open(os.path.join(helpFolder, fileName)) as handle:
+                mnemonics = set(json.load(handle))
+            self.assertEqual(set(), mnemonics - set(kickassquickassembler.OPCODES))
+
+    def test_opcode_tables_have_each_opcode_once(self):
+        opcodes = [opcode for modes in kickassquickassembler.OPCODES.values() for opcode in modes.values()]
+        self.assertEqual(len(opcodes), len(set(opcodes)))
+
+    def test_assemble_encodes_addressing_modes(self):
+        assembly = self.assemble('*=$1000\nlda #$01\nsta $d020\nsta $fb\nlda $10,x\nldx $10,y\nlda $1234,y\n'
+                                 'lda ($fb),y\nlda ($fb,x)\njmp ($fffc)\nasl\n')
+        self.assertEqual([], assembly.Messages)
+        self.assertEqual(bytes.fromhex('a901 8d20d0 85fb b510 b610 b93412 b1fb a1fb 6cfcff 0a'), self.getBytes(assembly))
+
+    def test_assemble_illegal_opcodes_are_encoded(self):
+        assembly = self.assemble('lax $fb\nsax $d020\nsbx #$10\nslo ($fb),y\n')
+        self.assertEqual(bytes.fromhex('a7fb 8f20d0 cb10 13fb'), self.getBytes(assembly))
+
+    def test_assemble_forward_label_uses_absolute_mode_and_label_address(self):
+        assembly = self.assemble('*=$c000\n    jmp end\n    lda data\nend: rts\n.label data = $fb\n')
+        self.assertEqual(bytes.fromhex('4c06c0 adfb00 60'), self.getBytes(assembly))
+
+    def test_assemble_branches_to_labels_and_multi_labels(self):
+        assembly = self.assemble('*=$1000\nloop: dex\n    bne loop\n!:  iny\n    beq !+\n    bne !-\n!:  rts\n')
+        self.assertEqual(bytes.fromhex('ca d0fd c8 f002 d0fb 60'), self.getBytes(assembly))
+
+    def test_assemble_branch_out_of_range_is_error(self):
+        assembly = self.assemble('*=$1000\nstart: .fill 200, 0\n    bne start\n')
+        self.assertEqual([(3, 'Branch out of range: -202 bytes')], [(m.line, m.text) for m in assembly.Errors])
+
+    def test_assemble_undefined_label_is_error(self):
+        assembly = self.assemble('    jmp missing\n    lda #BLACK\n')
+        self.assertEqual([(1, 5, "Unknown symbol 'missing'")], [(m.line, m.column, m.text) for m in assembly.Errors])
+
+    def test_assemble_unknown_mnemonic_and_illegal_addressing_mode_are_errors(self):
+        assembly = self.assemble('    ldz #1\n    stx $10,x\n    lda #$123\n')
+        self.assertEqual(["Unknown mnemonic 'ldz'", 'Illegal addressing mode for stx', 'Value out of range: 291'],
+                         [m.text for m in assembly.Errors])
+
+    def test_assemble_parenthesized_operand_before_x_is_illegal_addressing_mode(self):
+        assembly = self.assemble('*=$1000\n    sta ($10),x\n')
+        self.assertEqual([(2, 'Illegal addressing mode for sta')], [(m.line, m.text) for m in assembly.Errors])
+
+    def test_assemble_shifts_and_rotates_with_accumulator_operand_are_accumulator_mode(self):
+        assembly = self.assemble('*=$1000\na: asl a\n    lsr A\n    rol a\n    ror A\n    asl\n    lda a\n')
+        self.assertEqual([], [m.text for m in assembly.Errors])
+        self.assertEqual(bytes.fromhex('0a 4a 2a 6a 0a ad0010'), self.getBytes(assembly))
+
+    def test_assemble_immediate_operand_with_index_is_illegal_addressing_mode(self):
+        assembly = self.assemble('*=$1000\n    lda #$10,x\n    ldx #1, Y\n    lda #min(1, 2)\n')
+        self.assertEqual([(2, 'Illegal addressing mode for lda'), (3, 'Illegal addressing mode for ldx')],
+                         [(m.line, m.text) for m in assembly.Errors])
+
+    def test_assemble_parentheses_not_around_whole_operand_are_expression(self):
+        assembly = self.assemble('*=$1000\n    lda ($10)+1,x\n    lda ($10)+($20),y\n    jmp ($1000)+($10)\n')
+        self.assertEqual([], [m.text for m in assembly.Errors])
+        self.assertEqual(bytes.fromhex('b511 b93000 4c1010'), self.getBytes(assembly))
+
+    def test_assemble_data_directives_and_constants(self):
+        assembly = self.assemble('.const SIZE = 3\n.byte 1, <$1234, >$1234\n.word $1234, SIZE*2\n.fill SIZE, $ea\n.text "ab"\n')
+        self.assertEqual(bytes.fromhex('01 34 12 3412 0600 eaeaea 6162'), self.getBytes(assembly))
+
+    def test_assemble_segment_sizes_from_origins_and_segments(self):
+        assembly = self.assemble('.segmentdef Data [start=$2000]\n*=$0801 "Basic"\n.byte 1, 2\n'
+                                 '*=$1000 "Code"\nnop\nrts\n.segment Data\n.word 0, 0\n')
+        self.assertEqual([('Default', 0x0801, 0x0802, 'Basic'), ('Default', 0x1000, 0x1001, 'Code'), ('Data', 0x2000, 0x2003, 'Unnamed')],
+                         [tuple(b) for b in assembly.Blocks])
+        self.assertEqual({'Default': 4, 'Data': 4}, dict(assembly.getSegmentSizes()))
+
+    def test_assemble_comments_and_strings_are_skipped(self):
+        assembly = self.assemble('/* jmp missing\n   jmp missing */ nop // jmp missing\n.text "// not a comment"\n')
+        self.assertEqual([], assembly.Messages)
+        self.assertEqual(b'\xea// not a comment', self.getBytes(assembly))
+
+    def test_assemble_macro_definition_is_not_assembled_and_keeps_address(self):
+        assembly = self.assemble('*=$1000\n.macro Wait(count) {\n    ldx #count\ninner: dex\n}\nafter: nop\n')
+        self.assertEqual([], assembly.Messages)
+        self.assertEqual(0x1000, assembly.Symbols['after'])
+        self.assertTrue(assembly.Complete)
+
+    def test_assemble_macro_call_and_loop_make_following_addresses_unknown(self):
+        assembly = self.assemble('*=$1000\nWait(3)\nafter: .for (var i=0; i<8; i++) {\n    sta $d000+i\n}\nlast: nop\n')
+        self.assertEqual([], assembly.Messages)
+        self.assertIsNone(assembly.Symbols['last'])
+        self.assertFalse(assembly.Complete)
+
+    def test_assemble_scoped_labels_are_found_by_full_name(self):
+        assembly = self.assemble('*=$1000\nirq: {\n    nop\nexit: rti\n}\n    jmp irq.exit\n')
+        self.assertEqual(bytes.fromhex('ea 40 4c0110'), self.getBytes(assembly))
+
+    def test_assemble_imported_file_is_assembled_in_place(self):
+        self.writeFile('lib/data.asm', '#importonce\ndata: .byte 1\n')
+        assembly = self.assemble('*=$1000\n#import "lib/data.asm"\n#import "lib/data.asm"\n    lda data\n')
+        self.assertEqual(bytes.fromhex('01 ad0010'), self.getBytes(assembly))
+        self.assertEqual(self.path('lib/data.asm'), assembly.Lines[0].file)
+
+    def test_assemble_imported_file_found_in_libdir(self):
+        self.writeFile('kicklib/data.asm', 'data: .byte 1\n')
+        target = kickassquickassembler.KickAssQuickAssembler(kickassquickassembler.KickAssQuickAssembler.getLibDirs('-libdir kicklib', self.folder))
+        assembly = target.assemble(self.path('main.asm'), '#import "data.asm"\n    lda data\n')
+        self.assertEqual([], assembly.Messages)
+
+    def test_assemble_missing_import_does_not_report_unknown_symbols(self):
+        assembly = self.assemble('#import "missing.asm"\n    jmp fromMissing\n')
+        self.assertEqual([], assembly.Messages)
+        self.assertFalse(assembly.Complete)
+
+class TestKickassQuickCheckListener(TestCase):
+
+    def setUp(self):
+        self.view_mock = MagicMock()
+        self.view_mock.file_name.return_value = os.path.abspath('main.asm')
+        self.view_mock.window.return_value = None
+        self.view_mock.match_selector.return_value = True
+        self.view_mock.substr.return_value = '    jmp missing\n'
+        self.settings = {'kickass_quick_check': 'true'}
+        patcher = patch.object(kickassquickassembler.KickAssSettings, 'forView',
+                               return_value=kickassquickassembler.KickAssSettings(self.settings, None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('sublime.status_message')
+    def test_on_post_save_async_marks_errors_and_shows_first_in_status(self, status_message_mock):
+        kickassquickassembler.KickassQuickCheckListener().on_post_save_async(self.view_mock)
+        self.assertEqual('kickass_quick_check', self.view_mock.add_regions.call_args[0][0])
+        self.assertEqual(1, len(self.view_mock.add_regions.call_args[0][1]))
+        status_message_mock.assert_called_once_with("Quick check: 1 error, main.asm line 1: Unknown symbol 'missing'")
+
+    @patch('sublime.status_message')
+    def test_on_post_save_async_disabled_does_not_assemble(self, status_message_mock):
+        self.settings['kickass_quick_check'] = 'false'
+        kickassquickassembler.KickassQuickCheckListener().on_post_save_async(self.view_mock)
+        self.assertEqual(0, self.view_mock.add_regions.call_count)
+        self.assertEqual(0, status_message_mock.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from unittest import TestCase
+from unittest.mock import Mock
+try:
+    from tests.testglobals import kickasssettings
+except ImportError:
+    from testglobals import kickasssettings
+
+class TestKickAssSettings(TestCase):
+
+    def setUp(self):
+        kickasssettings.KickAssSettings.invalidateAll()
+        self.view_mock = Mock()
+        self.view_mock.id.return_value = 1
+        self.view_mock.window.return_value.id.return_value = 2
+        self.view_mock.window.return_value.project_data.return_value = {'settings': {'project-setting': 'project-value', 'test-setting': 'project-value'}}
+        self.view_settings = Mock()
+        self.view_settings.get.side_effect = lambda key, default=None: {'test-setting': 'view-value', 'bool-setting': True, 'string-bool': 'TRUE',
+                                                                       'list-setting': ['a', 'b'], 'string-list': 'a', 'path-setting': '~/c64'}.get(key, default)
+        self.view_mock.settings.return_value = self.view_settings
+
+    def tearDown(self):
+        kickasssettings.KickAssSettings.invalidateAll()
+
+    def test_get_view_setting_overrides_project_setting(self):
+        target = kickasssettings.KickAssSettings.forView(self.view_mock)
+        self.assertEqual('view-value', target.get('test-setting'))
+        self.assertEqual('project-value', target.get('project-setting'))
+        self.assertEqual('default', target.get('missing', 'default'))
+
+    def test_forview_returns_cached_snapshot_and_reads_project_data_once(self):
+        first = kickasssettings.KickAssSettings.forView(self.view_mock)
+        second = kickasssettings.KickAssSettings.forView(self.view_mock)
+        self.assertIs(first, second)
+        self.assertEqual(1, self.view_mock.window.return_value.project_data.call_count)
+
+    def test_get_reads_view_setting_once(self):
+        target = kickasssettings.KickAssSettings.forView(self.view_mock)
+        target.get('test-setting')
+        target.get('test-setting')
+        self.assertEqual(1, self.view_settings.get.call_count)
+
+    def test_view_settings_change_invalidates_snapshot(self):
+        first = kickasssettings.KickAssSettings.forView(self.view_mock)
+        self.view_settings.add_on_change.call_args[0][1]()
+        self.assertIsNot(first, kickasssettings.KickAssSettings.forView(self.view_mock))
+
+    def test_invalidateview_drops_snapshots_of_view(self):
+        first = kickasssettings.KickAssSettings.forView(self.view_mock)
+        kickasssettings.KickAssSettings.invalidateView(1)
+        self.assertIsNot(first, kickasssettings.KickAssSettings.forView(self.view_mock))
+
+    def test_getbool_accepts_json_bool_and_string(self):
+        target = kickasssettings.KickAssSettings.forView(self.view_mock)
+        self.assertEqual(True, target.getBool('bool-setting'))
+        self.assertEqual(True, target.getBool('string-bool'))
+        self.assertEqual(False, target.getBool('test-setting'))
+        self.assertEqual(False, target.getBool('missing'))
+
+    def test_getlist_returns_lists_for_lists_strings_and_missing_settings(self):
+        target = kickasssettings.KickAssSettings.forView(self.view_mock)
+        self.assertEqual(['a', 'b'], target.getList('list-setting'))
+        self.assertEqual(['a'], target.getList('string-list'))
+        self.assertEqual([], target.getList('missing'))
+
+    def test_getpath_expands_user_folder(self):
+        target = kickasssettings.KickAssSettings.forView(self.view_mock)
+        self.assertFalse(target.getPath('path-setting').startswith('~'))
+        self.assertEqual('', target.getPath('missing'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassvariables
+except ImportError:
+    from testglobals import kickassvariables
+
+class TestKickAssVariableExpander(TestCase):
+
+    def createExpander(self, variables, expandable=None):
+        return kickassvariables.KickAssVariableExpander(variables, expandable if expandable is not None else list(variables))
+
+    def test_expand_string_with_variables_returns_values_inserted(self):
+        actual = self.createExpander({'a': 'x', 'b': 'y'}).expand('$a ${b}!')
+        self.assertEqual('x y!', actual)
+
+    def test_expand_nested_more_than_two_levels_returns_fully_expanded_value(self):
+        variables = {'a': '${b}1', 'b': '${c}2', 'c': '${d}3', 'd': 'd'}
+        actual = self.createExpander(variables).expand('${a}')
+        self.assertEqual('d321', actual)
+
+    def test_expand_variables_referencing_each_other_raises_error_with_cycle(self):
+        variables = {'a': '${b}', 'b': '${c}', 'c': '${a}'}
+        with self.assertRaises(kickassvariables.KickAssVariableError) as context:
+            self.createExpander(variables).expand('${a}')
+        self.assertIn('a -> b -> c -> a', str(context.exception))
+
+    def test_expand_missing_variable_returns_empty_string(self):
+        actual = self.createExpander({}).expand('[${missing}]')
+        self.assertEqual('[]', actual)
+
+    def test_expand_missing_variable_with_default_returns_expanded_default(self):
+        actual = self.createExpander({'a': 'x'}).expand('${missing:${a}.prg}')
+        self.assertEqual('x.prg', actual)
+
+    def test_expand_empty_variable_with_default_returns_empty_string(self):
+        actual = self.createExpander({'a': ''}).expand('[${a:default}]')
+        self.assertEqual('[]', actual)
+
+    def test_expand_escaped_dollar_returns_literal_dollar(self):
+        actual = self.createExpander({'a': 'x'}).expand('\\$a $a')
+        self.assertEqual('$a x', actual)
+
+    def test_expand_not_expandable_variable_inserts_value_as_is(self):
+        actual = self.createExpander({'a': '${b}', 'b': 'x'}, ['b']).expand('${a} ${b}')
+        self.assertEqual('${b} x', actual)
+
+    def test_expand_dict_and_list_expands_all_strings(self):
+        actual = self.createExpander({'a': 'x'}).expand({'k': ['$a', 1], 'l': '${a}'})
+        self.assertEqual({'k': ['x', 1], 'l': 'x'}, actual)
+
+    def test_resolveAll_returns_copy_with_expandable_variables_expanded(self):
+        variables = {'a': '${b}', 'b': 'x', 'c': '${b}'}
+        actual = self.createExpander(variables, ['a']).resolveAll()
+        self.assertEqual({'a': 'x', 'b': 'x', 'c': '${b}'}, actual)
+        self.assertEqual('${b}', variables['a'])
+
+    def test_compileTemplate_same_template_returns_memoized_tokens(self):
+        first = kickassvariables.KickAssVariableExpander.compileTemplate('${a} and ${b}')
+        second = kickassvariables.KickAssVariableExpander.compileTemplate('${a} and ${b}')
+        self.assertIs(first, second)
+        self.assertEqual([('a', None), ' and ', ('b', None)], first)
+
+    def test_compileTemplate_regex_replacement_returns_none(self):
+        self.assertIsNone(kickassvariables.KickAssVariableExpander.compileTemplate('${file/\\.asm/.prg/}'))
+
+if __name__ == '__main__':
+    unittest.main()
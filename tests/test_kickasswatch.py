@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+try:
+    from tests.testglobals import kickasswatch, kickassvicemonitor
+except ImportError:
+    from testglobals import kickasswatch, kickassvicemonitor
+
+class TestKickAssWatch(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.writeFile('main.asm', '#import "lib/macros.asm"\n.import binary "music.bin"\n')
+        self.writeFile('lib/macros.asm', '.macro Clear() {}\n')
+        self.writeFile('other.asm', 'nop\n')
+        self.window_mock = MagicMock()
+        self.monitor_mock = MagicMock()
+        self.target = kickasswatch.KickAssWatch(self.window_mock, self.path('main.asm'), self.monitor_mock, 300,
+                                                self.path('bin/main_BuildCache.json'), 'breakpoints.txt')
+        self.target.updateImportGraph()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, relativePath):
+        return os.path.join(self.folder, relativePath)
+
+    def writeFile(self, relativePath, text):
+        os.makedirs(os.path.dirname(self.path(relativePath)), exist_ok=True)
+        with open(self.path(relativePath), 'w') as handle:
+            handle.write(text)
+
+    def test_updateImportGraph_finds_source_and_imported_files(self):
+        expected = set(self.path(p) for p in ['main.asm', 'lib/macros.asm', 'music.bin'])
+        self.assertEqual(expected, self.target.Files)
+
+    def test_isWatched_file_not_imported_returns_false(self):
+        self.assertFalse(self.target.isWatched(self.path('other.asm')))
+
+    @patch('sublime.set_timeout_async')
+    def test_fileSaved_imported_file_schedules_build_after_debounce_delay(self, set_timeout_async_mock):
+        self.assertTrue(self.target.fileSaved(self.path('lib/macros.asm')))
+        self.assertEqual(300, set_timeout_async_mock.call_args[0][1])
+        set_timeout_async_mock.call_args[0][0]()
+        self.window_mock.run_command.assert_called_once_with('kickass_build', {'buildmode': 'build', 'watch_file': self.path('main.asm')})
+
+    @patch('sublime.set_timeout_async')
+    def test_fileSaved_builds_with_build_system_args_watch_mode_started_with(self, set_timeout_async_mock):
+        target = kickasswatch.KickAssWatch(self.window_mock, self.path('main.asm'), self.monitor_mock, 300,
+                                           self.path('bin/main_BuildCache.json'), None, {'env': {'CLASSPATH': 'KickAss.jar'}, 'shell': True})
+        target.updateImportGraph()
+        target.fileSaved(self.path('main.asm'))
+        set_timeout_async_mock.call_args[0][0]()
+        self.window_mock.run_command.assert_called_once_with('kickass_build', {'buildmode': 'build', 'watch_file': self.path('main.asm'),
+                                                                               'env': {'CLASSPATH': 'KickAss.jar'}, 'shell': True})
+        # The build adds its variables to the environment it gets
+        self.window_mock.run_command.call_args[0][1]['env']['kickass_buildmode'] = 'build'
+        target.fileSaved(self.path('main.asm'))
+        set_timeout_async_mock.call_args[0][0]()
+        self.assertEqual({'CLASSPATH': 'KickAss.jar'}, self.window_mock.run_command.call_args[0][1]['env'])
+
+    @patch('sublime.set_timeout_async')
+    def test_fileSaved_file_not_imported_does_not_schedule_build(self, set_timeout_async_mock):
+        self.assertFalse(self.target.fileSaved(self.path('other.asm')))
+        self.assertEqual(0, set_timeout_async_mock.call_count)
+
+    @patch('sublime.set_timeout_async')
+    def test_fileSaved_saved_again_before_delay_builds_once(self, set_timeout_async_mock):
+        self.target.fileSaved(self.path('main.asm'))
+        self.target.fileSaved(self.path('lib/macros.asm'))
+        for c in set_timeout_async_mock.call_args_list:
+            c[0][0]()
+        self.assertEqual(1, self.window_mock.run_command.call_count)
+
+    @patch('sublime.status_message')
+    def test_reloadProgram_loads_program_into_emulator(self, status_message_mock):
+        self.target.reloadProgram(self.path('bin/main.prg'))
+        self.monitor_mock.loadProgram.assert_called_once_with(self.path('bin/main.prg'), [self.path('bin/main.vs'), self.path('bin/breakpoints.txt')])
+        status_message_mock.assert_called_once_with('Loaded main.prg into VICE')
+
+    @patch('sublime.status_message')
+    def test_reloadProgram_no_emulator_running_shows_error_in_status(self, status_message_mock):
+        self.monitor_mock.loadProgram.side_effect = kickassvicemonitor.ViceMonitorError('No VICE')
+        self.target.reloadProgram(self.path('bin/main.prg'))
+        status_message_mock.assert_called_once_with('No VICE')
+
+    @patch('sublime.status_message')
+    def test_reloadProgram_import_added_watches_new_import(self, status_message_mock):
+        self.writeFile('main.asm', '#import "other.asm"\n')
+        self.target.reloadProgram(self.path('bin/main.prg'))
+        self.assertTrue(self.target.isWatched(self.path('other.asm')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassmemorymap, kickassbuildoutput
+except ImportError:
+    from testglobals import kickassmemorymap, kickassbuildoutput
+
+MemoryBlock = kickassbuildoutput.MemoryBlock
+
+class TestMemoryMap(TestCase):
+
+    def setUp(self):
+        self.basic = MemoryBlock('Default', 0x0801, 0x080c, 'Basic')
+        self.code = MemoryBlock('Default', 0x0810, 0x0a3f, 'Code')
+        self.music = MemoryBlock('Music', 0x1000, 0x1fff, 'Music')
+        self.target = kickassmemorymap.MemoryMap([self.music, self.code, self.basic])
+
+    def test_blocks_are_sorted_by_start_address(self):
+        self.assertEqual([self.basic, self.code, self.music], self.target.Blocks)
+
+    def test_usedbytes_is_sum_of_block_sizes(self):
+        self.assertEqual(12 + 560 + 4096, self.target.UsedBytes)
+        self.assertEqual(0x10000 - self.target.UsedBytes, self.target.FreeBytes)
+
+    def test_overlapping_blocks_are_counted_once(self):
+        target = kickassmemorymap.MemoryMap([self.music, MemoryBlock('Default', 0x1f00, 0x20ff, 'Data')])
+        self.assertEqual(4096 + 256, target.UsedBytes)
+        self.assertEqual([(self.music, MemoryBlock('Default', 0x1f00, 0x20ff, 'Data'))], target.Overlaps)
+
+    def test_adjacent_blocks_do_not_overlap(self):
+        target = kickassmemorymap.MemoryMap([MemoryBlock('Default', 0x1000, 0x10ff, 'A'), MemoryBlock('Default', 0x1100, 0x11ff, 'B')])
+        self.assertEqual([], target.Overlaps)
+
+    def test_freeranges_are_gaps_between_blocks(self):
+        self.assertEqual([(0x0000, 0x0800), (0x080d, 0x080f), (0x0a40, 0x0fff), (0x2000, 0xffff)], self.target.FreeRanges)
+
+    def test_segments_group_blocks_by_segment(self):
+        self.assertEqual({'Default': [self.basic, self.code], 'Music': [self.music]}, dict(self.target.Segments))
+
+    def test_compare_returns_changed_segments_and_used_change(self):
+        previous = kickassmemorymap.MemoryMap([self.basic, MemoryBlock('Default', 0x0810, 0x0a00, 'Code')])
+        changes, usedChange = self.target.compare(previous)
+        self.assertEqual([('Default', 12 + 497, 12 + 560), ('Music', 0, 4096)], changes)
+        self.assertEqual(63 + 4096, usedChange)
+
+    def test_render_shows_usage_overlaps_and_labels(self):
+        target = kickassmemorymap.MemoryMap([self.music, MemoryBlock('Default', 0x1f00, 0x20ff, 'Data')])
+        text = target.render({0x1000: 'music_init'})
+        self.assertIn('$1000 ' + '#' * 60 + '!!!!', text)
+        self.assertIn('Music (music_init)', text)
+        self.assertIn('Overlaps:', text)
+
+    def test_render_partly_used_cell(self):
+        text = self.target.render()
+        self.assertIn('$0000 ' + '.' * 32 + '+', text)
+
+    def test_render_is_cached_for_same_arguments(self):
+        labels = {}
+        self.assertIs(self.target.render(labels), self.target.render(labels))
+
+class TestMemoryMapHistory(TestCase):
+
+    def test_record_keeps_latest_and_previous_map_per_window(self):
+        first, second, third = object(), object(), object()
+        kickassmemorymap.MemoryMapHistory.record(-1, first)
+        kickassmemorymap.MemoryMapHistory.record(-1, second)
+        kickassmemorymap.MemoryMapHistory.record(-2, third)
+        self.assertEqual((second, first), kickassmemorymap.MemoryMapHistory.get(-1))
+        self.assertEqual((third, None), kickassmemorymap.MemoryMapHistory.get(-2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+try:
+    from tests.testglobals import kickasstooltiprender
+except ImportError:
+    from testglobals import kickasstooltiprender
+
+LABELS = {'screen': 0x0400, 'gfx.init': 0x1000}
+
+
+def find(line, word, resolve=LABELS.get):
+    start = line.index(word)
+    return kickasstooltiprender.find_expression(line, start, start + len(word), resolve)
+
+
+class TestNumberTooltipRenderer(TestCase):
+
+    def setUp(self):
+        self.target = kickasstooltiprender.NumberTooltipRenderer(max_entries=2)
+        self.target.set_css('body { font-size: 12px; }')
+
+    def test_evaluate_literals_return_their_kind(self):
+        evaluate = kickasstooltiprender.evaluate
+        self.assertEqual(('hex', 0xd020), evaluate('$d020'))
+        self.assertEqual(('binary', 5), evaluate('%0101'))
+        self.assertEqual(('decimal', 53280), evaluate('53280'))
+        self.assertEqual(('hex', 0x10), evaluate('#$10'))
+
+    def test_evaluate_low_and_high_byte(self):
+        self.assertEqual(('expression', 0x34), kickasstooltiprender.evaluate('<$1234'))
+        self.assertEqual(('expression', 0x12), kickasstooltiprender.evaluate('#>$1234'))
+
+    def test_evaluate_expression_uses_operator_precedence(self):
+        self.assertEqual(('expression', 0xd021), kickasstooltiprender.evaluate('$d020 + 1'))
+        self.assertEqual(('expression', 14), kickasstooltiprender.evaluate('2+3*4'))
+        self.assertEqual(('expression', 20), kickasstooltiprender.evaluate('(2+3)*4'))
+        self.assertEqual(('expression', 0x05), kickasstooltiprender.evaluate('<($1000+5)'))
+        self.assertEqual(('expression', 0x28), kickasstooltiprender.evaluate('%101 << 3'))
+
+    def test_evaluate_resolves_names(self):
+        self.assertEqual(('expression', 0x0428), kickasstooltiprender.evaluate('screen+40', LABELS.get))
+        self.assertEqual(('name', 0x1000), kickasstooltiprender.evaluate('gfx.init', LABELS.get))
+
+    def test_evaluate_invalid_expressions_raise_error(self):
+        for text in ['', '$', 'unknown+1', '(1+2', '1 2', '5/2', 'lda #1']:
+            with self.assertRaises(kickasstooltiprender.ExpressionError):
+                kickasstooltiprender.evaluate(text, LABELS.get)
+
+    def test_find_expression_drops_mnemonic_and_index_register(self):
+        self.assertEqual((None, 'hex', 0xd020), find('    sta $d020,x', 'd020'))
+        self.assertEqual(('<$1234', 'expression', 0x34), find('    lda #<$1234', '1234'))
+
+    def test_find_expression_finds_whole_expression_around_word(self):
+        self.assertEqual(('$d020 + 1', 'expression', 0xd021), find('    sta $d020 + 1', '1'))
+        self.assertEqual(('screen+40', 'expression', 0x0428), find('    sta screen+40', 'screen'))
+
+    def test_find_expression_single_name_or_comment_returns_none(self):
+        self.assertIsNone(find('    jmp screen', 'screen'))
+        self.assertIsNone(find('    nop // $d020', 'd020'))
+
+    def test_render_shows_hex_binary_and_decimal_with_inlined_css(self):
+        popup = self.target.render('hex', 0xd0)
+        self.assertIn('<style>body { font-size: 12px; }</style>', popup)
+        self.assertIn('$D0', popup)
+        self.assertIn('%11010000', popup)
+        self.assertIn('208', popup)
+
+    def test_render_negative_value_shows_8_bit_twos_complement(self):
+        popup = self.target.render('expression', -1)
+        self.assertIn('<b>$FF</b>', popup)
+        self.assertIn('<b>%11111111</b>', popup)
+        self.assertIn('<b>-1</b>', popup)
+        self.assertNotIn('$-', popup)
+
+    def test_render_negative_value_below_byte_range_shows_16_bit_twos_complement(self):
+        popup = self.target.render('expression', -0x130)
+        self.assertIn('<b>$FED0</b>', popup)
+        self.assertIn('<b>%1111111011010000</b>', popup)
+
+    def test_render_negative_value_below_word_range_shows_only_decimal(self):
+        popup = self.target.render('expression', -0x10000)
+        self.assertNotIn('$', popup)
+        self.assertNotIn('%', popup)
+        self.assertIn('<b>-65536</b>', popup)
+
+    def test_render_expression_title_is_escaped(self):
+        self.assertIn('<u>&lt;$1234</u>', self.target.render('expression', 0x34, '<$1234'))
+
+    def test_render_note_is_appended_and_part_of_cache_key(self):
+        plain = self.target.render('hex', 0xd020)
+        popup = self.target.render('hex', 0xd020, note='<b>VIC-II</b><br>')
+        self.assertTrue(popup.endswith('<b>VIC-II</b><br>'))
+        self.assertNotIn('VIC-II', plain)
+
+    def test_is_value_operand_immediate_and_data_are_not_addresses(self):
+        self.assertTrue(kickasstooltiprender.is_value_operand('    lda #$d020', 9))
+        self.assertTrue(kickasstooltiprender.is_value_operand('loop: cmp.z #53280', 18))
+        self.assertTrue(kickasstooltiprender.is_value_operand('    .byte $d0, $20', 15))
+        self.assertFalse(kickasstooltiprender.is_value_operand('    sta $d020', 9))
+        self.assertFalse(kickasstooltiprender.is_value_operand('.const BORDER = $d020', 17))
+
+    def test_render_same_literal_returns_cached_popup(self):
+        first = self.target.render('hex', 1)
+        self.assertIs(first, self.target.render('hex', 1))
+
+    def test_render_full_cache_drops_least_recently_used_popup(self):
+        first = self.target.render('hex', 1)
+        second = self.target.render('hex', 2)
+        self.target.render('hex', 1)
+        self.target.render('hex', 3)
+        self.assertEqual(2, len(self.target))
+        self.assertIs(first, self.target.render('hex', 1))
+        self.assertIsNot(second, self.target.render('hex', 2))
+
+    def test_set_css_changed_css_drops_cached_popups(self):
+        self.target.render('hex', 1)
+        self.target.set_css('body { color: red; }')
+        self.assertEqual(0, len(self.target))
+        self.assertIn('color: red', self.target.render('hex', 1))
+
+    def test_load_css_absolute_path_reads_file(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'test.css')
+        with open(path, 'w') as handle:
+            handle.write('h1 { font-size: 14px; }')
+        self.assertEqual('h1 { font-size: 14px; }', kickasstooltiprender.load_css(path))
+
+    @patch('sublime.load_resource', create=True, return_value='body {}')
+    def test_load_css_relative_path_is_loaded_as_package_resource(self, load_resource_mock):
+        self.assertEqual('body {}', kickasstooltiprender.load_css('SublimeKickAssemblerC64/css/default.css'))
+        load_resource_mock.assert_called_once_with('Packages/SublimeKickAssemblerC64/css/default.css')
+
+    @patch('sublime.load_resource', create=True, side_effect=IOError('resource not found'))
+    def test_load_css_missing_file_returns_empty_css(self, load_resource_mock):
+        self.assertEqual('', kickasstooltiprender.load_css('Missing/missing.css'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import Mock
 try:
     from tests.testglobals import kickassbuild
 except ImportError:
@@ -52,30 +52,47 @@ class TestSublimeSettings(TestCase):
         actual = kickassbuild.SublimeSettings(self.command_mock).getSetting('test-setting1')
         self.assertEqual('', actual)
 
-    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings.getSetting', return_value='true', autospec=True)
-    def test_getSettingasbool_setting_value_is_true_returns_true(self, getSettings_mock):
+    def test_getSettingasbool_setting_value_is_true_returns_true(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'any': 'true'}
         actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
         self.assertEqual(True, actual)
 
-    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings.getSetting', return_value='TRUE', autospec=True)
-    def test_getSettingasbool_setting_value_is_capital_true_returns_true(self, getSettings_mock):
+    def test_getSettingasbool_setting_value_is_capital_true_returns_true(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'any': 'TRUE'}
         actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
         self.assertEqual(True, actual)
 
-    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings.getSetting', return_value='false', autospec=True)
-    def test_getSettingasbool_setting_value_is_false_returns_false(self, getSettings_mock):
+    def test_getSettingasbool_setting_value_is_false_returns_false(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'any': 'false'}
         actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
         self.assertEqual(False, actual)
 
-    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings.getSetting', return_value=None, autospec=True)
-    def test_getSettingasbool_setting_value_is_none_raises_attributeerror(self, getSettings_mock):
-        with self.assertRaisesRegexp(AttributeError, "'NoneType' object has no attribute 'lower'") as cm:
-            actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
+    def test_getSettingasbool_setting_missing_returns_false(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {}
+        actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
+        self.assertEqual(False, actual)
 
-    @patch('SublimeKickAssemblerC64.kickass_build.SublimeSettings.getSetting', return_value='abc', autospec=True)
-    def test_getSettingasbool_setting_value_is_abc_returns_false(self, getSettings_mock):
+    def test_getSettingasbool_setting_value_is_abc_returns_false(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'any': 'abc'}
         actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
         self.assertEqual(False, actual)
 
+    def test_getSettingasbool_setting_value_is_json_true_returns_true(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'any': True}
+        actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
+        self.assertEqual(True, actual)
+
+    def test_getSettingasbool_setting_value_is_number_returns_false(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'any': 1}
+        actual = kickassbuild.SublimeSettings(self.command_mock).getSettingAsBool('any')
+        self.assertEqual(False, actual)
+
+    def test_getSetting_snapshot_is_created_once_per_settings_object(self):
+        self.command_mock.window.active_view.return_value.settings.return_value = {'test-setting': 'test-view-value'}
+        target = kickassbuild.SublimeSettings(self.command_mock)
+        target.getSetting('test-setting')
+        target.getSetting('another-setting')
+        self.assertEqual(1, self.command_mock.window.project_data.call_count)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
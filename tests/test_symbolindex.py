@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from unittest import TestCase
+try:
+    from tests.testglobals import kickasssymbolindex
+except ImportError:
+    from testglobals import kickasssymbolindex
+
+SOURCE = """// main file
+#import "lib/macros.asm"
+.const BORDER = $d020
+.var counter = 0
+.namespace gfx {
+start:  lda #0      // comment: notalabel:
+        sta BORDER
+        jmp start
+}
+/* commented:
+   out: */
+.macro @SetColor(color) {
+}
+.function double(x) { .return x*2 }
+.pseudocommand mov src : dst {
+}
+.label screen = $0400
+"""
+
+class TestSymbolIndex(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.writeFile('main.asm', SOURCE)
+        self.writeFile('lib/macros.asm', '.macro Clear() {\n}\nloop: dex\n')
+        self.target = kickasssymbolindex.SymbolIndex(self.folder, os.path.join(self.folder, '.cache', 'index.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def writeFile(self, filename, text, mtime=None):
+        path = os.path.join(self.folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_parse_symbols_finds_all_symbol_kinds(self):
+        symbols, _ = kickasssymbolindex.parse_symbols(SOURCE)
+        self.assertEqual([['BORDER', 'const'], ['counter', 'var'], ['gfx', 'namespace'], ['start', 'label'],
+                          ['SetColor', 'macro'], ['double', 'function'], ['mov', 'pseudocommand'], ['screen', 'label']],
+                         [s[:2] for s in symbols])
+
+    def test_parse_symbols_returns_zero_based_line_and_column(self):
+        symbols, _ = kickasssymbolindex.parse_symbols(SOURCE)
+        self.assertEqual(['start', 'label', 5, 0], symbols[3])
+        self.assertEqual(['BORDER', 'const', 2, 7], symbols[0])
+
+    def test_parse_symbols_returns_imports(self):
+        _, imports = kickasssymbolindex.parse_symbols(SOURCE)
+        self.assertEqual(['lib/macros.asm'], imports)
+
+    def test_update_indexes_all_source_files_in_folder(self):
+        self.assertEqual(2, self.target.update())
+        self.assertEqual([(os.path.join(self.folder, 'lib', 'macros.asm'), 0, 7, 'macro')], self.target.find_definitions('Clear'))
+        self.assertEqual(1, len(self.target.find_definitions('start')))
+
+    def test_update_without_changes_parses_nothing(self):
+        self.target.update()
+        self.assertEqual(0, self.target.update())
+
+    def test_update_parses_only_changed_file(self):
+        self.target.update()
+        self.writeFile('lib/macros.asm', 'other: rts\n', mtime=1000)
+        self.assertEqual(1, self.target.update())
+        self.assertEqual([], self.target.find_definitions('Clear'))
+        self.assertEqual(1, len(self.target.find_definitions('other')))
+
+    def test_update_with_touched_but_unchanged_file_does_not_parse(self):
+        self.target.update()
+        path = os.path.join(self.folder, 'main.asm')
+        os.utime(path, (1000, 1000))
+        self.assertEqual(0, self.target.update([path]))
+        self.assertEqual(1000, self.target.files[path]['mtime'])
+
+    def test_update_removes_deleted_files(self):
+        self.target.update()
+        os.remove(os.path.join(self.folder, 'lib', 'macros.asm'))
+        self.target.update()
+        self.assertEqual([], self.target.find_definitions('Clear'))
+
+    def test_saved_index_is_loaded_without_parsing(self):
+        self.target.update()
+        self.target.save()
+        loaded = kickasssymbolindex.SymbolIndex(self.folder, self.target.index_file)
+        loaded.load()
+        self.assertEqual(0, loaded.update())
+        self.assertEqual(1, len(loaded.find_definitions('SetColor')))
+
+    def test_load_ignores_index_of_other_folder(self):
+        self.target.update()
+        self.target.save()
+        loaded = kickasssymbolindex.SymbolIndex('other', self.target.index_file)
+        loaded.load()
+        self.assertEqual({}, loaded.files)
+
+    def test_is_in_folder_does_not_match_folder_with_same_prefix(self):
+        self.assertTrue(kickasssymbolindex.is_in_folder(os.path.join(self.folder, 'lib', 'macros.asm'), self.folder))
+        self.assertFalse(kickasssymbolindex.is_in_folder(os.path.join(self.folder + '2', 'main.asm'), self.folder))
+
+    def test_find_references_returns_all_occurrences(self):
+        self.target.update()
+        references = self.target.find_references('BORDER')
+        self.assertEqual([2, 6], [r[1] for r in references])
+        self.assertEqual('sta BORDER', references[1][3])
+
+    def test_find_references_skips_comments(self):
+        self.target.update()
+        self.assertEqual([], self.target.find_references('notalabel'))
+        self.assertEqual([], self.target.find_references('commented'))
+
+    def test_find_references_reads_only_files_referencing_name(self):
+        self.target.update()
+        opened = []
+        realOpen = open
+
+        def trackingOpen(path, *args, **kwargs):
+            opened.append(path)
+            return realOpen(path, *args, **kwargs)
+        with unittest.mock.patch('builtins.open', side_effect=trackingOpen):
+            references = self.target.find_references('Clear')
+        self.assertEqual([os.path.join(self.folder, 'lib', 'macros.asm')], opened)
+        self.assertEqual([(os.path.join(self.folder, 'lib', 'macros.asm'), 0, 7, '.macro Clear() {')], references)
+
+    def test_find_references_after_update_removes_deleted_file(self):
+        self.target.update()
+        os.remove(os.path.join(self.folder, 'lib', 'macros.asm'))
+        self.target.update()
+        self.assertEqual([], self.target.find_references('Clear'))
+
+    def test_listener_activated_rescans_window_again_after_rescan_interval(self):
+        window = unittest.mock.MagicMock()
+        window.id.return_value = 4711
+        view = unittest.mock.MagicMock()
+        view.window.return_value = window
+        listener = kickasssymbolindex.KickassSymbolIndexListener()
+        with unittest.mock.patch.object(kickasssymbolindex, 'update_window_async') as update, \
+                unittest.mock.patch.object(kickasssymbolindex.time, 'time', side_effect=[1000, 1000, 1010, 1031, 1031]):
+            listener.on_activated_async(view)
+            listener.on_activated_async(view)
+            listener.on_activated_async(view)
+        kickasssymbolindex._updated_windows.pop(4711, None)
+        self.assertEqual(2, update.call_count)
+
+    def test_importers_of_returns_importing_files(self):
+        self.target.update()
+        self.assertEqual([os.path.join(self.folder, 'main.asm')],
+                         self.target.importers_of(os.path.join(self.folder, 'lib', 'macros.asm')))
+
+if __name__ == '__main__':
+    unittest.main()
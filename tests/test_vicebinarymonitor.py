@@ -0,0 +1,87 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassvicemonitor
+    from tests.testvicemonitor import FakeViceBinaryMonitor
+except ImportError:
+    from testglobals import kickassvicemonitor
+    from testvicemonitor import FakeViceBinaryMonitor
+
+class TestViceBinaryMonitor(TestCase):
+
+    def setUp(self):
+        self.server = FakeViceBinaryMonitor()
+        self.target = kickassvicemonitor.ViceBinaryMonitor.get(self.server.address)
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        kickassvicemonitor.ViceBinaryMonitor.closeAll()
+        self.server.close()
+        shutil.rmtree(self.folder)
+
+    def writeFile(self, name, text):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        return path
+
+    def test_get_same_address_returns_same_monitor(self):
+        self.assertIs(self.target, kickassvicemonitor.ViceBinaryMonitor.get(self.server.address))
+
+    def test_requests_reuse_one_connection(self):
+        self.target.ping()
+        self.target.ping()
+        self.assertEqual(1, self.server.connections)
+
+    def test_readMemory_returns_bytes_of_each_range(self):
+        actual = self.target.readMemory([(0x0810, 0x0813), (0xd020, 0xd020)])
+        self.assertEqual([bytes([0x10, 0x11, 0x12, 0x13]), bytes([0x20])], actual)
+
+    def test_readMemory_sends_memory_get_for_each_range(self):
+        self.target.readMemory([(0x0810, 0x0813), (0xd020, 0xd021)])
+        self.assertEqual([(0x01, struct.pack('<BHHBH', 0, 0x0810, 0x0813, 0, 0)), (0x01, struct.pack('<BHHBH', 0, 0xd020, 0xd021, 0, 0))],
+                         self.server.requests)
+
+    def test_setBreakpoints_sets_exec_checkpoints_and_resumes(self):
+        self.target.setBreakpoints([0x0810, 0x1000])
+        self.assertEqual([0x12, 0x12, 0xaa], self.server.commands())
+        self.assertEqual(struct.pack('<HHBBBBB', 0x1000, 0x1000, 1, 1, 0x04, 0, 0), self.server.requests[1][1])
+
+    def test_setBreakpoints_called_again_deletes_previous_breakpoints(self):
+        self.target.setBreakpoints([0x0810, 0x1000])
+        self.target.setBreakpoints([0x2000])
+        self.assertEqual([0x12, 0x12, 0xaa, 0x13, 0x13, 0x12, 0xaa], self.server.commands())
+        self.assertEqual([struct.pack('<I', 1), struct.pack('<I', 2)], [body for command, body in self.server.requests[3:5]])
+
+    def test_loadProgram_sets_breakpoints_from_command_files_and_autostarts(self):
+        vsFile = self.writeFile('test.vs', 'al C:0810 .start\nal C:1000 .irq\nbreak $0820\n')
+        breakpointFile = self.writeFile('breakpoints.txt', 'break .irq\n')
+        self.target.loadProgram('/work/bin/test.prg', [vsFile, breakpointFile, os.path.join(self.folder, 'missing.txt')])
+        self.assertEqual([0x12, 0x12, 0xdd, 0xaa], self.server.commands())
+        self.assertEqual([0x0820, 0x1000], [struct.unpack('<H', body[:2])[0] for command, body in self.server.requests[:2]])
+        self.assertEqual(struct.pack('<BHB', 1, 0, 18) + b'/work/bin/test.prg', self.server.requests[2][1])
+
+    def test_command_fails_raises_vicemonitorerror_and_keeps_connection(self):
+        self.server.errors[0x81] = 0x8f
+        with self.assertRaisesRegex(kickassvicemonitor.ViceMonitorError, 'error \\$8f'):
+            self.target.ping()
+        del self.server.errors[0x81]
+        self.target.ping()
+        self.assertEqual(1, self.server.connections)
+
+    def test_no_monitor_running_raises_vicemonitorerror(self):
+        self.server.close()
+        target = kickassvicemonitor.ViceBinaryMonitor(self.server.address, timeout=0.2)
+        with self.assertRaisesRegex(kickassvicemonitor.ViceMonitorError, 'start VICE with -binarymonitor'):
+            target.ping()
+
+    def test_read_breakpoints_label_not_defined_is_skipped(self):
+        path = self.writeFile('breakpoints.txt', 'break .missing\nbk 0810\nbreak exec $0810\n')
+        self.assertEqual([0x0810], kickassvicemonitor.read_breakpoints([path]))
+
+if __name__ == '__main__':
+    unittest.main()
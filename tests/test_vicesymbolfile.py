@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassvicesymbols
+except ImportError:
+    from testglobals import kickassvicesymbols
+
+class TestViceSymbolFile(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'test-file.vs')
+        self.target = kickassvicesymbols.ViceSymbolFile(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def writeSymbols(self, text, mtime=None):
+        with open(self.path, 'w') as handle:
+            handle.write(text)
+        if mtime:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_refresh_indexes_label_addresses(self):
+        self.writeSymbols('al C:080d .start\nal C:d020 .border\n')
+        self.target.refresh()
+        self.assertEqual(0x080d, self.target.get('start'))
+        self.assertEqual(0xd020, self.target.get('border'))
+
+    def test_refresh_indexes_namespaced_labels_by_full_and_local_name(self):
+        self.writeSymbols('al C:1000 .gfx.init\nal C:2000 .init\n')
+        self.target.refresh()
+        self.assertEqual(0x1000, self.target.get('gfx.init'))
+        self.assertEqual(0x2000, self.target.get('init'))
+
+    def test_refresh_ignores_other_lines(self):
+        self.writeSymbols('break 1000\nal C:080d .start\n')
+        self.target.refresh()
+        self.assertEqual({'start': 0x080d}, self.target.labels)
+
+    def test_refresh_missing_file_returns_none_and_clears_labels(self):
+        self.assertEqual(None, self.target.refresh())
+        self.assertEqual(None, self.target.get('start'))
+
+    def test_refresh_empty_file_has_no_labels(self):
+        self.writeSymbols('')
+        self.target.refresh()
+        self.assertEqual({}, self.target.labels)
+
+    def test_refresh_unchanged_file_keeps_labels(self):
+        self.writeSymbols('al C:080d .start\n', mtime=1000)
+        self.target.refresh()
+        self.target.labels['cached'] = 1
+        self.target.refresh()
+        self.assertEqual(1, self.target.get('cached'))
+
+    def test_refresh_changed_file_reloads_labels(self):
+        self.writeSymbols('al C:080d .start\n', mtime=1000)
+        self.target.refresh()
+        self.writeSymbols('al C:0810 .start\n', mtime=2000)
+        self.assertEqual((2000, 17), self.target.refresh())
+        self.assertEqual(0x0810, self.target.get('start'))
+
+if __name__ == '__main__':
+    unittest.main()
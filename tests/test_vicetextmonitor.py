@@ -0,0 +1,72 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+try:
+    from tests.testglobals import kickassvicemonitor
+    from tests.testvicemonitor import FakeViceTextMonitor
+except ImportError:
+    from testglobals import kickassvicemonitor
+    from testvicemonitor import FakeViceTextMonitor
+
+class TestViceTextMonitor(TestCase):
+
+    def setUp(self):
+        self.server = FakeViceTextMonitor()
+        self.target = kickassvicemonitor.ViceTextMonitor(self.server.address)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_loadProgram_sends_autostart_and_resumes_emulation(self):
+        self.target.loadProgram('/work/bin/test.prg')
+        self.assertTrue(self.server.resumed.wait(2))
+        self.assertEqual(['autostart "/work/bin/test.prg"', 'x'], self.server.commands)
+
+    def test_loadProgram_with_command_files_replaces_breakpoints_before_autostart(self):
+        with tempfile.NamedTemporaryFile(suffix='.vs', delete=False) as handle:
+            vsFile = handle.name
+        try:
+            self.target.loadProgram('/work/bin/test.prg', [vsFile, '/work/bin/missing.txt'])
+            self.assertTrue(self.server.resumed.wait(2))
+        finally:
+            os.unlink(vsFile)
+        self.assertEqual(['delete', 'playback "%s"' % vsFile, 'autostart "/work/bin/test.prg"', 'x'], self.server.commands)
+
+    def test_sendCommands_returns_responses_without_prompt(self):
+        actual = self.target.sendCommands(['m 0800 0810', 'r'])
+        self.assertEqual(['response to m 0800 0810', 'response to r'], actual)
+
+    def test_sendCommands_no_monitor_running_raises_vicemonitorerror(self):
+        self.server.close()
+        with self.assertRaisesRegex(kickassvicemonitor.ViceMonitorError, 'start VICE with -remotemonitor'):
+            kickassvicemonitor.ViceTextMonitor(self.server.address, timeout=0.2).sendCommands(['r'])
+
+    def test_sendCommands_monitor_opened_after_first_connect_retries_until_connected(self):
+        port = int(self.server.address.split(':')[1])
+        self.server.close()
+        timer = threading.Timer(0.2, lambda: setattr(self, 'server', FakeViceTextMonitor(port)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(['response to r'], self.target.sendCommands(['r']))
+
+    def test_loadProgram_does_not_wait_for_prompt_after_autostart(self):
+        start = time.time()
+        self.target.loadProgram('/work/bin/test.prg')
+        self.assertLess(time.time() - start, 1)
+
+    def test_parse_monitor_address_without_port_returns_default_port(self):
+        self.assertEqual(('localhost', 6510), kickassvicemonitor.parse_monitor_address('localhost', 6510))
+
+    def test_parse_monitor_address_with_port_returns_host_and_port(self):
+        self.assertEqual(('10.0.0.2', 6511), kickassvicemonitor.parse_monitor_address('10.0.0.2:6511', 6510))
+
+    def test_parse_monitor_address_invalid_port_raises_vicemonitorerror(self):
+        with self.assertRaises(kickassvicemonitor.ViceMonitorError):
+            kickassvicemonitor.parse_monitor_address('localhost:port', 6510)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,9 +9,53 @@ version = sublime.version()
 if version < '3000':
     # st2
     kickassbuild = sys.modules["kickass_build"]
+    kickasscompileserver = sys.modules["kickass_compile_server"]
+    kickassbuildcache = sys.modules["kickass_build_cache"]
+    kickassoutputcleanup = sys.modules["kickass_output_cleanup"]
+    kickasssettings = sys.modules["kickass_settings"]
+    kickasshelpindex = sys.modules["kickass_help_index"]
+    kickasssymbolindex = sys.modules["kickass_symbol_index"]
+    kickassvicesymbols = sys.modules["kickass_vice_symbols"]
+    kickassbuildoutput = sys.modules["kickass_build_output"]
+    kickassmemorymap = sys.modules["kickass_memory_map"]
+    kickassexec = sys.modules["kickass_exec"]
+    kickassassets = sys.modules["kickass_assets"]
+    kickassaddressindex = sys.modules["kickass_address_index"]
+    kickasslint = sys.modules["kickass_lint"]
+    kickasscycles = sys.modules["kickass_cycles"]
+    kickassquickassembler = sys.modules["kickass_quick_assembler"]
+    kickasstooltiprender = sys.modules["kickass_tooltip_render"]
+    kickassprofiler = sys.modules["kickass_profiler"]
+    kickassannotations = sys.modules["kickass_annotations"]
+    kickassvicemonitor = sys.modules["kickass_vice_monitor"]
+    kickasswatch = sys.modules["kickass_watch"]
+    kickassbuildplan = sys.modules["kickass_build_plan"]
+    kickassvariables = sys.modules["kickass_variables"]
 else:
     # st3
     kickassbuild = sys.modules["SublimeKickAssemblerC64.kickass_build"]
+    kickasscompileserver = sys.modules["SublimeKickAssemblerC64.kickass_compile_server"]
+    kickassbuildcache = sys.modules["SublimeKickAssemblerC64.kickass_build_cache"]
+    kickassoutputcleanup = sys.modules["SublimeKickAssemblerC64.kickass_output_cleanup"]
+    kickasssettings = sys.modules["SublimeKickAssemblerC64.kickass_settings"]
+    kickasshelpindex = sys.modules["SublimeKickAssemblerC64.kickass_help_index"]
+    kickasssymbolindex = sys.modules["SublimeKickAssemblerC64.kickass_symbol_index"]
+    kickassvicesymbols = sys.modules["SublimeKickAssemblerC64.kickass_vice_symbols"]
+    kickassbuildoutput = sys.modules["SublimeKickAssemblerC64.kickass_build_output"]
+    kickassmemorymap = sys.modules["SublimeKickAssemblerC64.kickass_memory_map"]
+    kickassexec = sys.modules["SublimeKickAssemblerC64.kickass_exec"]
+    kickassassets = sys.modules["SublimeKickAssemblerC64.kickass_assets"]
+    kickassaddressindex = sys.modules["SublimeKickAssemblerC64.kickass_address_index"]
+    kickasslint = sys.modules["SublimeKickAssemblerC64.kickass_lint"]
+    kickasscycles = sys.modules["SublimeKickAssemblerC64.kickass_cycles"]
+    kickassquickassembler = sys.modules["SublimeKickAssemblerC64.kickass_quick_assembler"]
+    kickasstooltiprender = sys.modules["SublimeKickAssemblerC64.kickass_tooltip_render"]
+    kickassprofiler = sys.modules["SublimeKickAssemblerC64.kickass_profiler"]
+    kickassannotations = sys.modules["SublimeKickAssemblerC64.kickass_annotations"]
+    kickassvicemonitor = sys.modules["SublimeKickAssemblerC64.kickass_vice_monitor"]
+    kickasswatch = sys.modules["SublimeKickAssemblerC64.kickass_watch"]
+    kickassbuildplan = sys.modules["SublimeKickAssemblerC64.kickass_build_plan"]
+    kickassvariables = sys.modules["SublimeKickAssemblerC64.kickass_variables"]
 
 default_variables_dict = {
     #'file_name': 'test-file.asm',
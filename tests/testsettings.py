@@ -13,4 +13,11 @@ class TestSettings():
         return setting if setting else ""
 
     def getSettingAsBool(self, settingKey): 
-        return self.getSetting(settingKey).lower() == "true"
\ No newline at end of file
+        return self.getSetting(settingKey).lower() == "true"
+
+    def getSettingAsPath(self, settingKey):
+        return self.getSetting(settingKey)
+
+    def getSettingAsList(self, settingKey):
+        setting = self.getSetting(settingKey)
+        return setting if isinstance(setting, list) else [setting] if setting else []
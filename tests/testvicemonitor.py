@@ -0,0 +1,106 @@
+import socket
+import struct
+import threading
+
+class FakeViceTextMonitor():
+    """
+    Local stand-in for the text remote monitor of VICE, records the commands it
+    receives. Like VICE, it does not answer autostart with a prompt.
+    """
+    def __init__(self, port=0):
+        self.commands = []
+        self.resumed = threading.Event()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', port))
+        self._server.listen(1)
+        self.address = "127.0.0.1:%d" % self._server.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with connection:
+                for line in connection.makefile('rb'):
+                    command = line.decode('utf-8').strip()
+                    self.commands.append(command)
+                    if command == 'x':
+                        self.resumed.set()
+                        break
+                    if command.startswith('autostart'):
+                        continue
+                    connection.sendall(b"response to " + command.encode('utf-8') + b"\n(C:$0810) ")
+
+    def close(self):
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+
+class FakeViceBinaryMonitor():
+    """
+    Local stand-in for the binary monitor of VICE. Records the requests it
+    receives as (command, body), answers memory reads from its memory and
+    sends a stopped event before each batch of responses.
+    """
+    def __init__(self):
+        self.requests = []
+        self.connections = 0
+        self.memory = bytearray(range(256)) * 256
+        self.errors = {}
+        self.nextCheckpoint = 1
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.address = "127.0.0.1:%d" % self._server.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with connection:
+                reader = connection.makefile('rb')
+                while True:
+                    header = reader.read(11)
+                    if len(header) < 11:
+                        break
+                    stx, version, length, requestId, command = struct.unpack('<BBIIB', header)
+                    body = reader.read(length)
+                    self.requests.append((command, body))
+                    connection.sendall(self.response(0x62, 0, 0xffffffff, b'\x00\x08'))
+                    connection.sendall(self.response(command, self.errors.get(command, 0), requestId, self.answer(command, body)))
+
+    def response(self, responseType, errorCode, requestId, body):
+        return struct.pack('<BBIBBI', 0x02, 0x02, len(body), responseType, errorCode, requestId) + body
+
+    def answer(self, command, body):
+        if command == 0x01:
+            side, start, end, memspace, bank = struct.unpack('<BHHBH', body)
+            data = bytes(self.memory[start:end + 1])
+            return struct.pack('<H', len(data)) + data
+        if command == 0x12:
+            self.nextCheckpoint += 1
+            return struct.pack('<I', self.nextCheckpoint - 1) + body
+        return b''
+
+    def commands(self):
+        return [command for command, body in self.requests]
+
+    def close(self):
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()